@@ -0,0 +1 @@
+Improve performance of state resolution by persisting the results of resolving state across state groups.
@@ -0,0 +1 @@
+Add experimental `state_res_worker_processes` and `state_res_worker_min_conflicted_events` options to run v2 state resolution for large rooms in a pool of worker processes.
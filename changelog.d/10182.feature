@@ -0,0 +1 @@
+Add an online state group compressor, and an admin API to queue a room for compression and inspect its progress.
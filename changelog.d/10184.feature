@@ -0,0 +1 @@
+Improve performance of persisting events by working out current state deltas from the state group chain.
@@ -0,0 +1 @@
+Add an experimental sliding window sync endpoint, enabled with `experimental_features.sliding_window_sync_enabled`.
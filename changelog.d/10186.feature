@@ -0,0 +1 @@
+Reduce memory usage of large `/sync` responses by encoding them room by room.
@@ -0,0 +1 @@
+Improve performance of waking up clients for events in large rooms.
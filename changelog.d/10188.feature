@@ -0,0 +1 @@
+Improve performance of incremental `/sync` by fetching the timelines of all changed rooms in one query.
@@ -0,0 +1 @@
+Improve performance of applying event filters, and cache stored filters.
@@ -0,0 +1 @@
+Improve performance of `/sync` by fetching the unread notification counts for all rooms at once.
@@ -0,0 +1 @@
+Improve performance of fetching unread counts by maintaining a per-user, per-room counter.
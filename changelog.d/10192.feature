@@ -0,0 +1 @@
+Improve performance of `/sync` by maintaining room summaries as current state changes.
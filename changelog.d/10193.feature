@@ -0,0 +1 @@
+Improve performance of gappy incremental `/sync` by working out state deltas from the state group chain.
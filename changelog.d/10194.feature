@@ -0,0 +1 @@
+Improve performance of incremental `/sync` for users with a lot of account data or tags.
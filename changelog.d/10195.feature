@@ -0,0 +1 @@
+Improve performance of evaluating push rules in large rooms by grouping users with the same rules.
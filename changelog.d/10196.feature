@@ -0,0 +1 @@
+Improve performance of matching push rule keywords against message bodies.
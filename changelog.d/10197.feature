@@ -0,0 +1 @@
+Add a `push_evaluator_instance` option to evaluate push rules in the background, after events are persisted.
@@ -0,0 +1 @@
+Add a `push.batch_gateway_urls` option to combine notifications for the same event to a push gateway, and limit concurrent requests to each push gateway.
@@ -0,0 +1 @@
+Improve performance of pushers by handing out push actions in one batch per stream range.
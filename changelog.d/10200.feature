@@ -0,0 +1 @@
+Reduce memory usage of push rules by sharing the compiled rules between users and rooms.
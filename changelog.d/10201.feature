@@ -0,0 +1 @@
+Improve performance of sending email notifications by sharing per-room data between users.
@@ -0,0 +1 @@
+Add a `federation_inbound_instances` option to stage events received over federation and process them in the background, sharded by room.
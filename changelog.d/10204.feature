@@ -0,0 +1 @@
+Improve performance of sending federation transactions to many servers by encoding each event once.
@@ -75,6 +75,7 @@ class Codes:
     INVALID_SIGNATURE = "M_INVALID_SIGNATURE"
     USER_DEACTIVATED = "M_USER_DEACTIVATED"
     BAD_ALIAS = "M_BAD_ALIAS"
+    UNKNOWN_POS = "M_UNKNOWN_POS"
 
 
 class CodeMessageException(RuntimeError):
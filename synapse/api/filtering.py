@@ -15,7 +15,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import json
-from typing import List
+from typing import Any, Callable, Iterable, List, Optional, Tuple
 
 import jsonschema
 from jsonschema import FormatChecker
@@ -24,6 +24,10 @@ from synapse.api.constants import EventContentFields
 from synapse.api.errors import SynapseError
 from synapse.api.presence import UserPresenceState
 from synapse.types import RoomID, UserID
+from synapse.util.caches.lrucache import LruCache
+
+# The number of compiled stored filters to keep around.
+FILTER_COLLECTION_CACHE_SIZE = 10000
 
 FILTER_SCHEMA = {
     "additionalProperties": False,
@@ -134,9 +138,20 @@ class Filtering:
         super().__init__()
         self.store = hs.get_datastore()
 
+        # Stored filters can't be changed, so we can hang on to the compiled
+        # versions of the ones in use.
+        self._filter_collection_cache = LruCache(
+            FILTER_COLLECTION_CACHE_SIZE, "filter_collection"
+        )  # type: LruCache[Tuple[str, str], FilterCollection]
+
     async def get_user_filter(self, user_localpart, filter_id):
-        result = await self.store.get_user_filter(user_localpart, filter_id)
-        return FilterCollection(result)
+        key = (user_localpart, str(filter_id))
+        filter_collection = self._filter_collection_cache.get(key)
+        if filter_collection is None:
+            result = await self.store.get_user_filter(user_localpart, filter_id)
+            filter_collection = FilterCollection(result)
+            self._filter_collection_cache[key] = filter_collection
+        return filter_collection
 
     def add_user_filter(self, user_localpart, user_filter):
         self.check_valid_filter(user_filter)
@@ -197,6 +212,15 @@ class FilterCollection:
     def timeline_limit(self):
         return self._room_timeline_filter.limit()
 
+    def room_timeline_filter(self):
+        return self._room_timeline_filter
+
+    def account_data_filter(self):
+        return self._account_data
+
+    def room_account_data_filter(self):
+        return self._room_account_data
+
     def presence_limit(self):
         return self._presence_filter.limit()
 
@@ -266,6 +290,29 @@ class Filter:
         self.labels = self.filter_json.get("org.matrix.labels", None)
         self.not_labels = self.filter_json.get("org.matrix.not_labels", [])
 
+        # Filters are checked against a lot of events, so we compile the lists
+        # above into quick lookups up front. Empty "not_" lists can't exclude
+        # anything, so are skipped entirely.
+        self._rooms = _compile_exact_matcher(self.rooms)
+        self._not_rooms = _compile_exact_matcher(self.not_rooms or None)
+        self._senders = _compile_exact_matcher(self.senders)
+        self._not_senders = _compile_exact_matcher(self.not_senders or None)
+        self._types = _compile_wildcard_matcher(self.types)
+        self._not_types = _compile_wildcard_matcher(self.not_types or None)
+
+        # Whether this filter lets everything through.
+        self._matches_everything = (
+            self.types is None
+            and not self.not_types
+            and self.rooms is None
+            and not self.not_rooms
+            and self.senders is None
+            and not self.not_senders
+            and self.contains_url is None
+            and self.labels is None
+            and not self.not_labels
+        )
+
     def filters_all_types(self):
         return "*" in self.not_types
 
@@ -318,29 +365,42 @@ class Filter:
         Returns:
             bool: True if the event fields match
         """
-        literal_keys = {
-            "rooms": lambda v: room_id == v,
-            "senders": lambda v: sender == v,
-            "types": lambda v: _matches_wildcard(event_type, v),
-            "labels": lambda v: v in labels,
-        }
-
-        for name, match_func in literal_keys.items():
-            not_name = "not_%s" % (name,)
-            disallowed_values = getattr(self, not_name)
-            if any(map(match_func, disallowed_values)):
+        if self._not_rooms is not None and self._not_rooms(room_id):
+            return False
+        if self._rooms is not None and not self._rooms(room_id):
+            return False
+
+        if self._not_senders is not None and self._not_senders(sender):
+            return False
+        if self._senders is not None and not self._senders(sender):
+            return False
+
+        if not self.check_type(event_type):
+            return False
+
+        # Events rarely have labels, and filters rarely mention them, so we
+        # don't bother compiling these.
+        if any(v in labels for v in self.not_labels):
+            return False
+        if self.labels is not None and not any(v in labels for v in self.labels):
+            return False
+
+        if self.contains_url is not None:
+            if self.contains_url != contains_url:
                 return False
 
-            allowed_values = getattr(self, name)
-            if allowed_values is not None:
-                if not any(map(match_func, allowed_values)):
-                    return False
+        return True
 
-        contains_url_filter = self.filter_json.get("contains_url")
-        if contains_url_filter is not None:
-            if contains_url_filter != contains_url:
-                return False
+    def check_type(self, event_type):
+        """Checks whether the filter's types match the given event type.
 
+        Returns:
+            bool: True if the event type matches
+        """
+        if self._not_types is not None and self._not_types(event_type):
+            return False
+        if self._types is not None and not self._types(event_type):
+            return False
         return True
 
     def filter_rooms(self, room_ids):
@@ -364,6 +424,16 @@ class Filter:
         return room_ids
 
     def filter(self, events):
+        """Filter a batch of events.
+
+        Args:
+            events (iterable): The events to filter.
+
+        Returns:
+            list: The events which match the filter, in the same order.
+        """
+        if self._matches_everything:
+            return list(events)
         return list(filter(self.check, events))
 
     def limit(self):
@@ -385,17 +455,42 @@ class Filter:
             filter: A new filter including the given rooms and the old
                     filter's rooms.
         """
-        newFilter = Filter(self.filter_json)
-        newFilter.rooms += room_ids
-        return newFilter
-
-
-def _matches_wildcard(actual_value, filter_value):
-    if filter_value.endswith("*"):
-        type_prefix = filter_value[:-1]
-        return actual_value.startswith(type_prefix)
-    else:
-        return actual_value == filter_value
+        # Filters may be shared (see `Filtering.get_user_filter`), so we must
+        # not modify our own `filter_json`.
+        filter_json = dict(self.filter_json)
+        filter_json["rooms"] = list(self.rooms) + list(room_ids)
+        return Filter(filter_json)
+
+
+def _compile_exact_matcher(
+    values: Optional[Iterable[str]],
+) -> Optional[Callable[[Any], bool]]:
+    """Compiles a list of values from a filter into a function which checks
+    whether a value is one of them, or None if no list was given.
+    """
+    if values is None:
+        return None
+    return frozenset(values).__contains__
+
+
+def _compile_wildcard_matcher(
+    values: Optional[Iterable[str]],
+) -> Optional[Callable[[Any], bool]]:
+    """Like `_compile_exact_matcher`, except that values ending in "*" match
+    anything starting with the rest of the value.
+    """
+    if values is None:
+        return None
+
+    exact = frozenset(v for v in values if not v.endswith("*"))
+    prefixes = tuple(v[:-1] for v in values if v.endswith("*"))
+    if not prefixes:
+        return exact.__contains__
+
+    def matches(value: Any) -> bool:
+        return value in exact or (isinstance(value, str) and value.startswith(prefixes))
+
+    return matches
 
 
 DEFAULT_FILTER_COLLECTION = FilterCollection({})
@@ -339,6 +339,11 @@ async def start(hs: "synapse.server.HomeServer"):
     hs.get_datastore().db_pool.start_profiling()
     hs.get_pusherpool().start()
 
+    # Instances which process events received over federation need to do so
+    # even if they don't receive any themselves.
+    if hs.get_instance_name() in hs.config.worker.federation_inbound_instances:
+        hs.get_federation_server()
+
     # Log when we start the shut down process.
     hs.get_reactor().addSystemEventTrigger(
         "before", "shutdown", logger.info, "Shutting down..."
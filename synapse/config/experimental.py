@@ -29,3 +29,23 @@ class ExperimentalConfig(Config):
 
         # MSC3026 (busy presence state)
         self.msc3026_enabled = experimental.get("msc3026_enabled", False)  # type: bool
+
+        # Run the sorting and auth check stages of v2 state resolution in a pool
+        # of worker processes, rather than on the reactor. Zero disables the
+        # pool.
+        self.state_res_worker_processes = experimental.get(
+            "state_res_worker_processes", 0
+        )  # type: int
+
+        # The minimum size of the full conflicted set (conflicted state plus
+        # auth chain difference) before state resolution is moved off the
+        # reactor. Smaller resolutions aren't worth the serialisation overhead.
+        self.state_res_worker_min_conflicted_events = experimental.get(
+            "state_res_worker_min_conflicted_events", 500
+        )  # type: int
+
+        # Enable the experimental sliding window sync endpoint, where clients ask
+        # for a window of their rooms ordered by recent activity.
+        self.sliding_window_sync_enabled = experimental.get(
+            "sliding_window_sync_enabled", False
+        )  # type: bool
@@ -25,6 +25,7 @@ class PushConfig(Config):
         self.push_group_unread_count_by_room = push_config.get(
             "group_unread_count_by_room", True
         )
+        self.push_batch_gateway_urls = set(push_config.get("batch_gateway_urls") or [])
 
         # There was a a 'redact_content' setting but mistakenly read from the
         # 'email'section'. Check for the flag in the 'push' section, and log,
@@ -77,4 +78,14 @@ class PushConfig(Config):
           # of unread messages.
           #
           #group_unread_count_by_room: false
+
+          # Push gateways which accept a notification for several devices in a
+          # single request. Notifications for the same event which are sent to
+          # one of these gateways at the same time are combined into one request.
+          #
+          # By default each request to a push gateway is for a single device, as
+          # some gateways only look at the first device in a request.
+          #
+          #batch_gateway_urls:
+          #  - https://push-gateway.example.com/_matrix/push/v1/notify
         """
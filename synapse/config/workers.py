@@ -282,6 +282,22 @@ class WorkerConfig(Config):
             self.worker_name is None and background_tasks_instance == "master"
         ) or self.worker_name == background_tasks_instance
 
+        # The instance which computes push actions for events after they have
+        # been persisted. If not set, push actions are instead computed before
+        # each event is persisted, by the process sending it.
+        push_evaluator_instance = config.get("push_evaluator_instance")
+        self.evaluate_push_actions_async = push_evaluator_instance is not None
+        self.run_push_evaluator = self.instance_name == push_evaluator_instance
+
+        # The instances which process events received over federation, sharded
+        # by room. If not set, each instance processes the events it receives.
+        self.federation_inbound_instances = (
+            config.get("federation_inbound_instances") or []
+        )
+        self.federation_inbound_shard_config = RoutableShardedWorkerHandlingConfig(
+            self.federation_inbound_instances or [self.instance_name]
+        )
+
     def generate_config_section(self, config_dir_path, server_name, **kwargs):
         return """\
         ## Workers ##
@@ -323,6 +339,30 @@ class WorkerConfig(Config):
         #
         #run_background_tasks_on: worker1
 
+        # The worker that is used to evaluate push rules for new events. If set,
+        # push rules are evaluated after events have been persisted rather than
+        # before, so that sending an event into a large room isn't slowed down
+        # by working out who to notify about it. Can be set to `master` to run
+        # on the main process.
+        #
+        # By default push rules are evaluated by the process sending the event.
+        #
+        #push_evaluator_instance: worker1
+
+        # The workers that process events received over federation. Events
+        # are acknowledged as soon as they have been received and are then
+        # processed in the background, sharded by room, by one of these
+        # workers. Any worker specified here must also be in the
+        # `instance_map`. Can include `master` to use the main process.
+        #
+        # By default events are processed by the process that received them,
+        # so with more than one federation reader the events of a room may be
+        # processed by several readers at once.
+        #
+        #federation_inbound_instances:
+        #  - federation_reader1
+        #  - federation_reader2
+
         # A shared secret used by the replication APIs to authenticate HTTP requests
         # from workers.
         #
@@ -19,7 +19,7 @@ from frozendict import frozendict
 from synapse.appservice import ApplicationService
 from synapse.events import EventBase
 from synapse.logging.context import make_deferred_yieldable, run_in_background
-from synapse.types import StateMap
+from synapse.types import ImmutableStateMap, StateMap
 
 if TYPE_CHECKING:
     from synapse.storage.databases.main import DataStore
@@ -314,17 +314,18 @@ class _AsyncEventContextImpl(EventContext):
         if self.state_group is None:
             return
 
-        self._current_state_ids = await self._storage.state.get_state_ids_for_group(
-            self.state_group
-        )
+        current_state_ids = ImmutableStateMap(
+            await self._storage.state.get_state_ids_for_group(self.state_group)
+        )  # type: ImmutableStateMap[str]
+        self._current_state_ids = current_state_ids
         if self._event_state_key is not None:
-            self._prev_state_ids = dict(self._current_state_ids)
-
             key = (self._event_type, self._event_state_key)
             if self._prev_state_id:
-                self._prev_state_ids[key] = self._prev_state_id
+                self._prev_state_ids = current_state_ids.with_changes(
+                    {key: self._prev_state_id}
+                )
             else:
-                self._prev_state_ids.pop(key, None)
+                self._prev_state_ids = current_state_ids.with_changes({}, [key])
         else:
             self._prev_state_ids = self._current_state_ids
 
@@ -24,6 +24,7 @@ from typing import (
     Iterable,
     List,
     Optional,
+    Set,
     Tuple,
     Union,
 )
@@ -57,9 +58,14 @@ from synapse.logging.context import (
 )
 from synapse.logging.opentracing import log_kv, start_active_span_from_edu, trace
 from synapse.logging.utils import log_function
+from synapse.metrics.background_process_metrics import (
+    run_as_background_process,
+    wrap_as_background_process,
+)
 from synapse.replication.http.federation import (
     ReplicationFederationSendEduRestServlet,
     ReplicationGetQueryRestServlet,
+    ReplicationProcessStagedEventsRestServlet,
 )
 from synapse.types import JsonDict
 from synapse.util import glob_to_regex, json_decoder, unwrapFirstError
@@ -74,6 +80,15 @@ if TYPE_CHECKING:
 # parallel, up to this limit.
 TRANSACTION_CONCURRENCY_LIMIT = 10
 
+# events received over federation are processed in the background; we process
+# events from different rooms in parallel, up to this limit.
+STAGED_EVENTS_CONCURRENCY_LIMIT = 10
+
+# the number of events which may be waiting to be processed in a room before
+# we start rejecting new ones. We'll fetch any we reject later on if we get
+# events which refer to them.
+MAX_STAGED_EVENTS_PER_ROOM = 1000
+
 logger = logging.getLogger(__name__)
 
 received_pdus_counter = Counter("synapse_federation_server_received_pdus", "")
@@ -138,6 +153,38 @@ class FederationServer(FederationBase):
             hs.config.federation.federation_metrics_domains
         )
 
+        # Events received in transactions are staged in the database and then
+        # processed in the background, a room at a time, by the instance
+        # responsible for the room.
+        self._instance_name = hs.get_instance_name()
+        self._inbound_shard_config = hs.config.worker.federation_inbound_shard_config
+        self._process_staged_events_client = (
+            ReplicationProcessStagedEventsRestServlet.make_client(hs)
+        )
+
+        # If processing isn't sharded then each instance processes the events
+        # it received, and must leave alone those received by any others.
+        self._staged_events_instance_name = None  # type: Optional[str]
+        if not hs.config.worker.federation_inbound_instances:
+            self._staged_events_instance_name = self._instance_name
+
+        # rooms whose staged events we're currently working through, and those
+        # which have had new events staged since we last checked.
+        self._rooms_processing_staged_events = set()  # type: Set[str]
+        self._rooms_with_new_staged_events = set()  # type: Set[str]
+
+        self._staged_events_limiter = Linearizer(
+            "fed_staged_events",
+            max_count=STAGED_EVENTS_CONCURRENCY_LIMIT,
+            clock=self._clock,
+        )
+
+        # Pick up any events which were staged but not processed before we
+        # restarted, or which we weren't told about.
+        if self._instance_name in self._inbound_shard_config.instances:
+            self._clock.call_later(0, self._process_all_staged_events)
+            self._clock.looping_call(self._process_all_staged_events, 60 * 1000)
+
     async def on_backfill_request(
         self, origin: str, room_id: str, versions: List[str], limit: int
     ) -> Tuple[int, Dict[str, Any]]:
@@ -354,27 +401,38 @@ class FederationServer(FederationBase):
                         pdu_results[event_id] = e.error_dict()
                     return
 
+                staged_count = await self.store.count_staged_events_for_room(room_id)
+                if staged_count >= MAX_STAGED_EVENTS_PER_ROOM:
+                    logger.warning(
+                        "Rejecting PDUs for room %s as %d are already waiting to be processed",
+                        room_id,
+                        staged_count,
+                    )
+                    for pdu in pdus_by_room[room_id]:
+                        pdu_results[pdu.event_id] = {
+                            "error": "Too many events waiting to be processed in room"
+                        }
+                    return
+
+                events_to_stage = []
                 for pdu in pdus_by_room[room_id]:
-                    pdu_results[pdu.event_id] = await process_pdu(pdu)
-
-        async def process_pdu(pdu: EventBase) -> JsonDict:
-            event_id = pdu.event_id
-            with pdu_process_time.time():
-                with nested_logging_context(event_id):
-                    try:
-                        await self._handle_received_pdu(origin, pdu)
-                        return {}
-                    except FederationError as e:
-                        logger.warning("Error handling PDU %s: %s", event_id, e)
-                        return {"error": str(e)}
-                    except Exception as e:
-                        f = failure.Failure()
-                        logger.error(
-                            "Failed to handle PDU %s",
-                            event_id,
-                            exc_info=(f.type, f.value, f.getTracebackObject()),  # type: ignore
-                        )
-                        return {"error": str(e)}
+                    with nested_logging_context(pdu.event_id):
+                        try:
+                            pdu = await self._check_received_pdu(pdu)
+                        except FederationError as e:
+                            logger.warning("Error handling PDU %s: %s", pdu.event_id, e)
+                            pdu_results[pdu.event_id] = {"error": str(e)}
+                            continue
+
+                    events_to_stage.append(pdu)
+                    pdu_results[pdu.event_id] = {}
+
+                await self.store.insert_received_events_to_staging(
+                    origin, events_to_stage, request_time
+                )
+
+                if events_to_stage:
+                    self._notify_staged_events(room_id)
 
         await concurrently_execute(
             process_pdus_for_room, pdus_by_room.keys(), TRANSACTION_CONCURRENCY_LIMIT
@@ -697,8 +755,132 @@ class FederationServer(FederationBase):
             destination=None,
         )
 
+    async def _check_received_pdu(self, pdu: EventBase) -> EventBase:
+        """Check the signatures and hashes of a PDU received in a federation
+        /send/ transaction, before it is staged for processing.
+
+        Args:
+            pdu: received pdu
+
+        Returns:
+            The pdu, redacted if its hash didn't match.
+
+        Raises: FederationError if the signatures do not match.
+        """
+
+        # We've already checked that we know the room version by this point
+        room_version = await self.store.get_room_version(pdu.room_id)
+
+        try:
+            return await self._check_sigs_and_hash(room_version, pdu)
+        except SynapseError as e:
+            raise FederationError("ERROR", e.code, e.msg, affected=pdu.event_id)
+
+    def _notify_staged_events(self, room_id: str) -> None:
+        """Make sure that newly staged events in the room get processed,
+        either by us or by the instance responsible for the room.
+        """
+        instance_name = self._inbound_shard_config.get_instance(room_id)
+        if instance_name == self._instance_name:
+            self.process_staged_events(room_id)
+        else:
+            run_as_background_process(
+                "notify_staged_events",
+                self._notify_remote_staged_events,
+                instance_name,
+                room_id,
+            )
+
+    async def _notify_remote_staged_events(
+        self, instance_name: str, room_id: str
+    ) -> None:
+        try:
+            await self._process_staged_events_client(
+                instance_name=instance_name, room_id=room_id
+            )
+        except Exception as e:
+            # The other instance will find the events when it next checks for
+            # any it wasn't told about.
+            logger.warning(
+                "Failed to tell %s about staged events in %s: %s",
+                instance_name,
+                room_id,
+                e,
+            )
+
+    def process_staged_events(self, room_id: str) -> None:
+        """Start processing the events waiting in the staging area for the
+        given room, if we aren't already.
+        """
+        if room_id in self._rooms_processing_staged_events:
+            self._rooms_with_new_staged_events.add(room_id)
+            return
+
+        self._rooms_processing_staged_events.add(room_id)
+        run_as_background_process(
+            "process_staged_events", self._process_staged_events_for_room, room_id
+        )
+
+    async def _process_staged_events_for_room(self, room_id: str) -> None:
+        """Process the events waiting in the staging area for the given room,
+        in the order they were received, until there are none left.
+        """
+        try:
+            room_version = await self.store.get_room_version(room_id)
+
+            while True:
+                self._rooms_with_new_staged_events.discard(room_id)
+
+                next_event = await self.store.get_next_staged_event_for_room(
+                    room_id, room_version, self._staged_events_instance_name
+                )
+                if next_event is None:
+                    # We may have been told about new events after we looked.
+                    if room_id in self._rooms_with_new_staged_events:
+                        continue
+                    break
+
+                origin, event = next_event
+                with (await self._staged_events_limiter.queue(None)):
+                    await self._process_staged_event(origin, event)
+
+                await self.store.remove_received_event_from_staging(
+                    origin, event.event_id
+                )
+        finally:
+            self._rooms_processing_staged_events.discard(room_id)
+            self._rooms_with_new_staged_events.discard(room_id)
+
+    async def _process_staged_event(self, origin: str, pdu: EventBase) -> None:
+        with pdu_process_time.time():
+            with nested_logging_context(pdu.event_id):
+                try:
+                    await self._handle_received_pdu(origin, pdu)
+                except FederationError as e:
+                    logger.warning("Error handling PDU %s: %s", pdu.event_id, e)
+                except Exception:
+                    f = failure.Failure()
+                    logger.error(
+                        "Failed to handle PDU %s",
+                        pdu.event_id,
+                        exc_info=(f.type, f.value, f.getTracebackObject()),  # type: ignore
+                    )
+
+    @wrap_as_background_process("process_all_staged_events")
+    async def _process_all_staged_events(self) -> None:
+        """Start processing the staged events in all the rooms we're
+        responsible for.
+        """
+        room_ids = await self.store.get_all_rooms_with_staged_incoming_events(
+            self._staged_events_instance_name
+        )
+        for room_id in room_ids:
+            if self._inbound_shard_config.get_instance(room_id) == self._instance_name:
+                self.process_staged_events(room_id)
+
     async def _handle_received_pdu(self, origin: str, pdu: EventBase) -> None:
-        """Process a PDU received in a federation /send/ transaction.
+        """Process a PDU received in a federation /send/ transaction, once its
+        signatures have been checked and it has been staged.
 
         If the event is invalid, then this method throws a FederationError.
         (The error will then be logged and sent back to the sender (which
@@ -721,20 +903,9 @@ class FederationServer(FederationBase):
             origin: server which sent the pdu
             pdu: received pdu
 
-        Raises: FederationError if the signatures / hash do not match, or
-            if the event was unacceptable for any other reason (eg, too large,
-            too many prev_events, couldn't find the prev_events)
+        Raises: FederationError if the event was unacceptable for any reason
+            (eg, too large, too many prev_events, couldn't find the prev_events)
         """
-
-        # We've already checked that we know the room version by this point
-        room_version = await self.store.get_room_version(pdu.room_id)
-
-        # Check signature.
-        try:
-            pdu = await self._check_sigs_and_hash(room_version, pdu)
-        except SynapseError as e:
-            raise FederationError("ERROR", e.code, e.msg, affected=pdu.event_id)
-
         await self.handler.on_receive_pdu(origin, pdu, sent_to_us_directly=True)
 
     def __str__(self) -> str:
@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging
+import weakref
 from typing import TYPE_CHECKING, List
 
+from canonicaljson import encode_canonical_json
 from prometheus_client import Gauge
 
 from synapse.api.errors import HttpResponseException
@@ -27,7 +29,7 @@ from synapse.logging.opentracing import (
     tags,
     whitelisted_homeserver,
 )
-from synapse.util import json_decoder
+from synapse.util import EncodedCanonicalJson, json_decoder
 from synapse.util.metrics import measure_func
 
 if TYPE_CHECKING:
@@ -62,6 +64,13 @@ class TransactionManager:
         # HACK to get unique tx id
         self._next_txn_id = int(self.clock.time_msec())
 
+        # The encoded JSON of the PDUs we're sending, so that each PDU is only
+        # encoded once however many servers it is sent to. Entries go away
+        # once nothing is using the event any more.
+        self._encoded_pdu_cache = (
+            weakref.WeakKeyDictionary()
+        )  # type: weakref.WeakKeyDictionary[EventBase, EncodedCanonicalJson]
+
     @measure_func("_send_new_transaction")
     async def send_new_transaction(
         self,
@@ -104,12 +113,12 @@ class TransactionManager:
                 len(edus),
             )
 
-            transaction = Transaction.create_new(
+            transaction = Transaction(
                 origin_server_ts=int(self.clock.time_msec()),
                 transaction_id=txn_id,
                 origin=self._server_name,
                 destination=destination,
-                pdus=pdus,
+                pdus=[self._get_encoded_pdu(pdu) for pdu in pdus],
                 edus=edus,
             )
 
@@ -119,28 +128,21 @@ class TransactionManager:
                 "TX [%s] {%s} Sending transaction [%s], (PDUs: %d, EDUs: %d)",
                 destination,
                 txn_id,
-                transaction.transaction_id,
+                txn_id,
                 len(pdus),
                 len(edus),
             )
 
             # Actually send the transaction
 
-            # FIXME (erikj): This is a bit of a hack to make the Pdu age
-            # keys work
-            # FIXME (richardv): I also believe it no longer works. We (now?) store
-            #  "age_ts" in "unsigned" rather than at the top level. See
+            # The PDUs are shared between destinations, so we can't rewrite
+            # them here.
+            # FIXME (richardv): We used to convert a top-level "age_ts" into
+            #  "unsigned.age" here, but we (now?) store "age_ts" in "unsigned"
+            #  rather than at the top level, so that never happened. See
             #  https://github.com/matrix-org/synapse/issues/8429.
             def json_data_cb():
-                data = transaction.get_dict()
-                now = int(self.clock.time_msec())
-                if "pdus" in data:
-                    for p in data["pdus"]:
-                        if "age_ts" in p:
-                            unsigned = p.setdefault("unsigned", {})
-                            unsigned["age"] = now - int(p["age_ts"])
-                            del p["age_ts"]
-                return data
+                return transaction.get_dict()
 
             try:
                 response = await self._transport_layer.send_transaction(
@@ -172,3 +174,15 @@ class TransactionManager:
                 last_pdu_ts_metric.labels(server_name=destination).set(
                     last_pdu.origin_server_ts / 1000
                 )
+
+    def _get_encoded_pdu(self, pdu: EventBase) -> EncodedCanonicalJson:
+        """Get the PDU JSON of the given event, along with its encoding."""
+        encoded_pdu = self._encoded_pdu_cache.get(pdu)
+        if encoded_pdu is None:
+            pdu_json = pdu.get_pdu_json()
+            encoded_pdu = EncodedCanonicalJson(
+                pdu_json, encode_canonical_json(pdu_json)
+            )
+            self._encoded_pdu_cache[pdu] = encoded_pdu
+
+        return encoded_pdu
@@ -1157,6 +1157,7 @@ class RoomContextHandler:
 class RoomEventSource:
     def __init__(self, hs: "HomeServer"):
         self.store = hs.get_datastore()
+        self._evaluate_push_actions_async = hs.config.worker.evaluate_push_actions_async
 
     async def get_new_events(
         self,
@@ -1209,7 +1210,14 @@ class RoomEventSource:
         return (events, end_key)
 
     def get_current_key(self) -> RoomStreamToken:
-        return self.store.get_room_max_token()
+        max_token = self.store.get_room_max_token()
+        if self._evaluate_push_actions_async:
+            # Hold back events until their push actions have been computed, so
+            # that clients get the right unread counts along with them.
+            evaluated_stream_id = self.store.get_current_push_evaluator_position()
+            if evaluated_stream_id < max_token.get_max_stream_pos():
+                return RoomStreamToken(None, min(evaluated_stream_id, max_token.stream))
+        return max_token
 
     def get_current_key_for_room(self, room_id: str) -> Awaitable[str]:
         return self.store.get_room_events_max_id(room_id)
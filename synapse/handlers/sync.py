@@ -30,6 +30,7 @@ import attr
 from prometheus_client import Counter
 
 from synapse.api.constants import AccountDataTypes, EventTypes, Membership
+from synapse.api.errors import Codes, SynapseError
 from synapse.api.filtering import FilterCollection
 from synapse.events import EventBase
 from synapse.logging.context import current_context
@@ -82,6 +83,15 @@ LAZY_LOADED_MEMBERS_CACHE_MAX_AGE = 30 * 60 * 1000
 # avoiding redundantly sending the same lazy-loaded members to the client
 LAZY_LOADED_MEMBERS_CACHE_MAX_SIZE = 100
 
+# How long we remember what we sent on a sliding window sync connection. A
+# client which comes back after this has to start again.
+SLIDING_WINDOW_CONNECTION_MAX_AGE = 30 * 60 * 1000
+
+# The number of sliding window sync connections we remember for each device,
+# and the number of devices we remember them for.
+SLIDING_WINDOW_CONNECTIONS_MAX_PER_DEVICE = 10
+SLIDING_WINDOW_CONNECTIONS_MAX_DEVICES = 10000
+
 
 @attr.s(slots=True, frozen=True)
 class SyncConfig:
@@ -90,6 +100,9 @@ class SyncConfig:
     is_guest = attr.ib(type=bool)
     request_key = attr.ib(type=Tuple[Any, ...])
     device_id = attr.ib(type=Optional[str])
+    # If set, only this state is sent for rooms. Used by sliding window syncs,
+    # which don't support lazy loading members.
+    required_state = attr.ib(type=Optional[StateFilter], default=None)
 
 
 @attr.s(slots=True, frozen=True)
@@ -159,6 +172,58 @@ class InvitedSyncResult:
         return True
 
 
+@attr.s(slots=True, frozen=True)
+class SlidingWindowSyncResult:
+    """
+    Attributes:
+        next_batch: Token for the next sync
+        count: The number of rooms the user is joined to
+        window: The IDs of the rooms in the requested window, most recently
+            active first
+        window_changed: Whether `window` differs from the previous sync
+        account_data: List of account_data events for the user.
+        joined: JoinedSyncResult for each room in the window with updates
+        invited: InvitedSyncResult for each invited room.
+    """
+
+    next_batch = attr.ib(type=StreamToken)
+    count = attr.ib(type=int)
+    window = attr.ib(type=List[str])
+    window_changed = attr.ib(type=bool)
+    account_data = attr.ib(type=List[JsonDict])
+    joined = attr.ib(type=List[JoinedSyncResult])
+    invited = attr.ib(type=List[InvitedSyncResult])
+
+    def __bool__(self) -> bool:
+        """Make the result appear empty if there are no updates. This is used
+        to tell if the notifier needs to wait for more events when polling for
+        events.
+        """
+        return bool(
+            self.window_changed or self.account_data or self.joined or self.invited
+        )
+
+
+@attr.s(slots=True, frozen=True)
+class _SlidingWindowConnectionState:
+    """What we've told a client on a sliding window sync connection, as of a
+    given sync position.
+
+    Attributes:
+        room_orderings: The stream ordering of the latest event in each of the
+            user's joined rooms.
+        window: The IDs of the rooms in the window.
+    """
+
+    room_orderings = attr.ib(type=Dict[str, int])
+    window = attr.ib(type=List[str])
+
+
+# The state of a sliding window sync connection at each sync position that the
+# client may send next.
+_SlidingWindowConnectionPositions = Dict[str, _SlidingWindowConnectionState]
+
+
 @attr.s(slots=True, frozen=True)
 class GroupsSyncResult:
     join = attr.ib(type=JsonDict)
@@ -268,6 +333,18 @@ class SyncHandler:
             expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE,
         )  # type: ExpiringCache[Tuple[str, Optional[str]], LruCache[str, str]]
 
+        # ExpiringCache((User, Device)) -> LruCache(Connection => Position =>
+        # state of the sliding window sync connection as of that position).
+        # Only the position the client last synced from and the one we sent it
+        # are kept for each connection.
+        self._sliding_window_connections = ExpiringCache(
+            "sliding_window_sync_connections",
+            self.clock,
+            max_len=SLIDING_WINDOW_CONNECTIONS_MAX_DEVICES,
+            expiry_ms=SLIDING_WINDOW_CONNECTION_MAX_AGE,
+            reset_expiry_on_get=True,
+        )  # type: ExpiringCache[Tuple[str, Optional[str]], LruCache[str, _SlidingWindowConnectionPositions]]
+
     async def wait_for_sync_for_user(
         self,
         requester: Requester,
@@ -369,6 +446,278 @@ class SyncHandler:
             set_tag(SynapseTags.SYNC_RESULT, bool(sync_result))
             return sync_result
 
+    async def wait_for_sliding_window_sync_for_user(
+        self,
+        requester: Requester,
+        sync_config: SyncConfig,
+        window: Tuple[int, int],
+        conn_id: str,
+        since: Optional[str] = None,
+        timeout: int = 0,
+    ) -> SlidingWindowSyncResult:
+        """Get a sliding window sync for the client, waiting for new data to
+        arrive if there is nothing to send yet.
+
+        Unlike a normal sync, the client only gets the rooms in the given window
+        of its joined rooms, ordered by most recent activity. We remember which
+        rooms we've sent on the connection, so that rooms which stay in the
+        window only get updates, while rooms entering it are sent in full.
+
+        Args:
+            requester
+            sync_config: `required_state` should be set to the state to send
+                for rooms entering the window.
+            window: The indexes of the first and last rooms to include.
+            conn_id: Identifies the connection, if the client has several.
+            since: The `next_batch` of the last sync on this connection, if any.
+            timeout: How long to wait for new data, if `since` is given.
+
+        Raises:
+            SynapseError if `since` isn't a position we know about on this
+            connection, in which case the client should start again.
+        """
+        await self.auth.check_auth_blocking(requester=requester)
+
+        res = await self.response_cache.wrap(
+            sync_config.request_key,
+            self._wait_for_sliding_window_sync_for_user,
+            sync_config,
+            window,
+            conn_id,
+            since,
+            timeout,
+        )
+        return res
+
+    async def _wait_for_sliding_window_sync_for_user(
+        self,
+        sync_config: SyncConfig,
+        window: Tuple[int, int],
+        conn_id: str,
+        since: Optional[str],
+        timeout: int,
+    ) -> SlidingWindowSyncResult:
+        context = current_context()
+        if context:
+            context.tag = "sliding_window_sync"
+
+        user_id = sync_config.user.to_string()
+
+        since_token = None
+        conn_state = None
+        if since is not None:
+            connections = self._sliding_window_connections.get(
+                (user_id, sync_config.device_id)
+            )
+            positions = None  # type: Optional[_SlidingWindowConnectionPositions]
+            if connections is not None:
+                positions = connections.get(conn_id)
+            if positions is not None:
+                conn_state = positions.get(since)
+            if conn_state is None:
+                raise SynapseError(
+                    400, "Unknown sync position %r" % (since,), Codes.UNKNOWN_POS
+                )
+            since_token = await StreamToken.from_string(self.store, since)
+
+        if timeout == 0 or since_token is None:
+            return await self.generate_sliding_window_sync_result(
+                sync_config, window, conn_id, since, since_token, conn_state
+            )
+
+        def current_sync_callback(before_token, after_token):
+            return self.generate_sliding_window_sync_result(
+                sync_config, window, conn_id, since, since_token, conn_state
+            )
+
+        return await self.notifier.wait_for_events(
+            user_id, timeout, current_sync_callback, from_token=since_token
+        )
+
+    async def generate_sliding_window_sync_result(
+        self,
+        sync_config: SyncConfig,
+        window: Tuple[int, int],
+        conn_id: str,
+        since: Optional[str],
+        since_token: Optional[StreamToken],
+        conn_state: Optional[_SlidingWindowConnectionState],
+    ) -> SlidingWindowSyncResult:
+        """Generates a sliding window sync result, and remembers what we sent
+        against its `next_batch`.
+
+        Any other positions remembered for the connection are forgotten, apart
+        from `since`, so that the client can retry the request.
+        """
+        now_token = self.event_sources.get_current_token()
+        user_id = sync_config.user.to_string()
+
+        joined_room_ids = await self.get_rooms_for_user_at(user_id, now_token.room_key)
+
+        # Work out when each room was last active. We only need to look up the
+        # rooms that have changed since the last sync on this connection.
+        if conn_state is None:
+            to_fetch = joined_room_ids  # type: Collection[str]
+            room_orderings = {}  # type: Dict[str, int]
+        else:
+            assert since_token is not None
+            previous_orderings = conn_state.room_orderings
+            changed_room_ids = self.store.get_rooms_that_changed(
+                joined_room_ids, since_token.room_key
+            )
+            changed_room_ids.update(
+                r for r in joined_room_ids if r not in previous_orderings
+            )
+            to_fetch = changed_room_ids
+            room_orderings = {
+                room_id: previous_orderings[room_id]
+                for room_id in joined_room_ids
+                if room_id not in to_fetch
+            }
+        room_orderings.update(
+            await self.store.get_last_event_stream_orderings_for_rooms(
+                to_fetch, now_token.room_key
+            )
+        )
+
+        sorted_room_ids = sorted(
+            joined_room_ids,
+            key=lambda room_id: (-room_orderings.get(room_id, 0), room_id),
+        )
+        start, end = window
+        window_room_ids = sorted_room_ids[start : end + 1]
+
+        previous_window = conn_state.window if conn_state else []
+        staying_room_ids = frozenset(window_room_ids).intersection(previous_window)
+        entering_room_ids = [r for r in window_room_ids if r not in staying_room_ids]
+
+        sync_result_builder = SyncResultBuilder(
+            sync_config,
+            full_state=False,
+            since_token=since_token,
+            now_token=now_token,
+            joined_room_ids=frozenset(window_room_ids),
+        )
+
+        account_data_by_room = await self._generate_sync_entry_for_account_data(
+            sync_result_builder
+        )
+        now_token, ephemeral_by_room = await self.ephemeral_by_room(
+            sync_result_builder, now_token=now_token, since_token=since_token
+        )
+        sync_result_builder.now_token = now_token
+
+        ignored_users = await self._get_ignored_users(user_id)
+
+        # Rooms entering the window are sent as if this were an initial sync.
+        room_entries = [
+            RoomSyncResultBuilder(
+                room_id=room_id,
+                rtype="joined",
+                events=None,
+                newly_joined=False,
+                full_state=True,
+                since_token=None,
+                upto_token=now_token,
+            )
+            for room_id in entering_room_ids
+        ]
+
+        if since_token:
+            # We only have the account data that changed since the last sync,
+            # so fetch the rest for rooms entering the window.
+            if entering_room_ids:
+                (
+                    _,
+                    all_account_data_by_room,
+                ) = await self.store.get_account_data_for_user(user_id)
+                for room_id in entering_room_ids:
+                    account_data_by_room[room_id] = all_account_data_by_room.get(
+                        room_id, {}
+                    )
+
+            # Rooms staying in the window just get what's changed.
+            room_changes = await self._get_rooms_changed(
+                SyncResultBuilder(
+                    sync_config,
+                    full_state=False,
+                    since_token=since_token,
+                    now_token=now_token,
+                    joined_room_ids=staying_room_ids,
+                ),
+                ignored_users,
+            )
+            room_entries.extend(
+                entry
+                for entry in room_changes.room_entries
+                if entry.room_id in staying_room_ids
+            )
+            invited = room_changes.invited
+
+            if sync_config.filter_collection.room_account_data_filter().check_type(
+                "m.tag"
+            ):
+                tags_by_room = await self.store.get_updated_tags(
+                    user_id, since_token.account_data_key
+                )
+            else:
+                tags_by_room = {}
+        else:
+            invited = []
+            for room in await self.store.get_invited_rooms_for_local_user(user_id):
+                if room.sender in ignored_users:
+                    continue
+                invite = await self.store.get_event(room.event_id)
+                invited.append(InvitedSyncResult(room_id=room.room_id, invite=invite))
+
+            tags_by_room = {}
+
+        unread_notifs_by_room = await self.unread_notifs_for_rooms(
+            room_entries, sync_config
+        )
+
+        async def handle_room_entries(room_entry):
+            await self._generate_room_entry(
+                sync_result_builder,
+                ignored_users,
+                room_entry,
+                ephemeral=ephemeral_by_room.get(room_entry.room_id, []),
+                tags=tags_by_room.get(room_entry.room_id),
+                account_data=account_data_by_room.get(room_entry.room_id, {}),
+                unread_notifs=unread_notifs_by_room.get(room_entry.room_id),
+                always_include=room_entry.full_state,
+            )
+
+        await concurrently_execute(handle_room_entries, room_entries, 10)
+
+        result = SlidingWindowSyncResult(
+            next_batch=sync_result_builder.now_token,
+            count=len(joined_room_ids),
+            window=window_room_ids,
+            window_changed=window_room_ids != previous_window,
+            account_data=sync_result_builder.account_data,
+            joined=sync_result_builder.joined,
+            invited=invited,
+        )
+
+        next_batch = await result.next_batch.to_string(self.store)
+
+        cache_key = (user_id, sync_config.device_id)
+        connections = self._sliding_window_connections.get(cache_key)
+        if connections is None:
+            connections = LruCache(SLIDING_WINDOW_CONNECTIONS_MAX_PER_DEVICE)
+            self._sliding_window_connections[cache_key] = connections
+
+        positions = {}  # type: _SlidingWindowConnectionPositions
+        if since is not None and conn_state is not None:
+            positions[since] = conn_state
+        positions[next_batch] = _SlidingWindowConnectionState(
+            room_orderings=room_orderings, window=window_room_ids
+        )
+        connections.set(conn_id, positions)
+
+        return result
+
     async def push_rules_for_user(self, user: UserID) -> JsonDict:
         user_id = user.to_string()
         rules = await self.store.get_push_rules_for_user(user_id)
@@ -520,6 +869,7 @@ class SyncHandler:
                         limit=load_limit + 1,
                         from_key=since_key,
                         to_key=end_key,
+                        event_filter=sync_config.filter_collection.room_timeline_filter(),
                     )
                 else:
                     events, end_key = await self.store.get_recent_events_for_room(
@@ -616,6 +966,161 @@ class SyncHandler:
             state = {}
         return state
 
+    async def _get_changed_state_for_gappy_sync(
+        self,
+        room_id: str,
+        batch: TimelineBatch,
+        since_token: StreamToken,
+        timeline_start_filter: StateFilter,
+        state_filter: StateFilter,
+        lazy_load_members: bool,
+    ) -> Optional[Tuple[StateMap[str], StateMap[str], StateMap[str]]]:
+        """Get the state at the start of the timeline, at the previous sync and
+        at the end of the timeline, restricted to the state which changed
+        between them.
+
+        `_calculate_state` only ever returns state whose value differs between
+        the previous sync and either end of the timeline, so leaving out the
+        state which is the same in all three doesn't change its result, and
+        saves loading the whole state of the room on every gappy sync.
+
+        Args:
+            room_id: The room being synced.
+            batch: The (non-empty) timeline batch for the room.
+            since_token: Token of the end of the previous batch.
+            timeline_start_filter: The filter to apply to the state at the
+                start of the timeline.
+            state_filter: The filter to apply to the rest of the state.
+            lazy_load_members: Whether the sync is lazy-loading members.
+
+        Returns:
+            A tuple of the state at the start of the timeline, the state at
+            the previous sync and the state at the end of the timeline, or
+            None if the state which changed couldn't be worked out cheaply.
+        """
+        last_events, _ = await self.store.get_recent_events_for_room(
+            room_id, end_token=since_token.room_key, limit=1
+        )
+        if not last_events:
+            return None
+
+        previous_event = last_events[-1]
+        first_event_id = batch.events[0].event_id
+        last_event_id = batch.events[-1].event_id
+
+        event_to_groups = await self.store._get_state_group_for_events(
+            [previous_event.event_id, first_event_id, last_event_id]
+        )
+        if len(event_to_groups) != len(
+            {previous_event.event_id, first_event_id, last_event_id}
+        ):
+            return None
+
+        # When lazy-loading, the state at the start of the timeline is only the
+        # members of the timeline senders, which we fetch in full below.
+        if lazy_load_members:
+            to_groups = [event_to_groups[last_event_id]]
+        else:
+            to_groups = [
+                event_to_groups[first_event_id],
+                event_to_groups[last_event_id],
+            ]
+
+        changed_keys = await self.state_store.get_state_keys_changed_between_groups(
+            event_to_groups[previous_event.event_id], to_groups
+        )
+        if changed_keys is None:
+            return None
+
+        if previous_event.is_state():
+            changed_keys.add((previous_event.type, previous_event.state_key))
+
+        state_at_timeline_start = None  # type: Optional[StateMap[str]]
+        if lazy_load_members:
+            state_at_timeline_start = await self.state_store.get_state_ids_for_event(
+                first_event_id, state_filter=timeline_start_filter
+            )
+            changed_keys.update(state_at_timeline_start)
+
+        changed_filter = StateFilter.from_types(changed_keys)
+        state_by_event = await self.state_store.get_state_ids_for_events(
+            [previous_event.event_id, first_event_id, last_event_id],
+            state_filter=changed_filter,
+        )
+        if not state_filter.is_full():
+            state_by_event = {
+                event_id: state_filter.filter_state(state)
+                for event_id, state in state_by_event.items()
+            }
+
+        if state_at_timeline_start is None:
+            state_at_timeline_start = state_by_event[first_event_id]
+
+        state_at_previous_sync = dict(state_by_event[previous_event.event_id])
+        if previous_event.is_state():
+            key = (previous_event.type, previous_event.state_key)
+            state_at_previous_sync[key] = previous_event.event_id
+
+        return (
+            state_at_timeline_start,
+            state_at_previous_sync,
+            state_by_event[last_event_id],
+        )
+
+    async def _get_full_state_for_gappy_sync(
+        self,
+        room_id: str,
+        batch: TimelineBatch,
+        since_token: StreamToken,
+        now_token: StreamToken,
+        timeline_start_filter: StateFilter,
+        state_filter: StateFilter,
+    ) -> Tuple[StateMap[str], StateMap[str], StateMap[str]]:
+        """Get the full state at the start of the timeline, at the previous
+        sync and at the end of the timeline.
+
+        Args:
+            room_id: The room being synced.
+            batch: The timeline batch for the room.
+            since_token: Token of the end of the previous batch.
+            now_token: Token of the end of the current batch.
+            timeline_start_filter: The filter to apply to the state at the
+                start of the timeline.
+            state_filter: The filter to apply to the rest of the state.
+
+        Returns:
+            A tuple of the state at the start of the timeline, the state at
+            the previous sync and the state at the end of the timeline.
+        """
+        if batch:
+            state_at_timeline_start = await self.state_store.get_state_ids_for_event(
+                batch.events[0].event_id, state_filter=timeline_start_filter
+            )
+        else:
+            # We can get here if the user has ignored the senders of all
+            # the recent events.
+            state_at_timeline_start = await self.get_state_at(
+                room_id, stream_position=now_token, state_filter=timeline_start_filter
+            )
+
+        state_at_previous_sync = await self.get_state_at(
+            room_id, stream_position=since_token, state_filter=state_filter
+        )
+
+        if batch:
+            current_state_ids = await self.state_store.get_state_ids_for_event(
+                batch.events[-1].event_id, state_filter=state_filter
+            )
+        else:
+            # Its not clear how we get here, but empirically we do
+            # (#5407). Logging has been added elsewhere to try and
+            # figure out where this state comes from.
+            current_state_ids = await self.get_state_at(
+                room_id, stream_position=now_token, state_filter=state_filter
+            )
+
+        return state_at_timeline_start, state_at_previous_sync, current_state_ids
+
     async def compute_summary(
         self,
         room_id: str,
@@ -815,6 +1320,8 @@ class SyncHandler:
                     members_to_fetch.add(sync_config.user.to_string())
 
                 state_filter = StateFilter.from_lazy_load_member_list(members_to_fetch)
+            elif sync_config.required_state is not None:
+                state_filter = sync_config.required_state
             else:
                 state_filter = StateFilter.all()
 
@@ -849,19 +1356,6 @@ class SyncHandler:
                     lazy_load_members=lazy_load_members,
                 )
             elif batch.limited:
-                if batch:
-                    state_at_timeline_start = (
-                        await self.state_store.get_state_ids_for_event(
-                            batch.events[0].event_id, state_filter=state_filter
-                        )
-                    )
-                else:
-                    # We can get here if the user has ignored the senders of all
-                    # the recent events.
-                    state_at_timeline_start = await self.get_state_at(
-                        room_id, stream_position=now_token, state_filter=state_filter
-                    )
-
                 # for now, we disable LL for gappy syncs - see
                 # https://github.com/vector-im/riot-web/issues/7211#issuecomment-419976346
                 # N.B. this slows down incr syncs as we are now processing way
@@ -874,26 +1368,46 @@ class SyncHandler:
                 # members to just be ones which were timeline senders, which then ensures
                 # all of the rest get included in the state block (if we need to know
                 # about them).
-                state_filter = StateFilter.all()
+                timeline_start_filter = state_filter
+                if sync_config.required_state is not None:
+                    state_filter = sync_config.required_state
+                else:
+                    state_filter = StateFilter.all()
 
                 # If this is an initial sync then full_state should be set, and
                 # that case is handled above. We assert here to ensure that this
                 # is indeed the case.
                 assert since_token is not None
-                state_at_previous_sync = await self.get_state_at(
-                    room_id, stream_position=since_token, state_filter=state_filter
-                )
 
+                state_maps = None
                 if batch:
-                    current_state_ids = await self.state_store.get_state_ids_for_event(
-                        batch.events[-1].event_id, state_filter=state_filter
+                    state_maps = await self._get_changed_state_for_gappy_sync(
+                        room_id,
+                        batch,
+                        since_token,
+                        timeline_start_filter=timeline_start_filter,
+                        state_filter=state_filter,
+                        lazy_load_members=lazy_load_members,
                     )
+
+                if state_maps is not None:
+                    (
+                        state_at_timeline_start,
+                        state_at_previous_sync,
+                        current_state_ids,
+                    ) = state_maps
                 else:
-                    # Its not clear how we get here, but empirically we do
-                    # (#5407). Logging has been added elsewhere to try and
-                    # figure out where this state comes from.
-                    current_state_ids = await self.get_state_at(
-                        room_id, stream_position=now_token, state_filter=state_filter
+                    (
+                        state_at_timeline_start,
+                        state_at_previous_sync,
+                        current_state_ids,
+                    ) = await self._get_full_state_for_gappy_sync(
+                        room_id,
+                        batch,
+                        since_token,
+                        now_token,
+                        timeline_start_filter=timeline_start_filter,
+                        state_filter=state_filter,
                     )
 
                 state_ids = _calculate_state(
@@ -966,20 +1480,20 @@ class SyncHandler:
             if e.type != EventTypes.Aliases  # until MSC2261 or alternative solution
         }
 
-    async def unread_notifs_for_room_id(
-        self, room_id: str, sync_config: SyncConfig
-    ) -> Dict[str, int]:
-        with Measure(self.clock, "unread_notifs_for_room_id"):
-            last_unread_event_id = await self.store.get_last_receipt_event_id_for_user(
-                user_id=sync_config.user.to_string(),
-                room_id=room_id,
-                receipt_type="m.read",
-            )
+    async def unread_notifs_for_rooms(
+        self, room_entries: List["RoomSyncResultBuilder"], sync_config: SyncConfig
+    ) -> Dict[str, Dict[str, int]]:
+        """Get the unread notification counts for the joined rooms among the
+        given room entries, in one go.
+        """
+        room_ids = [entry.room_id for entry in room_entries if entry.rtype == "joined"]
+        if not room_ids:
+            return {}
 
-            notifs = await self.store.get_unread_event_push_actions_by_room_for_user(
-                room_id, sync_config.user.to_string(), last_unread_event_id
+        with Measure(self.clock, "unread_notifs_for_rooms"):
+            return await self.store.get_unread_counts_for_rooms_for_user(
+                room_ids, sync_config.user.to_string()
             )
-            return notifs
 
     async def generate_sync_result(
         self,
@@ -1282,17 +1796,30 @@ class SyncHandler:
         user_id = sync_result_builder.sync_config.user.to_string()
         since_token = sync_result_builder.since_token
 
+        # Only fetch the types of account data the filters ask for.
+        account_data_filter = sync_config.filter_collection.account_data_filter()
+        room_account_data_filter = (
+            sync_config.filter_collection.room_account_data_filter()
+        )
+        include_push_rules = account_data_filter.check_type("m.push_rules")
+
         if since_token and not sync_result_builder.full_state:
             (
                 account_data,
                 account_data_by_room,
             ) = await self.store.get_updated_account_data_for_user(
-                user_id, since_token.account_data_key
+                user_id,
+                since_token.account_data_key,
+                account_data_filter=account_data_filter,
+                room_account_data_filter=room_account_data_filter,
             )
 
-            push_rules_changed = await self.store.have_push_rules_changed_for_user(
-                user_id, int(since_token.push_rules_key)
-            )
+            if include_push_rules:
+                push_rules_changed = await self.store.have_push_rules_changed_for_user(
+                    user_id, int(since_token.push_rules_key)
+                )
+            else:
+                push_rules_changed = False
 
             if push_rules_changed:
                 account_data["m.push_rules"] = await self.push_rules_for_user(
@@ -1302,12 +1829,16 @@ class SyncHandler:
             (
                 account_data,
                 account_data_by_room,
-            ) = await self.store.get_account_data_for_user(sync_config.user.to_string())
-
-            account_data["m.push_rules"] = await self.push_rules_for_user(
-                sync_config.user
+            ) = await self.store.get_filtered_account_data_for_user(
+                user_id, account_data_filter, room_account_data_filter
             )
 
+            if include_push_rules:
+                account_data = dict(account_data)
+                account_data["m.push_rules"] = await self.push_rules_for_user(
+                    sync_config.user
+                )
+
         account_data_for_user = sync_config.filter_collection.filter_account_data(
             [
                 {"type": account_data_type, "content": content}
@@ -1395,6 +1926,9 @@ class SyncHandler:
             newly_left_rooms, newly_left_users)`
         """
         user_id = sync_result_builder.sync_config.user.to_string()
+        # There's no point fetching tags which the filter is going to drop.
+        filter_collection = sync_result_builder.sync_config.filter_collection
+        include_tags = filter_collection.room_account_data_filter().check_type("m.tag")
         block_all_room_ephemeral = (
             sync_result_builder.since_token is None
             and sync_result_builder.sync_config.filter_collection.blocks_all_room_ephemeral()
@@ -1417,44 +1951,42 @@ class SyncHandler:
             if since_token and not ephemeral_by_room and not account_data_by_room:
                 have_changed = await self._have_rooms_changed(sync_result_builder)
                 if not have_changed:
-                    tags_by_room = await self.store.get_updated_tags(
-                        user_id, since_token.account_data_key
-                    )
+                    tags_by_room = {}
+                    if include_tags:
+                        tags_by_room = await self.store.get_updated_tags(
+                            user_id, since_token.account_data_key
+                        )
                     if not tags_by_room:
                         logger.debug("no-oping sync")
                         return set(), set(), set(), set()
 
-        ignored_account_data = (
-            await self.store.get_global_account_data_by_type_for_user(
-                AccountDataTypes.IGNORED_USER_LIST, user_id=user_id
-            )
-        )
-
-        # If there is ignored users account data and it matches the proper type,
-        # then use it.
-        ignored_users = frozenset()  # type: FrozenSet[str]
-        if ignored_account_data:
-            ignored_users_data = ignored_account_data.get("ignored_users", {})
-            if isinstance(ignored_users_data, dict):
-                ignored_users = frozenset(ignored_users_data.keys())
+        ignored_users = await self._get_ignored_users(user_id)
 
         if since_token:
             room_changes = await self._get_rooms_changed(
                 sync_result_builder, ignored_users
             )
-            tags_by_room = await self.store.get_updated_tags(
-                user_id, since_token.account_data_key
-            )
+            tags_by_room = {}
+            if include_tags:
+                tags_by_room = await self.store.get_updated_tags(
+                    user_id, since_token.account_data_key
+                )
         else:
             room_changes = await self._get_all_rooms(sync_result_builder, ignored_users)
 
-            tags_by_room = await self.store.get_tags_for_user(user_id)
+            tags_by_room = {}
+            if include_tags:
+                tags_by_room = await self.store.get_tags_for_user(user_id)
 
         room_entries = room_changes.room_entries
         invited = room_changes.invited
         newly_joined_rooms = room_changes.newly_joined_rooms
         newly_left_rooms = room_changes.newly_left_rooms
 
+        unread_notifs_by_room = await self.unread_notifs_for_rooms(
+            room_entries, sync_result_builder.sync_config
+        )
+
         async def handle_room_entries(room_entry):
             logger.debug("Generating room entry for %s", room_entry.room_id)
             res = await self._generate_room_entry(
@@ -1464,6 +1996,7 @@ class SyncHandler:
                 ephemeral=ephemeral_by_room.get(room_entry.room_id, []),
                 tags=tags_by_room.get(room_entry.room_id),
                 account_data=account_data_by_room.get(room_entry.room_id, {}),
+                unread_notifs=unread_notifs_by_room.get(room_entry.room_id),
                 always_include=sync_result_builder.full_state,
             )
             logger.debug("Generated room entry for %s", room_entry.room_id)
@@ -1503,6 +2036,24 @@ class SyncHandler:
             newly_left_users,
         )
 
+    async def _get_ignored_users(self, user_id: str) -> FrozenSet[str]:
+        """Get the set of users the given user has ignored."""
+        ignored_account_data = (
+            await self.store.get_global_account_data_by_type_for_user(
+                AccountDataTypes.IGNORED_USER_LIST, user_id=user_id
+            )
+        )
+
+        # If there is ignored users account data and it matches the proper type,
+        # then use it.
+        ignored_users = frozenset()  # type: FrozenSet[str]
+        if ignored_account_data:
+            ignored_users_data = ignored_account_data.get("ignored_users", {})
+            if isinstance(ignored_users_data, dict):
+                ignored_users = frozenset(ignored_users_data.keys())
+
+        return ignored_users
+
     async def _have_rooms_changed(
         self, sync_result_builder: "SyncResultBuilder"
     ) -> bool:
@@ -1690,12 +2241,16 @@ class SyncHandler:
 
         timeline_limit = sync_config.filter_collection.timeline_limit()
 
-        # Get all events for rooms we're currently joined to.
+        # Get all events for rooms we're currently joined to. The timeline
+        # filter's type and sender clauses are applied in the database, so
+        # that rooms with lots of filtered out events still get a full
+        # timeline without `_load_filtered_recents` going back for more.
         room_to_events = await self.store.get_room_events_stream_for_rooms(
             room_ids=sync_result_builder.joined_room_ids,
             from_key=since_token.room_key,
             to_key=now_token.room_key,
             limit=timeline_limit + 1,
+            event_filter=sync_config.filter_collection.room_timeline_filter(),
         )
 
         # We loop through all room ids, even if there are no new events, in case
@@ -1820,6 +2375,7 @@ class SyncHandler:
         ephemeral: List[JsonDict],
         tags: Optional[Dict[str, Dict[str, Any]]],
         account_data: Dict[str, JsonDict],
+        unread_notifs: Optional[Dict[str, int]] = None,
         always_include: bool = False,
     ):
         """Populates the `joined` and `archived` section of `sync_result_builder`
@@ -1833,6 +2389,8 @@ class SyncHandler:
             tags: List of *all* tags for room, or None if there has been
                 no change.
             account_data: List of new account data for room
+            unread_notifs: The unread notification counts for the room, as
+                returned by `unread_notifs_for_rooms`. Only used for joined rooms.
             always_include: Always include this room in the sync response,
                 even if empty.
         """
@@ -1947,7 +2505,11 @@ class SyncHandler:
             )
 
             if room_sync or always_include:
-                notifs = await self.unread_notifs_for_room_id(room_id, sync_config)
+                notifs = unread_notifs
+                if notifs is None:
+                    notifs = await self.store.get_unread_counts_for_room_for_user(
+                        room_id, sync_config.user.to_string()
+                    )
 
                 unread_notifications["notification_count"] = notifs["notify_count"]
                 unread_notifications["highlight_count"] = notifs["highlight_count"]
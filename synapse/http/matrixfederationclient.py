@@ -21,10 +21,12 @@ import typing
 import urllib.parse
 from io import BytesIO, StringIO
 from typing import (
+    Any,
     Callable,
     Dict,
     Generic,
     List,
+    Mapping,
     Optional,
     Tuple,
     TypeVar,
@@ -34,10 +36,9 @@ from typing import (
 
 import attr
 import treq
-from canonicaljson import encode_canonical_json
 from prometheus_client import Counter
-from signedjson.sign import sign_json
 from typing_extensions import Literal
+from unpaddedbase64 import encode_base64
 
 from twisted.internet import defer
 from twisted.internet.error import DNSLookupError
@@ -73,7 +74,7 @@ from synapse.logging.opentracing import (
     tags,
 )
 from synapse.types import ISynapseReactor, JsonDict
-from synapse.util import json_decoder
+from synapse.util import EncodedCanonicalJson, json_decoder, splice_canonical_json
 from synapse.util.async_helpers import timeout_deferred
 from synapse.util.metrics import Measure
 
@@ -522,10 +523,13 @@ class MatrixFederationHttpClient:
                     json = request.get_json()
                     if json:
                         headers_dict[b"Content-Type"] = [b"application/json"]
+                        data = splice_canonical_json(json)
                         auth_headers = self.build_auth_headers(
-                            destination_bytes, method_bytes, url_to_sign_bytes, json
+                            destination_bytes,
+                            method_bytes,
+                            url_to_sign_bytes,
+                            EncodedCanonicalJson(json, data),
                         )
-                        data = encode_canonical_json(json)
                         producer = QuieterFileBodyProducer(
                             BytesIO(data), cooperator=self._cooperator
                         )  # type: Optional[IBodyProducer]
@@ -682,7 +686,7 @@ class MatrixFederationHttpClient:
         destination: Optional[bytes],
         method: bytes,
         url_bytes: bytes,
-        content: Optional[JsonDict] = None,
+        content: Optional[Mapping[str, Any]] = None,
         destination_is: Optional[bytes] = None,
     ) -> List[bytes]:
         """
@@ -715,18 +719,17 @@ class MatrixFederationHttpClient:
         if content is not None:
             request["content"] = content
 
-        request = sign_json(request, self.server_name, self.signing_key)
-
-        auth_headers = []
-
-        for key, sig in request["signatures"][self.server_name].items():
-            auth_headers.append(
-                (
-                    'X-Matrix origin=%s,key="%s",sig="%s"'
-                    % (self.server_name, key, sig)
-                ).encode("ascii")
-            )
-        return auth_headers
+        # We sign the request ourselves rather than using `sign_json`, so that
+        # we don't have to encode content which has already been encoded again.
+        key_id = "%s:%s" % (self.signing_key.alg, self.signing_key.version)
+        signed = self.signing_key.sign(splice_canonical_json(request))
+        sig = encode_base64(signed.signature)
+
+        return [
+            (
+                'X-Matrix origin=%s,key="%s",sig="%s"' % (self.server_name, key_id, sig)
+            ).encode("ascii")
+        ]
 
     @overload
     async def put_json(
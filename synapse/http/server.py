@@ -612,6 +612,17 @@ class _ByteProducer:
                     self._request.finish()
                     self.stopProducing()
                     return
+                except Exception:
+                    # The iterator may be doing real work (see
+                    # `StreamedJsonObject`), so it can fail part way through.
+                    # The headers have already gone out, so all we can do is
+                    # drop the connection so the client sees a truncated
+                    # response rather than waiting forever.
+                    logger.exception("Failed to encode response to %s", self._request)
+                    self._request.unregisterProducer()
+                    self._request.loseConnection()
+                    self.stopProducing()
+                    return
 
             self._send_data(buffer)
 
@@ -628,6 +639,47 @@ def _encode_json_bytes(json_object: Any) -> Iterator[bytes]:
         yield chunk.encode("utf-8")
 
 
+class StreamedJsonObject:
+    """A JSON object whose members are only generated as it is being written
+    out by `respond_with_json`.
+
+    This lets large responses (e.g. /sync) be serialized a piece at a time,
+    rather than building the whole response up in memory first. Values may
+    themselves be `StreamedJsonObject`s.
+
+    Note that the members are not sorted, so the output is not canonical JSON.
+
+    Args:
+        members: An iterable of (key, value) pairs. It will be iterated over at
+            most once, possibly after the request handler has returned.
+    """
+
+    def __init__(self, members: Iterable[Tuple[str, Any]]):
+        self.members = members
+
+
+def _encode_streamed_json(obj: StreamedJsonObject) -> Iterator[bytes]:
+    """
+    Encode a `StreamedJsonObject` into JSON. Returns an iterator of bytes.
+    """
+    yield b"{"
+    first = True
+    for key, value in obj.members:
+        if first:
+            first = False
+        else:
+            yield b","
+
+        yield json_encoder.encode(key).encode("utf-8")
+        yield b":"
+
+        if isinstance(value, StreamedJsonObject):
+            yield from _encode_streamed_json(value)
+        else:
+            yield from _encode_json_bytes(value)
+    yield b"}"
+
+
 def respond_with_json(
     request: Request,
     code: int,
@@ -640,11 +692,12 @@ def respond_with_json(
     Args:
         request: The http request to respond to.
         code: The HTTP response code.
-        json_object: The object to serialize to JSON.
+        json_object: The object to serialize to JSON. If this is a
+            `StreamedJsonObject` then it is encoded as it is written out.
         send_cors: Whether to send Cross-Origin Resource Sharing headers
             https://fetch.spec.whatwg.org/#http-cors-protocol
         canonical_json: Whether to use the canonicaljson algorithm when encoding
-            the JSON bytes.
+            the JSON bytes. Ignored for `StreamedJsonObject`s.
 
     Returns:
         twisted.web.server.NOT_DONE_YET if the request is still active.
@@ -658,7 +711,9 @@ def respond_with_json(
         )
         return None
 
-    if canonical_json:
+    if isinstance(json_object, StreamedJsonObject):
+        encoder = _encode_streamed_json  # type: Callable[[Any], Iterator[bytes]]
+    elif canonical_json:
         encoder = iterencode_canonical_json
     else:
         encoder = _encode_json_bytes
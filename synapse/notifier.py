@@ -13,11 +13,13 @@
 # limitations under the License.
 
 import logging
-from collections import namedtuple
+from collections import deque, namedtuple
 from typing import (
+    TYPE_CHECKING,
     Awaitable,
     Callable,
     Collection,
+    Deque,
     Dict,
     Iterable,
     List,
@@ -33,7 +35,6 @@ from prometheus_client import Counter
 
 from twisted.internet import defer
 
-import synapse.server
 from synapse.api.constants import EventTypes, HistoryVisibility, Membership
 from synapse.api.errors import AuthError
 from synapse.events import EventBase
@@ -49,6 +50,9 @@ from synapse.util.async_helpers import ObservableDeferred, timeout_deferred
 from synapse.util.metrics import Measure
 from synapse.visibility import filter_events_for_client
 
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
 logger = logging.getLogger(__name__)
 
 notified_events_counter = Counter("synapse_notifier_notified_events", "")
@@ -114,38 +118,66 @@ class _NotifierUserStream:
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
 
-    def notify(
+    def advance(
         self,
         stream_key: str,
         stream_id: Union[int, RoomStreamToken],
         time_now_ms: int,
-    ):
-        """Notify any listeners for this user of a new event from an
-        event source.
+        advanced_tokens: Optional[Dict[StreamToken, StreamToken]] = None,
+    ) -> Optional[ObservableDeferred]:
+        """Move this stream's token on for a new event from an event source,
+        without waking up any listeners yet.
+
+        Listeners that start after this will see the new token straight away.
+
         Args:
             stream_key: The stream the event came from.
             stream_id: The new id for the stream the event came from.
             time_now_ms: The current time in milliseconds.
+            advanced_tokens: If given, a cache of the results of advancing
+                tokens by `stream_id`, to be shared between all the streams
+                being told about the same event. Most of them will be starting
+                from the same token.
+
+        Returns:
+            The deferred the existing listeners are waiting on, which should be
+            passed to `wake`, or None if there are no listeners to wake.
         """
-        self.current_token = self.current_token.copy_and_advance(stream_key, stream_id)
-        self.last_notified_token = self.current_token
+        new_token = None  # type: Optional[StreamToken]
+        if advanced_tokens is not None:
+            new_token = advanced_tokens.get(self.current_token)
+        if new_token is None:
+            new_token = self.current_token.copy_and_advance(stream_key, stream_id)
+            if advanced_tokens is not None:
+                advanced_tokens[self.current_token] = new_token
+
+        self.current_token = new_token
+        self.last_notified_token = new_token
         self.last_notified_ms = time_now_ms
-        noify_deferred = self.notify_deferred
+
+        listeners = self.count_listeners()
 
         log_kv(
             {
                 "notify": self.user_id,
                 "stream": stream_key,
                 "stream_id": stream_id,
-                "listeners": self.count_listeners(),
+                "listeners": listeners,
             }
         )
 
-        users_woken_by_stream_counter.labels(stream_key).inc()
+        if not listeners:
+            return None
 
+        notify_deferred = self.notify_deferred
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
-            noify_deferred.callback(self.current_token)
+        return notify_deferred
+
+    def wake(self, notify_deferred: ObservableDeferred) -> None:
+        """Wake up the listeners waiting on a deferred returned by `advance`."""
+        with PreserveLoggingContext():
+            notify_deferred.callback(self.current_token)
 
     def remove(self, notifier: "Notifier"):
         """Remove this listener from all the indexes in the Notifier
@@ -177,6 +209,11 @@ class _NotifierUserStream:
             return _NotificationListener(self.notify_deferred.observe())
 
 
+# A user stream whose listeners need waking up, and the deferred they're waiting
+# on.
+_PendingWakeup = Tuple[_NotifierUserStream, ObservableDeferred]
+
+
 class EventStreamResult(namedtuple("EventStreamResult", ("events", "tokens"))):
     def __bool__(self):
         return bool(self.events)
@@ -193,6 +230,19 @@ class _PendingRoomEventEntry:
     membership = attr.ib(type=Optional[str])
 
 
+@attr.s(slots=True, frozen=True)
+class _UnevaluatedRoomEvents:
+    """Room events which clients are yet to be told about, as their push actions
+    haven't been computed yet.
+    """
+
+    # The highest position of the events.
+    stream_id = attr.ib(type=int)
+    max_room_stream_token = attr.ib(type=RoomStreamToken)
+    users = attr.ib(type=Set[UserID])
+    rooms = attr.ib(type=Set[str])
+
+
 class Notifier:
     """This class is responsible for notifying any listeners when there are
     new events available for it.
@@ -202,7 +252,12 @@ class Notifier:
 
     UNUSED_STREAM_EXPIRY_MS = 10 * 60 * 1000
 
-    def __init__(self, hs: "synapse.server.HomeServer"):
+    # The maximum number of user streams to wake up in a single reactor tick.
+    # Anything beyond this is left to later ticks, so that an event in a huge
+    # room doesn't stall the reactor.
+    MAX_WAKEUPS_PER_TICK = 500
+
+    def __init__(self, hs: "HomeServer"):
         self.user_to_user_stream = {}  # type: Dict[str, _NotifierUserStream]
         self.room_to_user_streams = {}  # type: Dict[str, Set[_NotifierUserStream]]
 
@@ -212,6 +267,17 @@ class Notifier:
         self.store = hs.get_datastore()
         self.pending_new_room_events = []  # type: List[_PendingRoomEventEntry]
 
+        # User streams whose tokens have been advanced, but whose listeners
+        # have yet to be woken, along with the deferred those listeners are
+        # waiting on. These are worked through a batch per reactor tick.
+        self._pending_wakeups = deque()  # type: Deque[_PendingWakeup]
+        self._wakeups_scheduled = False
+
+        # If push actions are computed after events are persisted, clients
+        # aren't told about new events until the push evaluator has got to them.
+        self._evaluate_push_actions_async = hs.config.worker.evaluate_push_actions_async
+        self._unevaluated_room_events = deque()  # type: Deque[_UnevaluatedRoomEvents]
+
         # Called when there are new things to stream over replication
         self.replication_callbacks = []  # type: List[Callable[[], None]]
 
@@ -227,6 +293,10 @@ class Notifier:
         if hs.should_send_federation():
             self.federation_sender = hs.get_federation_sender()
 
+        self._action_generator = None
+        if hs.config.worker.run_push_evaluator:
+            self._action_generator = hs.get_action_generator()
+
         self.state_handler = hs.get_state_handler()
 
         self.clock.looping_call(
@@ -257,6 +327,18 @@ class Notifier:
         LaterGauge(
             "synapse_notifier_users", "", [], lambda: len(self.user_to_user_stream)
         )
+        LaterGauge(
+            "synapse_notifier_pending_wakeups",
+            "",
+            [],
+            lambda: len(self._pending_wakeups),
+        )
+        LaterGauge(
+            "synapse_notifier_unevaluated_room_events",
+            "Number of batches of room events waiting for the push evaluator",
+            [],
+            lambda: len(self._unevaluated_room_events),
+        )
 
     def add_replication_callback(self, cb: Callable[[], None]):
         """Add a callback that will be called when some new data is available.
@@ -331,11 +413,13 @@ class Notifier:
 
         users = set()  # type: Set[UserID]
         rooms = set()  # type: Set[str]
+        stream_id = 0
 
         for entry in pending:
             if entry.event_pos.persisted_after(max_room_stream_token):
                 self.pending_new_room_events.append(entry)
             else:
+                stream_id = max(stream_id, entry.event_pos.stream)
                 if (
                     entry.type == EventTypes.Member
                     and entry.membership == Membership.JOIN
@@ -347,13 +431,56 @@ class Notifier:
                 rooms.add(entry.room_id)
 
         if users or rooms:
+            if self._evaluate_push_actions_async:
+                self._unevaluated_room_events.append(
+                    _UnevaluatedRoomEvents(
+                        stream_id=stream_id,
+                        max_room_stream_token=max_room_stream_token,
+                        users=users,
+                        rooms=rooms,
+                    )
+                )
+                self._notify_evaluated_room_events()
+            else:
+                self.on_new_event(
+                    "room_key",
+                    max_room_stream_token,
+                    users=users,
+                    rooms=rooms,
+                )
+            self._on_updated_room_token(max_room_stream_token)
+
+    def on_push_evaluator_progress(self) -> None:
+        """Called when the push evaluator has computed the push actions for
+        more events.
+        """
+        self._notify_evaluated_room_events()
+        self._pusher_pool.on_push_evaluator_progress()
+
+    def _notify_evaluated_room_events(self) -> None:
+        """Notify for the room events which the push evaluator has got to."""
+        evaluated_stream_id = self.store.get_current_push_evaluator_position()
+
+        max_room_stream_token = None  # type: Optional[RoomStreamToken]
+        users = set()  # type: Set[UserID]
+        rooms = set()  # type: Set[str]
+
+        while (
+            self._unevaluated_room_events
+            and self._unevaluated_room_events[0].stream_id <= evaluated_stream_id
+        ):
+            entry = self._unevaluated_room_events.popleft()
+            max_room_stream_token = entry.max_room_stream_token
+            users.update(entry.users)
+            rooms.update(entry.rooms)
+
+        if max_room_stream_token:
             self.on_new_event(
                 "room_key",
                 max_room_stream_token,
                 users=users,
                 rooms=rooms,
             )
-            self._on_updated_room_token(max_room_stream_token)
 
     def _on_updated_room_token(self, max_room_stream_token: RoomStreamToken):
         """Poke services that might care that the room position has been
@@ -367,6 +494,9 @@ class Notifier:
         if self.federation_sender:
             self.federation_sender.notify_new_events(max_room_stream_token)
 
+        if self._action_generator:
+            self._action_generator.notify_new_events(max_room_stream_token)
+
     def _notify_app_services(self, max_room_stream_token: RoomStreamToken):
         try:
             self.appservice_handler.notify_interested_services(max_room_stream_token)
@@ -434,12 +564,27 @@ class Notifier:
                     users,
                 )
 
+            # We advance the tokens now, but leave actually waking up the
+            # listeners to `_wake_pending_streams`. As `advance` hands over the
+            # deferred the listeners are waiting on, a stream that gets several
+            # events before then is only woken up once.
             time_now_ms = self.clock.time_msec()
+            advanced_tokens = {}  # type: Dict[StreamToken, StreamToken]
             for user_stream in user_streams:
                 try:
-                    user_stream.notify(stream_key, new_token, time_now_ms)
+                    notify_deferred = user_stream.advance(
+                        stream_key, new_token, time_now_ms, advanced_tokens
+                    )
                 except Exception:
                     logger.exception("Failed to notify listener")
+                    continue
+
+                if notify_deferred is not None:
+                    self._pending_wakeups.append((user_stream, notify_deferred))
+
+            self._schedule_wakeups()
+
+            users_woken_by_stream_counter.labels(stream_key).inc(len(user_streams))
 
             self.notify_replication()
 
@@ -450,6 +595,26 @@ class Notifier:
                 users,
             )
 
+    def _schedule_wakeups(self) -> None:
+        if self._pending_wakeups and not self._wakeups_scheduled:
+            self._wakeups_scheduled = True
+            self.clock.call_later(0, self._wake_pending_streams)
+
+    def _wake_pending_streams(self) -> None:
+        """Wake up the listeners of a batch of pending user streams, and
+        schedule another run if there are more left.
+        """
+        self._wakeups_scheduled = False
+
+        for _ in range(min(self.MAX_WAKEUPS_PER_TICK, len(self._pending_wakeups))):
+            user_stream, notify_deferred = self._pending_wakeups.popleft()
+            try:
+                user_stream.wake(notify_deferred)
+            except Exception:
+                logger.exception("Failed to notify listener")
+
+        self._schedule_wakeups()
+
     def on_new_replication_data(self) -> None:
         """Used to inform replication listeners that something has happened
         without waking up any of the normal user event streams"""
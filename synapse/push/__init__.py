@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import abc
-from typing import TYPE_CHECKING, Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 import attr
 
@@ -93,6 +93,26 @@ class Pusher(metaclass=abc.ABCMeta):
         self.max_stream_ordering = max(max_stream_ordering, self.max_stream_ordering)
         self._start_processing()
 
+    def on_new_push_actions(
+        self,
+        min_stream_ordering: int,
+        max_token: RoomStreamToken,
+        push_actions: List[dict],
+    ) -> None:
+        """Called with the new unread push actions for the user, as fetched by
+        the pusher pool.
+
+        Args:
+            min_stream_ordering: The exclusive lower bound of the stream
+                orderings that the pusher pool has handed out all the new push
+                actions for.
+            max_token: The inclusive upper bound of the new push actions.
+            push_actions: The user's unread push actions after the last batch
+                and up to `max_token`, in the same form as returned by
+                `get_unread_push_actions_for_user_in_range_for_http`.
+        """
+        self.on_new_notifications(max_token)
+
     @abc.abstractmethod
     def _start_processing(self):
         """Start processing push notifications."""
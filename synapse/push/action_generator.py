@@ -13,11 +13,18 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
 
+from twisted.internet import defer
+
+import synapse.metrics
 from synapse.events import EventBase
 from synapse.events.snapshot import EventContext
+from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.push.bulk_push_rule_evaluator import BulkPushRuleEvaluator
+from synapse.types import RoomStreamToken
+from synapse.util import unwrapFirstError
 from synapse.util.metrics import Measure
 
 if TYPE_CHECKING:
@@ -27,8 +34,14 @@ logger = logging.getLogger(__name__)
 
 
 class ActionGenerator:
+    # How long to wait before retrying a batch of events whose push actions
+    # couldn't be computed, in seconds.
+    RETRY_INTERVAL_SECS = 5
+
     def __init__(self, hs: "HomeServer"):
         self.clock = hs.get_clock()
+        self.store = hs.get_datastore()
+        self.storage = hs.get_storage()
         self.bulk_evaluator = BulkPushRuleEvaluator(hs)
         # really we want to get all user ids and all profile tags too,
         # since we want the actions for each profile tag for every user and
@@ -37,8 +50,162 @@ class ActionGenerator:
         # event stream, so we just run the rules for a client with no profile
         # tag (ie. we just need all the users).
 
+        # If push actions are computed asynchronously they are computed for
+        # events after they have been persisted, by working through the events
+        # stream.
+        self._evaluate_push_actions_async = hs.config.worker.evaluate_push_actions_async
+        self._last_poked_id = -1
+        self._is_processing = False
+        if hs.config.worker.run_push_evaluator:
+            self.hs = hs
+
+            # Catch up on any events which were persisted while we were down.
+            self.clock.call_later(
+                0,
+                self.notify_new_events,
+                RoomStreamToken(None, self.store.get_room_max_stream_ordering()),
+            )
+
     async def handle_push_actions_for_event(
         self, event: EventBase, context: EventContext
     ) -> None:
+        if self._evaluate_push_actions_async:
+            # We'll get to the event once it's been persisted.
+            return
+
         with Measure(self.clock, "action_for_event_by_user"):
             await self.bulk_evaluator.action_for_event_by_user(event, context)
+
+    def notify_new_events(self, max_token: RoomStreamToken) -> None:
+        """Called when there are new events which we may need to compute the
+        push actions for.
+        """
+        # We just use the minimum stream ordering and ignore the vector clock
+        # component. This is safe to do as long as we *always* ignore the vector
+        # clock components.
+        self._last_poked_id = max(max_token.stream, self._last_poked_id)
+
+        if self._is_processing:
+            return
+
+        run_as_background_process(
+            "evaluate_push_actions", self._process_event_queue_loop
+        )
+
+    async def _process_event_queue_loop(self) -> None:
+        try:
+            self._is_processing = True
+            while True:
+                last_token = await self.store.get_push_evaluator_position()
+                next_token, events = await self.store.get_all_new_events_stream(
+                    last_token, self._last_poked_id, limit=100
+                )
+
+                if not events and next_token >= self._last_poked_id:
+                    break
+
+                events_by_room = {}  # type: Dict[str, List[EventBase]]
+                for event in events:
+                    # Outliers aren't part of the timeline, so never notify.
+                    if event.internal_metadata.is_outlier():
+                        continue
+                    events_by_room.setdefault(event.room_id, []).append(event)
+
+                # The events, along with the push actions for each user and
+                # whether they count as unread.
+                events_and_actions = (
+                    []
+                )  # type: List[Tuple[EventBase, Dict[str, List[Union[dict, str]]], bool]]
+
+                async def handle_room_events(events: List[EventBase]) -> None:
+                    for event in events:
+                        context = await self._get_context_for_persisted_event(event)
+                        with Measure(self.clock, "action_for_event_by_user"):
+                            (
+                                actions_by_user,
+                                count_as_unread,
+                            ) = await self.bulk_evaluator.get_actions_for_event(
+                                event, context
+                            )
+
+                        events_and_actions.append(
+                            (event, actions_by_user, count_as_unread)
+                        )
+
+                try:
+                    await make_deferred_yieldable(
+                        defer.gatherResults(
+                            [
+                                run_in_background(handle_room_events, evs)
+                                for evs in events_by_room.values()
+                            ],
+                            consumeErrors=True,
+                        )
+                    ).addErrback(unwrapFirstError)
+
+                    # The push actions and our new position are written
+                    # together, so that each event's push actions are added
+                    # exactly once.
+                    await self.store.add_push_actions_for_persisted_events(
+                        events_and_actions, next_token
+                    )
+                except Exception:
+                    # Skipping the events would leave their push actions
+                    # missing for good, so we retry the batch from our stored
+                    # position instead.
+                    logger.exception(
+                        "Failed to compute push actions for events after %d,"
+                        " retrying",
+                        last_token,
+                    )
+                    await self.clock.sleep(self.RETRY_INTERVAL_SECS)
+                    continue
+
+                # Let clients and pushers on this instance go on to these
+                # events, and tell the other instances that they can too.
+                # (The notifier is fetched here as it depends on us.)
+                notifier = self.hs.get_notifier()
+                notifier.on_push_evaluator_progress()
+                notifier.notify_replication()
+
+                if events:
+                    now = self.clock.time_msec()
+                    ts = await self.store.get_received_ts(events[-1].event_id)
+
+                    synapse.metrics.event_processing_lag.labels("push_evaluator").set(
+                        now - ts
+                    )
+                    synapse.metrics.event_processing_last_ts.labels(
+                        "push_evaluator"
+                    ).set(ts)
+
+                synapse.metrics.event_processing_positions.labels("push_evaluator").set(
+                    next_token
+                )
+        finally:
+            self._is_processing = False
+
+    async def _get_context_for_persisted_event(self, event: EventBase) -> EventContext:
+        """Build a context for an event which has already been persisted, from
+        the state stored for it.
+        """
+        state_groups = await self.storage.state.get_state_groups_ids(
+            event.room_id, [event.event_id]
+        )
+        ((state_group, current_state_ids),) = state_groups.items()
+
+        prev_state_ids = dict(current_state_ids)
+        if event.is_state():
+            key = (event.type, event.state_key)
+            replaces_state = event.unsigned.get("replaces_state")
+            if replaces_state:
+                prev_state_ids[key] = replaces_state
+            else:
+                prev_state_ids.pop(key, None)
+
+        return EventContext.with_state(
+            state_group=state_group,
+            state_group_before_event=None,
+            current_state_ids=current_state_ids,
+            prev_state_ids=prev_state_ids,
+        )
@@ -14,7 +14,19 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple, Union
+import weakref
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import attr
 from prometheus_client import Counter
@@ -24,12 +36,14 @@ from synapse.event_auth import get_user_power_level
 from synapse.events import EventBase
 from synapse.events.snapshot import EventContext
 from synapse.state import POWER_KEY
+from synapse.types import get_localpart_from_id
+from synapse.util import json_encoder
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches import CacheMetric, register_cache
 from synapse.util.caches.descriptors import lru_cache
 from synapse.util.caches.lrucache import LruCache
 
-from .push_rule_evaluator import PushRuleEvaluatorForEvent
+from .push_rule_evaluator import PushRuleEvaluatorForEvent, WordMatcher
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -117,14 +131,23 @@ class BulkPushRuleEvaluator:
             resizable=False,
         )
 
+        # The compiled push rules of each user, shared by every room.
+        self._rule_set_cache = _RuleSetCache(50000)
+
+        # Maps room ID to a `WordMatcher` for the words that the push rules of
+        # the users in the room look for in message bodies.
+        self._word_matcher_cache = LruCache(
+            1000, "push_word_matcher_cache"
+        )  # type: LruCache[str, WordMatcher]
+
     async def _get_rules_for_event(
         self, event: EventBase, context: EventContext
-    ) -> Dict[str, List[Dict[str, Any]]]:
+    ) -> Dict[str, "_RuleSet"]:
         """This gets the rules for all users in the room at the time of the event,
         as well as the push rules for the invitee if the event is an invite.
 
         Returns:
-            dict of user_id -> push_rules
+            dict of user_id -> compiled push rules
         """
         room_id = event.room_id
 
@@ -134,6 +157,7 @@ class BulkPushRuleEvaluator:
             room_id=room_id,
             rules_for_room_cache=self._get_rules_for_room.cache,
             room_push_rule_cache_metrics=self.room_push_rule_cache_metrics,
+            rule_set_cache=self._rule_set_cache,
             linearizer=self._rules_linearizer,
             cached_data=rules_for_room_data,
         )
@@ -147,10 +171,9 @@ class BulkPushRuleEvaluator:
             if invited and self.hs.is_mine_id(invited):
                 has_pusher = await self.store.user_has_pusher(invited)
                 if has_pusher:
+                    rules = await self.store.get_push_rules_for_user(invited)
                     rules_by_user = dict(rules_by_user)
-                    rules_by_user[invited] = await self.store.get_push_rules_for_user(
-                        invited
-                    )
+                    rules_by_user[invited] = self._rule_set_cache.get(invited, rules)
 
         return rules_by_user
 
@@ -191,6 +214,29 @@ class BulkPushRuleEvaluator:
         should increment the unread count, and insert the results into the
         event_push_actions_staging table.
         """
+        actions_by_user, count_as_unread = await self.get_actions_for_event(
+            event, context
+        )
+
+        # Mark in the DB staging area the push actions for users who should be
+        # notified for this event. (This will then get handled when we persist
+        # the event)
+        await self.store.add_push_actions_to_staging(
+            event.event_id,
+            actions_by_user,
+            count_as_unread,
+        )
+
+    async def get_actions_for_event(
+        self, event: EventBase, context: EventContext
+    ) -> Tuple[Dict[str, List[Union[dict, str]]], bool]:
+        """Given an event and context, evaluate the push rules and check if the
+        message should increment the unread count.
+
+        Returns:
+            A mapping of user ID to the push actions for that user, and whether
+            the event should increment the unread counts of those users.
+        """
         count_as_unread = _should_count_as_unread(event, context)
 
         rules_by_user = await self._get_rules_for_event(event, context)
@@ -203,25 +249,37 @@ class BulkPushRuleEvaluator:
             sender_power_level,
         ) = await self._get_power_levels_and_sender_level(event, context)
 
-        evaluator = PushRuleEvaluatorForEvent(
-            event, len(room_members), sender_power_level, power_levels
-        )
-
-        condition_cache = {}  # type: Dict[str, bool]
-
         # If the event is not a state event check if any users ignore the sender.
         if not event.is_state():
             ignorers = await self.store.ignored_by(event.sender)
         else:
             ignorers = set()
 
-        for uid, rules in rules_by_user.items():
+        # Most users have the same push rules, so we group the users by their
+        # rules and evaluate the conditions which don't depend on the user once
+        # per group. Only the conditions which do (e.g. on their display name)
+        # are evaluated for each user.
+        users_by_rule_set = {}  # type: Dict[str, Tuple[_RuleSet, List[str]]]
+        for uid, rule_set in rules_by_user.items():
             if event.sender == uid:
                 continue
 
             if uid in ignorers:
                 continue
 
+            if count_as_unread:
+                # Add an element for the current user if the event needs to be marked as
+                # unread, so that add_push_actions_to_staging iterates over it.
+                # If the event shouldn't be marked as unread but should notify the
+                # current user, it'll be added to the dict later.
+                actions_by_user[uid] = []
+
+            _, user_ids = users_by_rule_set.setdefault(
+                rule_set.fingerprint, (rule_set, [])
+            )
+            user_ids.append(uid)
+
+        def get_display_name(uid: str) -> Optional[str]:
             display_name = None
             profile_info = room_members.get(uid)
             if profile_info:
@@ -233,42 +291,233 @@ class BulkPushRuleEvaluator:
                 if event.type == EventTypes.Member and event.state_key == uid:
                     display_name = event.content.get("displayname", None)
 
-            if count_as_unread:
-                # Add an element for the current user if the event needs to be marked as
-                # unread, so that add_push_actions_to_staging iterates over it.
-                # If the event shouldn't be marked as unread but should notify the
-                # current user, it'll be added to the dict later.
-                actions_by_user[uid] = []
+            return display_name
 
-            for rule in rules:
-                if "enabled" in rule and not rule["enabled"]:
+        word_matcher = None
+        body = event.content.get("body", None)
+        if body and isinstance(body, str):
+            word_matcher = self._get_word_matcher(
+                event.room_id, users_by_rule_set.values(), get_display_name
+            )
+
+        evaluator = PushRuleEvaluatorForEvent(
+            event,
+            len(room_members),
+            sender_power_level,
+            power_levels,
+            word_matcher=word_matcher,
+        )
+
+        condition_cache = {}  # type: Dict[str, bool]
+
+        for rule_set, user_ids in users_by_rule_set.values():
+            # Each user gets the actions of the first rule which matches for
+            # them, so we work through the rules until every user has matched.
+            for rule in rule_set.rules:
+                if not user_ids:
+                    break
+
+                if not _condition_checker(
+                    evaluator, rule.shared_conditions, None, None, condition_cache
+                ):
                     continue
 
-                matches = _condition_checker(
-                    evaluator, rule["conditions"], uid, display_name, condition_cache
+                if rule.user_conditions:
+                    matched_user_ids = []
+                    unmatched_user_ids = []
+                    for uid in user_ids:
+                        if _condition_checker(
+                            evaluator,
+                            rule.user_conditions,
+                            uid,
+                            get_display_name(uid),
+                            {},
+                        ):
+                            matched_user_ids.append(uid)
+                        else:
+                            unmatched_user_ids.append(uid)
+                    user_ids = unmatched_user_ids
+                else:
+                    matched_user_ids = user_ids
+                    user_ids = []
+
+                if rule.actions:
+                    # Push rules say we should notify the user of this event
+                    for uid in matched_user_ids:
+                        actions_by_user[uid] = rule.actions
+
+        return actions_by_user, count_as_unread
+
+    def _get_word_matcher(
+        self,
+        room_id: str,
+        users_by_rule_set: Iterable[Tuple["_RuleSet", List[str]]],
+        get_display_name: Callable[[str], Optional[str]],
+    ) -> WordMatcher:
+        """Get a `WordMatcher` for all the words the given users' push rules
+        look for in message bodies.
+
+        The matcher for the room is reused if it has all of them.
+        """
+        words = set()  # type: Set[str]
+        for rule_set, user_ids in users_by_rule_set:
+            words.update(rule_set.body_words)
+
+            if not rule_set.body_user_patterns:
+                continue
+            for uid in user_ids:
+                if "display_name" in rule_set.body_user_patterns:
+                    display_name = get_display_name(uid)
+                    if display_name:
+                        words.add(display_name)
+                if "user_id" in rule_set.body_user_patterns:
+                    words.add(uid)
+                if "user_localpart" in rule_set.body_user_patterns:
+                    words.add(get_localpart_from_id(uid))
+
+        word_matcher = self._word_matcher_cache.get(room_id)
+        if word_matcher is None or not all(
+            word in word_matcher for word in words if WordMatcher.can_match(word)
+        ):
+            # We build a new matcher rather than adding to the old one, which
+            # also drops the words of users who have since left.
+            word_matcher = WordMatcher(words)
+            self._word_matcher_cache[room_id] = word_matcher
+
+        return word_matcher
+
+
+def _is_user_condition(condition: Dict[str, Any]) -> bool:
+    """Whether the outcome of a push rule condition depends on the user the
+    rule belongs to, rather than just the event.
+    """
+    if condition["kind"] == "contains_display_name":
+        return True
+    if condition["kind"] == "event_match" and not condition.get("pattern"):
+        # The pattern comes from the user's ID.
+        return True
+    return False
+
+
+@attr.s(slots=True, frozen=True)
+class _CompiledRule:
+    """An enabled push rule, with its conditions split by whether they depend
+    on the user.
+    """
+
+    shared_conditions = attr.ib(type=List[Dict[str, Any]])
+    user_conditions = attr.ib(type=List[Dict[str, Any]])
+    # The actions to store if the rule matches, or None if the rule doesn't
+    # notify.
+    actions = attr.ib(type=Optional[List[Union[dict, str]]])
+
+
+@attr.s(slots=True, frozen=True)
+class _RuleSet:
+    """A user's list of push rules, prepared for evaluating against events.
+
+    These are shared by all the users with the same rules, so must not be
+    modified.
+    """
+
+    # Users with the same fingerprint have the same rules.
+    fingerprint = attr.ib(type=str)
+    rules = attr.ib(type=List[_CompiledRule])
+    # The patterns the rules look for in message bodies which are the same for
+    # every user.
+    body_words = attr.ib(type=Set[str])
+    # Which of the user's details the rules look for in message bodies: any of
+    # "display_name", "user_id" and "user_localpart".
+    body_user_patterns = attr.ib(type=Set[str])
+
+    @classmethod
+    def from_rules(cls, fingerprint: str, rules: List[Dict[str, Any]]) -> "_RuleSet":
+        compiled_rules = []
+        body_words = set()
+        body_user_patterns = set()
+        for rule in rules:
+            if "enabled" in rule and not rule["enabled"]:
+                continue
+
+            for condition in rule["conditions"]:
+                if condition["kind"] == "contains_display_name":
+                    body_user_patterns.add("display_name")
+                elif (
+                    condition["kind"] == "event_match"
+                    and condition.get("key") == "content.body"
+                ):
+                    if condition.get("pattern"):
+                        body_words.add(condition["pattern"])
+                    elif condition.get("pattern_type"):
+                        body_user_patterns.add(condition["pattern_type"])
+
+            actions = [x for x in rule["actions"] if x != "dont_notify"]
+            compiled_rules.append(
+                _CompiledRule(
+                    shared_conditions=[
+                        c for c in rule["conditions"] if not _is_user_condition(c)
+                    ],
+                    user_conditions=[
+                        c for c in rule["conditions"] if _is_user_condition(c)
+                    ],
+                    actions=actions if actions and "notify" in actions else None,
                 )
-                if matches:
-                    actions = [x for x in rule["actions"] if x != "dont_notify"]
-                    if actions and "notify" in actions:
-                        # Push rules say we should notify the user of this event
-                        actions_by_user[uid] = actions
-                    break
+            )
 
-        # Mark in the DB staging area the push actions for users who should be
-        # notified for this event. (This will then get handled when we persist
-        # the event)
-        await self.store.add_push_actions_to_staging(
-            event.event_id,
-            actions_by_user,
-            count_as_unread,
+        return cls(
+            fingerprint=fingerprint,
+            rules=compiled_rules,
+            body_words=body_words,
+            body_user_patterns=body_user_patterns,
         )
 
 
+class _RuleSetCache:
+    """Caches the compiled push rules of each user.
+
+    Users with the same rules share a single `_RuleSet`, so the rules for the
+    users in a room only take up as much memory as the number of distinct sets
+    of rules, however many rooms and users there are.
+    """
+
+    def __init__(self, max_entries: int):
+        # Maps user ID to the list of rules the entry was built from and the
+        # compiled rules.
+        self._by_user = LruCache(
+            max_entries, "push_rule_set_cache"
+        )  # type: LruCache[str, Tuple[List[Dict[str, Any]], _RuleSet]]
+
+        # The compiled rules in use, by fingerprint.
+        self._by_fingerprint = (
+            weakref.WeakValueDictionary()
+        )  # type: weakref.WeakValueDictionary[str, _RuleSet]
+
+    def get(self, user_id: str, rules: List[Dict[str, Any]]) -> _RuleSet:
+        """Get the compiled form of the given user's list of push rules, as
+        returned by the store.
+        """
+        # The store replaces the cached list of rules when it sees the user's
+        # rules change on the push rules stream, so the entry is up to date if
+        # it was built from the same list.
+        entry = self._by_user.get(user_id)
+        if entry is not None and entry[0] is rules:
+            return entry[1]
+
+        fingerprint = json_encoder.encode(rules)
+        rule_set = self._by_fingerprint.get(fingerprint)
+        if rule_set is None:
+            rule_set = _RuleSet.from_rules(fingerprint, rules)
+            self._by_fingerprint[fingerprint] = rule_set
+
+        self._by_user[user_id] = (rules, rule_set)
+        return rule_set
+
+
 def _condition_checker(
     evaluator: PushRuleEvaluatorForEvent,
     conditions: List[dict],
-    uid: str,
-    display_name: str,
+    uid: Optional[str],
+    display_name: Optional[str],
     cache: Dict[str, bool],
 ) -> bool:
     for cond in conditions:
@@ -300,8 +549,8 @@ class RulesForRoomData:
 
     # event_id -> (user_id, state)
     member_map = attr.ib(type=Dict[str, Tuple[str, str]], factory=dict)
-    # user_id -> rules
-    rules_by_user = attr.ib(type=Dict[str, List[Dict[str, dict]]], factory=dict)
+    # user_id -> rules, which are shared with other rooms and users
+    rules_by_user = attr.ib(type=Dict[str, _RuleSet], factory=dict)
 
     # The last state group we updated the caches for. If the state_group of
     # a new event comes along, we know that we can just return the cached
@@ -341,6 +590,7 @@ class RulesForRoom:
         room_id: str,
         rules_for_room_cache: LruCache,
         room_push_rule_cache_metrics: CacheMetric,
+        rule_set_cache: _RuleSetCache,
         linearizer: Linearizer,
         cached_data: RulesForRoomData,
     ):
@@ -351,6 +601,7 @@ class RulesForRoom:
             rules_for_room_cache: The cache object that caches these
                 RoomsForUser objects.
             room_push_rule_cache_metrics: The metrics object
+            rule_set_cache: The cache of the compiled push rules of each user.
             linearizer: The linearizer used to ensure only one thing mutates
                 the cache at a time. Keyed off room_id
             cached_data: Cached data from previous calls to `self.get_rules`,
@@ -360,6 +611,7 @@ class RulesForRoom:
         self.is_mine_id = hs.is_mine_id
         self.store = hs.get_datastore()
         self.room_push_rule_cache_metrics = room_push_rule_cache_metrics
+        self.rule_set_cache = rule_set_cache
 
         # Used to ensure only one thing mutates the cache at a time. Keyed off
         # room_id.
@@ -377,7 +629,7 @@ class RulesForRoom:
 
     async def get_rules(
         self, event: EventBase, context: EventContext
-    ) -> Dict[str, List[Dict[str, dict]]]:
+    ) -> Dict[str, _RuleSet]:
         """Given an event context return the rules for all users who are
         currently in the room.
         """
@@ -475,7 +727,7 @@ class RulesForRoom:
 
     async def _update_rules_with_member_event_ids(
         self,
-        ret_rules_by_user: Dict[str, list],
+        ret_rules_by_user: Dict[str, _RuleSet],
         member_event_ids: Dict[str, str],
         state_group: Optional[int],
         event: EventBase,
@@ -527,7 +779,9 @@ class RulesForRoom:
         )
 
         ret_rules_by_user.update(
-            item for item in rules_by_user.items() if item[0] is not None
+            (user_id, self.rule_set_cache.get(user_id, rules))
+            for user_id, rules in rules_by_user.items()
+            if user_id is not None
         )
 
         self.update_cache(sequence, members, ret_rules_by_user, state_group)
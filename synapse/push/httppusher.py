@@ -14,7 +14,7 @@
 # limitations under the License.
 import logging
 import urllib.parse
-from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Union
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Union
 
 from prometheus_client import Counter
 
@@ -26,6 +26,7 @@ from synapse.events import EventBase
 from synapse.logging import opentracing
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.push import Pusher, PusherConfig, PusherConfigException
+from synapse.types import RoomStreamToken
 
 from . import push_rule_evaluator, push_tools
 
@@ -62,6 +63,9 @@ class HttpPusher(Pusher):
     # This one's in ms because we compare it against the clock
     GIVE_UP_AFTER_MS = 24 * 60 * 60 * 1000
 
+    # The maximum number of push actions to fetch at once.
+    PUSH_ACTIONS_FETCH_LIMIT = 20
+
     def __init__(self, hs: "HomeServer", pusher_config: PusherConfig):
         super().__init__(hs, pusher_config)
         self.storage = self.hs.get_storage()
@@ -73,6 +77,13 @@ class HttpPusher(Pusher):
         self.failing_since = pusher_config.failing_since
         self.timed_call = None  # type: Optional[IDelayedCall]
         self._is_processing = False
+
+        # The stream ordering up to which we have processed all of the user's
+        # push actions, if known. While we're caught up, we can use the push
+        # actions handed to us by the pusher pool rather than fetching them.
+        self._caught_up_stream_ordering = None  # type: Optional[int]
+        self._new_push_actions = None  # type: Optional[List[dict]]
+
         self._group_unread_count_by_room = hs.config.push_group_unread_count_by_room
         self._pusherpool = hs.get_pusherpool()
 
@@ -102,7 +113,7 @@ class HttpPusher(Pusher):
             )
 
         self.url = url
-        self.http_client = hs.get_proxied_blacklisted_http_client()
+        self._push_gateway_client = hs.get_push_gateway_client()
         self.data_minus_url = {}
         self.data_minus_url.update(self.data)
         del self.data_minus_url["url"]
@@ -117,6 +128,30 @@ class HttpPusher(Pusher):
         """
         if should_check_for_notifs:
             self._start_processing()
+        else:
+            self._caught_up_stream_ordering = self.max_stream_ordering
+
+    def on_new_push_actions(
+        self,
+        min_stream_ordering: int,
+        max_token: RoomStreamToken,
+        push_actions: List[dict],
+    ) -> None:
+        if (
+            not self._is_processing
+            and self._caught_up_stream_ordering is not None
+            and self._caught_up_stream_ordering >= min_stream_ordering
+            and max_token.stream >= self.max_stream_ordering
+        ):
+            # We've processed everything before this batch, so the push actions
+            # in it are all that we have to do.
+            self._new_push_actions = [
+                push_action
+                for push_action in push_actions
+                if push_action["stream_ordering"] > self._caught_up_stream_ordering
+            ]
+
+        self.on_new_notifications(max_token)
 
     def on_new_receipts(self, min_stream_id: int, max_stream_id: int) -> None:
         # Note that the min here shouldn't be relied upon to be accurate.
@@ -177,11 +212,25 @@ class HttpPusher(Pusher):
         Never call this directly: use _process which will only allow this to
         run once per pusher.
         """
-        unprocessed = (
-            await self.store.get_unread_push_actions_for_user_in_range_for_http(
-                self.user_id, self.last_stream_ordering, self.max_stream_ordering
+        # We only know that we're caught up again once we've processed
+        # everything successfully.
+        self._caught_up_stream_ordering = None
+        max_stream_ordering = self.max_stream_ordering
+
+        if self._new_push_actions is not None:
+            unprocessed = self._new_push_actions
+            self._new_push_actions = None
+            fetched_all = True
+        else:
+            unprocessed = (
+                await self.store.get_unread_push_actions_for_user_in_range_for_http(
+                    self.user_id,
+                    self.last_stream_ordering,
+                    max_stream_ordering,
+                    limit=self.PUSH_ACTIONS_FETCH_LIMIT,
+                )
             )
-        )
+            fetched_all = len(unprocessed) < self.PUSH_ACTIONS_FETCH_LIMIT
 
         logger.info(
             "Processing %i unprocessed push actions for %s starting at "
@@ -269,7 +318,10 @@ class HttpPusher(Pusher):
                     self.backoff_delay = min(
                         self.backoff_delay * 2, self.MAX_BACKOFF_SEC
                     )
-                    break
+                    return
+
+        if fetched_all:
+            self._caught_up_stream_ordering = max_stream_ordering
 
     async def _process_one(self, push_action: dict) -> bool:
         if "notify" not in push_action["actions"]:
@@ -384,7 +436,7 @@ class HttpPusher(Pusher):
         if not notification_dict:
             return []
         try:
-            resp = await self.http_client.post_json_get_json(
+            resp = await self._push_gateway_client.send_notification(
                 self.url, notification_dict
             )
         except Exception as e:
@@ -424,7 +476,7 @@ class HttpPusher(Pusher):
             }
         }
         try:
-            await self.http_client.post_json_get_json(self.url, d)
+            await self._push_gateway_client.send_notification(self.url, d)
             http_badges_processed_counter.inc()
         except Exception as e:
             logger.warning(
@@ -14,7 +14,7 @@
 
 import logging
 import urllib.parse
-from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, TypeVar
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, TypeVar
 
 import bleach
 import jinja2
@@ -31,6 +31,7 @@ from synapse.push.presentable_names import (
 from synapse.storage.state import StateFilter
 from synapse.types import StateMap, UserID
 from synapse.util.async_helpers import concurrently_execute
+from synapse.util.caches.response_cache import ResponseCache
 from synapse.visibility import filter_events_for_client
 
 if TYPE_CHECKING:
@@ -44,6 +45,10 @@ T = TypeVar("T")
 CONTEXT_BEFORE = 1
 CONTEXT_AFTER = 1
 
+# How long to keep the parts of notification emails which are the same for every
+# user, so that they're shared between all the emails sent around the same time.
+SHARED_DATA_CACHE_MS = 10 * 60 * 1000
+
 # From https://github.com/matrix-org/matrix-react-sdk/blob/master/src/HtmlUtils.js
 ALLOWED_TAGS = [
     "font",  # custom to matrix for IRC-style font coloring
@@ -112,6 +117,18 @@ class Mailer:
         self.app_name = app_name
         self.email_subjects = hs.config.email_subjects  # type: EmailSubjectConfig
 
+        # The IDs of the events before each notification, by room ID and event
+        # ID of the notification.
+        self._context_cache = ResponseCache(
+            hs.get_clock(), "email_notif_context", timeout_ms=SHARED_DATA_CACHE_MS
+        )  # type: ResponseCache[Tuple[str, str]]
+
+        # The explicit names of rooms, by room ID and the event IDs of the
+        # room's name and canonical alias.
+        self._room_name_cache = ResponseCache(
+            hs.get_clock(), "email_room_name", timeout_ms=SHARED_DATA_CACHE_MS
+        )  # type: ResponseCache[Tuple[str, Optional[str], Optional[str]]]
+
         logger.info("Created Mailer for app_name %s" % app_name)
 
     async def send_password_reset_mail(
@@ -266,8 +283,8 @@ class Mailer:
             )
             rooms.append(roomvars)
 
-        reason["room_name"] = await calculate_room_name(
-            self.store,
+        reason["room_name"] = await self._get_room_name(
+            reason["room_id"],
             state_by_room[reason["room_id"]],
             user_id,
             fallback_to_members=True,
@@ -354,7 +371,7 @@ class Mailer:
                     is_invite = True
                     break
 
-        room_name = await calculate_room_name(self.store, room_state_ids, user_id)
+        room_name = await self._get_room_name(room_id, room_state_ids, user_id)
 
         room_vars = {
             "title": room_name,
@@ -413,12 +430,15 @@ class Mailer:
              A dictionary to be added to the template context.
         """
 
-        results = await self.store.get_events_around(
+        # Every user notified about the event shares the same context, but we
+        # fetch the events themselves each time to pick up any redactions.
+        event_ids_before = await self._context_cache.wrap(
+            (notif["room_id"], notif["event_id"]),
+            self._get_event_ids_before,
             notif["room_id"],
             notif["event_id"],
-            before_limit=CONTEXT_BEFORE,
-            after_limit=CONTEXT_AFTER,
         )
+        events_before = await self.store.get_events_as_list(event_ids_before)
 
         ret = {
             "link": self._make_notif_link(notif),
@@ -427,7 +447,7 @@ class Mailer:
         }
 
         the_events = await filter_events_for_client(
-            self.storage, user_id, results["events_before"]
+            self.storage, user_id, events_before
         )
         the_events.append(notif_event)
 
@@ -438,6 +458,46 @@ class Mailer:
 
         return ret
 
+    async def _get_event_ids_before(self, room_id: str, event_id: str) -> List[str]:
+        """Get the IDs of the events to show before a notification."""
+        results = await self.store.get_events_around(
+            room_id,
+            event_id,
+            before_limit=CONTEXT_BEFORE,
+            after_limit=CONTEXT_AFTER,
+        )
+        return [event.event_id for event in results["events_before"]]
+
+    async def _get_room_name(
+        self,
+        room_id: str,
+        room_state_ids: StateMap[str],
+        user_id: str,
+        fallback_to_members: bool = True,
+    ) -> Optional[str]:
+        """Work out the name of a room to show to the user, as
+        `calculate_room_name` does.
+
+        The room's explicit name or alias is the same for every user, so is
+        shared between them.
+        """
+        key = (
+            room_id,
+            room_state_ids.get((EventTypes.Name, "")),
+            room_state_ids.get((EventTypes.CanonicalAlias, "")),
+        )
+        room_name = await self._room_name_cache.wrap(
+            key,
+            calculate_room_name,
+            self.store,
+            room_state_ids,
+            user_id,
+            fallback_to_members=False,
+        )
+        if room_name is None and fallback_to_members:
+            room_name = await calculate_room_name(self.store, room_state_ids, user_id)
+        return room_name
+
     async def _get_message_vars(
         self, notif: Dict[str, Any], event: EventBase, room_state_ids: StateMap[str]
     ) -> Optional[Dict[str, Any]]:
@@ -569,8 +629,8 @@ class Mailer:
         # If the room has some kind of name, use it, but we don't
         # want the generated-from-names one here otherwise we'll
         # end up with, "new message from Bob in the Bob room"
-        room_name = await calculate_room_name(
-            self.store, room_state_ids, user_id, fallback_to_members=False
+        room_name = await self._get_room_name(
+            room_id, room_state_ids, user_id, fallback_to_members=False
         )
 
         # See if one of the notifs is an invite event for the user
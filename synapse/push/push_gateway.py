@@ -0,0 +1,219 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import urllib.parse
+from typing import TYPE_CHECKING, Collection, Dict, List, Optional, Tuple
+
+import attr
+from prometheus_client import Counter, Gauge, Histogram
+
+from twisted.internet import defer
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.types import JsonDict
+from synapse.util import json_encoder
+from synapse.util.async_helpers import Linearizer
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of requests we make to a push gateway at once. Any more
+# notifications for the gateway wait for one of the requests to finish, which
+# also gives them the chance to be coalesced with each other.
+MAX_CONCURRENT_REQUESTS_PER_GATEWAY = 10
+
+push_gateway_request_time = Histogram(
+    "synapse_push_gateway_request_time_seconds",
+    "Time taken for requests to push gateways",
+    ["gateway"],
+)
+
+push_gateway_queued_devices = Gauge(
+    "synapse_push_gateway_queued_devices",
+    "Number of devices with notifications waiting to be sent to push gateways",
+    ["gateway"],
+)
+
+push_gateway_devices_sent = Counter(
+    "synapse_push_gateway_devices_sent",
+    "Number of devices notifications have been sent to via push gateways",
+    ["gateway"],
+)
+
+
+@attr.s(slots=True)
+class _PendingNotification:
+    """A notification waiting to be sent to a push gateway, which further
+    devices can still be added to.
+    """
+
+    # The notification, without its list of devices.
+    notification = attr.ib(type=JsonDict)
+    devices = attr.ib(type=List[JsonDict], factory=list)
+    # The deferreds to resolve with the gateway's response, along with the
+    # pushkeys of the devices each one added.
+    waiters = attr.ib(type=List[Tuple[defer.Deferred, Collection[str]]], factory=list)
+
+
+class PushGatewayClient:
+    """Sends notifications to push gateways.
+
+    The push gateway API allows a single notification to be sent to several
+    devices at once, so notifications for gateways which support it (see
+    `push.batch_gateway_urls`) which only differ in the devices they're for are
+    coalesced into one request if they're sent at the same time, or while
+    earlier requests to the gateway are in flight.
+    """
+
+    def __init__(self, hs: "HomeServer"):
+        self.clock = hs.get_clock()
+        self.http_client = hs.get_proxied_blacklisted_http_client()
+
+        # The gateways which we can send notifications for several devices to
+        # in one request.
+        self._batch_gateway_urls = hs.config.push.push_batch_gateway_urls
+
+        # Limits the number of requests to each gateway URL.
+        self._limiter = Linearizer(
+            name="push_gateway",
+            max_count=MAX_CONCURRENT_REQUESTS_PER_GATEWAY,
+            clock=self.clock,
+        )
+
+        # The notifications waiting to be sent, by gateway URL and then by the
+        # JSON encoding of the notification.
+        self._pending = {}  # type: Dict[str, Dict[str, _PendingNotification]]
+
+    async def send_notification(self, url: str, notification: JsonDict) -> JsonDict:
+        """Send a notification to the push gateway at the given URL.
+
+        Args:
+            url: The URL of the push gateway's notify endpoint.
+            notification: The body of the request, as defined by the push
+                gateway API.
+
+        Returns:
+            The response from the push gateway, with the rejected pushkeys
+            limited to those of the given devices.
+
+        Raises:
+            Exception if the request failed.
+        """
+        devices = notification["notification"]["devices"]
+        body = {k: v for k, v in notification["notification"].items() if k != "devices"}
+
+        key = None  # type: Optional[str]
+        pending = None  # type: Optional[_PendingNotification]
+        if url in self._batch_gateway_urls:
+            key = json_encoder.encode(body)
+            pending = self._pending.get(url, {}).get(key)
+
+        start_sending = pending is None
+        if pending is None:
+            pending = _PendingNotification(notification=body)
+            if key is not None:
+                self._pending.setdefault(url, {})[key] = pending
+
+        # The devices and waiter must be added before we start sending, as
+        # `_send_pending` may run as far as making the request before it
+        # first yields.
+        pending.devices.extend(devices)
+        push_gateway_queued_devices.labels(_gateway_label(url)).inc(len(devices))
+
+        d = defer.Deferred()  # type: defer.Deferred
+        pending.waiters.append((d, {device.get("pushkey") for device in devices}))
+
+        if start_sending:
+            run_as_background_process(
+                "push_gateway_send", self._send_pending, url, key, pending
+            )
+
+        return await make_deferred_yieldable(d)
+
+    async def _send_pending(
+        self, url: str, key: Optional[str], pending: _PendingNotification
+    ) -> None:
+        """Send a notification to the push gateway at the given URL.
+
+        Args:
+            url: The URL of the push gateway's notify endpoint.
+            key: The key of the notification in `_pending`, if other devices
+                can be added to it.
+            pending: The notification.
+        """
+        gateway = _gateway_label(url)
+        queued = True
+
+        try:
+            if key is not None:
+                # Give any other pushers handling the same event a chance to add
+                # their devices.
+                await self.clock.sleep(0)
+
+            with (await self._limiter.queue(url)):
+                # No more devices can be added once we've started sending.
+                queued = False
+                self._remove_pending(url, key, pending)
+                push_gateway_devices_sent.labels(gateway).inc(len(pending.devices))
+
+                notification = dict(pending.notification, devices=list(pending.devices))
+                start = self.clock.time()
+                try:
+                    resp = await self.http_client.post_json_get_json(
+                        url, {"notification": notification}
+                    )
+                finally:
+                    push_gateway_request_time.labels(gateway).observe(
+                        self.clock.time() - start
+                    )
+
+            rejected = resp.get("rejected") or []
+            results = [
+                dict(resp, rejected=[pk for pk in rejected if pk in pushkeys])
+                for _, pushkeys in pending.waiters
+            ]
+        except Exception as e:
+            # Every waiter must hear back, or its pusher would wait forever.
+            if queued:
+                self._remove_pending(url, key, pending)
+            for d, _ in pending.waiters:
+                d.errback(e)
+            return
+
+        for (d, _), result in zip(pending.waiters, results):
+            d.callback(result)
+
+    def _remove_pending(
+        self, url: str, key: Optional[str], pending: _PendingNotification
+    ) -> None:
+        """Stop other devices being added to a notification, as it is being
+        sent.
+        """
+        pending_by_key = self._pending.get(url, {})
+        if key is not None and pending_by_key.get(key) is pending:
+            del pending_by_key[key]
+            if not pending_by_key:
+                del self._pending[url]
+
+        push_gateway_queued_devices.labels(_gateway_label(url)).dec(
+            len(pending.devices)
+        )
+
+
+def _gateway_label(url: str) -> str:
+    """The label to use for the push gateway at the given URL in metrics."""
+    return urllib.parse.urlparse(url).netloc
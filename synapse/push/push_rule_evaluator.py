@@ -15,7 +15,7 @@
 
 import logging
 import re
-from typing import Any, Dict, List, Optional, Pattern, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Set, Tuple, Union
 
 from synapse.events import EventBase
 from synapse.types import UserID
@@ -28,6 +28,9 @@ logger = logging.getLogger(__name__)
 GLOB_REGEX = re.compile(r"\\\[(\\\!|)(.*)\\\]")
 IS_GLOB = re.compile(r"[\?\*\[\]]")
 INEQUALITY_EXPR = re.compile("^([=<>]*)([0-9]*)$")
+NON_WORD_CHAR = re.compile(r"\W")
+# Used instead of `str.isascii`, which needs Python 3.7.
+NON_ASCII_CHAR = re.compile(r"[^\x00-\x7f]")
 
 
 def _room_member_count(
@@ -112,6 +115,78 @@ def tweaks_for_actions(actions: List[Union[str, Dict]]) -> Dict[str, Any]:
     return tweaks
 
 
+class WordMatcher:
+    """Finds which of a set of words appear in a piece of text, in a single pass
+    over the text.
+
+    A word "appears" in the text if `_glob_matches(word, text, word_boundary=True)`
+    would be true: that is, it matches case-insensitively, and is either at the
+    start of the text or preceded by a non-word character, and either at the
+    end of the text or followed by one.
+
+    Only short ASCII words without glob wildcards are supported (see
+    `can_match`), and only ASCII text can be searched.
+    """
+
+    # The longest word which can be looked for. Each stretch of the text up to
+    # this long is looked up, so the cost of a search grows with it.
+    MAX_WORD_LENGTH = 64
+
+    def __init__(self, words: Iterable[str]):
+        self._words = {word.lower() for word in words if self.can_match(word)}
+        self._max_length = max((len(word) for word in self._words), default=0)
+
+    @staticmethod
+    def can_match(word: str) -> bool:
+        """Whether the given word can be looked for by a `WordMatcher`."""
+        return (
+            0 < len(word) <= WordMatcher.MAX_WORD_LENGTH
+            and not NON_ASCII_CHAR.search(word)
+            and not IS_GLOB.search(word)
+        )
+
+    def __contains__(self, word: str) -> bool:
+        return word.lower() in self._words
+
+    def find(self, text: str) -> Optional[Set[str]]:
+        """Find the words which appear in the given text.
+
+        Returns:
+            The (lower-cased) words which appear in the text, or None if the
+            text can't be searched.
+        """
+        if NON_ASCII_CHAR.search(text):
+            return None
+
+        text = text.lower()
+
+        # The positions which a word can start and end at.
+        starts = [0]
+        ends = []
+        for match in NON_WORD_CHAR.finditer(text):
+            starts.append(match.end())
+            ends.append(match.start())
+        ends.append(len(text))
+
+        # Rather than searching for each word, we look up each stretch of the
+        # text between a start and an end which could be one of the words.
+        found = set()  # type: Set[str]
+        first_end = 0
+        for start in starts:
+            while ends[first_end] <= start:
+                first_end += 1
+                if first_end == len(ends):
+                    return found
+
+            for end in ends[first_end:]:
+                if end - start > self._max_length:
+                    break
+                if text[start:end] in self._words:
+                    found.add(text[start:end])
+
+        return found
+
+
 class PushRuleEvaluatorForEvent:
     def __init__(
         self,
@@ -119,7 +194,18 @@ class PushRuleEvaluatorForEvent:
         room_member_count: int,
         sender_power_level: int,
         power_levels: Dict[str, Union[int, Dict[str, int]]],
+        word_matcher: Optional[WordMatcher] = None,
     ):
+        """
+        Args:
+            event: The event to evaluate push rules against.
+            room_member_count: The number of members in the room.
+            sender_power_level: The power level of the sender of the event.
+            power_levels: The content of the power levels event of the room.
+            word_matcher: If given, the words of the matcher which appear in
+                the body of the event are found up front, so that matching the
+                body against any of them doesn't need a search of its own.
+        """
         self._event = event
         self._room_member_count = room_member_count
         self._sender_power_level = sender_power_level
@@ -128,8 +214,17 @@ class PushRuleEvaluatorForEvent:
         # Maps strings of e.g. 'content.body' -> event["content"]["body"]
         self._value_cache = _flatten_dict(event)
 
+        self._word_matcher = word_matcher
+        self._words_in_body = None  # type: Optional[Set[str]]
+        body = event.content.get("body", None)
+        if word_matcher is not None and body and isinstance(body, str):
+            self._words_in_body = word_matcher.find(body)
+
     def matches(
-        self, condition: Dict[str, Any], user_id: str, display_name: str
+        self,
+        condition: Dict[str, Any],
+        user_id: Optional[str],
+        display_name: Optional[str],
     ) -> bool:
         if condition["kind"] == "event_match":
             return self._event_match(condition, user_id)
@@ -144,14 +239,14 @@ class PushRuleEvaluatorForEvent:
         else:
             return True
 
-    def _event_match(self, condition: dict, user_id: str) -> bool:
+    def _event_match(self, condition: dict, user_id: Optional[str]) -> bool:
         pattern = condition.get("pattern", None)
 
         if not pattern:
             pattern_type = condition.get("pattern_type", None)
             if pattern_type == "user_id":
                 pattern = user_id
-            elif pattern_type == "user_localpart":
+            elif pattern_type == "user_localpart" and user_id:
                 pattern = UserID.from_string(user_id).localpart
 
         if not pattern:
@@ -164,7 +259,7 @@ class PushRuleEvaluatorForEvent:
             if not body or not isinstance(body, str):
                 return False
 
-            return _glob_matches(pattern, body, word_boundary=True)
+            return self._body_contains(pattern, is_glob=True)
         else:
             haystack = self._get_value(condition["key"])
             if haystack is None:
@@ -172,7 +267,7 @@ class PushRuleEvaluatorForEvent:
 
             return _glob_matches(pattern, haystack)
 
-    def _contains_display_name(self, display_name: str) -> bool:
+    def _contains_display_name(self, display_name: Optional[str]) -> bool:
         if not display_name:
             return False
 
@@ -180,13 +275,36 @@ class PushRuleEvaluatorForEvent:
         if not body or not isinstance(body, str):
             return False
 
-        # Similar to _glob_matches, but do not treat display_name as a glob.
-        r = regex_cache.get((display_name, False, True), None)
+        return self._body_contains(display_name, is_glob=False)
+
+    def _body_contains(self, pattern: str, is_glob: bool) -> bool:
+        """Whether the pattern appears in the body of the event as a whole
+        word.
+
+        Args:
+            pattern: The pattern to look for.
+            is_glob: Whether the pattern should be treated as a glob.
+        """
+        if (
+            self._words_in_body is not None
+            and self._word_matcher is not None
+            and pattern in self._word_matcher
+        ):
+            # Only words without glob characters are in the matcher, so it
+            # doesn't matter whether the pattern is a glob.
+            return pattern.lower() in self._words_in_body
+
+        body = self._event.content["body"]
+        if is_glob:
+            return _glob_matches(pattern, body, word_boundary=True)
+
+        # Similar to _glob_matches, but do not treat the pattern as a glob.
+        r = regex_cache.get((pattern, False, True), None)
         if not r:
-            r1 = re.escape(display_name)
+            r1 = re.escape(pattern)
             r1 = re_word_boundary(r1)
             r = re.compile(r1, flags=re.IGNORECASE)
-            regex_cache[(display_name, False, True)] = r
+            regex_cache[(pattern, False, True)] = r
 
         return bool(r.search(body))
 
@@ -27,24 +27,20 @@ async def get_badge_count(store: DataStore, user_id: str, group_by_room: bool) -
 
     badge = len(invites)
 
-    for room_id in joins:
-        if room_id in my_receipts_by_room:
-            last_unread_event_id = my_receipts_by_room[room_id]
+    counts_by_room = await store.get_unread_counts_for_rooms_for_user(
+        [room_id for room_id in joins if room_id in my_receipts_by_room], user_id
+    )
 
-            notifs = await (
-                store.get_unread_event_push_actions_by_room_for_user(
-                    room_id, user_id, last_unread_event_id
-                )
-            )
-            if notifs["notify_count"] == 0:
-                continue
+    for notifs in counts_by_room.values():
+        if notifs["notify_count"] == 0:
+            continue
 
-            if group_by_room:
-                # return one badge count per conversation
-                badge += 1
-            else:
-                # increment the badge count by the number of unread messages in the room
-                badge += notifs["notify_count"]
+        if group_by_room:
+            # return one badge count per conversation
+            badge += 1
+        else:
+            # increment the badge count by the number of unread messages in the room
+            badge += notifs["notify_count"]
     return badge
 
 
@@ -14,7 +14,7 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING, Dict, Iterable, Optional
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
 
 from prometheus_client import Gauge
 
@@ -27,7 +27,7 @@ from synapse.push import Pusher, PusherConfig, PusherConfigException
 from synapse.push.pusher import PusherFactory
 from synapse.replication.http.push import ReplicationRemovePusherRestServlet
 from synapse.types import JsonDict, RoomStreamToken
-from synapse.util.async_helpers import concurrently_execute
+from synapse.util.async_helpers import Linearizer, concurrently_execute
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -40,6 +40,10 @@ synapse_pushers = Gauge(
     "synapse_pushers", "Number of active synapse pushers", ["kind", "app_id"]
 )
 
+# The maximum number of push actions to fetch for handing out to the pushers at
+# once. If there are more than this in a batch then the pushers fetch their own.
+PUSH_ACTIONS_BATCH_LIMIT = 10000
+
 
 class PusherPool:
     """
@@ -86,6 +90,25 @@ class PusherPool:
         # startup.
         self._last_room_stream_id_seen = self.store.get_room_max_stream_ordering()
 
+        # The new push actions are fetched in one go for each batch of events
+        # and handed out to the pushers. This is the stream ID from which we've
+        # done so for every batch, so pushers which have caught up to it can
+        # rely on being handed all of their push actions since.
+        self._batched_since = self._last_room_stream_id_seen
+
+        # Batches are handled one at a time, so that they're handed out in
+        # order.
+        self._notifications_linearizer = Linearizer(
+            name="pusherpool_notifications", clock=self.clock
+        )
+
+        # If push actions are computed after events have been persisted, we
+        # can only pass on notifications for the events that the push evaluator
+        # has got through. This is the furthest position we've been poked about
+        # that it hasn't reached yet, if any, so that we can come back to it.
+        self._evaluate_push_actions_async = hs.config.worker.evaluate_push_actions_async
+        self._unevaluated_max_token = None  # type: Optional[RoomStreamToken]
+
         # map from user id to app_id:pushkey to pusher
         self.pushers = {}  # type: Dict[str, Dict[str, Pusher]]
 
@@ -223,18 +246,47 @@ class PusherPool:
 
     @wrap_as_background_process("on_new_notifications")
     async def _on_new_notifications(self, max_token: RoomStreamToken) -> None:
+        with (await self._notifications_linearizer.queue(())):
+            await self._handle_new_notifications(max_token)
+
+    async def _handle_new_notifications(self, max_token: RoomStreamToken) -> None:
+        if self._evaluate_push_actions_async:
+            max_token = self._get_evaluated_max_token(max_token)
+
         # We just use the minimum stream ordering and ignore the vector clock
         # component. This is safe to do as long as we *always* ignore the vector
         # clock components.
         max_stream_id = max_token.stream
 
         prev_stream_id = self._last_room_stream_id_seen
+        if max_stream_id <= prev_stream_id:
+            # We've already handled this batch.
+            return
         self._last_room_stream_id_seen = max_stream_id
 
         try:
-            users_affected = await self.store.get_push_action_users_in_range(
-                prev_stream_id, max_stream_id
+            # Fetch the push actions for all the pushers at once, rather than
+            # having each pusher fetch its own.
+            push_actions = await self.store.get_unread_push_actions_in_range_for_http(
+                prev_stream_id, max_stream_id, limit=PUSH_ACTIONS_BATCH_LIMIT
             )
+            # The push actions for each user, or None if they weren't fetched.
+            prefetched_push_actions = None  # type: Optional[Dict[str, List[dict]]]
+            if len(push_actions) < PUSH_ACTIONS_BATCH_LIMIT:
+                push_actions_by_user = {}  # type: Dict[str, List[dict]]
+                for push_action in push_actions:
+                    push_actions_by_user.setdefault(push_action["user_id"], []).append(
+                        push_action
+                    )
+                prefetched_push_actions = push_actions_by_user
+                users_affected = list(push_actions_by_user)  # type: Iterable[str]
+            else:
+                # There are too many to hand out, so the pushers will have to
+                # fetch their own.
+                self._batched_since = max_stream_id
+                users_affected = await self.store.get_push_action_users_in_range(
+                    prev_stream_id, max_stream_id
+                )
 
             for u in users_affected:
                 # Don't push if the user account has expired
@@ -247,11 +299,45 @@ class PusherPool:
 
                 if u in self.pushers:
                     for p in self.pushers[u].values():
-                        p.on_new_notifications(max_token)
+                        if prefetched_push_actions is None:
+                            p.on_new_notifications(max_token)
+                        else:
+                            p.on_new_push_actions(
+                                self._batched_since,
+                                max_token,
+                                prefetched_push_actions[u],
+                            )
 
         except Exception:
+            # We may not have handed out all of the push actions.
+            self._batched_since = max_stream_id
             logger.exception("Exception in pusher on_new_notifications")
 
+    def _get_evaluated_max_token(self, max_token: RoomStreamToken) -> RoomStreamToken:
+        """Limit the given token to the events which have had their push actions
+        computed, remembering the rest for when the push evaluator gets to them.
+        """
+        evaluated_stream_id = self.store.get_current_push_evaluator_position()
+        if evaluated_stream_id >= max_token.stream:
+            return max_token
+
+        if (
+            self._unevaluated_max_token is None
+            or self._unevaluated_max_token.stream < max_token.stream
+        ):
+            self._unevaluated_max_token = max_token
+
+        return RoomStreamToken(None, evaluated_stream_id)
+
+    def on_push_evaluator_progress(self) -> None:
+        """Called when the push evaluator has computed the push actions for
+        more events.
+        """
+        max_token = self._unevaluated_max_token
+        self._unevaluated_max_token = None
+        if max_token is not None:
+            self.on_new_notifications(max_token)
+
     async def on_new_receipts(
         self, min_stream_id: int, max_stream_id: int, affected_room_ids: Iterable[str]
     ) -> None:
@@ -311,6 +397,14 @@ class PusherPool:
 
     async def _start_pushers(self) -> None:
         """Start all the pushers"""
+        if self._evaluate_push_actions_async:
+            # Some of the events before now may not have had their push actions
+            # computed yet.
+            self._last_room_stream_id_seen = (
+                await self.store.get_push_evaluator_position()
+            )
+            self._batched_since = self._last_room_stream_id_seen
+
         pushers = await self.store.get_all_pushers()
 
         # Stagger starting up the pushers so we don't completely drown the
@@ -355,6 +449,13 @@ class PusherPool:
         if not p:
             return None
 
+        if self._evaluate_push_actions_async:
+            # Don't let the pusher get ahead of the push evaluator, otherwise it
+            # would skip the push actions which are yet to be added.
+            p.max_stream_ordering = min(
+                p.max_stream_ordering, self._last_room_stream_id_seen
+            )
+
         appid_pushkey = "%s:%s" % (pusher_config.app_id, pusher_config.pushkey)
 
         byuser = self.pushers.setdefault(pusher_config.user_name, {})
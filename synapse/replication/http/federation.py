@@ -289,9 +289,45 @@ class ReplicationStoreRoomOnOutlierMembershipRestServlet(ReplicationEndpoint):
         return 200, {}
 
 
+class ReplicationProcessStagedEventsRestServlet(ReplicationEndpoint):
+    """Tells the instance responsible for a room that there are new events
+    received over federation waiting to be processed in it.
+
+    Request format:
+
+        POST /_synapse/replication/fed_process_staged_events/:room_id/:txn_id
+
+        {}
+    """
+
+    NAME = "fed_process_staged_events"
+    PATH_ARGS = ("room_id",)
+
+    def __init__(self, hs):
+        super().__init__(hs)
+
+        self.hs = hs
+
+    @staticmethod
+    async def _serialize_payload(room_id):
+        """
+        Args:
+            room_id (str)
+        """
+        return {}
+
+    async def _handle_request(self, request, room_id):
+        # The federation server isn't otherwise needed on every instance, so
+        # only create it once we're asked to process events.
+        self.hs.get_federation_server().process_staged_events(room_id)
+
+        return 200, {}
+
+
 def register_servlets(hs, http_server):
     ReplicationFederationSendEventsRestServlet(hs).register(http_server)
     ReplicationFederationSendEduRestServlet(hs).register(http_server)
     ReplicationGetQueryRestServlet(hs).register(http_server)
     ReplicationCleanRoomRestServlet(hs).register(http_server)
     ReplicationStoreRoomOnOutlierMembershipRestServlet(hs).register(http_server)
+    ReplicationProcessStagedEventsRestServlet(hs).register(http_server)
@@ -30,6 +30,7 @@ from synapse.replication.tcp.streams import (
     DeviceListsStream,
     GroupServerStream,
     PushersStream,
+    PushEvaluatorStream,
     PushRulesStream,
     ReceiptsStream,
     TagAccountDataStream,
@@ -183,6 +184,8 @@ class ReplicationDataHandler:
             self.notifier.on_new_event(
                 "groups_key", token, users=[row.user_id for row in rows]
             )
+        elif stream_name == PushEvaluatorStream.NAME:
+            self.notifier.on_push_evaluator_progress()
         elif stream_name == PushersStream.NAME:
             for row in rows:
                 if row.deleted:
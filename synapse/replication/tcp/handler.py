@@ -57,6 +57,7 @@ from synapse.replication.tcp.streams import (
     FederationStream,
     PresenceFederationStream,
     PresenceStream,
+    PushEvaluatorStream,
     ReceiptsStream,
     Stream,
     TagAccountDataStream,
@@ -167,6 +168,14 @@ class ReplicationCommandHandler:
 
                 continue
 
+            if isinstance(stream, PushEvaluatorStream):
+                # Only add PushEvaluatorStream as a source on the instance which
+                # evaluates push rules.
+                if hs.config.worker.run_push_evaluator:
+                    self._streams_to_replicate.append(stream)
+
+                continue
+
             # Only add any other streams if we're on master.
             if hs.config.worker_app is not None:
                 continue
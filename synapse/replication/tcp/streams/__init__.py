@@ -34,6 +34,7 @@ from synapse.replication.tcp.streams._base import (
     PresenceStream,
     PublicRoomsStream,
     PushersStream,
+    PushEvaluatorStream,
     PushRulesStream,
     ReceiptsStream,
     Stream,
@@ -56,6 +57,7 @@ STREAMS_MAP = {
         ReceiptsStream,
         PushRulesStream,
         PushersStream,
+        PushEvaluatorStream,
         CachesStream,
         PublicRoomsStream,
         DeviceListsStream,
@@ -78,6 +80,7 @@ __all__ = [
     "ReceiptsStream",
     "PushRulesStream",
     "PushersStream",
+    "PushEvaluatorStream",
     "CachesStream",
     "PublicRoomsStream",
     "DeviceListsStream",
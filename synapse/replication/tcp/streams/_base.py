@@ -417,6 +417,38 @@ class PushersStream(Stream):
         )
 
 
+class PushEvaluatorStream(Stream):
+    """The push evaluator has computed the push actions for new events.
+
+    Only the push evaluator's position is replicated, which is a position in
+    the events stream: each update is a single row with the new position.
+    """
+
+    PushEvaluatorStreamRow = namedtuple("PushEvaluatorStreamRow", ("stream_id",))  # int
+
+    NAME = "push_evaluator"
+    ROW_TYPE = PushEvaluatorStreamRow
+
+    def __init__(self, hs):
+        store = hs.get_datastore()
+
+        super().__init__(
+            hs.get_instance_name(),
+            current_token_without_instance(store.get_current_push_evaluator_position),
+            self._update_function,
+        )
+
+    @staticmethod
+    async def _update_function(
+        instance_name: str, from_token: int, upto_token: int, limit: int
+    ) -> StreamUpdateResult:
+        # The rows can be worked out from the tokens alone, so there is no need
+        # to ask the push evaluator for them.
+        if upto_token <= from_token:
+            return [], upto_token, False
+        return [(upto_token, (upto_token,))], upto_token, False
+
+
 class CachesStream(Stream):
     """A cache was invalidated on the master and no other stream would invalidate
     the cache on the workers
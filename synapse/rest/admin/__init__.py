@@ -46,6 +46,7 @@ from synapse.rest.admin.rooms import (
     RoomEventContextServlet,
     RoomMembersRestServlet,
     RoomRestServlet,
+    RoomStateCompressionRestServlet,
     RoomStateRestServlet,
     ShutdownRoomRestServlet,
 )
@@ -216,6 +217,7 @@ def register_servlets(hs: "HomeServer", http_server: HttpServer) -> None:
     register_servlets_for_client_rest_resource(hs, http_server)
     ListRoomRestServlet(hs).register(http_server)
     RoomStateRestServlet(hs).register(http_server)
+    RoomStateCompressionRestServlet(hs).register(http_server)
     RoomRestServlet(hs).register(http_server)
     RoomMembersRestServlet(hs).register(http_server)
     DeleteRoomRestServlet(hs).register(http_server)
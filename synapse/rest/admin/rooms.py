@@ -369,6 +369,52 @@ class RoomStateRestServlet(RestServlet):
         return 200, ret
 
 
+class RoomStateCompressionRestServlet(RestServlet):
+    """Queue the state groups of a room for compression, or get the progress of
+    the compression.
+
+        Queue a room for compression:
+        POST /_synapse/admin/v1/rooms/<room_id>/compress_state
+
+        Get the progress of the compression:
+        GET /_synapse/admin/v1/rooms/<room_id>/compress_state
+    """
+
+    PATTERNS = admin_patterns("/rooms/(?P<room_id>[^/]+)/compress_state$")
+
+    def __init__(self, hs: "HomeServer"):
+        self.auth = hs.get_auth()
+        self.store = hs.get_datastore()
+        self.state_store = hs.get_datastores().state
+
+    async def on_POST(
+        self, request: SynapseRequest, room_id: str
+    ) -> Tuple[int, JsonDict]:
+        await assert_requester_is_admin(self.auth, request)
+
+        ret = await self.store.get_room(room_id)
+        if not ret:
+            raise NotFoundError("Room not found")
+
+        await self.state_store.queue_room_for_state_compression(room_id)
+
+        return 200, {}
+
+    async def on_GET(
+        self, request: SynapseRequest, room_id: str
+    ) -> Tuple[int, JsonDict]:
+        await assert_requester_is_admin(self.auth, request)
+
+        progress = await self.state_store.get_state_compression_progress(room_id)
+        if not progress:
+            raise NotFoundError("Room has not been queued for compression")
+
+        return 200, {
+            "pending": bool(progress["pending"]),
+            "last_compressed_group": progress["last_compressed_group"],
+        }
+
+
 class JoinRoomAliasServlet(ResolveRoomIdMixin, RestServlet):
 
     PATTERNS = admin_patterns("/join/(?P<room_identifier>[^/]*)")
@@ -14,7 +14,7 @@
 
 import itertools
 import logging
-from typing import TYPE_CHECKING, Tuple
+from typing import TYPE_CHECKING, Tuple, Union
 
 from synapse.api.constants import PresenceState
 from synapse.api.errors import Codes, StoreError, SynapseError
@@ -22,11 +22,20 @@ from synapse.api.filtering import DEFAULT_FILTER_COLLECTION, FilterCollection
 from synapse.events.utils import (
     format_event_for_client_v2_without_room_id,
     format_event_raw,
+    serialize_event,
 )
 from synapse.handlers.presence import format_user_presence_state
 from synapse.handlers.sync import SyncConfig
-from synapse.http.servlet import RestServlet, parse_boolean, parse_integer, parse_string
+from synapse.http.server import StreamedJsonObject
+from synapse.http.servlet import (
+    RestServlet,
+    parse_boolean,
+    parse_integer,
+    parse_json_object_from_request,
+    parse_string,
+)
 from synapse.http.site import SynapseRequest
+from synapse.storage.state import StateFilter
 from synapse.types import JsonDict, StreamToken
 from synapse.util import json_decoder
 
@@ -38,7 +47,229 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
-class SyncRestServlet(RestServlet):
+class BaseSyncRestServlet(RestServlet):
+    """Common code for encoding the parts of sync responses."""
+
+    def __init__(self, hs: "HomeServer"):
+        super().__init__()
+        self.store = hs.get_datastore()
+        self._event_serializer = hs.get_event_client_serializer()
+
+    @staticmethod
+    def encode_presence(events, time_now):
+        return {
+            "events": [
+                {
+                    "type": "m.presence",
+                    "sender": event.user_id,
+                    "content": format_user_presence_state(
+                        event, time_now, include_user_id=False
+                    ),
+                }
+                for event in events
+            ]
+        }
+
+    async def encode_joined(
+        self, rooms, time_now, token_id, event_fields, event_formatter
+    ):
+        """
+        Encode the joined rooms in a sync result
+
+        Args:
+            rooms(list[synapse.handlers.sync.JoinedSyncResult]): list of sync
+                results for rooms this user is joined to
+            time_now(int): current time - used as a baseline for age
+                calculations
+            token_id(int): ID of the user's auth token - used for namespacing
+                of transaction IDs
+            event_fields(list<str>): List of event fields to include. If empty,
+                all fields will be returned.
+            event_formatter (func[dict]): function to convert from federation format
+                to client format
+        Returns:
+            StreamedJsonObject: the joined rooms list, in our response format.
+                The rooms are only serialized as the response is written out.
+        """
+        return await self._encode_rooms(
+            rooms,
+            time_now,
+            token_id,
+            joined=True,
+            only_fields=event_fields,
+            event_formatter=event_formatter,
+        )
+
+    async def encode_invited(self, rooms, time_now, token_id, event_formatter):
+        """
+        Encode the invited rooms in a sync result
+
+        Args:
+            rooms(list[synapse.handlers.sync.InvitedSyncResult]): list of
+                sync results for rooms this user is joined to
+            time_now(int): current time - used as a baseline for age
+                calculations
+            token_id(int): ID of the user's auth token - used for namespacing
+                of transaction IDs
+            event_formatter (func[dict]): function to convert from federation format
+                to client format
+
+        Returns:
+            dict[str, dict[str, object]]: the invited rooms list, in our
+                response format
+        """
+        invited = {}
+        for room in rooms:
+            invite = await self._event_serializer.serialize_event(
+                room.invite,
+                time_now,
+                token_id=token_id,
+                event_format=event_formatter,
+                is_invite=True,
+            )
+            unsigned = dict(invite.get("unsigned", {}))
+            invite["unsigned"] = unsigned
+            invited_state = list(unsigned.pop("invite_room_state", []))
+            invited_state.append(invite)
+            invited[room.room_id] = {"invite_state": {"events": invited_state}}
+
+        return invited
+
+    async def encode_archived(
+        self, rooms, time_now, token_id, event_fields, event_formatter
+    ):
+        """
+        Encode the archived rooms in a sync result
+
+        Args:
+            rooms (list[synapse.handlers.sync.ArchivedSyncResult]): list of
+                sync results for rooms this user is joined to
+            time_now(int): current time - used as a baseline for age
+                calculations
+            token_id(int): ID of the user's auth token - used for namespacing
+                of transaction IDs
+            event_fields(list<str>): List of event fields to include. If empty,
+                all fields will be returned.
+            event_formatter (func[dict]): function to convert from federation format
+                to client format
+        Returns:
+            StreamedJsonObject: The archived rooms list, in our response format.
+                The rooms are only serialized as the response is written out.
+        """
+        return await self._encode_rooms(
+            rooms,
+            time_now,
+            token_id,
+            joined=False,
+            only_fields=event_fields,
+            event_formatter=event_formatter,
+        )
+
+    async def _encode_rooms(
+        self, rooms, time_now, token_id, joined, only_fields, event_formatter
+    ) -> StreamedJsonObject:
+        """Encode a list of joined or archived rooms lazily, so that each room's
+        events are only serialized when the response producer gets to it.
+
+        Only the pagination tokens need the database, so they are worked out up
+        front.
+        """
+        prev_batches = [
+            await room.timeline.prev_batch.to_string(self.store) for room in rooms
+        ]
+
+        def members():
+            for room, prev_batch in zip(rooms, prev_batches):
+                yield room.room_id, self.encode_room(
+                    room,
+                    time_now,
+                    token_id,
+                    joined=joined,
+                    only_fields=only_fields,
+                    event_formatter=event_formatter,
+                    prev_batch=prev_batch,
+                )
+
+        return StreamedJsonObject(members())
+
+    def encode_room(
+        self, room, time_now, token_id, joined, only_fields, event_formatter, prev_batch
+    ):
+        """
+        Args:
+            room (JoinedSyncResult|ArchivedSyncResult): sync result for a
+                single room
+            time_now (int): current time - used as a baseline for age
+                calculations
+            token_id (int): ID of the user's auth token - used for namespacing
+                of transaction IDs
+            joined (bool): True if the user is joined to this room - will mean
+                we handle ephemeral events
+            only_fields(list<str>): Optional. The list of event fields to include.
+            event_formatter (func[dict]): function to convert from federation format
+                to client format
+            prev_batch (str): the serialized `room.timeline.prev_batch` token
+        Returns:
+            dict[str, object]: the room, encoded in our response format
+        """
+
+        def serialize(events):
+            # We don't bundle aggregations for "live" events, as otherwise
+            # clients will end up double counting annotations. That means there
+            # is nothing to look up, so we can serialize without yielding.
+            return [
+                serialize_event(
+                    event,
+                    time_now,
+                    token_id=token_id,
+                    event_format=event_formatter,
+                    only_event_fields=only_fields,
+                )
+                for event in events
+            ]
+
+        state_dict = room.state
+        timeline_events = room.timeline.events
+
+        state_events = state_dict.values()
+
+        for event in itertools.chain(state_events, timeline_events):
+            # We've had bug reports that events were coming down under the
+            # wrong room.
+            if event.room_id != room.room_id:
+                logger.warning(
+                    "Event %r is under room %r instead of %r",
+                    event.event_id,
+                    room.room_id,
+                    event.room_id,
+                )
+
+        serialized_state = serialize(state_events)
+        serialized_timeline = serialize(timeline_events)
+
+        account_data = room.account_data
+
+        result = {
+            "timeline": {
+                "events": serialized_timeline,
+                "prev_batch": prev_batch,
+                "limited": room.timeline.limited,
+            },
+            "state": {"events": serialized_state},
+            "account_data": {"events": account_data},
+        }
+
+        if joined:
+            ephemeral_events = room.ephemeral
+            result["ephemeral"] = {"events": ephemeral_events}
+            result["unread_notifications"] = room.unread_notifications
+            result["summary"] = room.summary
+            result["org.matrix.msc2654.unread_count"] = room.unread_count
+
+        return result
+
+
+class SyncRestServlet(BaseSyncRestServlet):
     """
 
     GET parameters::
@@ -78,18 +309,18 @@ class SyncRestServlet(RestServlet):
     ALLOWED_PRESENCE = {"online", "offline", "unavailable"}
 
     def __init__(self, hs: "HomeServer"):
-        super().__init__()
+        super().__init__(hs)
         self.hs = hs
         self.auth = hs.get_auth()
-        self.store = hs.get_datastore()
         self.sync_handler = hs.get_sync_handler()
         self.clock = hs.get_clock()
         self.filtering = hs.get_filtering()
         self.presence_handler = hs.get_presence_handler()
         self._server_notices_sender = hs.get_server_notices_sender()
-        self._event_serializer = hs.get_event_client_serializer()
 
-    async def on_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
+    async def on_GET(
+        self, request: SynapseRequest
+    ) -> Tuple[int, Union[JsonDict, StreamedJsonObject]]:
         # This will always be set by the time Twisted calls us.
         assert request.args is not None
 
@@ -228,216 +459,236 @@ class SyncRestServlet(RestServlet):
             event_formatter,
         )
 
-        logger.debug("building sync response dict")
-        return {
-            "account_data": {"events": sync_result.account_data},
-            "to_device": {"events": sync_result.to_device},
-            "device_lists": {
-                "changed": list(sync_result.device_lists.changed),
-                "left": list(sync_result.device_lists.left),
-            },
-            "presence": SyncRestServlet.encode_presence(sync_result.presence, time_now),
-            "rooms": {"join": joined, "invite": invited, "leave": archived},
-            "groups": {
-                "join": sync_result.groups.join,
-                "invite": sync_result.groups.invite,
-                "leave": sync_result.groups.leave,
-            },
-            "device_one_time_keys_count": sync_result.device_one_time_keys_count,
-            "org.matrix.msc2732.device_unused_fallback_key_types": sync_result.device_unused_fallback_key_types,
-            "next_batch": await sync_result.next_batch.to_string(self.store),
-        }
+        next_batch = await sync_result.next_batch.to_string(self.store)
 
-    @staticmethod
-    def encode_presence(events, time_now):
-        return {
-            "events": [
-                {
-                    "type": "m.presence",
-                    "sender": event.user_id,
-                    "content": format_user_presence_state(
-                        event, time_now, include_user_id=False
+        logger.debug("building sync response dict")
+        return StreamedJsonObject(
+            [
+                ("account_data", {"events": sync_result.account_data}),
+                ("to_device", {"events": sync_result.to_device}),
+                (
+                    "device_lists",
+                    {
+                        "changed": list(sync_result.device_lists.changed),
+                        "left": list(sync_result.device_lists.left),
+                    },
+                ),
+                (
+                    "presence",
+                    SyncRestServlet.encode_presence(sync_result.presence, time_now),
+                ),
+                (
+                    "groups",
+                    {
+                        "join": sync_result.groups.join,
+                        "invite": sync_result.groups.invite,
+                        "leave": sync_result.groups.leave,
+                    },
+                ),
+                ("device_one_time_keys_count", sync_result.device_one_time_keys_count),
+                (
+                    "org.matrix.msc2732.device_unused_fallback_key_types",
+                    sync_result.device_unused_fallback_key_types,
+                ),
+                ("next_batch", next_batch),
+                # The rooms go last, so that everything else has been written
+                # out by the time we start serializing events.
+                (
+                    "rooms",
+                    StreamedJsonObject(
+                        [("join", joined), ("invite", invited), ("leave", archived)]
                     ),
-                }
-                for event in events
+                ),
             ]
-        }
+        )
 
-    async def encode_joined(
-        self, rooms, time_now, token_id, event_fields, event_formatter
-    ):
-        """
-        Encode the joined rooms in a sync result
 
-        Args:
-            rooms(list[synapse.handlers.sync.JoinedSyncResult]): list of sync
-                results for rooms this user is joined to
-            time_now(int): current time - used as a baseline for age
-                calculations
-            token_id(int): ID of the user's auth token - used for namespacing
-                of transaction IDs
-            event_fields(list<str>): List of event fields to include. If empty,
-                all fields will be returned.
-            event_formatter (func[dict]): function to convert from federation format
-                to client format
-        Returns:
-            dict[str, dict[str, object]]: the joined rooms list, in our
-                response format
-        """
-        joined = {}
-        for room in rooms:
-            joined[room.room_id] = await self.encode_room(
-                room,
-                time_now,
-                token_id,
-                joined=True,
-                only_fields=event_fields,
-                event_formatter=event_formatter,
-            )
+class SlidingWindowSyncRestServlet(BaseSyncRestServlet):
+    """An experimental sync where the client asks for a window of its joined
+    rooms, ordered by most recent activity, rather than all of them.
 
-        return joined
+    POST parameters::
+        timeout(int): How long to wait for new data in milliseconds.
+        since(batch_token): The `next_batch` of the previous sync on the
+            connection, if any.
 
-    async def encode_invited(self, rooms, time_now, token_id, event_formatter):
-        """
-        Encode the invited rooms in a sync result
+    Request JSON::
+        {
+          "conn_id": // Optional. Distinguishes concurrent connections from
+                     // the same device.
+          "window": {
+            "range": [0, 19], // The indexes of the first and last rooms
+            "timeline_limit": 10, // The number of events to send per room
+            "required_state": [["m.room.name", ""], ["m.room.member", "*"]]
+                // The state to send for rooms entering the window. A state
+                // key of "*" matches all state keys.
+          }
+        }
 
-        Args:
-            rooms(list[synapse.handlers.sync.InvitedSyncResult]): list of
-                sync results for rooms this user is joined to
-            time_now(int): current time - used as a baseline for age
-                calculations
-            token_id(int): ID of the user's auth token - used for namespacing
-                of transaction IDs
-            event_formatter (func[dict]): function to convert from federation format
-                to client format
+    Response JSON::
+        {
+          "next_batch": // batch token for the next sync on this connection.
+          "count": // the number of rooms the user is joined to.
+          "window": [] // The IDs of the rooms in the window.
+          "rooms": {
+            "join": {} // Rooms in the window being updated, as for /sync.
+                       // Rooms entering the window are sent in full.
+            "invite": {} // Invited rooms being updated.
+          }
+          "account_data": {"events": []}
+        }
 
-        Returns:
-            dict[str, dict[str, object]]: the invited rooms list, in our
-                response format
-        """
-        invited = {}
-        for room in rooms:
-            invite = await self._event_serializer.serialize_event(
-                room.invite,
-                time_now,
-                token_id=token_id,
-                event_format=event_formatter,
-                is_invite=True,
-            )
-            unsigned = dict(invite.get("unsigned", {}))
-            invite["unsigned"] = unsigned
-            invited_state = list(unsigned.pop("invite_room_state", []))
-            invited_state.append(invite)
-            invited[room.room_id] = {"invite_state": {"events": invited_state}}
+    If `since` is no longer known about, the server responds with a 400 and
+    M_UNKNOWN_POS, and the client should start again without `since`.
+    """
 
-        return invited
+    PATTERNS = client_patterns(
+        "/org.matrix.sliding_window_sync/sync$", releases=()
+    )  # This is an unstable feature
 
-    async def encode_archived(
-        self, rooms, time_now, token_id, event_fields, event_formatter
-    ):
-        """
-        Encode the archived rooms in a sync result
+    # The maximum number of rooms a client can ask for in its window.
+    MAX_WINDOW_SIZE = 1000
 
-        Args:
-            rooms (list[synapse.handlers.sync.ArchivedSyncResult]): list of
-                sync results for rooms this user is joined to
-            time_now(int): current time - used as a baseline for age
-                calculations
-            token_id(int): ID of the user's auth token - used for namespacing
-                of transaction IDs
-            event_fields(list<str>): List of event fields to include. If empty,
-                all fields will be returned.
-            event_formatter (func[dict]): function to convert from federation format
-                to client format
-        Returns:
-            dict[str, dict[str, object]]: The invited rooms list, in our
-                response format
-        """
-        joined = {}
-        for room in rooms:
-            joined[room.room_id] = await self.encode_room(
-                room,
-                time_now,
-                token_id,
-                joined=False,
-                only_fields=event_fields,
-                event_formatter=event_formatter,
-            )
+    def __init__(self, hs: "HomeServer"):
+        super().__init__(hs)
+        self.auth = hs.get_auth()
+        self.sync_handler = hs.get_sync_handler()
+        self.clock = hs.get_clock()
+        self._timeline_limit = hs.config.filter_timeline_limit
 
-        return joined
+    async def on_POST(
+        self, request: SynapseRequest
+    ) -> Tuple[int, Union[JsonDict, StreamedJsonObject]]:
+        requester = await self.auth.get_user_by_req(request)
+        body = parse_json_object_from_request(request)
 
-    async def encode_room(
-        self, room, time_now, token_id, joined, only_fields, event_formatter
-    ):
-        """
-        Args:
-            room (JoinedSyncResult|ArchivedSyncResult): sync result for a
-                single room
-            time_now (int): current time - used as a baseline for age
-                calculations
-            token_id (int): ID of the user's auth token - used for namespacing
-                of transaction IDs
-            joined (bool): True if the user is joined to this room - will mean
-                we handle ephemeral events
-            only_fields(list<str>): Optional. The list of event fields to include.
-            event_formatter (func[dict]): function to convert from federation format
-                to client format
-        Returns:
-            dict[str, object]: the room, encoded in our response format
-        """
+        timeout = parse_integer(request, "timeout", default=0)
+        since = parse_string(request, "since")
 
-        def serialize(events):
-            return self._event_serializer.serialize_events(
-                events,
-                time_now=time_now,
-                # We don't bundle "live" events, as otherwise clients
-                # will end up double counting annotations.
-                bundle_aggregations=False,
-                token_id=token_id,
-                event_format=event_formatter,
-                only_event_fields=only_fields,
+        conn_id = body.get("conn_id", "")
+        if not isinstance(conn_id, str):
+            raise SynapseError(400, "'conn_id' must be a string", Codes.INVALID_PARAM)
+
+        window = body.get("window")
+        if not isinstance(window, dict):
+            raise SynapseError(400, "Missing 'window'", Codes.MISSING_PARAM)
+
+        window_range = window.get("range")
+        if (
+            not isinstance(window_range, list)
+            or len(window_range) != 2
+            or not all(type(i) is int and i >= 0 for i in window_range)
+            or window_range[0] > window_range[1]
+        ):
+            raise SynapseError(
+                400, "'range' must be a pair of indexes", Codes.INVALID_PARAM
+            )
+        start, end = window_range
+        if end - start >= self.MAX_WINDOW_SIZE:
+            raise SynapseError(
+                400,
+                "Window can contain at most %d rooms" % (self.MAX_WINDOW_SIZE,),
+                Codes.INVALID_PARAM,
             )
 
-        state_dict = room.state
-        timeline_events = room.timeline.events
+        timeline_limit = window.get("timeline_limit", 10)
+        if type(timeline_limit) is not int or timeline_limit < 0:
+            raise SynapseError(
+                400,
+                "'timeline_limit' must be a non-negative integer",
+                Codes.INVALID_PARAM,
+            )
+        timeline_limit = min(timeline_limit, self._timeline_limit)
+
+        required_state = window.get("required_state", [])
+        if not isinstance(required_state, list) or not all(
+            isinstance(entry, list)
+            and len(entry) == 2
+            and all(isinstance(s, str) for s in entry)
+            for entry in required_state
+        ):
+            raise SynapseError(
+                400,
+                "'required_state' must be a list of [type, state_key] pairs",
+                Codes.INVALID_PARAM,
+            )
+        state_filter = StateFilter.from_types(
+            (event_type, None if state_key == "*" else state_key)
+            for event_type, state_key in required_state
+        )
 
-        state_events = state_dict.values()
+        user = requester.user
+        device_id = requester.device_id
 
-        for event in itertools.chain(state_events, timeline_events):
-            # We've had bug reports that events were coming down under the
-            # wrong room.
-            if event.room_id != room.room_id:
-                logger.warning(
-                    "Event %r is under room %r instead of %r",
-                    event.event_id,
-                    room.room_id,
-                    event.room_id,
-                )
+        request_key = (
+            user,
+            timeout,
+            since,
+            device_id,
+            conn_id,
+            start,
+            end,
+            timeline_limit,
+            tuple(tuple(entry) for entry in required_state),
+        )
+        sync_config = SyncConfig(
+            user=user,
+            filter_collection=FilterCollection(
+                {"room": {"timeline": {"limit": timeline_limit}}}
+            ),
+            is_guest=requester.is_guest,
+            request_key=request_key,
+            device_id=device_id,
+            required_state=state_filter,
+        )
 
-        serialized_state = await serialize(state_events)
-        serialized_timeline = await serialize(timeline_events)
+        sync_result = await self.sync_handler.wait_for_sliding_window_sync_for_user(
+            requester,
+            sync_config,
+            window=(start, end),
+            conn_id=conn_id,
+            since=since,
+            timeout=timeout,
+        )
 
-        account_data = room.account_data
+        # the client may have disconnected by now; don't bother to serialize the
+        # response if so.
+        if request._disconnected:
+            logger.info("Client has disconnected; not serializing response.")
+            return 200, {}
 
-        result = {
-            "timeline": {
-                "events": serialized_timeline,
-                "prev_batch": await room.timeline.prev_batch.to_string(self.store),
-                "limited": room.timeline.limited,
-            },
-            "state": {"events": serialized_state},
-            "account_data": {"events": account_data},
-        }
+        time_now = self.clock.time_msec()
+        event_formatter = format_event_for_client_v2_without_room_id
 
-        if joined:
-            ephemeral_events = room.ephemeral
-            result["ephemeral"] = {"events": ephemeral_events}
-            result["unread_notifications"] = room.unread_notifications
-            result["summary"] = room.summary
-            result["org.matrix.msc2654.unread_count"] = room.unread_count
+        joined = await self.encode_joined(
+            sync_result.joined,
+            time_now,
+            requester.access_token_id,
+            [],
+            event_formatter,
+        )
+        invited = await self.encode_invited(
+            sync_result.invited, time_now, requester.access_token_id, event_formatter
+        )
 
-        return result
+        next_batch = await sync_result.next_batch.to_string(self.store)
+
+        return 200, StreamedJsonObject(
+            [
+                ("next_batch", next_batch),
+                ("count", sync_result.count),
+                ("window", sync_result.window),
+                ("account_data", {"events": sync_result.account_data}),
+                (
+                    "rooms",
+                    StreamedJsonObject([("join", joined), ("invite", invited)]),
+                ),
+            ]
+        )
 
 
 def register_servlets(hs, http_server):
     SyncRestServlet(hs).register(http_server)
+
+    if hs.config.experimental.sliding_window_sync_enabled:
+        SlidingWindowSyncRestServlet(hs).register(http_server)
@@ -45,9 +45,10 @@ from synapse.events.snapshot import EventContext
 from synapse.logging.context import ContextResourceUsage
 from synapse.logging.utils import log_function
 from synapse.state import v1, v2
+from synapse.state.executor import StateResolutionExecutor
 from synapse.storage.databases.main.events_worker import EventRedactBehaviour
 from synapse.storage.roommember import ProfileInfo
-from synapse.types import StateMap
+from synapse.types import ImmutableStateMap, StateMap
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.metrics import Measure, measure_func
@@ -82,7 +83,14 @@ def _gen_state_id():
 
 
 class _StateCacheEntry:
-    __slots__ = ["state", "state_group", "state_id", "prev_group", "delta_ids"]
+    __slots__ = [
+        "state",
+        "state_group",
+        "state_id",
+        "prev_group",
+        "delta_ids",
+        "resolved_groups",
+    ]
 
     def __init__(
         self,
@@ -92,7 +100,7 @@ class _StateCacheEntry:
         delta_ids: Optional[StateMap[str]] = None,
     ):
         # A map from (type, state_key) to event_id.
-        self.state = frozendict(state)
+        self.state = ImmutableStateMap.of(state)
 
         # the ID of a state group if one and only one is involved.
         # otherwise, None otherwise?
@@ -101,6 +109,11 @@ class _StateCacheEntry:
         self.prev_group = prev_group
         self.delta_ids = frozendict(delta_ids) if delta_ids is not None else None
 
+        # if this entry is the result of resolving the state across several
+        # state groups, the set of those state groups. Used to record the
+        # resolution once a state group has been assigned to the entry.
+        self.resolved_groups = None  # type: Optional[FrozenSet[int]]
+
         # The `state_id` is a unique ID we generate that can be used as ID for
         # this collection of state. Usually this would be the same as the
         # state group, but on worker instances we can't generate a new state
@@ -126,6 +139,7 @@ class StateHandler:
         self.clock = hs.get_clock()
         self.store = hs.get_datastore()
         self.state_store = hs.get_storage().state
+        self._state_group_store = hs.get_datastores().state
         self.hs = hs
         self._state_resolution_handler = hs.get_state_resolution_handler()
 
@@ -309,9 +323,9 @@ class StateHandler:
 
         if old_state:
             # if we're given the state before the event, then we use that
-            state_ids_before_event = {
-                (s.type, s.state_key): s.event_id for s in old_state
-            }  # type: StateMap[str]
+            state_ids_before_event = ImmutableStateMap(
+                {(s.type, s.state_key): s.event_id for s in old_state}
+            )
             state_group_before_event = None
             state_group_before_event_prev_group = None
             deltas_to_state_group_before_event = None
@@ -354,6 +368,16 @@ class StateHandler:
             if entry and entry.state_group is None:
                 entry.state_group = state_group_before_event
 
+                # Record the resolution so that it doesn't need to be redone
+                # after a restart or on another worker.
+                if entry.resolved_groups:
+                    await self.state_store.store_state_group_resolution(
+                        event.room_id,
+                        event.room_version.identifier,
+                        entry.resolved_groups,
+                        state_group_before_event,
+                    )
+
         #
         # now if it's not a state event, we're done
         #
@@ -378,9 +402,8 @@ class StateHandler:
             if replaces != event.event_id:
                 event.unsigned["replaces_state"] = replaces
 
-        state_ids_after_event = dict(state_ids_before_event)
-        state_ids_after_event[key] = event.event_id
         delta_ids = {key: event.event_id}
+        state_ids_after_event = state_ids_before_event.with_changes(delta_ids)
 
         state_group_after_event = await self.state_store.store_state_group(
             event.event_id,
@@ -443,7 +466,7 @@ class StateHandler:
             room_version,
             state_groups_ids,
             None,
-            state_res_store=StateResolutionStore(self.store),
+            state_res_store=StateResolutionStore(self.store, self._state_group_store),
         )
         return result
 
@@ -467,7 +490,7 @@ class StateHandler:
             room_version,
             state_set_ids,
             event_map=state_map,
-            state_res_store=StateResolutionStore(self.store),
+            state_res_store=StateResolutionStore(self.store, self._state_group_store),
         )
 
         return {key: state_map[ev_id] for key, ev_id in new_state.items()}
@@ -512,6 +535,11 @@ class StateResolutionHandler:
 
         self.resolve_linearizer = Linearizer(name="state_resolve_lock")
 
+        # if configured, used to run large v2 resolutions in worker processes
+        self._executor = None  # type: Optional[StateResolutionExecutor]
+        if hs.config.experimental.state_res_worker_processes:
+            self._executor = StateResolutionExecutor(hs)
+
         # dict of set of event_ids -> _StateCacheEntry.
         self._state_cache = ExpiringCache(
             cache_name="state_cache",
@@ -574,6 +602,15 @@ class StateResolutionHandler:
             if cache:
                 return cache
 
+            # We may have resolved these state groups before (possibly on
+            # another worker), in which case we can just load the result.
+            cache = await self._get_persisted_resolution(
+                room_version, group_names, state_res_store
+            )
+            if cache:
+                self._state_cache[group_names] = cache
+                return cache
+
             logger.info(
                 "Resolving state for %s with groups %s",
                 room_id,
@@ -598,10 +635,38 @@ class StateResolutionHandler:
             with Measure(self.clock, "state.create_group_ids"):
                 cache = _make_state_cache_entry(new_state, state_groups_ids)
 
+            if cache.state_group is None:
+                cache.resolved_groups = group_names
+            else:
+                # The resolved state matched one of the input state groups, so
+                # we can record the resolution straight away.
+                await state_res_store.store_resolved_state_group(
+                    room_id, room_version, group_names, cache.state_group
+                )
+
             self._state_cache[group_names] = cache
 
             return cache
 
+    async def _get_persisted_resolution(
+        self,
+        room_version: str,
+        group_names: FrozenSet[int],
+        state_res_store: "StateResolutionStore",
+    ) -> Optional[_StateCacheEntry]:
+        """Load a previously persisted result of resolving the given state
+        groups, if there is one.
+        """
+        with Measure(self.clock, "state.get_persisted_resolution"):
+            resolved = await state_res_store.get_resolved_state_group(
+                room_version, group_names
+            )
+            if resolved is None:
+                return None
+
+            state_group, state = resolved
+            return _StateCacheEntry(state=state, state_group=state_group)
+
     async def resolve_events_with_store(
         self,
         room_id: str,
@@ -647,6 +712,7 @@ class StateResolutionHandler:
                         state_sets,
                         event_map,
                         state_res_store,
+                        executor=self._executor,
                     )
         finally:
             self._record_state_res_metrics(room_id, m.get_resource_usage())
@@ -774,9 +840,12 @@ class StateResolutionStore:
 
     Args:
         store (DataStore)
+        state_store (StateGroupDataStore|None): if given, used to persist and
+            look up the results of previous resolutions.
     """
 
     store = attr.ib()
+    state_store = attr.ib(default=None)
 
     def get_events(
         self, event_ids: Iterable[str], allow_rejected: bool = False
@@ -813,3 +882,41 @@ class StateResolutionStore:
         """
 
         return self.store.get_auth_chain_difference(room_id, state_sets)
+
+    async def get_resolved_state_group(
+        self, room_version: str, state_groups: FrozenSet[int]
+    ) -> Optional[Tuple[int, StateMap[str]]]:
+        """Look up the persisted result of resolving the given state groups.
+
+        Returns:
+            The state group holding the resolved state and that state, or None
+            if the state groups have not been resolved before.
+        """
+        if self.state_store is None:
+            return None
+
+        state_group = await self.state_store.get_state_group_for_resolution(
+            room_version, state_groups
+        )
+        if state_group is None:
+            return None
+
+        group_to_state = await self.state_store._get_state_for_groups((state_group,))
+        return state_group, group_to_state[state_group]
+
+    async def store_resolved_state_group(
+        self,
+        room_id: str,
+        room_version: str,
+        state_groups: FrozenSet[int],
+        resolved_state_group: int,
+    ) -> None:
+        """Persist the result of resolving the given state groups, if we have
+        somewhere to persist it to.
+        """
+        if self.state_store is None:
+            return
+
+        await self.state_store.store_state_group_resolution(
+            room_id, room_version, state_groups, resolved_state_group
+        )
@@ -0,0 +1,301 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Support for running the CPU-bound stages of v2 state resolution in a pool of
+worker processes, so that resolving large forks doesn't block the reactor.
+
+The subprocess is handed a snapshot of the events it is likely to need. If it
+turns out to need any others, it reports them back instead of a result, and we
+fetch them from the database and try again.
+"""
+
+import logging
+import multiprocessing
+from typing import TYPE_CHECKING, Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+from prometheus_client import Counter
+
+from twisted.internet import defer
+
+import synapse.state
+from synapse.api.room_versions import KNOWN_ROOM_VERSIONS
+from synapse.events import EventBase, make_event_from_dict
+from synapse.logging.context import make_deferred_yieldable
+from synapse.state import v2
+from synapse.types import JsonDict, StateMap
+
+if TYPE_CHECKING:
+    from synapse.server import HomeServer
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of times we'll go back to the database for events the
+# subprocess found it needed, before giving up and resolving on the reactor.
+_MAX_FETCH_ROUNDS = 5
+
+offloaded_state_res_counter = Counter(
+    "synapse_state_res_offloaded_total",
+    "Number of state resolutions handed to a worker process, by outcome",
+    ["outcome"],
+)
+
+# An event in the form we send to the subprocess: event ID, PDU JSON, internal
+# metadata and rejection reason.
+_SerialisedEvent = Tuple[str, JsonDict, JsonDict, Optional[str]]
+
+
+class StateResolutionExecutor:
+    """Runs `v2.resolve_conflicted_events` in a pool of worker processes for
+    resolutions whose full conflicted set is at least a configured size.
+    """
+
+    def __init__(self, hs: "HomeServer"):
+        self._reactor = hs.get_reactor()
+        self._clock = hs.get_clock()
+
+        self._processes = hs.config.experimental.state_res_worker_processes
+        self._min_conflicted_events = (
+            hs.config.experimental.state_res_worker_min_conflicted_events
+        )
+
+        # The pool is created on first use, as most processes never need it.
+        self._pool = None  # type: Optional[multiprocessing.pool.Pool]
+
+        self._reactor.addSystemEventTrigger("before", "shutdown", self._shutdown)
+
+    def should_offload(self, full_conflicted_set: Collection[str]) -> bool:
+        """Whether a resolution over the given full conflicted set is big
+        enough to be worth running in a worker process.
+        """
+        return len(full_conflicted_set) >= self._min_conflicted_events
+
+    async def resolve_conflicted_events(
+        self,
+        room_id: str,
+        room_version: str,
+        unconflicted_state: StateMap[str],
+        full_conflicted_set: Set[str],
+        event_map: Dict[str, EventBase],
+        state_res_store: "synapse.state.StateResolutionStore",
+    ) -> StateMap[str]:
+        """Equivalent to `v2.resolve_conflicted_events`, but with the work done
+        in a worker process.
+
+        `event_map` is updated with any events we need to fetch.
+        """
+        # The auth events of the conflicted events are needed to work out power
+        # levels and to auth the events, so fetch them up front to save a round
+        # trip to the subprocess.
+        await _fetch_missing_events(
+            (
+                aid
+                for eid in full_conflicted_set
+                for aid in event_map[eid].auth_event_ids()
+            ),
+            event_map,
+            state_res_store,
+        )
+
+        # events which we know aren't in the database.
+        known_missing = set()  # type: Set[str]
+
+        # Serialising the events is done on the reactor, so we only do it once
+        # for each event, adding those we fetch in later rounds.
+        events = [_serialise_event(ev) for ev in event_map.values()]
+
+        for _ in range(_MAX_FETCH_ROUNDS):
+            resolved, missing = await self._run_in_pool(
+                room_id,
+                room_version,
+                unconflicted_state,
+                full_conflicted_set,
+                events,
+                known_missing,
+            )
+            if resolved is not None:
+                offloaded_state_res_counter.labels("success").inc()
+                return resolved
+
+            logger.debug(
+                "State res subprocess needs %d more events for %s",
+                len(missing),
+                room_id,
+            )
+            fetched = await _fetch_missing_events(missing, event_map, state_res_store)
+            events.extend(_serialise_event(ev) for ev in fetched.values())
+            known_missing.update(eid for eid in missing if eid not in event_map)
+
+        # We keep finding more events that we need, so give up and do it here.
+        offloaded_state_res_counter.labels("fallback").inc()
+        return await v2.resolve_conflicted_events(
+            self._clock,
+            room_id,
+            room_version,
+            unconflicted_state,
+            full_conflicted_set,
+            event_map,
+            state_res_store,
+        )
+
+    async def _run_in_pool(
+        self,
+        room_id: str,
+        room_version: str,
+        unconflicted_state: StateMap[str],
+        full_conflicted_set: Set[str],
+        events: List[_SerialisedEvent],
+        known_missing: Set[str],
+    ) -> Tuple[Optional[StateMap[str]], Set[str]]:
+        if self._pool is None:
+            self._pool = multiprocessing.get_context("spawn").Pool(self._processes)
+
+        d = defer.Deferred()  # type: defer.Deferred
+
+        # The pool calls these from its result handling thread.
+        def on_result(result):
+            self._reactor.callFromThread(d.callback, result)
+
+        def on_error(e):
+            self._reactor.callFromThread(d.errback, e)
+
+        self._pool.apply_async(
+            _resolve_in_subprocess,
+            (
+                room_id,
+                room_version,
+                unconflicted_state,
+                full_conflicted_set,
+                events,
+                known_missing,
+            ),
+            callback=on_result,
+            error_callback=on_error,
+        )
+
+        return await make_deferred_yieldable(d)
+
+    def _shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+async def _fetch_missing_events(
+    event_ids: Iterable[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: "synapse.state.StateResolutionStore",
+) -> Dict[str, EventBase]:
+    """Add any of the given events which aren't in `event_map` to it.
+
+    Returns:
+        The events which were added.
+    """
+    to_fetch = {eid for eid in event_ids if eid not in event_map}
+    if not to_fetch:
+        return {}
+
+    events = await state_res_store.get_events(to_fetch, allow_rejected=True)
+    event_map.update(events)
+    return events
+
+
+def _serialise_event(event: EventBase) -> _SerialisedEvent:
+    return (
+        event.event_id,
+        event.get_pdu_json(),
+        event.internal_metadata.get_dict(),
+        event.rejected_reason,
+    )
+
+
+class _InlineClock:
+    """A stand-in for `Clock` in the subprocess, where there is no reactor to
+    yield to.
+    """
+
+    async def sleep(self, seconds: float) -> None:
+        pass
+
+
+class _SnapshotStateResolutionStore:
+    """A stand-in for `StateResolutionStore` in the subprocess, which has no
+    database. Records the events that were asked for so that the caller can
+    fetch them.
+    """
+
+    def __init__(self, known_missing: Set[str]):
+        self._known_missing = known_missing
+        self.missing = set()  # type: Set[str]
+
+    async def get_events(
+        self, event_ids: Iterable[str], allow_rejected: bool = False
+    ) -> Dict[str, EventBase]:
+        self.missing.update(e for e in event_ids if e not in self._known_missing)
+        return {}
+
+
+def _resolve_in_subprocess(
+    room_id: str,
+    room_version: str,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    events: List[_SerialisedEvent],
+    known_missing: Set[str],
+) -> Tuple[Optional[StateMap[str]], Set[str]]:
+    """Entry point in the worker process.
+
+    Returns:
+        The resolved state, or None and the set of event IDs which need to be
+        added to `events` before the resolution can be done.
+    """
+    room_version_obj = KNOWN_ROOM_VERSIONS[room_version]
+    event_map = {
+        event_id: make_event_from_dict(
+            pdu_json, room_version_obj, internal_metadata, rejected_reason
+        )
+        for event_id, pdu_json, internal_metadata, rejected_reason in events
+    }
+    store = _SnapshotStateResolutionStore(known_missing)
+
+    # The stand-in clock and store never actually suspend, so we can drive the
+    # coroutine to completion directly.
+    coro = v2.resolve_conflicted_events(
+        _InlineClock(),  # type: ignore[arg-type]
+        room_id,
+        room_version,
+        unconflicted_state,
+        full_conflicted_set,
+        event_map,
+        store,  # type: ignore[arg-type]
+    )
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        resolved = e.value
+    except Exception:
+        # If we were missing events then that's probably why we failed;
+        # otherwise it's a genuine error.
+        if store.missing:
+            return None, store.missing
+        raise
+    else:
+        coro.close()
+        raise Exception("State resolution unexpectedly suspended")
+
+    # A missing event may have changed the outcome, so we can't trust the
+    # result until we've fetched them.
+    if store.missing:
+        return None, store.missing
+
+    return dict(resolved), set()
@@ -16,6 +16,7 @@ import heapq
 import itertools
 import logging
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Collection,
@@ -41,6 +42,9 @@ from synapse.events import EventBase
 from synapse.types import MutableStateMap, StateMap
 from synapse.util import Clock
 
+if TYPE_CHECKING:
+    from synapse.state.executor import StateResolutionExecutor
+
 logger = logging.getLogger(__name__)
 
 
@@ -57,6 +61,7 @@ async def resolve_events_with_store(
     state_sets: Sequence[StateMap[str]],
     event_map: Optional[Dict[str, EventBase]],
     state_res_store: "synapse.state.StateResolutionStore",
+    executor: Optional["StateResolutionExecutor"] = None,
 ) -> StateMap[str]:
     """Resolves the state using the v2 state resolution algorithm
 
@@ -76,6 +81,9 @@ async def resolve_events_with_store(
 
         state_res_store:
 
+        executor: if given, used to run the resolution of large conflicted
+            sets in a separate process rather than on the reactor.
+
     Returns:
         A map from (type, state_key) to event_id.
     """
@@ -129,6 +137,53 @@ async def resolve_events_with_store(
 
     logger.debug("%d full_conflicted_set entries", len(full_conflicted_set))
 
+    if executor is not None and executor.should_offload(full_conflicted_set):
+        return await executor.resolve_conflicted_events(
+            room_id,
+            room_version,
+            unconflicted_state,
+            full_conflicted_set,
+            event_map,
+            state_res_store,
+        )
+
+    return await resolve_conflicted_events(
+        clock,
+        room_id,
+        room_version,
+        unconflicted_state,
+        full_conflicted_set,
+        event_map,
+        state_res_store,
+    )
+
+
+async def resolve_conflicted_events(
+    clock: Clock,
+    room_id: str,
+    room_version: str,
+    unconflicted_state: StateMap[str],
+    full_conflicted_set: Set[str],
+    event_map: Dict[str, EventBase],
+    state_res_store: "synapse.state.StateResolutionStore",
+) -> StateMap[str]:
+    """Runs the sorting and auth check stages of the v2 state resolution
+    algorithm over the full conflicted set.
+
+    Args:
+        clock
+        room_id: the room we are working in
+        room_version: The room version
+        unconflicted_state: The state which is common to all state sets
+        full_conflicted_set: The conflicted state events plus the auth chain
+            difference, all of which must be in `event_map`.
+        event_map: a dict from event_id to event. Any further events that are
+            needed will be requested via state_res_store.
+        state_res_store:
+
+    Returns:
+        A map from (type, state_key) to event_id.
+    """
     # Get and sort all the power events (kicks/bans/etc)
     power_events = (
         eid for eid in full_conflicted_set if _is_power_event(event_map[eid])
@@ -14,9 +14,10 @@
 # limitations under the License.
 
 import logging
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from synapse.api.constants import AccountDataTypes
+from synapse.api.filtering import Filter
 from synapse.replication.slave.storage._slaved_id_tracker import SlavedIdTracker
 from synapse.replication.tcp.streams import AccountDataStream, TagAccountDataStream
 from synapse.storage._base import SQLBaseStore, db_to_json
@@ -97,7 +98,6 @@ class AccountDataWorkerStore(SQLBaseStore):
         """
         return self._account_data_id_gen.get_current_token()
 
-    @cached()
     async def get_account_data_for_user(
         self, user_id: str
     ) -> Tuple[Dict[str, JsonDict], Dict[str, Dict[str, JsonDict]]]:
@@ -109,6 +109,54 @@ class AccountDataWorkerStore(SQLBaseStore):
             A 2-tuple of a dict of global account_data and a dict mapping from
             room_id string to per room account_data dicts.
         """
+        (
+            stream_id,
+            global_account_data,
+            by_room,
+        ) = await self._get_versioned_account_data_for_user(user_id)
+
+        if not self._account_data_stream_cache.has_entity_changed(user_id, stream_id):
+            return global_account_data, by_room
+
+        # Rather than reloading everything, bring the cached copy up to date
+        # with what has changed since it was loaded. Account data is only ever
+        # added or replaced, so the changes can just be layered on top.
+        current_id = self.get_max_account_data_stream_id()
+        global_changes, room_changes = await self.db_pool.runInteraction(
+            "get_account_data_for_user_changes",
+            self._get_updated_account_data_for_user_txn,
+            user_id,
+            stream_id,
+            None,
+            None,
+        )
+
+        global_account_data = {**global_account_data, **global_changes}
+        by_room = dict(by_room)
+        for room_id, room_data in room_changes.items():
+            by_room[room_id] = {**by_room.get(room_id, {}), **room_data}
+
+        self._get_versioned_account_data_for_user.prefill(
+            (user_id,), (current_id, global_account_data, by_room)
+        )
+
+        return global_account_data, by_room
+
+    @cached()
+    async def _get_versioned_account_data_for_user(
+        self, user_id: str
+    ) -> Tuple[int, Dict[str, JsonDict], Dict[str, Dict[str, JsonDict]]]:
+        """Load all the client account_data for a user, along with the position
+        in the account data stream it is up to date with.
+
+        This cache isn't invalidated when the account data changes: instead
+        `get_account_data_for_user` uses the account data stream to apply the
+        changes since it was loaded.
+        """
+
+        # Any change after this position is recorded in the stream change
+        # cache, so it's safe to read the data after we get the position.
+        stream_id = self.get_max_account_data_stream_id()
 
         def get_account_data_for_user_txn(txn):
             rows = self.db_pool.simple_select_list_txn(
@@ -134,12 +182,61 @@ class AccountDataWorkerStore(SQLBaseStore):
                 room_data = by_room.setdefault(row["room_id"], {})
                 room_data[row["account_data_type"]] = db_to_json(row["content"])
 
-            return global_account_data, by_room
+            return stream_id, global_account_data, by_room
 
         return await self.db_pool.runInteraction(
             "get_account_data_for_user", get_account_data_for_user_txn
         )
 
+    async def get_filtered_account_data_for_user(
+        self,
+        user_id: str,
+        account_data_filter: Optional[Filter],
+        room_account_data_filter: Optional[Filter],
+    ) -> Tuple[Dict[str, JsonDict], Dict[str, Dict[str, JsonDict]]]:
+        """Get the client account_data for a user whose types match the given
+        filters.
+
+        Only the types of the filters are applied, so callers must still check
+        the results against the rest of the filters.
+
+        Args:
+            user_id: The user to get the account_data for.
+            account_data_filter: The filter to apply to the global account_data.
+            room_account_data_filter: The filter to apply to the per room
+                account_data.
+        Returns:
+            A 2-tuple of a dict of global account_data and a dict mapping from
+            room_id string to per room account_data dicts.
+        """
+        if not _filters_types(account_data_filter) and not _filters_types(
+            room_account_data_filter
+        ):
+            return await self.get_account_data_for_user(user_id)
+
+        # If we've got everything cached anyway, there's no need to go to the
+        # database.
+        cached_data = self._get_versioned_account_data_for_user.cache.get_immediate(
+            (user_id,), None, update_metrics=False
+        )
+        if cached_data is not None:
+            global_account_data, by_room = await self.get_account_data_for_user(user_id)
+            return _filter_account_data_by_type(
+                global_account_data,
+                by_room,
+                account_data_filter,
+                room_account_data_filter,
+            )
+
+        return await self.db_pool.runInteraction(
+            "get_filtered_account_data_for_user",
+            self._get_updated_account_data_for_user_txn,
+            user_id,
+            None,
+            account_data_filter,
+            room_account_data_filter,
+        )
+
     @cached(num_args=2, max_entries=5000)
     async def get_global_account_data_by_type_for_user(
         self, data_type: str, user_id: str
@@ -284,42 +381,25 @@ class AccountDataWorkerStore(SQLBaseStore):
         )
 
     async def get_updated_account_data_for_user(
-        self, user_id: str, stream_id: int
+        self,
+        user_id: str,
+        stream_id: int,
+        account_data_filter: Optional[Filter] = None,
+        room_account_data_filter: Optional[Filter] = None,
     ) -> Tuple[Dict[str, JsonDict], Dict[str, Dict[str, JsonDict]]]:
         """Get all the client account_data for a that's changed for a user
 
         Args:
             user_id: The user to get the account_data for.
             stream_id: The point in the stream since which to get updates
+            account_data_filter: If given, only global account_data with types
+                matching the filter are returned.
+            room_account_data_filter: If given, only per room account_data with
+                types matching the filter are returned.
         Returns:
             A deferred pair of a dict of global account_data and a dict
             mapping from room_id string to per room account_data dicts.
         """
-
-        def get_updated_account_data_for_user_txn(txn):
-            sql = (
-                "SELECT account_data_type, content FROM account_data"
-                " WHERE user_id = ? AND stream_id > ?"
-            )
-
-            txn.execute(sql, (user_id, stream_id))
-
-            global_account_data = {row[0]: db_to_json(row[1]) for row in txn}
-
-            sql = (
-                "SELECT room_id, account_data_type, content FROM room_account_data"
-                " WHERE user_id = ? AND stream_id > ?"
-            )
-
-            txn.execute(sql, (user_id, stream_id))
-
-            account_data_by_room = {}
-            for row in txn:
-                room_account_data = account_data_by_room.setdefault(row[0], {})
-                room_account_data[row[1]] = db_to_json(row[2])
-
-            return global_account_data, account_data_by_room
-
         changed = self._account_data_stream_cache.has_entity_changed(
             user_id, int(stream_id)
         )
@@ -327,9 +407,61 @@ class AccountDataWorkerStore(SQLBaseStore):
             return ({}, {})
 
         return await self.db_pool.runInteraction(
-            "get_updated_account_data_for_user", get_updated_account_data_for_user_txn
+            "get_updated_account_data_for_user",
+            self._get_updated_account_data_for_user_txn,
+            user_id,
+            stream_id,
+            account_data_filter,
+            room_account_data_filter,
         )
 
+    def _get_updated_account_data_for_user_txn(
+        self,
+        txn,
+        user_id: str,
+        stream_id: Optional[int],
+        account_data_filter: Optional[Filter],
+        room_account_data_filter: Optional[Filter],
+    ) -> Tuple[Dict[str, JsonDict], Dict[str, Dict[str, JsonDict]]]:
+        """Get the client account_data for a user which has changed since the
+        given stream position (or all of it, if that is None) and whose types
+        match the given filters.
+        """
+        stream_clause = ""
+        stream_args = []  # type: List[Any]
+        if stream_id is not None:
+            stream_clause = " AND stream_id > ?"
+            stream_args = [stream_id]
+
+        type_clause, type_args = _filter_to_type_clause(account_data_filter)
+        sql = (
+            "SELECT account_data_type, content FROM account_data"
+            " WHERE user_id = ?" + stream_clause + type_clause
+        )
+        args = [user_id]  # type: List[Any]
+        args.extend(stream_args)
+        args.extend(type_args)
+        txn.execute(sql, args)
+
+        global_account_data = {row[0]: db_to_json(row[1]) for row in txn}
+
+        type_clause, type_args = _filter_to_type_clause(room_account_data_filter)
+        sql = (
+            "SELECT room_id, account_data_type, content FROM room_account_data"
+            " WHERE user_id = ?" + stream_clause + type_clause
+        )
+        args = [user_id]
+        args.extend(stream_args)
+        args.extend(type_args)
+        txn.execute(sql, args)
+
+        account_data_by_room = {}  # type: Dict[str, Dict[str, JsonDict]]
+        for row in txn:
+            room_account_data = account_data_by_room.setdefault(row[0], {})
+            room_account_data[row[1]] = db_to_json(row[2])
+
+        return global_account_data, account_data_by_room
+
     @cached(max_entries=5000, iterable=True)
     async def ignored_by(self, user_id: str) -> Set[str]:
         """
@@ -354,7 +486,6 @@ class AccountDataWorkerStore(SQLBaseStore):
         if stream_name == TagAccountDataStream.NAME:
             self._account_data_id_gen.advance(instance_name, token)
             for row in rows:
-                self.get_tags_for_user.invalidate((row.user_id,))
                 self._account_data_stream_cache.entity_has_changed(row.user_id, token)
         elif stream_name == AccountDataStream.NAME:
             self._account_data_id_gen.advance(instance_name, token)
@@ -363,7 +494,6 @@ class AccountDataWorkerStore(SQLBaseStore):
                     self.get_global_account_data_by_type_for_user.invalidate(
                         (row.data_type, row.user_id)
                     )
-                self.get_account_data_for_user.invalidate((row.user_id,))
                 self.get_account_data_for_room.invalidate((row.user_id, row.room_id))
                 self.get_account_data_for_room_and_type.invalidate(
                     (row.user_id, row.room_id, row.data_type)
@@ -406,7 +536,6 @@ class AccountDataWorkerStore(SQLBaseStore):
             )
 
             self._account_data_stream_cache.entity_has_changed(user_id, next_id)
-            self.get_account_data_for_user.invalidate((user_id,))
             self.get_account_data_for_room.invalidate((user_id, room_id))
             self.get_account_data_for_room_and_type.prefill(
                 (user_id, room_id, account_data_type), content
@@ -440,7 +569,6 @@ class AccountDataWorkerStore(SQLBaseStore):
             )
 
             self._account_data_stream_cache.entity_has_changed(user_id, next_id)
-            self.get_account_data_for_user.invalidate((user_id,))
             self.get_global_account_data_by_type_for_user.invalidate(
                 (account_data_type, user_id)
             )
@@ -515,3 +643,81 @@ class AccountDataWorkerStore(SQLBaseStore):
 
 class AccountDataStore(AccountDataWorkerStore):
     pass
+
+
+def _filters_types(account_data_filter: Optional[Filter]) -> bool:
+    """Whether the given filter restricts the types of account_data returned."""
+    return account_data_filter is not None and bool(
+        account_data_filter.types is not None or account_data_filter.not_types
+    )
+
+
+def _filter_to_type_clause(
+    account_data_filter: Optional[Filter],
+) -> Tuple[str, List[str]]:
+    """Converts the types of a filter into an SQL clause on the
+    `account_data_type` column, to be appended to a WHERE clause.
+    """
+    if not _filters_types(account_data_filter):
+        return "", []
+    assert account_data_filter is not None
+
+    def type_to_clause(account_data_type: str) -> Tuple[str, str]:
+        if account_data_type.endswith("*"):
+            # We compare the prefix directly rather than using LIKE, as LIKE is
+            # case insensitive on SQLite.
+            prefix = account_data_type[:-1]
+            return "substr(account_data_type, 1, %d) = ?" % (len(prefix),), prefix
+        return "account_data_type = ?", account_data_type
+
+    clauses = []
+    args = []
+
+    if account_data_filter.types is not None:
+        if not account_data_filter.types:
+            return " AND 1 = 0", []
+
+        type_clauses = []
+        for account_data_type in account_data_filter.types:
+            type_clause, type_arg = type_to_clause(account_data_type)
+            type_clauses.append(type_clause)
+            args.append(type_arg)
+        clauses.append("(%s)" % " OR ".join(type_clauses))
+
+    for account_data_type in account_data_filter.not_types:
+        type_clause, type_arg = type_to_clause(account_data_type)
+        clauses.append("NOT %s" % (type_clause,))
+        args.append(type_arg)
+
+    return " AND " + " AND ".join(clauses), args
+
+
+def _filter_account_data_by_type(
+    global_account_data: Dict[str, JsonDict],
+    by_room: Dict[str, Dict[str, JsonDict]],
+    account_data_filter: Optional[Filter],
+    room_account_data_filter: Optional[Filter],
+) -> Tuple[Dict[str, JsonDict], Dict[str, Dict[str, JsonDict]]]:
+    """Applies the types of the given filters to a user's account_data."""
+    if _filters_types(account_data_filter):
+        assert account_data_filter is not None
+        global_account_data = {
+            account_data_type: content
+            for account_data_type, content in global_account_data.items()
+            if account_data_filter.check_type(account_data_type)
+        }
+
+    if _filters_types(room_account_data_filter):
+        assert room_account_data_filter is not None
+        filtered_by_room = {}
+        for room_id, room_data in by_room.items():
+            room_data = {
+                account_data_type: content
+                for account_data_type, content in room_data.items()
+                if room_account_data_filter.check_type(account_data_type)
+            }
+            if room_data:
+                filtered_by_room[room_id] = room_data
+        by_room = filtered_by_room
+
+    return global_account_data, by_room
@@ -173,6 +173,7 @@ class CacheInvalidationWorkerStore(SQLBaseStore):
         self.get_latest_event_ids_in_room.invalidate((room_id,))
 
         self.get_unread_event_push_actions_by_room_for_user.invalidate((room_id,))
+        self.get_unread_counts_for_room_for_user.invalidate((room_id,))
 
         if not backfilled:
             self._events_stream_cache.entity_has_changed(room_id, stream_ordering)
@@ -14,21 +14,51 @@
 import itertools
 import logging
 from queue import Empty, PriorityQueue
-from typing import Collection, Dict, Iterable, List, Set, Tuple
+from typing import Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+from prometheus_client import Gauge
 
 from synapse.api.errors import StoreError
-from synapse.events import EventBase
+from synapse.api.room_versions import RoomVersion
+from synapse.events import EventBase, make_event_from_dict
 from synapse.metrics.background_process_metrics import wrap_as_background_process
-from synapse.storage._base import SQLBaseStore, make_in_list_sql_clause
+from synapse.storage._base import SQLBaseStore, db_to_json, make_in_list_sql_clause
 from synapse.storage.database import DatabasePool, LoggingTransaction
 from synapse.storage.databases.main.events_worker import EventsWorkerStore
 from synapse.storage.databases.main.signatures import SignatureWorkerStore
 from synapse.storage.engines import PostgresEngine
 from synapse.storage.types import Cursor
+from synapse.util import json_encoder
 from synapse.util.caches.descriptors import cached
 from synapse.util.caches.lrucache import LruCache
 from synapse.util.iterutils import batch_iter
 
+oldest_staged_event_age_gauge = Gauge(
+    "synapse_federation_server_oldest_inbound_pdu_in_staging",
+    "The age in seconds since we received the oldest pdu waiting to be processed",
+)
+
+number_staged_events_gauge = Gauge(
+    "synapse_federation_server_number_inbound_pdu_in_staging",
+    "The total number of pdus waiting to be processed",
+)
+
+number_staged_rooms_gauge = Gauge(
+    "synapse_federation_server_number_rooms_with_inbound_pdu_in_staging",
+    "The number of rooms with pdus waiting to be processed",
+)
+
+largest_staged_room_gauge = Gauge(
+    "synapse_federation_server_largest_room_inbound_pdu_in_staging",
+    "The largest number of pdus waiting to be processed in a single room",
+)
+
+number_staged_events_by_origin_gauge = Gauge(
+    "synapse_federation_server_number_inbound_pdu_in_staging_by_origin",
+    "The number of pdus waiting to be processed which were received from the given domain",
+    labelnames=("server_name",),
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,6 +76,14 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
                 self._delete_old_forward_extrem_cache, 60 * 60 * 1000
             )
 
+            hs.get_clock().looping_call(self._update_staged_events_metrics, 30 * 1000)
+
+        self._federation_metrics_domains = (
+            hs.config.federation.federation_metrics_domains
+        )
+
+        self._instance_name = hs.get_instance_name()
+
         # Cache of event ID to list of auth event IDs and their depths.
         self._event_auth_cache = LruCache(
             500000, "_event_auth_cache", size_callback=len
@@ -981,6 +1019,199 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore, SQLBas
 
         return [row["event_id"] for row in rows]
 
+    async def insert_received_events_to_staging(
+        self, origin: str, events: List[EventBase], received_ts: int
+    ) -> None:
+        """Stage events received in a federation transaction, so that they can
+        be processed after we've responded to the transaction.
+
+        Args:
+            origin: The server that sent us the events.
+            events: The events, in the order they appeared in the transaction.
+            received_ts: When we received the transaction.
+
+        The events are recorded as having been received by this instance.
+        """
+        if not events:
+            return
+
+        await self.db_pool.simple_upsert_many(
+            table="federation_inbound_events_staging",
+            key_names=("origin", "event_id"),
+            key_values=[(origin, event.event_id) for event in events],
+            value_names=(
+                "room_id",
+                "instance_name",
+                "received_ts",
+                "txn_position",
+                "event_json",
+                "internal_metadata",
+            ),
+            value_values=[
+                (
+                    event.room_id,
+                    self._instance_name,
+                    received_ts,
+                    position,
+                    json_encoder.encode(event.get_pdu_json()),
+                    json_encoder.encode(event.internal_metadata.get_dict()),
+                )
+                for position, event in enumerate(events)
+            ],
+            desc="insert_received_events_to_staging",
+        )
+
+    async def remove_received_event_from_staging(
+        self, origin: str, event_id: str
+    ) -> None:
+        """Remove the given event from the staging area once it's been
+        processed.
+        """
+        await self.db_pool.simple_delete(
+            table="federation_inbound_events_staging",
+            keyvalues={"origin": origin, "event_id": event_id},
+            desc="remove_received_event_from_staging",
+        )
+
+    async def get_next_staged_event_for_room(
+        self,
+        room_id: str,
+        room_version: RoomVersion,
+        instance_name: Optional[str] = None,
+    ) -> Optional[Tuple[str, EventBase]]:
+        """Get the oldest event in the staging area for the given room.
+
+        Args:
+            room_id: The room to get the event for.
+            room_version: The version of the room.
+            instance_name: If given, only consider events received by this
+                instance.
+
+        Returns:
+            The origin the event was received from and the event, or None if
+            there are no events waiting to be processed in the room.
+        """
+
+        def _get_next_staged_event_for_room_txn(txn):
+            args = [room_id]
+            instance_clause = ""
+            if instance_name is not None:
+                instance_clause = "AND instance_name = ?"
+                args.append(instance_name)
+
+            sql = """
+                SELECT origin, event_json, internal_metadata
+                FROM federation_inbound_events_staging
+                WHERE room_id = ? %s
+                ORDER BY received_ts ASC, txn_position ASC
+                LIMIT 1
+            """ % (
+                instance_clause,
+            )
+
+            txn.execute(sql, args)
+            return txn.fetchone()
+
+        row = await self.db_pool.runInteraction(
+            "get_next_staged_event_for_room", _get_next_staged_event_for_room_txn
+        )
+
+        if not row:
+            return None
+
+        origin, event_json, internal_metadata = row
+        event = make_event_from_dict(
+            db_to_json(event_json), room_version, db_to_json(internal_metadata)
+        )
+
+        return origin, event
+
+    async def count_staged_events_for_room(self, room_id: str) -> int:
+        """Get the number of events waiting to be processed in the room."""
+        return await self.db_pool.simple_select_one_onecol(
+            table="federation_inbound_events_staging",
+            keyvalues={"room_id": room_id},
+            retcol="COUNT(*)",
+            desc="count_staged_events_for_room",
+        )
+
+    async def get_all_rooms_with_staged_incoming_events(
+        self, instance_name: Optional[str] = None
+    ) -> List[str]:
+        """Get the rooms which have events waiting to be processed.
+
+        Args:
+            instance_name: If given, only consider events received by this
+                instance.
+        """
+        keyvalues = {}
+        if instance_name is not None:
+            keyvalues["instance_name"] = instance_name
+
+        return await self.db_pool.simple_select_onecol(
+            table="federation_inbound_events_staging",
+            keyvalues=keyvalues,
+            retcol="DISTINCT room_id",
+            desc="get_all_rooms_with_staged_incoming_events",
+        )
+
+    @wrap_as_background_process("_update_staged_events_metrics")
+    async def _update_staged_events_metrics(self) -> None:
+        """Update the metrics on the events waiting to be processed."""
+
+        def _update_staged_events_metrics_txn(txn):
+            sql = """
+                SELECT room_id, COUNT(*), MIN(received_ts)
+                FROM federation_inbound_events_staging
+                GROUP BY room_id
+            """
+            txn.execute(sql)
+            rooms = txn.fetchall()
+
+            sql = """
+                SELECT origin, COUNT(*)
+                FROM federation_inbound_events_staging
+                GROUP BY origin
+            """
+            txn.execute(sql)
+            origins = dict(txn)
+
+            return rooms, origins
+
+        rooms, origins = await self.db_pool.runInteraction(
+            "_update_staged_events_metrics",
+            _update_staged_events_metrics_txn,
+        )
+
+        now = self._clock.time_msec()
+
+        number_staged_rooms_gauge.set(len(rooms))
+        number_staged_events_gauge.set(sum(count for _, count, _ in rooms))
+
+        if rooms:
+            oldest_ts = min(received_ts for _, _, received_ts in rooms)
+            oldest_staged_event_age_gauge.set((now - oldest_ts) / 1000)
+
+            largest_room_id, largest_count, _ = max(rooms, key=lambda r: r[1])
+            largest_staged_room_gauge.set(largest_count)
+
+            # A single room with a long queue usually means we're struggling
+            # to process its events, so say which room it is.
+            if largest_count >= 100:
+                logger.warning(
+                    "%d events waiting to be processed in %s",
+                    largest_count,
+                    largest_room_id,
+                )
+        else:
+            oldest_staged_event_age_gauge.set(0)
+            largest_staged_room_gauge.set(0)
+
+        for server_name in self._federation_metrics_domains:
+            number_staged_events_by_origin_gauge.labels(server_name=server_name).set(
+                origins.get(server_name, 0)
+            )
+
     @wrap_as_background_process("delete_old_forward_extrem_cache")
     async def _delete_old_forward_extrem_cache(self) -> None:
         def _delete_old_forward_extrem_cache_txn(txn):
@@ -13,15 +13,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Collection, Dict, List, Optional, Tuple, Union
 
 import attr
 
+from synapse.api.constants import Membership
+from synapse.events import EventBase
 from synapse.metrics.background_process_metrics import wrap_as_background_process
+from synapse.replication.tcp.streams import PushEvaluatorStream
 from synapse.storage._base import SQLBaseStore, db_to_json
-from synapse.storage.database import DatabasePool, LoggingTransaction
+from synapse.storage.database import (
+    DatabasePool,
+    LoggingTransaction,
+    make_in_list_sql_clause,
+)
+from synapse.storage.engines import PostgresEngine, Sqlite3Engine
 from synapse.util import json_encoder
-from synapse.util.caches.descriptors import cached
+from synapse.util.caches.descriptors import cached, cachedList
+from synapse.util.iterutils import batch_iter
 
 logger = logging.getLogger(__name__)
 
@@ -79,6 +88,28 @@ class EventPushActionsWorkerStore(SQLBaseStore):
             self._find_stream_orderings_for_times, 10 * 60 * 1000
         )
 
+        # The furthest position of the push evaluator that this process has
+        # seen. Clients aren't sent events beyond this, so that they get the
+        # right unread counts along with the events.
+        self._push_evaluator_position = 0
+        if hs.config.worker.evaluate_push_actions_async:
+            cur = db_conn.cursor(txn_name="_get_push_evaluator_position_on_start")
+            cur.execute("SELECT stream_id FROM push_evaluator_stream_position")
+            row = cur.fetchone()
+            if row is None:
+                # The push evaluator will start from the end of the events
+                # stream.
+                cur.execute("SELECT COALESCE(MAX(stream_ordering), 0) FROM events")
+                row = cur.fetchone()
+            self._push_evaluator_position = row[0]
+            cur.close()
+        elif hs.config.run_background_tasks:
+            # Forget the push evaluator's position, so that it doesn't go back
+            # over the events persisted since, should it be switched on again.
+            cur = db_conn.cursor(txn_name="_clear_push_evaluator_position_txn")
+            cur.execute("DELETE FROM push_evaluator_stream_position")
+            cur.close()
+
         self._rotate_delay = 3
         self._rotate_count = 10000
         self._doing_notif_rotation = False
@@ -87,6 +118,18 @@ class EventPushActionsWorkerStore(SQLBaseStore):
                 self._rotate_notifs, 30 * 60 * 1000
             )
 
+        # Whether the event_push_counts table has been fully populated; set by
+        # `_have_push_counts`.
+        self._push_counts_populated = False
+
+        # Each run of `_reconcile_push_counts` checks this many batches of this
+        # many stored counts, which at one run a minute gets through about
+        # seven million a day.
+        self._reconcile_batch_size = 500
+        self._reconcile_batches_per_run = 10
+        if hs.config.run_background_tasks:
+            self._clock.looping_call(self._reconcile_push_counts, 60 * 1000)
+
     @cached(num_args=3, tree=True, max_entries=5000)
     async def get_unread_event_push_actions_by_room_for_user(
         self,
@@ -127,6 +170,24 @@ class EventPushActionsWorkerStore(SQLBaseStore):
         user_id,
         last_read_event_id,
     ):
+        stream_ordering = self._get_unread_position_txn(
+            txn, room_id, user_id, last_read_event_id
+        )
+
+        return self._get_unread_counts_by_pos_txn(
+            txn, room_id, user_id, stream_ordering
+        )
+
+    def _get_unread_position_txn(
+        self,
+        txn: LoggingTransaction,
+        room_id: str,
+        user_id: str,
+        last_read_event_id: Optional[str],
+    ) -> int:
+        """Get the stream ordering after which events count as unread for a user
+        in a room, given the event their latest read receipt points to.
+        """
         stream_ordering = None
 
         if last_read_event_id is not None:
@@ -150,10 +211,156 @@ class EventPushActionsWorkerStore(SQLBaseStore):
 
             stream_ordering = self.get_stream_id_for_event_txn(txn, event_id)
 
-        return self._get_unread_counts_by_pos_txn(
-            txn, room_id, user_id, stream_ordering
+        return stream_ordering
+
+    @cached(num_args=2, tree=True, max_entries=50000)
+    async def get_unread_counts_for_room_for_user(
+        self, room_id: str, user_id: str
+    ) -> Dict[str, int]:
+        """Get the notification count, the highlight count and the unread message count
+        for a given user in a given room after their latest read receipt.
+
+        Unlike `get_unread_event_push_actions_by_room_for_user`, the read receipt
+        is looked up as part of the query, so this is invalidated whenever the user
+        sends a new read receipt in the room.
+        """
+        results = await self.db_pool.runInteraction(
+            "get_unread_counts_for_room_for_user",
+            self._get_unread_counts_for_rooms_txn,
+            [room_id],
+            user_id,
+            await self._have_push_counts(),
+        )
+        return results[room_id]
+
+    @cachedList(
+        cached_method_name="get_unread_counts_for_room_for_user",
+        list_name="room_ids",
+    )
+    async def get_unread_counts_for_rooms_for_user(
+        self, room_ids: Collection[str], user_id: str
+    ) -> Dict[str, Dict[str, int]]:
+        """Get the notification count, the highlight count and the unread message count
+        for a given user in each of the given rooms after their latest read receipt
+        in that room.
+
+        This assumes the user to be a current member of the rooms; the counts are
+        taken from their join event if they have no read receipt in a room.
+
+        Args:
+            room_ids: The rooms to retrieve the counts in.
+            user_id: The user to retrieve the counts for.
+
+        Returns:
+            A dict from room ID to a dict containing the counts, under the keys
+            "notify_count", "highlight_count" and "unread_count".
+        """
+        return await self.db_pool.runInteraction(
+            "get_unread_counts_for_rooms_for_user",
+            self._get_unread_counts_for_rooms_txn,
+            room_ids,
+            user_id,
+            await self._have_push_counts(),
         )
 
+    async def _have_push_counts(self) -> bool:
+        """Whether the `event_push_counts` table has been populated, and so can
+        be read from instead of counting push actions.
+        """
+        if not self._push_counts_populated:
+            self._push_counts_populated = (
+                await self.db_pool.updates.has_completed_background_update(
+                    "event_push_counts_populate"
+                )
+            )
+        return self._push_counts_populated
+
+    def _get_unread_counts_for_rooms_txn(
+        self,
+        txn: LoggingTransaction,
+        room_ids: Collection[str],
+        user_id: str,
+        use_push_counts: bool = False,
+    ) -> Dict[str, Dict[str, int]]:
+        results = {
+            room_id: {"notify_count": 0, "unread_count": 0, "highlight_count": 0}
+            for room_id in room_ids
+        }
+
+        if use_push_counts:
+            rows = self.db_pool.simple_select_many_txn(
+                txn,
+                table="event_push_counts",
+                column="room_id",
+                iterable=room_ids,
+                keyvalues={"user_id": user_id},
+                retcols=("room_id", "notif_count", "highlight_count", "unread_count"),
+            )
+            for row in rows:
+                results[row["room_id"]] = {
+                    "notify_count": row["notif_count"],
+                    "unread_count": row["unread_count"],
+                    "highlight_count": row["highlight_count"],
+                }
+            return results
+
+        for batch in batch_iter(room_ids, 100):
+            clause, args = make_in_list_sql_clause(
+                self.database_engine, "m.room_id", batch
+            )
+
+            # The stream ordering from which to count in each room: that of the
+            # event the user's read receipt points to, or, if they don't have
+            # one (or it points to an event we don't have), that of their join.
+            receipt_positions = """
+                SELECT
+                    m.room_id,
+                    COALESCE(re.stream_ordering, me.stream_ordering) AS stream_ordering
+                FROM local_current_membership AS m
+                INNER JOIN events AS me ON me.event_id = m.event_id
+                LEFT JOIN receipts_linearized AS r
+                    ON r.room_id = m.room_id
+                    AND r.user_id = m.user_id
+                    AND r.receipt_type = 'm.read'
+                LEFT JOIN events AS re ON re.event_id = r.event_id
+                WHERE m.user_id = ? AND %s
+            """ % (
+                clause,
+            )
+
+            sql = """
+                SELECT room_id, SUM(notif), SUM(highlight), SUM(unread)
+                FROM (
+                    SELECT
+                        ea.room_id,
+                        CASE WHEN notif = 1 THEN 1 ELSE 0 END AS notif,
+                        CASE WHEN highlight = 1 THEN 1 ELSE 0 END AS highlight,
+                        CASE WHEN unread = 1 THEN 1 ELSE 0 END AS unread
+                    FROM event_push_actions AS ea
+                    INNER JOIN (%(receipt_positions)s) AS p USING (room_id)
+                    WHERE ea.user_id = ? AND ea.stream_ordering > p.stream_ordering
+                    UNION ALL
+                    SELECT eps.room_id, notif_count, 0, COALESCE(unread_count, 0)
+                    FROM event_push_summary AS eps
+                    INNER JOIN (%(receipt_positions)s) AS p USING (room_id)
+                    WHERE eps.user_id = ? AND eps.stream_ordering > p.stream_ordering
+                ) AS counts
+                GROUP BY room_id
+            """ % {
+                "receipt_positions": receipt_positions
+            }
+
+            txn.execute(sql, [user_id, *args, user_id] * 2)
+
+            for room_id, notif_count, highlight_count, unread_count in txn:
+                results[room_id] = {
+                    "notify_count": int(notif_count),
+                    "unread_count": int(unread_count),
+                    "highlight_count": int(highlight_count),
+                }
+
+        return results
+
     def _get_unread_counts_by_pos_txn(self, txn, room_id, user_id, stream_ordering):
         sql = (
             "SELECT"
@@ -212,6 +419,62 @@ class EventPushActionsWorkerStore(SQLBaseStore):
         ret = await self.db_pool.runInteraction("get_push_action_users_in_range", f)
         return ret
 
+    async def get_unread_push_actions_in_range_for_http(
+        self, min_stream_ordering: int, max_stream_ordering: int, limit: int
+    ) -> List[dict]:
+        """Get the unread push actions for all users with pushers within the given
+        stream ordering range, for handing out to the http pushers.
+
+        Args:
+            min_stream_ordering: The exclusive lower bound on the
+                stream ordering of event push actions to fetch.
+            max_stream_ordering: The inclusive upper bound on the
+                stream ordering of event push actions to fetch.
+            limit: The maximum number of rows to return.
+        Returns:
+            A list of dicts with the keys "user_id", "event_id", "room_id",
+            "stream_ordering", "actions". The list will be ordered by ascending
+            stream_ordering.
+        """
+
+        def get_unread_push_actions_in_range_for_http_txn(txn):
+            sql = """
+                SELECT ep.user_id, ep.event_id, ep.room_id, ep.stream_ordering,
+                    ep.actions, ep.highlight
+                FROM event_push_actions AS ep
+                WHERE
+                    ep.stream_ordering > ?
+                    AND ep.stream_ordering <= ?
+                    AND ep.notif = 1
+                    AND ep.user_id IN (SELECT user_name FROM pushers)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM receipts_linearized AS r
+                        INNER JOIN events AS e USING (room_id, event_id)
+                        WHERE
+                            r.room_id = ep.room_id
+                            AND r.user_id = ep.user_id
+                            AND r.receipt_type = 'm.read'
+                            AND e.stream_ordering >= ep.stream_ordering
+                    )
+                ORDER BY ep.stream_ordering ASC LIMIT ?
+            """
+            txn.execute(sql, (min_stream_ordering, max_stream_ordering, limit))
+            return [
+                {
+                    "user_id": row[0],
+                    "event_id": row[1],
+                    "room_id": row[2],
+                    "stream_ordering": row[3],
+                    "actions": _deserialize_action(row[4], row[5]),
+                }
+                for row in txn
+            ]
+
+        return await self.db_pool.runInteraction(
+            "get_unread_push_actions_in_range_for_http",
+            get_unread_push_actions_in_range_for_http_txn,
+        )
+
     async def get_unread_push_actions_for_user_in_range_for_http(
         self,
         user_id: str,
@@ -526,6 +789,165 @@ class EventPushActionsWorkerStore(SQLBaseStore):
                 "Error removing push actions after event persistence failure"
             )
 
+    async def get_push_evaluator_position(self) -> int:
+        """Get the position in the events stream up to which push actions have
+        been computed for events.
+
+        The first time this is called after push actions start being computed
+        asynchronously, the position is set to the end of the events stream.
+        """
+
+        def _get_push_evaluator_position_txn(txn: LoggingTransaction) -> int:
+            stream_id = self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                table="push_evaluator_stream_position",
+                keyvalues={},
+                retcol="stream_id",
+                allow_none=True,
+            )
+            if stream_id is not None:
+                return stream_id
+
+            # Other processes may be doing this at the same time.
+            if isinstance(self.database_engine, PostgresEngine):
+                sql = """
+                    INSERT INTO push_evaluator_stream_position (stream_id)
+                    SELECT COALESCE(MAX(stream_ordering), 0) FROM events
+                    ON CONFLICT DO NOTHING
+                """
+            elif isinstance(self.database_engine, Sqlite3Engine):
+                sql = """
+                    INSERT OR IGNORE INTO push_evaluator_stream_position (stream_id)
+                    SELECT COALESCE(MAX(stream_ordering), 0) FROM events
+                """
+            else:
+                raise RuntimeError("Unknown database engine")
+
+            txn.execute(sql)
+
+            return self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                table="push_evaluator_stream_position",
+                keyvalues={},
+                retcol="stream_id",
+            )
+
+        stream_id = await self.db_pool.runInteraction(
+            "get_push_evaluator_position", _get_push_evaluator_position_txn
+        )
+        self._push_evaluator_position = max(self._push_evaluator_position, stream_id)
+        return stream_id
+
+    def get_current_push_evaluator_position(self) -> int:
+        """Get the furthest position of the push evaluator that this process has
+        seen, without going to the database.
+        """
+        return self._push_evaluator_position
+
+    def process_replication_rows(self, stream_name, instance_name, token, rows):
+        if stream_name == PushEvaluatorStream.NAME:
+            self._push_evaluator_position = max(self._push_evaluator_position, token)
+
+        return super().process_replication_rows(stream_name, instance_name, token, rows)
+
+    def _update_push_evaluator_position_txn(
+        self, txn: LoggingTransaction, stream_id: int
+    ) -> None:
+        txn.execute(
+            """
+            UPDATE push_evaluator_stream_position SET stream_id = ?
+            WHERE stream_id < ?
+            """,
+            (stream_id, stream_id),
+        )
+
+    async def add_push_actions_for_persisted_events(
+        self,
+        events_and_actions: List[
+            Tuple[EventBase, Dict[str, List[Union[dict, str]]], bool]
+        ],
+        stream_id: int,
+    ) -> None:
+        """Add the push actions for events which have already been persisted,
+        and move the push evaluator's position on to the given stream ID.
+
+        Args:
+            events_and_actions: A list of events, along with a mapping of user_id
+                to the list of push actions for the event and whether the event
+                should increment unread counts.
+            stream_id: The position in the events stream up to which push
+                actions have now been computed.
+        """
+
+        def _add_push_actions_for_persisted_events_txn(txn):
+            sql = """
+                INSERT INTO event_push_actions (
+                    room_id, event_id, user_id, actions, stream_ordering,
+                    topological_ordering, notif, highlight, unread
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """
+
+            for event, user_id_actions, count_as_unread in events_and_actions:
+                stream_ordering = event.internal_metadata.stream_ordering
+
+                rows = []
+                counts_by_user = {}  # type: Dict[str, Tuple[int, int, int]]
+                for user_id, actions in user_id_actions.items():
+                    is_highlight = 1 if _action_has_highlight(actions) else 0
+                    notif = 1 if "notify" in actions else 0
+                    rows.append(
+                        (
+                            event.room_id,
+                            event.event_id,
+                            user_id,
+                            _serialize_action(actions, is_highlight),
+                            stream_ordering,
+                            event.depth,
+                            notif,
+                            is_highlight,
+                            int(count_as_unread),
+                        )
+                    )
+                    counts_by_user[user_id] = (
+                        notif,
+                        is_highlight,
+                        int(count_as_unread),
+                    )
+
+                if not rows:
+                    continue
+
+                txn.execute_batch(sql, rows)
+
+                # The users may have already sent a read receipt for the event
+                # by the time we get here, in which case it mustn't be counted.
+                self._increment_push_counts_txn(
+                    txn, event.room_id, counts_by_user, stream_ordering=stream_ordering
+                )
+
+                # The unread counts are cached by other workers too, so we need
+                # to stream the invalidations to them.
+                for user_id in counts_by_user:
+                    self._invalidate_cache_and_stream(
+                        txn,
+                        self.get_unread_event_push_actions_by_room_for_user,
+                        (event.room_id, user_id),
+                    )
+                    self._invalidate_cache_and_stream(
+                        txn,
+                        self.get_unread_counts_for_room_for_user,
+                        (event.room_id, user_id),
+                    )
+
+            self._update_push_evaluator_position_txn(txn, stream_id)
+
+        await self.db_pool.runInteraction(
+            "add_push_actions_for_persisted_events",
+            _add_push_actions_for_persisted_events_txn,
+        )
+        self._push_evaluator_position = max(self._push_evaluator_position, stream_id)
+
     @wrap_as_background_process("event_push_action_stream_orderings")
     async def _find_stream_orderings_for_times(self) -> None:
         await self.db_pool.runInteraction(
@@ -863,6 +1285,10 @@ class EventPushActionsWorkerStore(SQLBaseStore):
             self.get_unread_event_push_actions_by_room_for_user.invalidate,
             (room_id, user_id),
         )
+        txn.call_after(
+            self.get_unread_counts_for_room_for_user.invalidate,
+            (room_id, user_id),
+        )
 
         # We need to join on the events table to get the received_ts for
         # event_push_actions and sqlite won't let us use a join in a delete so
@@ -888,6 +1314,334 @@ class EventPushActionsWorkerStore(SQLBaseStore):
             (room_id, user_id, stream_ordering),
         )
 
+    def _increment_push_counts_txn(
+        self,
+        txn: LoggingTransaction,
+        room_id: str,
+        counts_by_user: Dict[str, Tuple[int, int, int]],
+        stream_ordering: Optional[int] = None,
+    ) -> None:
+        """Add newly persisted push actions to the users' unread counts in a room.
+
+        Args:
+            txn: The transaction
+            room_id: The room the push actions are in.
+            counts_by_user: A map from user ID to the number of new notifying,
+                highlighting and unread push actions for that user.
+            stream_ordering: If given, the stream ordering of the event the push
+                actions are for. Users whose counts have already been reset by a
+                read receipt at or after that event are left alone.
+        """
+        if stream_ordering is None:
+            upsert_clause = ""
+            update_clause = ""
+            extra_args = ()  # type: Tuple[int, ...]
+        else:
+            upsert_clause = "WHERE event_push_counts.stream_ordering < ?"
+            update_clause = "AND stream_ordering < ?"
+            extra_args = (stream_ordering,)
+
+        if self.database_engine.can_native_upsert:
+            sql = """
+                INSERT INTO event_push_counts (
+                    user_id, room_id, stream_ordering,
+                    notif_count, highlight_count, unread_count
+                ) VALUES (?, ?, 0, ?, ?, ?)
+                ON CONFLICT (user_id, room_id) DO UPDATE SET
+                    notif_count = event_push_counts.notif_count + EXCLUDED.notif_count,
+                    highlight_count =
+                        event_push_counts.highlight_count + EXCLUDED.highlight_count,
+                    unread_count =
+                        event_push_counts.unread_count + EXCLUDED.unread_count
+                %s
+            """ % (
+                upsert_clause,
+            )
+            txn.execute_batch(
+                sql,
+                (
+                    (user_id, room_id, notif, highlight, unread) + extra_args
+                    for user_id, (notif, highlight, unread) in counts_by_user.items()
+                ),
+            )
+            return
+
+        # Without native upserts we try to update each row and insert the ones
+        # which don't exist yet. This is only the case on old SQLite versions,
+        # where there aren't concurrent writers to race with.
+        for user_id, (notif, highlight, unread) in counts_by_user.items():
+            txn.execute(
+                """
+                UPDATE event_push_counts SET
+                    notif_count = notif_count + ?,
+                    highlight_count = highlight_count + ?,
+                    unread_count = unread_count + ?
+                WHERE user_id = ? AND room_id = ? %s
+                """
+                % (update_clause,),
+                (notif, highlight, unread, user_id, room_id) + extra_args,
+            )
+            if txn.rowcount == 0:
+                self.db_pool.simple_upsert_txn_emulated(
+                    txn,
+                    table="event_push_counts",
+                    keyvalues={"user_id": user_id, "room_id": room_id},
+                    values={},
+                    insertion_values={
+                        "stream_ordering": 0,
+                        "notif_count": notif,
+                        "highlight_count": highlight,
+                        "unread_count": unread,
+                    },
+                )
+
+    def _remove_push_counts_for_event_txn(
+        self, txn: LoggingTransaction, room_id: str, event_id: str
+    ) -> None:
+        """Take an event's push actions off the users' unread counts, ahead of
+        the push actions being deleted.
+        """
+        txn.execute(
+            """
+            SELECT user_id, stream_ordering, notif, highlight, unread
+            FROM event_push_actions
+            WHERE room_id = ? AND event_id = ?
+            """,
+            (room_id, event_id),
+        )
+        rows = txn.fetchall()
+
+        txn.execute_batch(
+            """
+            UPDATE event_push_counts SET
+                notif_count = notif_count - ?,
+                highlight_count = highlight_count - ?,
+                unread_count = unread_count - ?
+            WHERE user_id = ? AND room_id = ? AND stream_ordering < ?
+            """,
+            (
+                (
+                    1 if notif == 1 else 0,
+                    1 if highlight == 1 else 0,
+                    1 if unread == 1 else 0,
+                    user_id,
+                    room_id,
+                    stream_ordering,
+                )
+                for user_id, stream_ordering, notif, highlight, unread in rows
+            ),
+        )
+
+    def _remove_push_counts_for_left_users_txn(
+        self, txn: LoggingTransaction, room_id: str, user_ids: Collection[str]
+    ) -> None:
+        """Drop the unread counts in a room of those of the given local users who
+        are no longer joined to it.
+        """
+        txn.execute_batch(
+            """
+            DELETE FROM event_push_counts
+            WHERE room_id = ? AND user_id = ? AND NOT EXISTS (
+                SELECT 1 FROM local_current_membership
+                WHERE room_id = ? AND user_id = ? AND membership = ?
+            )
+            """,
+            (
+                (room_id, user_id, room_id, user_id, Membership.JOIN)
+                for user_id in user_ids
+            ),
+        )
+        for user_id in user_ids:
+            txn.call_after(
+                self.get_unread_counts_for_room_for_user.invalidate, (room_id, user_id)
+            )
+
+    def _reset_push_counts_txn(
+        self, txn: LoggingTransaction, room_id: str, user_id: str, stream_ordering: int
+    ) -> None:
+        """Reset a user's unread counts in a room after they sent a read receipt
+        for the event at the given stream ordering.
+
+        Usually the receipt is for the latest event that notified them, in which
+        case the counts are just zeroed. Otherwise they are counted afresh.
+        """
+        txn.execute(
+            """
+            SELECT 1 FROM event_push_actions
+            WHERE user_id = ? AND room_id = ? AND stream_ordering > ?
+            LIMIT 1
+            """,
+            (user_id, room_id, stream_ordering),
+        )
+        has_later_actions = txn.fetchone() is not None
+        if not has_later_actions:
+            # Older push actions may have been rotated into the summary.
+            txn.execute(
+                """
+                SELECT 1 FROM event_push_summary
+                WHERE user_id = ? AND room_id = ? AND stream_ordering > ?
+                """,
+                (user_id, room_id, stream_ordering),
+            )
+            has_later_actions = txn.fetchone() is not None
+
+        if not has_later_actions:
+            counts = {"notify_count": 0, "highlight_count": 0, "unread_count": 0}
+        else:
+            counts = self._get_unread_counts_by_pos_txn(
+                txn, room_id, user_id, stream_ordering
+            )
+        self.db_pool.simple_upsert_txn(
+            txn,
+            table="event_push_counts",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            values={
+                "stream_ordering": stream_ordering,
+                "notif_count": counts["notify_count"],
+                "highlight_count": counts["highlight_count"],
+                "unread_count": counts["unread_count"],
+            },
+        )
+
+    def _recompute_push_counts_txn(
+        self, txn: LoggingTransaction, user_id: str, room_id: str
+    ) -> bool:
+        """Recompute a user's unread counts in a room from their push actions,
+        and fix up the stored counts if they have drifted.
+
+        Returns:
+            True if the stored counts had to be changed.
+        """
+        membership = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="local_current_membership",
+            keyvalues={"room_id": room_id, "user_id": user_id},
+            retcol="membership",
+            allow_none=True,
+        )
+        if membership != Membership.JOIN:
+            # We only care about counts in rooms the user is in.
+            deleted = self.db_pool.simple_delete_txn(
+                txn,
+                table="event_push_counts",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+            )
+            if not deleted:
+                return False
+            self._invalidate_cache_and_stream(
+                txn, self.get_unread_counts_for_room_for_user, (room_id, user_id)
+            )
+            return True
+
+        last_read_event_id = self.db_pool.simple_select_one_onecol_txn(
+            txn,
+            table="receipts_linearized",
+            keyvalues={
+                "room_id": room_id,
+                "user_id": user_id,
+                "receipt_type": "m.read",
+            },
+            retcol="event_id",
+            allow_none=True,
+        )
+        stream_ordering = self._get_unread_position_txn(
+            txn, room_id, user_id, last_read_event_id
+        )
+        counts = self._get_unread_counts_by_pos_txn(
+            txn, room_id, user_id, stream_ordering
+        )
+
+        expected = {
+            "stream_ordering": stream_ordering,
+            "notif_count": counts["notify_count"],
+            "highlight_count": counts["highlight_count"],
+            "unread_count": counts["unread_count"],
+        }
+        current = self.db_pool.simple_select_one_txn(
+            txn,
+            table="event_push_counts",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            retcols=list(expected),
+            allow_none=True,
+        )
+        if current == expected:
+            return False
+
+        self.db_pool.simple_upsert_txn(
+            txn,
+            table="event_push_counts",
+            keyvalues={"user_id": user_id, "room_id": room_id},
+            values=expected,
+        )
+        # This is run on the background tasks worker, so the other workers need
+        # to be told about the new counts.
+        self._invalidate_cache_and_stream(
+            txn, self.get_unread_counts_for_room_for_user, (room_id, user_id)
+        )
+        return True
+
+    @wrap_as_background_process("reconcile_push_counts")
+    async def _reconcile_push_counts(self) -> None:
+        """Check a batch of the stored unread counts against the push actions
+        they were derived from, and repair any which have drifted.
+
+        Each batch picks up where the last one left off, so that over time all
+        the stored counts get checked. The position is stored along with the
+        repaired counts, so that it survives restarts.
+        """
+        if not await self._have_push_counts():
+            return
+
+        def _reconcile_push_counts_txn(txn: LoggingTransaction) -> Tuple[int, bool]:
+            """Returns the number of counts repaired, and whether we got to the
+            end of the table.
+            """
+            txn.execute(
+                "SELECT user_id, room_id FROM event_push_counts_reconcile_position"
+            )
+            row = txn.fetchone()
+            assert row is not None
+            last_user_id, last_room_id = row
+            txn.execute(
+                """
+                SELECT user_id, room_id FROM event_push_counts
+                WHERE user_id > ? OR (user_id = ? AND room_id > ?)
+                ORDER BY user_id, room_id
+                LIMIT ?
+                """,
+                (last_user_id, last_user_id, last_room_id, self._reconcile_batch_size),
+            )
+            rows = txn.fetchall()
+
+            finished = len(rows) < self._reconcile_batch_size
+            if finished:
+                # Start again from the beginning next time.
+                next_user_id, next_room_id = "", ""
+            else:
+                next_user_id, next_room_id = rows[-1]
+            txn.execute(
+                "UPDATE event_push_counts_reconcile_position SET user_id = ?, room_id = ?",
+                (next_user_id, next_room_id),
+            )
+
+            repaired = sum(
+                self._recompute_push_counts_txn(txn, user_id, room_id)
+                for user_id, room_id in rows
+            )
+            return repaired, finished
+
+        repaired = 0
+        for _ in range(self._reconcile_batches_per_run):
+            count, finished = await self.db_pool.runInteraction(
+                "reconcile_push_counts", _reconcile_push_counts_txn
+            )
+            repaired += count
+            if finished:
+                break
+
+        if repaired:
+            logger.info("Repaired %d drifted unread counts", repaired)
+
 
 class EventPushActionsStore(EventPushActionsWorkerStore):
     EPA_HIGHLIGHT_INDEX = "epa_highlight_index"
@@ -910,6 +1664,53 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
             where_clause="highlight=1",
         )
 
+        self.db_pool.updates.register_background_update_handler(
+            "event_push_counts_populate", self._background_populate_push_counts
+        )
+
+    async def _background_populate_push_counts(self, progress, batch_size):
+        """Fill in the unread counts of every local user in the rooms they are
+        joined to.
+        """
+        last_user_id = progress.get("last_user_id", "")
+        last_room_id = progress.get("last_room_id", "")
+
+        def _populate_push_counts_txn(txn):
+            txn.execute(
+                """
+                SELECT user_id, room_id FROM local_current_membership
+                WHERE membership = ?
+                    AND (user_id > ? OR (user_id = ? AND room_id > ?))
+                ORDER BY user_id, room_id
+                LIMIT ?
+                """,
+                (Membership.JOIN, last_user_id, last_user_id, last_room_id, batch_size),
+            )
+            rows = txn.fetchall()
+
+            for user_id, room_id in rows:
+                self._recompute_push_counts_txn(txn, user_id, room_id)
+
+            if rows:
+                self.db_pool.updates._background_update_progress_txn(
+                    txn,
+                    "event_push_counts_populate",
+                    {"last_user_id": rows[-1][0], "last_room_id": rows[-1][1]},
+                )
+
+            return len(rows)
+
+        count = await self.db_pool.runInteraction(
+            "populate_push_counts", _populate_push_counts_txn
+        )
+
+        if not count:
+            await self.db_pool.updates._end_background_update(
+                "event_push_counts_populate"
+            )
+
+        return count
+
     async def get_push_actions_for_user(
         self, user_id, before=None, limit=50, only_highlight=False
     ):
@@ -44,7 +44,7 @@ from synapse.storage.databases.main.search import SearchEntry
 from synapse.storage.types import Connection
 from synapse.storage.util.id_generators import MultiWriterIdGenerator
 from synapse.storage.util.sequence import SequenceGenerator
-from synapse.types import StateMap, get_domain_from_id
+from synapse.types import ImmutableStateMap, StateMap, get_domain_from_id
 from synapse.util import json_encoder
 from synapse.util.iterutils import batch_iter, sorted_topologically
 
@@ -204,7 +204,9 @@ class PersistEventsStore:
                 event_counter.labels(event.type, origin_type, origin_entity).inc()
 
             for room_id, new_state in current_state_for_room.items():
-                self.store.get_current_state_ids.prefill((room_id,), new_state)
+                self.store.get_current_state_ids.prefill(
+                    (room_id,), ImmutableStateMap.of(new_state)
+                )
 
             for room_id, latest_event_ids in new_forward_extremeties.items():
                 self.store.get_latest_event_ids_in_room.prefill(
@@ -970,6 +972,11 @@ class PersistEventsStore:
                     table="current_state_events",
                     keyvalues={"room_id": room_id},
                 )
+                self.db_pool.simple_delete_txn(
+                    txn,
+                    table="room_summaries",
+                    keyvalues={"room_id": room_id},
+                )
             else:
                 # We're still in the room, so we update the current state as normal.
 
@@ -1009,6 +1016,18 @@ class PersistEventsStore:
                         for etype, state_key in itertools.chain(to_delete, to_insert)
                     ),
                 )
+                # Note the memberships which are about to change, so that we can
+                # update the room's summary.
+                changed_member_ids = [
+                    state_key
+                    for etype, state_key in itertools.chain(to_delete, to_insert)
+                    if etype == EventTypes.Member
+                ]
+                if changed_member_ids:
+                    old_members = self.store._get_current_memberships_txn(
+                        txn, room_id, changed_member_ids
+                    )
+
                 # Now we actually update the current_state_events table
 
                 txn.execute_batch(
@@ -1034,6 +1053,14 @@ class PersistEventsStore:
                     ],
                 )
 
+                if changed_member_ids:
+                    new_members = self.store._get_current_memberships_txn(
+                        txn, room_id, changed_member_ids
+                    )
+                    self.store._update_room_summary_txn(
+                        txn, room_id, old_members, new_members
+                    )
+
             # We now update `local_current_membership`. We do this regardless
             # of whether we're still in the room or not to handle the case where
             # e.g. we just got banned (where we need to record that fact here).
@@ -1066,6 +1093,19 @@ class PersistEventsStore:
                     ],
                 )
 
+            if to_delete or to_insert:
+                # Users only have unread counts in the rooms they're joined to,
+                # so that they start again from nothing if they come back.
+                self.store._remove_push_counts_for_left_users_txn(
+                    txn,
+                    room_id,
+                    {
+                        state_key
+                        for etype, state_key in itertools.chain(to_delete, to_insert)
+                        if etype == EventTypes.Member and self.is_mine_id(state_key)
+                    },
+                )
+
             txn.call_after(
                 self.store._curr_state_delta_stream_cache.entity_has_changed,
                 room_id,
@@ -1896,16 +1936,32 @@ class PersistEventsStore:
                     column="event_id",
                     iterable=event_ids,
                     keyvalues={},
-                    retcols=("user_id",),
+                    retcols=("user_id", "notif", "highlight", "unread"),
                 )
 
-                user_ids = {row["user_id"] for row in rows}
+                counts_by_user = {}  # type: Dict[str, Tuple[int, int, int]]
+                for row in rows:
+                    notif, highlight, unread = counts_by_user.get(
+                        row["user_id"], (0, 0, 0)
+                    )
+                    counts_by_user[row["user_id"]] = (
+                        notif + (row["notif"] == 1),
+                        highlight + (row["highlight"] == 1),
+                        unread + (row["unread"] == 1),
+                    )
+                self.store._increment_push_counts_txn(txn, room_id, counts_by_user)
+
+                user_ids = set(counts_by_user)
 
                 for user_id in user_ids:
                     txn.call_after(
                         self.store.get_unread_event_push_actions_by_room_for_user.invalidate,
                         (room_id, user_id),
                     )
+                    txn.call_after(
+                        self.store.get_unread_counts_for_room_for_user.invalidate,
+                        (room_id, user_id),
+                    )
 
         # Now we delete the staging area for *all* events that were being
         # persisted.
@@ -1920,6 +1976,10 @@ class PersistEventsStore:
             self.store.get_unread_event_push_actions_by_room_for_user.invalidate,
             (room_id,),
         )
+        txn.call_after(
+            self.store.get_unread_counts_for_room_for_user.invalidate, (room_id,)
+        )
+        self.store._remove_push_counts_for_event_txn(txn, room_id, event_id)
         txn.execute(
             "DELETE FROM event_push_actions WHERE room_id = ? AND event_id = ?",
             (room_id, event_id),
@@ -381,8 +381,10 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
             "event_backward_extremities",
             "event_forward_extremities",
             "event_push_actions",
+            "event_push_counts",
             "event_search",
             "events",
+            "federation_inbound_events_staging",
             "group_rooms",
             "public_room_list_stream",
             "receipts_graph",
@@ -394,6 +396,7 @@ class PurgeEventsStore(StateGroupWorkerStore, CacheInvalidationWorkerStore):
             "room_stats_current",
             "room_stats_historical",
             "room_stats_earliest_token",
+            "room_summaries",
             "rooms",
             "stream_ordering_to_exterm",
             "users_in_public_rooms",
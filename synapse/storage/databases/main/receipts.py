@@ -467,6 +467,9 @@ class ReceiptsWorkerStore(SQLBaseStore):
         self._invalidate_get_users_with_receipts_in_room(room_id, receipt_type, user_id)
         self.get_receipts_for_room.invalidate((room_id, receipt_type))
 
+        if receipt_type == "m.read":
+            self.get_unread_counts_for_room_for_user.invalidate((room_id, user_id))
+
     def process_replication_rows(self, stream_name, instance_name, token, rows):
         if stream_name == ReceiptsStream.NAME:
             self._receipts_id_gen.advance(instance_name, token)
@@ -551,6 +554,9 @@ class ReceiptsWorkerStore(SQLBaseStore):
             self._remove_old_push_actions_before_txn(
                 txn, room_id=room_id, user_id=user_id, stream_ordering=stream_ordering
             )
+            self._reset_push_counts_txn(
+                txn, room_id=room_id, user_id=user_id, stream_ordering=stream_ordering
+            )
 
         return rx_ts
 
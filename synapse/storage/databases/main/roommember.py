@@ -37,7 +37,7 @@ from synapse.metrics.background_process_metrics import (
     wrap_as_background_process,
 )
 from synapse.storage._base import SQLBaseStore, db_to_json, make_in_list_sql_clause
-from synapse.storage.database import DatabasePool
+from synapse.storage.database import DatabasePool, LoggingTransaction
 from synapse.storage.databases.main.events_worker import EventsWorkerStore
 from synapse.storage.engines import Sqlite3Engine
 from synapse.storage.roommember import (
@@ -47,6 +47,7 @@ from synapse.storage.roommember import (
     RoomsForUser,
 )
 from synapse.types import PersistedEventPosition, StateMap, get_domain_from_id
+from synapse.util import json_encoder
 from synapse.util.async_helpers import Linearizer
 from synapse.util.caches import intern_string
 from synapse.util.caches.descriptors import _CacheContext, cached, cachedList
@@ -60,6 +61,38 @@ logger = logging.getLogger(__name__)
 
 _MEMBERSHIP_PROFILE_UPDATE_NAME = "room_membership_profile_update"
 _CURRENT_STATE_MEMBERSHIP_UPDATE_NAME = "current_state_events_membership"
+_ROOM_SUMMARIES_UPDATE_NAME = "room_summaries_populate"
+
+# The number of members we keep in a room summary: 5 heroes, plus 1 in case one
+# of them is the user asking.
+_ROOM_SUMMARY_MEMBERS = 6
+
+
+def _hero_sort_key(hero: Tuple[str, str, str]) -> Tuple[int, str]:
+    """The order in which members are picked as heroes: joined members first,
+    then invited members, then everyone else, each ordered (fairly arbitrarily)
+    by event ID.
+    """
+    _, membership, event_id = hero
+    if membership == Membership.JOIN:
+        return 1, event_id
+    if membership == Membership.INVITE:
+        return 2, event_id
+    return 3, event_id
+
+
+def _build_member_summaries(
+    counts: Dict[str, int], heroes: Iterable[Tuple[str, str, str]]
+) -> Dict[str, MemberSummary]:
+    """Build the result of `get_room_summary` from the number of members with
+    each membership and the heroes of the room.
+    """
+    res = {membership: MemberSummary([], count) for membership, count in counts.items()}
+    for user_id, membership, event_id in heroes:
+        # we will always have a summary for this membership type at this
+        # point given the summary currently contains the counts.
+        res[membership].members.append((user_id, event_id))
+    return res
 
 
 class RoomMemberWorkerStore(EventsWorkerStore):
@@ -80,6 +113,10 @@ class RoomMemberWorkerStore(EventsWorkerStore):
         self._check_safe_current_state_events_membership_updated_txn(txn)
         txn.close()
 
+        # Whether the room_summaries table has been fully populated; set by
+        # `_have_room_summaries`.
+        self._room_summaries_populated = False
+
         if (
             self.hs.config.run_background_tasks
             and self.hs.config.metrics_flags.known_servers
@@ -230,80 +267,219 @@ class RoomMemberWorkerStore(EventsWorkerStore):
         Returns:
             dict of membership states, pointing to a MemberSummary named tuple.
         """
+        if await self._have_room_summaries():
+            row = await self.db_pool.simple_select_one(
+                table="room_summaries",
+                keyvalues={"room_id": room_id},
+                retcols=("membership_counts", "heroes"),
+                allow_none=True,
+                desc="get_room_summary",
+            )
+            if row is None:
+                return {}
+
+            return _build_member_summaries(
+                db_to_json(row["membership_counts"]), db_to_json(row["heroes"])
+            )
 
         def _get_room_summary_txn(txn):
-            # first get counts.
             # We do this all in one transaction to keep the cache small.
-            # FIXME: get rid of this when we have room_stats
-
-            # If we can assume current_state_events.membership is up to date
-            # then we can avoid a join, which is a Very Good Thing given how
-            # frequently this function gets called.
-            if self._current_state_events_membership_up_to_date:
-                # Note, rejected events will have a null membership field, so
-                # we we manually filter them out.
-                sql = """
-                    SELECT count(*), membership FROM current_state_events
-                    WHERE type = 'm.room.member' AND room_id = ?
-                        AND membership IS NOT NULL
-                    GROUP BY membership
-                """
-            else:
-                sql = """
-                    SELECT count(*), m.membership FROM room_memberships as m
-                    INNER JOIN current_state_events as c
-                    ON m.event_id = c.event_id
-                    AND m.room_id = c.room_id
-                    AND m.user_id = c.state_key
-                    WHERE c.type = 'm.room.member' AND c.room_id = ?
-                    GROUP BY m.membership
-                """
+            return _build_member_summaries(
+                self._get_room_membership_counts_txn(txn, room_id),
+                self._get_room_heroes_txn(txn, room_id),
+            )
 
-            txn.execute(sql, (room_id,))
-            res = {}
-            for count, membership in txn:
-                summary = res.setdefault(membership, MemberSummary([], count))
+        return await self.db_pool.runInteraction(
+            "get_room_summary", _get_room_summary_txn
+        )
 
-            # we order by membership and then fairly arbitrarily by event_id so
-            # heroes are consistent
-            if self._current_state_events_membership_up_to_date:
-                # Note, rejected events will have a null membership field, so
-                # we we manually filter them out.
-                sql = """
-                    SELECT state_key, membership, event_id
-                    FROM current_state_events
-                    WHERE type = 'm.room.member' AND room_id = ?
-                        AND membership IS NOT NULL
-                    ORDER BY
-                        CASE membership WHEN ? THEN 1 WHEN ? THEN 2 ELSE 3 END ASC,
-                        event_id ASC
-                    LIMIT ?
-                """
-            else:
-                sql = """
-                    SELECT c.state_key, m.membership, c.event_id
-                    FROM room_memberships as m
-                    INNER JOIN current_state_events as c USING (room_id, event_id)
-                    WHERE c.type = 'm.room.member' AND c.room_id = ?
-                    ORDER BY
-                        CASE m.membership WHEN ? THEN 1 WHEN ? THEN 2 ELSE 3 END ASC,
-                        c.event_id ASC
-                    LIMIT ?
-                """
+    async def _have_room_summaries(self) -> bool:
+        """Whether the `room_summaries` table has been populated, and so can be
+        read from instead of counting the room's members.
+        """
+        if not self._room_summaries_populated:
+            self._room_summaries_populated = (
+                await self.db_pool.updates.has_completed_background_update(
+                    _ROOM_SUMMARIES_UPDATE_NAME
+                )
+            )
+        return self._room_summaries_populated
 
-            # 6 is 5 (number of heroes) plus 1, in case one of them is the calling user.
-            txn.execute(sql, (room_id, Membership.JOIN, Membership.INVITE, 6))
-            for user_id, membership, event_id in txn:
-                summary = res[membership]
-                # we will always have a summary for this membership type at this
-                # point given the summary currently contains the counts.
-                members = summary.members
-                members.append((user_id, event_id))
+    def _get_room_membership_counts_txn(
+        self, txn: LoggingTransaction, room_id: str
+    ) -> Dict[str, int]:
+        """Count the members of a room in its current state, by membership."""
+        # If we can assume current_state_events.membership is up to date
+        # then we can avoid a join, which is a Very Good Thing given how
+        # frequently this function gets called.
+        if self._current_state_events_membership_up_to_date:
+            # Note, rejected events will have a null membership field, so
+            # we we manually filter them out.
+            sql = """
+                SELECT count(*), membership FROM current_state_events
+                WHERE type = 'm.room.member' AND room_id = ?
+                    AND membership IS NOT NULL
+                GROUP BY membership
+            """
+        else:
+            sql = """
+                SELECT count(*), m.membership FROM room_memberships as m
+                INNER JOIN current_state_events as c
+                ON m.event_id = c.event_id
+                AND m.room_id = c.room_id
+                AND m.user_id = c.state_key
+                WHERE c.type = 'm.room.member' AND c.room_id = ?
+                GROUP BY m.membership
+            """
 
-            return res
+        txn.execute(sql, (room_id,))
+        return {membership: count for count, membership in txn}
 
-        return await self.db_pool.runInteraction(
-            "get_room_summary", _get_room_summary_txn
+    def _get_room_heroes_txn(
+        self, txn: LoggingTransaction, room_id: str
+    ) -> List[Tuple[str, str, str]]:
+        """Get the members of a room to use as heroes in its summary.
+
+        Returns:
+            Up to _ROOM_SUMMARY_MEMBERS (user_id, membership, event_id) tuples,
+            in the order given by `_hero_sort_key`.
+        """
+        # we order by membership and then fairly arbitrarily by event_id so
+        # heroes are consistent
+        if self._current_state_events_membership_up_to_date:
+            # Note, rejected events will have a null membership field, so
+            # we we manually filter them out.
+            sql = """
+                SELECT state_key, membership, event_id
+                FROM current_state_events
+                WHERE type = 'm.room.member' AND room_id = ?
+                    AND membership IS NOT NULL
+                ORDER BY
+                    CASE membership WHEN ? THEN 1 WHEN ? THEN 2 ELSE 3 END ASC,
+                    event_id ASC
+                LIMIT ?
+            """
+        else:
+            sql = """
+                SELECT c.state_key, m.membership, c.event_id
+                FROM room_memberships as m
+                INNER JOIN current_state_events as c USING (room_id, event_id)
+                WHERE c.type = 'm.room.member' AND c.room_id = ?
+                ORDER BY
+                    CASE m.membership WHEN ? THEN 1 WHEN ? THEN 2 ELSE 3 END ASC,
+                    c.event_id ASC
+                LIMIT ?
+            """
+
+        txn.execute(
+            sql, (room_id, Membership.JOIN, Membership.INVITE, _ROOM_SUMMARY_MEMBERS)
+        )
+        return [
+            (user_id, membership, event_id) for user_id, membership, event_id in txn
+        ]
+
+    def _get_current_memberships_txn(
+        self, txn: LoggingTransaction, room_id: str, user_ids: Collection[str]
+    ) -> Dict[str, Tuple[Optional[str], str]]:
+        """Get the current membership of the given users in a room.
+
+        Returns:
+            A map from user ID to a tuple of their membership (None if the
+            membership event was rejected) and the membership event ID, for
+            the users who have a membership event in the room's current state.
+        """
+        clause, args = make_in_list_sql_clause(
+            self.database_engine, "c.state_key", user_ids
+        )
+        sql = """
+            SELECT c.state_key, m.membership, c.event_id
+            FROM current_state_events AS c
+            LEFT JOIN room_memberships AS m USING (event_id)
+            WHERE c.room_id = ? AND c.type = ? AND %s
+        """ % (
+            clause,
+        )
+        txn.execute(sql, (room_id, EventTypes.Member, *args))
+        return {
+            user_id: (membership, event_id) for user_id, membership, event_id in txn
+        }
+
+    def _update_room_summary_txn(
+        self,
+        txn: LoggingTransaction,
+        room_id: str,
+        old_members: Dict[str, Tuple[Optional[str], str]],
+        new_members: Dict[str, Tuple[Optional[str], str]],
+    ) -> None:
+        """Update the stored summary of a room after a change to its current
+        state. Must be called after `current_state_events` has been updated.
+
+        Args:
+            txn: The transaction
+            room_id: The room whose current state has changed.
+            old_members: The previous memberships of the members whose membership
+                events have changed, as returned by `_get_current_memberships_txn`.
+            new_members: The new memberships of those members.
+        """
+        row = self.db_pool.simple_select_one_txn(
+            txn,
+            table="room_summaries",
+            keyvalues={"room_id": room_id},
+            retcols=("membership_counts", "heroes"),
+            allow_none=True,
+        )
+
+        if row is None:
+            # We haven't got a summary for this room yet, so we work it out from
+            # scratch.
+            counts = self._get_room_membership_counts_txn(txn, room_id)
+            heroes = self._get_room_heroes_txn(txn, room_id)
+        else:
+            counts = db_to_json(row["membership_counts"])
+            for membership, _ in old_members.values():
+                if membership is not None:
+                    counts[membership] = counts.get(membership, 0) - 1
+            for membership, _ in new_members.values():
+                if membership is not None:
+                    counts[membership] = counts.get(membership, 0) + 1
+            counts = {
+                membership: count for membership, count in counts.items() if count > 0
+            }
+
+            heroes = [(u, m, e) for u, m, e in db_to_json(row["heroes"])]
+            remaining_heroes = [
+                hero
+                for hero in heroes
+                if hero[0] not in old_members and hero[0] not in new_members
+            ]
+            if len(heroes) == _ROOM_SUMMARY_MEMBERS and len(remaining_heroes) < len(
+                heroes
+            ):
+                # One of the heroes has changed, so one of the members we haven't
+                # got to hand may need to take their place.
+                heroes = self._get_room_heroes_txn(txn, room_id)
+            else:
+                # Otherwise the heroes are either all the members of the room,
+                # or the first of them, and so can only be displaced by one of
+                # the new memberships.
+                heroes = sorted(
+                    remaining_heroes
+                    + [
+                        (user_id, membership, event_id)
+                        for user_id, (membership, event_id) in new_members.items()
+                        if membership is not None
+                    ],
+                    key=_hero_sort_key,
+                )[:_ROOM_SUMMARY_MEMBERS]
+
+        self.db_pool.simple_upsert_txn(
+            txn,
+            table="room_summaries",
+            keyvalues={"room_id": room_id},
+            values={
+                "membership_counts": json_encoder.encode(counts),
+                "heroes": json_encoder.encode(heroes),
+            },
         )
 
     @cached()
@@ -1112,6 +1288,62 @@ class RoomMemberStore(RoomMemberWorkerStore, RoomMemberBackgroundUpdateStore):
     def __init__(self, database: DatabasePool, db_conn, hs):
         super().__init__(database, db_conn, hs)
 
+        self.db_pool.updates.register_background_update_handler(
+            _ROOM_SUMMARIES_UPDATE_NAME, self._background_populate_room_summaries
+        )
+
+    async def _background_populate_room_summaries(self, progress, batch_size):
+        """Work out the summary of every room we have current state for.
+
+        This works by iterating over all rooms in alphabetical order.
+        """
+        last_room_id = progress.get("last_room_id", "")
+
+        def _populate_room_summaries_txn(txn):
+            txn.execute(
+                """
+                SELECT DISTINCT room_id FROM current_state_events
+                WHERE room_id > ? AND type = ?
+                ORDER BY room_id
+                LIMIT ?
+                """,
+                (last_room_id, EventTypes.Member, batch_size),
+            )
+            room_ids = [room_id for room_id, in txn]
+
+            for room_id in room_ids:
+                self.db_pool.simple_upsert_txn(
+                    txn,
+                    table="room_summaries",
+                    keyvalues={"room_id": room_id},
+                    values={
+                        "membership_counts": json_encoder.encode(
+                            self._get_room_membership_counts_txn(txn, room_id)
+                        ),
+                        "heroes": json_encoder.encode(
+                            self._get_room_heroes_txn(txn, room_id)
+                        ),
+                    },
+                )
+
+            if room_ids:
+                self.db_pool.updates._background_update_progress_txn(
+                    txn, _ROOM_SUMMARIES_UPDATE_NAME, {"last_room_id": room_ids[-1]}
+                )
+
+            return len(room_ids)
+
+        count = await self.db_pool.runInteraction(
+            _ROOM_SUMMARIES_UPDATE_NAME, _populate_room_summaries_txn
+        )
+
+        if not count:
+            await self.db_pool.updates._end_background_update(
+                _ROOM_SUMMARIES_UPDATE_NAME
+            )
+
+        return count
+
     async def forget(self, user_id: str, room_id: str) -> None:
         """Indicate that user_id wishes to discard history for room_id."""
 
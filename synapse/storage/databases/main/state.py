@@ -26,7 +26,7 @@ from synapse.storage.database import DatabasePool
 from synapse.storage.databases.main.events_worker import EventsWorkerStore
 from synapse.storage.databases.main.roommember import RoomMemberWorkerStore
 from synapse.storage.state import StateFilter
-from synapse.types import StateMap
+from synapse.types import ImmutableStateMap, StateMap
 from synapse.util.caches import intern_string
 from synapse.util.caches.descriptors import cached, cachedList
 
@@ -181,7 +181,9 @@ class StateGroupWorkerStore(EventsWorkerStore, SQLBaseStore):
                 (room_id,),
             )
 
-            return {(intern_string(r[0]), intern_string(r[1])): r[2] for r in txn}
+            return ImmutableStateMap(
+                {(intern_string(r[0]), intern_string(r[1])): r[2] for r in txn}
+            )
 
         return await self.db_pool.runInteraction(
             "get_current_state_ids", _get_current_state_ids_txn
@@ -37,13 +37,10 @@ what sort order was used:
 import abc
 import logging
 from collections import namedtuple
-from typing import TYPE_CHECKING, Collection, Dict, List, Optional, Set, Tuple
-
-from twisted.internet import defer
+from typing import TYPE_CHECKING, Any, Collection, Dict, List, Optional, Set, Tuple
 
 from synapse.api.filtering import Filter
 from synapse.events import EventBase
-from synapse.logging.context import make_deferred_yieldable, run_in_background
 from synapse.storage._base import SQLBaseStore
 from synapse.storage.database import (
     DatabasePool,
@@ -56,6 +53,7 @@ from synapse.storage.util.id_generators import MultiWriterIdGenerator
 from synapse.types import PersistedEventPosition, RoomStreamToken
 from synapse.util.caches.descriptors import cached
 from synapse.util.caches.stream_change_cache import StreamChangeCache
+from synapse.util.iterutils import batch_iter
 
 if TYPE_CHECKING:
     from synapse.server import HomeServer
@@ -258,7 +256,17 @@ def _filter_results(
     return True
 
 
-def filter_to_clause(event_filter: Optional[Filter]) -> Tuple[str, List[str]]:
+def filter_to_clause(
+    event_filter: Optional[Filter], include_labels: bool = True
+) -> Tuple[str, List[str]]:
+    """Converts a filter into an SQL clause on the events table.
+
+    Args:
+        event_filter: The filter to convert.
+        include_labels: Whether to include the "labels" clause, which needs the
+            query to join against `event_labels`. If False, callers must apply
+            any label filtering themselves.
+    """
     # NB: This may create SQL clauses that don't optimise well (and we don't
     # have indices on all possible clauses). E.g. it may create
     # "room_id == X AND room_id != X", which postgres doesn't optimise.
@@ -270,12 +278,17 @@ def filter_to_clause(event_filter: Optional[Filter]) -> Tuple[str, List[str]]:
     args = []
 
     if event_filter.types:
-        clauses.append("(%s)" % " OR ".join("type = ?" for _ in event_filter.types))
-        args.extend(event_filter.types)
+        type_clauses = []
+        for typ in event_filter.types:
+            type_clause, type_arg = _type_to_clause(typ)
+            type_clauses.append(type_clause)
+            args.append(type_arg)
+        clauses.append("(%s)" % " OR ".join(type_clauses))
 
     for typ in event_filter.not_types:
-        clauses.append("type != ?")
-        args.append(typ)
+        type_clause, type_arg = _type_to_clause(typ)
+        clauses.append("NOT %s" % (type_clause,))
+        args.append(type_arg)
 
     if event_filter.senders:
         clauses.append("(%s)" % " OR ".join("sender = ?" for _ in event_filter.senders))
@@ -301,13 +314,25 @@ def filter_to_clause(event_filter: Optional[Filter]) -> Tuple[str, List[str]]:
     # "not_labels" filter via a SQL query is non-trivial. Instead, we let
     # event_filter.check_fields apply it, which is not as efficient but makes the
     # implementation simpler.
-    if event_filter.labels:
+    if include_labels and event_filter.labels:
         clauses.append("(%s)" % " OR ".join("label = ?" for _ in event_filter.labels))
         args.extend(event_filter.labels)
 
     return " AND ".join(clauses), args
 
 
+def _type_to_clause(event_type: str) -> Tuple[str, str]:
+    """Converts an event type from a filter, which may end in a "*" wildcard,
+    into an SQL clause matching it.
+    """
+    if event_type.endswith("*"):
+        # We compare the prefix directly rather than using LIKE, as LIKE is
+        # case insensitive on SQLite.
+        prefix = event_type[:-1]
+        return "substr(type, 1, %d) = ?" % (len(prefix),), prefix
+    return "type = ?", event_type
+
+
 class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
     """This is an abstract base class where subclasses must implement
     `get_room_max_stream_ordering` and `get_room_min_stream_ordering`
@@ -388,19 +413,26 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
         to_key: RoomStreamToken,
         limit: int = 0,
         order: str = "DESC",
+        event_filter: Optional[Filter] = None,
     ) -> Dict[str, Tuple[List[EventBase], RoomStreamToken]]:
         """Get new room events in stream ordering since `from_key`.
 
+        The events for all the rooms are fetched with a single query per batch
+        of rooms, rather than a query per room.
+
         Args:
             room_ids
             from_key: Token from which no events are returned before
             to_key: Token from which no events are returned after. (This
                 is typically the current stream token)
-            limit: Maximum number of events to return
+            limit: Maximum number of events to return per room
             order: Either "DESC" or "ASC". Determines which events are
                 returned when the result is limited. If "DESC" then the most
                 recent `limit` events are returned, otherwise returns the
                 oldest `limit` events.
+            event_filter: If provided, only events matching the filter's
+                type, sender, room and URL clauses are returned (and count
+                towards the limit). Label filtering is left to the caller.
 
         Returns:
             A map from room id to a tuple containing:
@@ -414,29 +446,234 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
         if not room_ids:
             return {}
 
+        if from_key == to_key:
+            return {room_id: ([], from_key) for room_id in room_ids}
+
+        rows_by_room = await self.db_pool.runInteraction(
+            "get_room_events_stream_for_rooms",
+            self._get_room_events_stream_for_rooms_txn,
+            room_ids,
+            from_key,
+            to_key,
+            limit,
+            order,
+            event_filter,
+        )
+
+        event_map = await self.get_events(
+            [r.event_id for rows in rows_by_room.values() for r in rows],
+            get_prev_content=True,
+        )
+
         results = {}
-        room_ids = list(room_ids)
-        for rm_ids in (room_ids[i : i + 20] for i in range(0, len(room_ids), 20)):
-            res = await make_deferred_yieldable(
-                defer.gatherResults(
-                    [
-                        run_in_background(
-                            self.get_room_events_stream_for_room,
-                            room_id,
-                            from_key,
-                            to_key,
-                            limit,
-                            order=order,
-                        )
-                        for room_id in rm_ids
-                    ],
-                    consumeErrors=True,
-                )
-            )
-            results.update(dict(zip(rm_ids, res)))
+        for room_id in room_ids:
+            rows = [r for r in rows_by_room.get(room_id, []) if r.event_id in event_map]
+            events = [event_map[r.event_id] for r in rows]
+
+            self._set_before_and_after(events, rows, topo_order=False)
+
+            if order.lower() == "desc":
+                events.reverse()
+
+            if rows:
+                key = RoomStreamToken(None, min(r.stream_ordering for r in rows))
+            else:
+                # Assume we didn't get anything because there was nothing to
+                # get.
+                key = from_key
+
+            results[room_id] = (events, key)
 
         return results
 
+    def _get_room_events_stream_for_rooms_txn(
+        self,
+        txn: LoggingTransaction,
+        room_ids: Collection[str],
+        from_key: RoomStreamToken,
+        to_key: RoomStreamToken,
+        limit: int,
+        order: str,
+        event_filter: Optional[Filter],
+    ) -> Dict[str, List[_EventDictReturn]]:
+        # To handle tokens with a non-empty instance_map we fetch more
+        # results than necessary and then filter down
+        min_from_id = from_key.stream
+        max_to_id = to_key.get_max_stream_pos()
+
+        filter_clause, filter_args = filter_to_clause(
+            event_filter, include_labels=False
+        )
+        if filter_clause:
+            filter_clause = "AND " + filter_clause
+
+        # The queries to run, along with their arguments.
+        batches = []  # type: List[Tuple[str, List[Any]]]
+        if isinstance(self.database_engine, PostgresEngine):
+            # A LATERAL join lets postgres walk the (room_id, stream_ordering)
+            # index backwards for each room, stopping after `limit` rows.
+            sql = """
+                SELECT r.room_id, e.event_id, e.instance_name,
+                    e.topological_ordering, e.stream_ordering
+                FROM unnest(?::text[]) AS r(room_id),
+                LATERAL (
+                    SELECT event_id, instance_name, topological_ordering,
+                        stream_ordering
+                    FROM events
+                    WHERE events.room_id = r.room_id
+                        AND not outlier
+                        AND stream_ordering > ? AND stream_ordering <= ?
+                        %(filter_clause)s
+                    ORDER BY stream_ordering %(order)s LIMIT ?
+                ) AS e
+            """ % {
+                "filter_clause": filter_clause,
+                "order": order,
+            }
+            args = [list(room_ids), min_from_id, max_to_id]  # type: List[Any]
+            args.extend(filter_args)
+            args.append(2 * limit)
+            batches.append((sql, args))
+        elif self.database_engine.module.sqlite_version_info >= (3, 25, 0):
+            # Window functions let us do the per-room limit in one query.
+            for batch in batch_iter(room_ids, 100):
+                clause, args = make_in_list_sql_clause(
+                    self.database_engine, "room_id", batch
+                )
+                sql = """
+                    SELECT room_id, event_id, instance_name,
+                        topological_ordering, stream_ordering
+                    FROM (
+                        SELECT room_id, event_id, instance_name,
+                            topological_ordering, stream_ordering,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY room_id
+                                ORDER BY stream_ordering %(order)s
+                            ) AS row_num
+                        FROM events
+                        WHERE %(clause)s
+                            AND not outlier
+                            AND stream_ordering > ? AND stream_ordering <= ?
+                            %(filter_clause)s
+                    ) AS e
+                    WHERE row_num <= ?
+                """ % {
+                    "clause": clause,
+                    "filter_clause": filter_clause,
+                    "order": order,
+                }
+                args.extend([min_from_id, max_to_id])
+                args.extend(filter_args)
+                args.append(2 * limit)
+                batches.append((sql, args))
+        else:
+            # Older versions of SQLite don't have window functions, so we fall
+            # back to a query per room (albeit in the one transaction).
+            sql = """
+                SELECT room_id, event_id, instance_name,
+                    topological_ordering, stream_ordering
+                FROM events
+                WHERE room_id = ?
+                    AND not outlier
+                    AND stream_ordering > ? AND stream_ordering <= ?
+                    %(filter_clause)s
+                ORDER BY stream_ordering %(order)s LIMIT ?
+            """ % {
+                "filter_clause": filter_clause,
+                "order": order,
+            }
+            for room_id in room_ids:
+                args = [room_id, min_from_id, max_to_id]
+                args.extend(filter_args)
+                args.append(2 * limit)
+                batches.append((sql, args))
+
+        rows_by_room = {}  # type: Dict[str, List[_EventDictReturn]]
+        for sql, args in batches:
+            txn.execute(sql, args)
+            for (
+                room_id,
+                event_id,
+                instance_name,
+                topological_ordering,
+                stream_ordering,
+            ) in txn:
+                if _filter_results(
+                    from_key,
+                    to_key,
+                    instance_name,
+                    topological_ordering,
+                    stream_ordering,
+                ):
+                    rows_by_room.setdefault(room_id, []).append(
+                        _EventDictReturn(event_id, None, stream_ordering)
+                    )
+
+        reverse = order.lower() == "desc"
+        for rows in rows_by_room.values():
+            rows.sort(key=lambda r: r.stream_ordering, reverse=reverse)
+            del rows[limit:]
+
+        return rows_by_room
+
+    async def get_last_event_stream_orderings_for_rooms(
+        self, room_ids: Collection[str], to_key: RoomStreamToken
+    ) -> Dict[str, int]:
+        """Get the stream ordering of the most recent event in each of the given
+        rooms, up to `to_key`.
+
+        Args:
+            room_ids
+            to_key: Token from which no events are considered after.
+
+        Returns:
+            A map from room ID to stream ordering. Rooms without any events
+            before `to_key` are omitted.
+        """
+
+        max_to_id = to_key.get_max_stream_pos()
+
+        def _get_last_event_stream_orderings_for_rooms_txn(txn):
+            # We look up the latest event in each room by walking the
+            # (room_id, stream_ordering) index backwards, rather than using
+            # MAX(), which would read every event in the rooms to skip the
+            # outliers.
+            if isinstance(self.database_engine, PostgresEngine):
+                sql = """
+                    SELECT r.room_id, e.stream_ordering
+                    FROM unnest(?::text[]) AS r(room_id),
+                    LATERAL (
+                        SELECT stream_ordering FROM events
+                        WHERE events.room_id = r.room_id
+                            AND NOT outlier
+                            AND stream_ordering <= ?
+                        ORDER BY stream_ordering DESC LIMIT 1
+                    ) AS e
+                """
+                txn.execute(sql, (list(room_ids), max_to_id))
+                return dict(txn)
+
+            results = {}
+            sql = """
+                SELECT stream_ordering FROM events
+                WHERE room_id = ? AND NOT outlier AND stream_ordering <= ?
+                ORDER BY stream_ordering DESC LIMIT 1
+            """
+            for room_id in room_ids:
+                txn.execute(sql, (room_id, max_to_id))
+                row = txn.fetchone()
+                if row:
+                    results[room_id] = row[0]
+            return results
+
+        if not room_ids:
+            return {}
+
+        return await self.db_pool.runInteraction(
+            "get_last_event_stream_orderings_for_rooms",
+            _get_last_event_stream_orderings_for_rooms_txn,
+        )
+
     def get_rooms_that_changed(
         self, room_ids: Collection[str], from_key: RoomStreamToken
     ) -> Set[str]:
@@ -457,6 +694,7 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
         to_key: RoomStreamToken,
         limit: int = 0,
         order: str = "DESC",
+        event_filter: Optional[Filter] = None,
     ) -> Tuple[List[EventBase], RoomStreamToken]:
         """Get new room events in stream ordering since `from_key`.
 
@@ -470,6 +708,9 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
                 returned when the result is limited. If "DESC" then the most
                 recent `limit` events are returned, otherwise returns the
                 oldest `limit` events.
+            event_filter: If provided, only events matching the filter's
+                type, sender, room and URL clauses are returned. Label
+                filtering is left to the caller.
 
         Returns:
             The list of events (in ascending order) and the token from the start
@@ -491,6 +732,12 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
             min_from_id = from_key.stream
             max_to_id = to_key.get_max_stream_pos()
 
+            filter_clause, filter_args = filter_to_clause(
+                event_filter, include_labels=False
+            )
+            if filter_clause:
+                filter_clause = "AND " + filter_clause
+
             sql = """
                 SELECT event_id, instance_name, topological_ordering, stream_ordering
                 FROM events
@@ -498,11 +745,16 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore, metaclass=abc.ABCMeta):
                     room_id = ?
                     AND not outlier
                     AND stream_ordering > ? AND stream_ordering <= ?
+                    %s
                 ORDER BY stream_ordering %s LIMIT ?
             """ % (
+                filter_clause,
                 order,
             )
-            txn.execute(sql, (room_id, min_from_id, max_to_id, 2 * limit))
+            args = [room_id, min_from_id, max_to_id]  # type: List[Any]
+            args.extend(filter_args)
+            args.append(2 * limit)
+            txn.execute(sql, args)
 
             rows = [
                 _EventDictReturn(event_id, None, stream_ordering)
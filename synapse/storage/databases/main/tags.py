@@ -26,7 +26,6 @@ logger = logging.getLogger(__name__)
 
 
 class TagsWorkerStore(AccountDataWorkerStore):
-    @cached()
     async def get_tags_for_user(self, user_id: str) -> Dict[str, Dict[str, JsonDict]]:
         """Get all the tags for a user.
 
@@ -37,6 +36,44 @@ class TagsWorkerStore(AccountDataWorkerStore):
             A mapping from room_id strings to dicts mapping from tag strings to
             tag content.
         """
+        stream_id, tags_by_room = await self._get_versioned_tags_for_user(user_id)
+
+        if not self._account_data_stream_cache.has_entity_changed(user_id, stream_id):
+            return tags_by_room
+
+        # Bring the cached copy up to date by replacing the tags of the rooms
+        # which have changed since it was loaded.
+        current_id = self.get_max_account_data_stream_id()
+        changed_tags_by_room = await self.db_pool.runInteraction(
+            "get_tags_for_user_changes",
+            self._get_updated_tags_txn,
+            user_id,
+            stream_id,
+        )
+
+        tags_by_room = {
+            room_id: tags
+            for room_id, tags in {**tags_by_room, **changed_tags_by_room}.items()
+            if tags
+        }
+
+        self._get_versioned_tags_for_user.prefill(
+            (user_id,), (current_id, tags_by_room)
+        )
+
+        return tags_by_room
+
+    @cached()
+    async def _get_versioned_tags_for_user(
+        self, user_id: str
+    ) -> Tuple[int, Dict[str, Dict[str, JsonDict]]]:
+        """Load all the tags for a user, along with the position in the account
+        data stream they are up to date with.
+
+        Like `_get_versioned_account_data_for_user`, this cache isn't
+        invalidated when the tags change.
+        """
+        stream_id = self.get_max_account_data_stream_id()
 
         rows = await self.db_pool.simple_select_list(
             "room_tags", {"user_id": user_id}, ["room_id", "tag", "content"]
@@ -46,7 +83,7 @@ class TagsWorkerStore(AccountDataWorkerStore):
         for row in rows:
             room_tags = tags_by_room.setdefault(row["room_id"], {})
             room_tags[row["tag"]] = db_to_json(row["content"])
-        return tags_by_room
+        return stream_id, tags_by_room
 
     async def get_all_updated_tags(
         self, instance_name: str, last_id: int, current_id: int, limit: int
@@ -135,31 +172,35 @@ class TagsWorkerStore(AccountDataWorkerStore):
             rooms that changed since the stream_id token.
         """
 
-        def get_updated_tags_txn(txn):
-            sql = (
-                "SELECT room_id from room_tags_revisions"
-                " WHERE user_id = ? AND stream_id > ?"
-            )
-            txn.execute(sql, (user_id, stream_id))
-            room_ids = [row[0] for row in txn]
-            return room_ids
-
         changed = self._account_data_stream_cache.has_entity_changed(
             user_id, int(stream_id)
         )
         if not changed:
             return {}
 
-        room_ids = await self.db_pool.runInteraction(
-            "get_updated_tags", get_updated_tags_txn
+        return await self.db_pool.runInteraction(
+            "get_updated_tags", self._get_updated_tags_txn, user_id, stream_id
         )
 
-        results = {}
-        if room_ids:
-            tags_by_room = await self.get_tags_for_user(user_id)
-            for room_id in room_ids:
-                results[room_id] = tags_by_room.get(room_id, {})
+    def _get_updated_tags_txn(
+        self, txn, user_id: str, stream_id: int
+    ) -> Dict[str, Dict[str, JsonDict]]:
+        """Get the tags of the rooms whose tags have changed since the given
+        stream position. Rooms which no longer have any tags map to an empty
+        dict.
+        """
+        sql = (
+            "SELECT r.room_id, t.tag, t.content FROM room_tags_revisions AS r"
+            " LEFT JOIN room_tags AS t USING (user_id, room_id)"
+            " WHERE r.user_id = ? AND r.stream_id > ?"
+        )
+        txn.execute(sql, (user_id, stream_id))
 
+        results = {}  # type: Dict[str, Dict[str, JsonDict]]
+        for room_id, tag, content in txn:
+            room_tags = results.setdefault(room_id, {})
+            if tag is not None:
+                room_tags[tag] = db_to_json(content)
         return results
 
     async def get_tags_for_room(
@@ -212,8 +253,6 @@ class TagsWorkerStore(AccountDataWorkerStore):
         async with self._account_data_id_gen.get_next() as next_id:
             await self.db_pool.runInteraction("add_tag", add_tag_txn, next_id)
 
-        self.get_tags_for_user.invalidate((user_id,))
-
         return self._account_data_id_gen.get_current_token()
 
     async def remove_tag_from_room(self, user_id: str, room_id: str, tag: str) -> int:
@@ -235,8 +274,6 @@ class TagsWorkerStore(AccountDataWorkerStore):
         async with self._account_data_id_gen.get_next() as next_id:
             await self.db_pool.runInteraction("remove_tag", remove_tag_txn, next_id)
 
-        self.get_tags_for_user.invalidate((user_id,))
-
         return self._account_data_id_gen.get_current_token()
 
     def _update_revision_txn(
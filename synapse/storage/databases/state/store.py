@@ -12,18 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import logging
 from collections import namedtuple
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+from typing import Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+import attr
 
 from synapse.api.constants import EventTypes
-from synapse.storage._base import SQLBaseStore
+from synapse.metrics.background_process_metrics import wrap_as_background_process
+from synapse.storage._base import SQLBaseStore, db_to_json
 from synapse.storage.database import DatabasePool
 from synapse.storage.databases.state.bg_updates import StateBackgroundUpdateStore
+from synapse.storage.engines import PostgresEngine
 from synapse.storage.state import StateFilter
 from synapse.storage.types import Cursor
 from synapse.storage.util.sequence import build_sequence_generator
 from synapse.types import MutableStateMap, StateMap
+from synapse.util import json_encoder
 from synapse.util.caches.descriptors import cached
 from synapse.util.caches.dictionary_cache import DictionaryCache
 
@@ -32,6 +38,14 @@ logger = logging.getLogger(__name__)
 
 MAX_STATE_DELTA_HOPS = 100
 
+# The maximum lengths of the delta chains at each level of the structure built
+# by the state compressor. The longest possible chain is the sum of these, and a
+# full copy of the state is stored once every product of these state groups.
+STATE_COMPRESSOR_LEVELS = (50, 25, 25)
+
+# The number of state groups the state compressor rewrites per transaction.
+STATE_COMPRESSOR_BATCH_SIZE = 50
+
 
 class _GetStateGroupDelta(
     namedtuple("_GetStateGroupDelta", ("prev_group", "delta_ids"))
@@ -46,6 +60,68 @@ class _GetStateGroupDelta(
         return len(self.delta_ids) if self.delta_ids else 0
 
 
+def _state_group_resolution_key(room_version: str, state_groups: Iterable[int]) -> str:
+    """Build the key used in `state_group_resolutions` for the result of
+    resolving the given state groups.
+
+    We hash the key, as the list of state groups can be arbitrarily long.
+    """
+    key = "%s|%s" % (room_version, ",".join(str(sg) for sg in sorted(state_groups)))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+@attr.s(slots=True)
+class _CompressorLevel:
+    """One level of the structure built by the state compressor: a chain of at
+    most `max_length` deltas, whose latest state group is `head`.
+    """
+
+    max_length = attr.ib(type=int)
+    current_length = attr.ib(type=int, default=0)
+    head = attr.ib(type=Optional[int], default=None)
+
+    def has_space(self) -> bool:
+        return self.current_length < self.max_length
+
+    def update(self, new_head: int, delta: bool) -> None:
+        """Make `new_head` the head of this level, either by extending the
+        current chain (if `delta`) or by starting a new one.
+        """
+        self.head = new_head
+        if delta:
+            self.current_length += 1
+        else:
+            self.current_length = 1
+
+
+def _get_compressed_prev_group(
+    levels: List[_CompressorLevel], state_group: int
+) -> Optional[int]:
+    """Pick the state group that `state_group` should be stored as a delta
+    against in the compressed structure, and add it to the structure.
+
+    Each level is a chain of deltas against the previous group in the chain.
+    When the chain at one level is full a new chain is started, whose first group
+    is stored as a delta against the head of the next level up. If every level
+    is full then the group is stored in full.
+
+    A group which is stored in full starts a chain at every level, so that the
+    next level up always has a head to delta against.
+
+    Returns:
+        The new previous group, or None if the group should be stored in full.
+    """
+    for level in levels:
+        if level.has_space() and level.head is not None:
+            prev_group = level.head
+            level.update(state_group, True)
+            return prev_group
+
+        level.update(state_group, False)
+
+    return None
+
+
 class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
     """A data store for fetching/storing state groups."""
 
@@ -104,6 +180,12 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             id_column="id",
         )
 
+        # whether the state compressor is currently running
+        self._compressing_state_groups = False
+
+        if hs.config.run_background_tasks:
+            self._clock.looping_call(self._compress_pending_rooms, 60 * 1000)
+
     @cached(max_entries=10000, iterable=True)
     async def get_state_group_delta(self, state_group):
         """Given a state group try to return a previous group and a delta between
@@ -141,6 +223,100 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             "get_state_group_delta", _get_state_group_delta_txn
         )
 
+    async def get_state_keys_changed_between_groups(
+        self, from_group: int, to_groups: Collection[int]
+    ) -> Optional[Set[Tuple[str, str]]]:
+        """Work out which state keys may differ between a state group and each
+        of the given state groups, by walking their delta chains back to a
+        common ancestor.
+
+        Args:
+            from_group: The state group to compare against.
+            to_groups: The state groups to compare with `from_group`.
+
+        Returns:
+            The (type, state_key) pairs whose values may differ between
+            `from_group` and any of `to_groups`, or None if some group doesn't
+            share an ancestor with `from_group` within MAX_STATE_DELTA_HOPS.
+        """
+
+        def _get_state_keys_changed_between_groups_txn(txn):
+            from_chain = self._get_state_group_chain_txn(txn, from_group)
+            from_positions = {group: i for i, group in enumerate(from_chain)}
+
+            groups_with_changes = set()  # type: Set[int]
+            for to_group in to_groups:
+                to_chain = self._get_state_group_chain_txn(
+                    txn, to_group, stop_at=from_positions
+                )
+                if to_chain[-1] not in from_positions:
+                    return None
+
+                # The deltas of every group on the paths from the common
+                # ancestor to each group (but not of the ancestor itself) cover
+                # all the keys which differ between them.
+                groups_with_changes.update(to_chain[:-1])
+                groups_with_changes.update(from_chain[: from_positions[to_chain[-1]]])
+
+            rows = self.db_pool.simple_select_many_txn(
+                txn,
+                table="state_groups_state",
+                column="state_group",
+                iterable=groups_with_changes,
+                keyvalues={},
+                retcols=("type", "state_key"),
+            )
+            return {(row["type"], row["state_key"]) for row in rows}
+
+        return await self.db_pool.runInteraction(
+            "get_state_keys_changed_between_groups",
+            _get_state_keys_changed_between_groups_txn,
+        )
+
+    def _get_state_group_chain_txn(
+        self, txn, state_group: int, stop_at: Collection[int] = ()
+    ) -> List[int]:
+        """Get the given state group followed by its previous groups, nearest
+        first, up to MAX_STATE_DELTA_HOPS of them. The chain ends early at a
+        group that is stored in full, or at any group in `stop_at`.
+        """
+        if isinstance(self.database_engine, PostgresEngine):
+            sql = """
+                WITH RECURSIVE state(state_group, depth) AS (
+                    VALUES(?::bigint, 0)
+                    UNION ALL
+                    SELECT prev_state_group, depth + 1
+                    FROM state_group_edges e, state s
+                    WHERE s.state_group = e.state_group AND s.depth < ?
+                )
+                SELECT state_group FROM state ORDER BY depth
+            """
+            txn.execute(sql, (state_group, MAX_STATE_DELTA_HOPS))
+
+            chain = []
+            for (group,) in txn:
+                chain.append(group)
+                if group in stop_at:
+                    break
+            return chain
+
+        # We don't use WITH RECURSIVE on sqlite3 as there are distributions
+        # that ship with an sqlite3 version that doesn't support it (e.g. wheezy)
+        chain = [state_group]
+        while state_group not in stop_at and len(chain) <= MAX_STATE_DELTA_HOPS:
+            prev_group = self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                table="state_group_edges",
+                keyvalues={"state_group": state_group},
+                retcol="prev_state_group",
+                allow_none=True,
+            )  # type: Optional[int]
+            if not prev_group:
+                break
+            state_group = prev_group
+            chain.append(state_group)
+        return chain
+
     async def _get_state_groups_from_groups(
         self, groups: List[int], state_filter: StateFilter
     ) -> Dict[int, StateMap[str]]:
@@ -492,6 +668,356 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             "store_state_group", _store_state_group_txn
         )
 
+    async def get_state_group_for_resolution(
+        self, room_version: str, state_groups: Collection[int]
+    ) -> Optional[int]:
+        """Look up a previously persisted result of resolving the state across
+        the given state groups.
+
+        Args:
+            room_version: The version of the room the state groups belong to.
+            state_groups: The state groups that were resolved.
+
+        Returns:
+            A state group containing the resolved state, or None if the groups
+            have not been resolved before.
+        """
+        return await self.db_pool.simple_select_one_onecol(
+            table="state_group_resolutions",
+            keyvalues={
+                "resolution_key": _state_group_resolution_key(
+                    room_version, state_groups
+                )
+            },
+            retcol="resolved_state_group",
+            allow_none=True,
+            desc="get_state_group_for_resolution",
+        )
+
+    async def store_state_group_resolution(
+        self,
+        room_id: str,
+        room_version: str,
+        state_groups: Collection[int],
+        resolved_state_group: int,
+    ) -> None:
+        """Record that resolving the state across the given state groups
+        results in the state of `resolved_state_group`.
+
+        Args:
+            room_id: The room the state groups belong to.
+            room_version: The version of the room.
+            state_groups: The state groups that were resolved.
+            resolved_state_group: A persisted state group containing the
+                resolved state.
+        """
+        await self.db_pool.simple_upsert(
+            table="state_group_resolutions",
+            keyvalues={
+                "resolution_key": _state_group_resolution_key(
+                    room_version, state_groups
+                )
+            },
+            values={},
+            insertion_values={
+                "room_id": room_id,
+                "resolved_state_group": resolved_state_group,
+            },
+            desc="store_state_group_resolution",
+            lock=False,
+        )
+
+    async def queue_room_for_state_compression(self, room_id: str) -> None:
+        """Ask for the state groups of the given room to be compressed by the
+        background state compressor.
+
+        If the room has been compressed before, the compressor carries on from
+        where it stopped.
+        """
+        await self.db_pool.simple_upsert(
+            table="state_compressor_progress",
+            keyvalues={"room_id": room_id},
+            values={"pending": True},
+            insertion_values={
+                "last_compressed_group": 0,
+                "levels": json_encoder.encode([]),
+            },
+            desc="queue_room_for_state_compression",
+            lock=False,
+        )
+
+    async def get_state_compression_progress(self, room_id: str) -> Optional[dict]:
+        """Get the progress of the state compressor for the given room.
+
+        Returns:
+            None if the room has never been queued for compression, otherwise a
+            dict with keys:
+                pending (bool): whether there is compression still to do
+                last_compressed_group (int): the last state group which has been
+                    compressed
+        """
+        return await self.db_pool.simple_select_one(
+            table="state_compressor_progress",
+            keyvalues={"room_id": room_id},
+            retcols=("pending", "last_compressed_group"),
+            allow_none=True,
+            desc="get_state_compression_progress",
+        )
+
+    @wrap_as_background_process("compress_state_groups")
+    async def _compress_pending_rooms(self) -> None:
+        """Compress the state groups of all the rooms queued for compression."""
+        if self._compressing_state_groups:
+            return
+
+        self._compressing_state_groups = True
+        try:
+            room_ids = await self.db_pool.simple_select_onecol(
+                table="state_compressor_progress",
+                keyvalues={"pending": True},
+                retcol="room_id",
+                desc="_compress_pending_rooms",
+            )
+
+            for room_id in room_ids:
+                logger.info("Compressing state groups for %s", room_id)
+                while not await self.compress_state_groups_for_room(
+                    room_id, STATE_COMPRESSOR_BATCH_SIZE
+                ):
+                    # Give other work a chance to happen between batches.
+                    await self._clock.sleep(1)
+        finally:
+            self._compressing_state_groups = False
+
+    async def compress_state_groups_for_room(
+        self, room_id: str, batch_size: int
+    ) -> bool:
+        """Compress the next batch of state groups for the given room.
+
+        The state groups are rewritten, in order, as deltas against a
+        multi-level structure of delta chains (see `_get_compressed_prev_group`).
+        This bounds the length of the chains while only storing the full state
+        occasionally. The state of each group is left unchanged.
+
+        Args:
+            room_id: The room to compress. Must have been queued for compression
+                with `queue_room_for_state_compression`.
+            batch_size: The maximum number of state groups to compress.
+
+        Returns:
+            True if there are no more state groups to compress.
+        """
+        return await self.db_pool.runInteraction(
+            "compress_state_groups_for_room",
+            self._compress_state_groups_for_room_txn,
+            room_id,
+            batch_size,
+        )
+
+    def _compress_state_groups_for_room_txn(
+        self, txn, room_id: str, batch_size: int
+    ) -> bool:
+        progress = self.db_pool.simple_select_one_txn(
+            txn,
+            table="state_compressor_progress",
+            keyvalues={"room_id": room_id},
+            retcols=("last_compressed_group", "levels"),
+            allow_none=True,
+        )
+        if not progress:
+            return True
+
+        last_compressed_group = progress["last_compressed_group"]
+        levels = [
+            _CompressorLevel(max_length, current_length, head)
+            for max_length, current_length, head in db_to_json(progress["levels"])
+        ]
+
+        # If the heads of the levels have since been purged, or we're using
+        # different levels, then we need to start a new structure.
+        heads = {level.head for level in levels if level.head is not None}
+        if heads:
+            rows = self.db_pool.simple_select_many_txn(
+                txn,
+                table="state_groups",
+                column="id",
+                iterable=heads,
+                keyvalues={},
+                retcols=("id",),
+            )
+            if len(rows) != len(heads):
+                levels = []
+        if [level.max_length for level in levels] != list(STATE_COMPRESSOR_LEVELS):
+            levels = [_CompressorLevel(length) for length in STATE_COMPRESSOR_LEVELS]
+
+        txn.execute(
+            "SELECT id FROM state_groups WHERE room_id = ? AND id > ?"
+            " ORDER BY id ASC LIMIT ?",
+            (room_id, last_compressed_group, batch_size),
+        )
+        state_groups = [row[0] for row in txn]
+
+        # A cache of the full state of the level heads, and of the last group we
+        # compressed (which is often the old prev group of the next one).
+        group_to_state = {}  # type: Dict[int, StateMap[str]]
+
+        def get_state(state_group: int) -> StateMap[str]:
+            state = group_to_state.get(state_group)
+            if state is None:
+                state = self._get_state_groups_from_groups_txn(txn, [state_group])[
+                    state_group
+                ]
+            return state
+
+        for state_group in state_groups:
+            old_prev_group = self.db_pool.simple_select_one_onecol_txn(
+                txn,
+                table="state_group_edges",
+                keyvalues={"state_group": state_group},
+                retcol="prev_state_group",
+                allow_none=True,
+            )
+            if old_prev_group in group_to_state:
+                # Build the state from the state we already have, rather than
+                # walking the whole chain again.
+                rows = self.db_pool.simple_select_list_txn(
+                    txn,
+                    table="state_groups_state",
+                    keyvalues={"state_group": state_group},
+                    retcols=("type", "state_key", "event_id"),
+                )
+                full_state = dict(group_to_state[old_prev_group])
+                full_state.update(
+                    ((row["type"], row["state_key"]), row["event_id"]) for row in rows
+                )
+                state = full_state  # type: StateMap[str]
+            else:
+                state = get_state(state_group)
+
+            prev_group = _get_compressed_prev_group(levels, state_group)
+            if (
+                prev_group is not None
+                and prev_group != old_prev_group
+                and not self._lock_state_group_txn(txn, prev_group)
+            ):
+                # The group has been purged since we picked it as a head, so we
+                # start a new structure from this group instead.
+                levels = [
+                    _CompressorLevel(length) for length in STATE_COMPRESSOR_LEVELS
+                ]
+                prev_group = _get_compressed_prev_group(levels, state_group)
+
+            delta_ids = None  # type: Optional[StateMap[str]]
+            if prev_group is not None:
+                prev_state = get_state(prev_group)
+
+                # We can only store a delta if the state is a superset of the
+                # keys of the previous group's state.
+                if not prev_state.keys() - state.keys():
+                    delta_ids = {
+                        key: event_id
+                        for key, event_id in state.items()
+                        if prev_state.get(key) != event_id
+                    }
+                else:
+                    prev_group = None
+
+            if prev_group != old_prev_group:
+                self._rewrite_state_group_txn(
+                    txn,
+                    room_id,
+                    state_group,
+                    prev_group,
+                    delta_ids if delta_ids is not None else state,
+                )
+
+            group_to_state = {
+                level.head: get_state(level.head)
+                for level in levels
+                if level.head is not None and level.head != state_group
+            }
+            group_to_state[state_group] = state
+
+        finished = len(state_groups) < batch_size
+
+        self.db_pool.simple_update_one_txn(
+            txn,
+            table="state_compressor_progress",
+            keyvalues={"room_id": room_id},
+            updatevalues={
+                "last_compressed_group": state_groups[-1]
+                if state_groups
+                else last_compressed_group,
+                "levels": json_encoder.encode(
+                    [
+                        (level.max_length, level.current_length, level.head)
+                        for level in levels
+                    ]
+                ),
+                "pending": not finished,
+            },
+        )
+
+        return finished
+
+    def _lock_state_group_txn(self, txn, state_group: int) -> bool:
+        """Check that the given state group still exists, and make sure that it
+        isn't purged by another transaction until this one has finished.
+
+        The group's row is (trivially) updated, so that a concurrent purge of it
+        conflicts with this transaction, and whichever one comes second is
+        retried. On retrying, the purge sees any new references to the group.
+
+        Returns:
+            False if the state group no longer exists.
+        """
+        txn.execute(
+            "UPDATE state_groups SET room_id = room_id WHERE id = ?", (state_group,)
+        )
+        return txn.rowcount == 1
+
+    def _rewrite_state_group_txn(
+        self,
+        txn,
+        room_id: str,
+        state_group: int,
+        prev_group: Optional[int],
+        state_ids: StateMap[str],
+    ) -> None:
+        """Replace the stored state of the given state group, either with a
+        delta against `prev_group` or in full if `prev_group` is None.
+        """
+        self.db_pool.simple_delete_txn(
+            txn, table="state_group_edges", keyvalues={"state_group": state_group}
+        )
+        self.db_pool.simple_delete_txn(
+            txn, table="state_groups_state", keyvalues={"state_group": state_group}
+        )
+
+        if prev_group is not None:
+            self.db_pool.simple_insert_txn(
+                txn,
+                table="state_group_edges",
+                values={"state_group": state_group, "prev_state_group": prev_group},
+            )
+
+        self.db_pool.simple_insert_many_txn(
+            txn,
+            table="state_groups_state",
+            values=[
+                {
+                    "state_group": state_group,
+                    "room_id": room_id,
+                    "type": key[0],
+                    "state_key": key[1],
+                    "event_id": event_id,
+                }
+                for key, event_id in state_ids.items()
+            ],
+        )
+
+        txn.call_after(self.get_state_group_delta.invalidate, (state_group,))
+
     async def purge_unreferenced_state_groups(
         self, room_id: str, state_groups_to_delete
     ) -> None:
@@ -568,6 +1094,10 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             )
 
         logger.info("[purge] removing redundant state groups")
+        txn.execute_batch(
+            "DELETE FROM state_group_resolutions WHERE resolved_state_group = ?",
+            ((sg,) for sg in state_groups_to_delete),
+        )
         txn.execute_batch(
             "DELETE FROM state_groups_state WHERE state_group = ?",
             ((sg,) for sg in state_groups_to_delete),
@@ -638,6 +1168,18 @@ class StateGroupDataStore(StateBackgroundUpdateStore, SQLBaseStore):
             keyvalues={},
         )
 
+        # ... and any recorded state resolutions
+        logger.info("[purge] removing %s from state_group_resolutions", room_id)
+
+        self.db_pool.simple_delete_txn(
+            txn, table="state_group_resolutions", keyvalues={"room_id": room_id}
+        )
+
+        # ... and any state compressor progress
+        self.db_pool.simple_delete_txn(
+            txn, table="state_compressor_progress", keyvalues={"room_id": room_id}
+        )
+
         # ... and the state groups
         logger.info("[purge] removing %s from state_groups", room_id)
 
@@ -32,6 +32,7 @@ from synapse.storage.databases import Databases
 from synapse.storage.databases.main.events import DeltaState
 from synapse.storage.databases.main.events_worker import EventRedactBehaviour
 from synapse.types import (
+    ImmutableStateMap,
     PersistedEventPosition,
     RoomStreamToken,
     StateMap,
@@ -88,6 +89,17 @@ times_pruned_extremities = Counter(
     "Number of times we were actually be able to prune extremities",
 )
 
+state_delta_from_chain_counter = Counter(
+    "synapse_storage_events_state_delta_from_state_group_chain",
+    "Number of times we worked out the current state delta by following the "
+    "chain of state group deltas",
+)
+
+# The maximum number of state group deltas we'll follow back from the new
+# current state looking for the existing current state, before giving up and
+# diffing the full states instead.
+MAX_STATE_DELTA_CHAIN_LENGTH = 20
+
 
 class _EventPeristenceQueue:
     """Queues up events so that they can be persisted in bulk with only one
@@ -710,13 +722,15 @@ class EventsPersistenceStorage:
 
         if len(new_state_groups) == 1 and len(old_state_groups) == 1:
             # If we're going from one state group to another, lets check if
-            # we have a delta for that transition. If we do then we can just
-            # return that.
+            # the new one descends from the old one. If it does then we can
+            # just return the delta along the chain.
 
             new_state_group = next(iter(new_state_groups))
             old_state_group = next(iter(old_state_groups))
 
-            delta_ids = state_group_deltas.get((old_state_group, new_state_group), None)
+            delta_ids = await self._get_state_delta_from_chain(
+                old_state_group, new_state_group, state_group_deltas
+            )
             if delta_ids is not None:
                 # We have a delta from the existing to new current state,
                 # so lets just return that. If we happen to already have
@@ -765,7 +779,7 @@ class EventsPersistenceStorage:
             room_version,
             state_groups,
             events_map,
-            state_res_store=StateResolutionStore(self.main_store),
+            state_res_store=StateResolutionStore(self.main_store, self.state_store),
         )
 
         state_resolutions_during_persistence.inc()
@@ -782,7 +796,92 @@ class EventsPersistenceStorage:
                 events_context,
             )
 
-        return res.state, None, new_latest_event_ids
+        # The resolved state may well descend from the existing current state
+        # (for instance if one of the new forward extremities won outright), in
+        # which case we can still avoid diffing the full states.
+        delta_ids = None
+        if len(old_state_groups) == 1:
+            old_state_group = next(iter(old_state_groups))
+            if res.state_group is not None:
+                delta_ids = await self._get_state_delta_from_chain(
+                    old_state_group, res.state_group, state_group_deltas
+                )
+            elif res.prev_group is not None and res.delta_ids is not None:
+                delta_ids = await self._get_state_delta_from_chain(
+                    old_state_group, res.prev_group, state_group_deltas
+                )
+                if delta_ids is not None:
+                    delta_ids = dict(delta_ids)
+                    delta_ids.update(res.delta_ids)
+
+        return res.state, delta_ids, new_latest_event_ids
+
+    async def _get_state_delta_from_chain(
+        self,
+        old_state_group: int,
+        new_state_group: int,
+        state_group_deltas: Dict[Tuple[int, int], Optional[StateMap[str]]],
+    ) -> Optional[StateMap[str]]:
+        """Try to work out the delta from one state group to another by following
+        the chain of state group deltas back from the new state group.
+
+        Since a state group's delta can only add or replace state, the combined
+        delta is all we need to update the current state.
+
+        Args:
+            old_state_group: the state group of the existing current state.
+            new_state_group: the state group of the new current state.
+            state_group_deltas: the deltas we already have in memory, keyed by
+                (prev state group, state group).
+
+        Returns:
+            The delta, or None if `new_state_group` doesn't descend from
+            `old_state_group` within `MAX_STATE_DELTA_CHAIN_LENGTH` hops.
+        """
+        if old_state_group == new_state_group:
+            return {}
+
+        known_deltas = {
+            state_group: (prev_group, delta_ids)
+            for (prev_group, state_group), delta_ids in state_group_deltas.items()
+            if delta_ids is not None
+        }
+
+        deltas = []
+        state_group = new_state_group
+        prev_group = None  # type: Optional[int]
+        delta_ids = None  # type: Optional[StateMap[str]]
+        for _ in range(MAX_STATE_DELTA_CHAIN_LENGTH):
+            # State groups are always created after their prev group, so once
+            # we've gone past the old state group it can't be an ancestor.
+            if state_group < old_state_group:
+                return None
+
+            if state_group in known_deltas:
+                prev_group, delta_ids = known_deltas[state_group]
+            else:
+                prev_group, delta_ids = await self.state_store.get_state_group_delta(
+                    state_group
+                )
+            if prev_group is None or delta_ids is None:
+                return None
+
+            deltas.append(delta_ids)
+            if prev_group == old_state_group:
+                break
+            state_group = prev_group
+        else:
+            return None
+
+        if len(deltas) == 1:
+            return deltas[0]
+
+        state_delta_from_chain_counter.inc()
+
+        combined = dict(deltas[-1])
+        for delta in reversed(deltas[:-1]):
+            combined.update(delta)
+        return combined
 
     async def _prune_extremities(
         self,
@@ -910,15 +1009,11 @@ class EventsPersistenceStorage:
 
         Assumes that we are only persisting events for one room at a time.
         """
-        existing_state = await self.main_store.get_current_state_ids(room_id)
+        existing_state = ImmutableStateMap.of(
+            await self.main_store.get_current_state_ids(room_id)
+        )
 
-        to_delete = [key for key in existing_state if key not in current_state]
-
-        to_insert = {
-            key: ev_id
-            for key, ev_id in current_state.items()
-            if ev_id != existing_state.get(key)
-        }
+        to_delete, to_insert = existing_state.diff(current_state)
 
         return DeltaState(to_delete=to_delete, to_insert=to_insert)
 
@@ -994,12 +1089,10 @@ class EventsPersistenceStorage:
         # The server will leave the room, so we go and find out which remote
         # users will still be joined when we leave.
         if current_state is None:
-            current_state = await self.main_store.get_current_state_ids(room_id)
-            current_state = dict(current_state)
-            for key in delta.to_delete:
-                current_state.pop(key, None)
-
-            current_state.update(delta.to_insert)
+            existing_state = await self.main_store.get_current_state_ids(room_id)
+            current_state = ImmutableStateMap.of(existing_state).with_changes(
+                delta.to_insert, delta.to_delete
+            )
 
         remote_event_ids = [
             event_id
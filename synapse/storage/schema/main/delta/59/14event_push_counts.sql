@@ -0,0 +1,36 @@
+/* Copyright 2021 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The notification, highlight and unread counts of each local user in each room
+-- they're joined to. These are incremented as push actions are persisted, and
+-- reset when the user sends a read receipt, so that they don't need to be
+-- counted from event_push_actions and event_push_summary on every read.
+CREATE TABLE IF NOT EXISTS event_push_counts(
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    -- The stream ordering of the event the user last read, i.e. the counts are
+    -- of push actions after this point. 0 if the counts were started from
+    -- scratch.
+    stream_ordering BIGINT NOT NULL,
+    notif_count BIGINT NOT NULL,
+    highlight_count BIGINT NOT NULL,
+    unread_count BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS event_push_counts_user_room
+    ON event_push_counts(user_id, room_id);
+
+INSERT INTO background_updates (ordering, update_name, progress_json) VALUES
+  (5914, 'event_push_counts_populate', '{}');
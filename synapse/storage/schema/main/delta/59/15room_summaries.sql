@@ -0,0 +1,31 @@
+/* Copyright 2021 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The summary of each room's membership used by the room summary in /sync,
+-- maintained as the room's current state changes.
+CREATE TABLE IF NOT EXISTS room_summaries(
+    room_id TEXT NOT NULL,
+    -- A JSON object mapping each membership to the number of members of the
+    -- room with that membership.
+    membership_counts TEXT NOT NULL,
+    -- A JSON list of the first few members of the room to use as heroes, as
+    -- [user_id, membership, event_id] lists.
+    heroes TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS room_summaries_room_id ON room_summaries(room_id);
+
+INSERT INTO background_updates (ordering, update_name, progress_json) VALUES
+  (5915, 'room_summaries_populate', '{}');
@@ -0,0 +1,36 @@
+/* Copyright 2021 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Events received over federation in `/send` transactions which haven't been
+-- processed yet. They are handled a room at a time, in the order they were
+-- received.
+CREATE TABLE IF NOT EXISTS federation_inbound_events_staging(
+    origin TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    -- The instance which received the event.
+    instance_name TEXT NOT NULL,
+    received_ts BIGINT NOT NULL,
+    -- The position of the event in the transaction it was received in.
+    txn_position INTEGER NOT NULL,
+    event_json TEXT NOT NULL,
+    internal_metadata TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS federation_inbound_events_staging_room
+    ON federation_inbound_events_staging(room_id, received_ts, txn_position);
+
+CREATE UNIQUE INDEX IF NOT EXISTS federation_inbound_events_staging_origin_event
+    ON federation_inbound_events_staging(origin, event_id);
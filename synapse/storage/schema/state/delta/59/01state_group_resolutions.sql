@@ -0,0 +1,31 @@
+/* Copyright 2021 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Records the outcome of resolving the state across a set of state groups, so
+-- that the (potentially very expensive) resolution doesn't need to be redone
+-- after a restart or on a different worker.
+--
+-- `resolution_key` is a hash of the room version and the sorted list of state
+-- groups that were resolved (see `_state_group_resolution_key`), and
+-- `resolved_state_group` is a state group containing the resolved state.
+CREATE TABLE IF NOT EXISTS state_group_resolutions (
+    room_id TEXT NOT NULL,
+    resolution_key TEXT NOT NULL,
+    resolved_state_group BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX state_group_resolutions_key_idx ON state_group_resolutions(resolution_key);
+CREATE INDEX state_group_resolutions_room_idx ON state_group_resolutions(room_id);
+CREATE INDEX state_group_resolutions_group_idx ON state_group_resolutions(resolved_state_group);
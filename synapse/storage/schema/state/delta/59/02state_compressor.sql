@@ -0,0 +1,31 @@
+/* Copyright 2021 The Matrix.org Foundation C.I.C
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Tracks the progress of the state compressor, which rewrites the state groups
+-- of a room into a multi-level structure of delta chains.
+--
+-- `last_compressed_group` is the highest state group in the room which has
+-- been compressed, and `levels` is a JSON encoded description of the
+-- structure built so far, so that the compressor can pick up where it left
+-- off. `pending` is set when the room has been queued for compression, and
+-- cleared once there are no more state groups to compress.
+CREATE TABLE IF NOT EXISTS state_compressor_progress (
+    room_id TEXT NOT NULL,
+    last_compressed_group BIGINT NOT NULL,
+    levels TEXT NOT NULL,
+    pending BOOLEAN NOT NULL
+);
+
+CREATE UNIQUE INDEX state_compressor_progress_room_idx ON state_compressor_progress(room_id);
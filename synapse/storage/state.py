@@ -15,6 +15,7 @@ import logging
 from typing import (
     TYPE_CHECKING,
     Awaitable,
+    Collection,
     Dict,
     Iterable,
     List,
@@ -360,6 +361,26 @@ class StateGroupStorage:
 
         return await self.stores.state.get_state_group_delta(state_group)
 
+    async def get_state_keys_changed_between_groups(
+        self, from_group: int, to_groups: Collection[int]
+    ) -> Optional[Set[Tuple[str, str]]]:
+        """Work out which state keys may differ between a state group and each
+        of the given state groups, from the delta chains of the groups.
+
+        Args:
+            from_group: The state group to compare against.
+            to_groups: The state groups to compare with `from_group`.
+
+        Returns:
+            A set of (type, state_key) pairs, outside of which the state of all
+            the groups is the same, or None if the groups' delta chains don't
+            meet.
+        """
+
+        return await self.stores.state.get_state_keys_changed_between_groups(
+            from_group, to_groups
+        )
+
     async def get_state_groups_ids(
         self, _room_id: str, event_ids: Iterable[str]
     ) -> Dict[int, MutableStateMap[str]]:
@@ -591,3 +612,24 @@ class StateGroupStorage:
         return await self.stores.state.store_state_group(
             event_id, room_id, prev_group, delta_ids, current_state_ids
         )
+
+    async def store_state_group_resolution(
+        self,
+        room_id: str,
+        room_version: str,
+        state_groups: Collection[int],
+        resolved_state_group: int,
+    ) -> None:
+        """Record that resolving the state across the given state groups
+        results in the state of `resolved_state_group`.
+
+        Args:
+            room_id: The room the state groups belong to.
+            room_version: The version of the room.
+            state_groups: The state groups that were resolved.
+            resolved_state_group: A persisted state group containing the
+                resolved state.
+        """
+        await self.stores.state.store_state_group_resolution(
+            room_id, room_version, state_groups, resolved_state_group
+        )
@@ -20,6 +20,9 @@ from typing import (
     TYPE_CHECKING,
     Any,
     Dict,
+    Iterable,
+    Iterator,
+    List,
     Mapping,
     MutableMapping,
     Optional,
@@ -38,6 +41,7 @@ from twisted.internet.interfaces import (
     IReactorCore,
     IReactorPluggableNameResolver,
     IReactorTCP,
+    IReactorThreads,
     IReactorTime,
 )
 
@@ -60,10 +64,204 @@ MutableStateMap = MutableMapping[StateKey, T]
 JsonDict = Dict[str, Any]
 
 
+# Marks an entry in an `ImmutableStateMap`'s overlay as having been removed.
+# These sentinels are typed as Any so that they can be the default of a lookup
+# in a map of any type.
+_REMOVED = object()  # type: Any
+# The default for lookups in the overlay, to tell "no change" apart from "removed".
+_UNCHANGED = object()  # type: Any
+
+
+class ImmutableStateMap(Mapping[StateKey, T]):
+    """An immutable state map which can cheaply be copied with some entries
+    changed, and cheaply diffed against other maps derived from the same one.
+
+    The map is made up of a base dict, which is shared between all maps derived
+    from the same original map, and a (usually small) overlay of the entries
+    that differ from the base. Once the overlay gets too large relative to the
+    base, a new base is created.
+
+    Use `ImmutableStateMap.of` rather than the constructor where the argument
+    may already be an `ImmutableStateMap`, to avoid copying it.
+    """
+
+    __slots__ = ("_base", "_overlay", "_len")
+
+    # The overlay is folded into a new base once it has more than
+    # `max(_MIN_OVERLAY_SIZE, len(base) // _OVERLAY_RATIO)` entries.
+    _MIN_OVERLAY_SIZE = 32
+    _OVERLAY_RATIO = 8
+
+    def __init__(self, state: Optional[StateMap[T]] = None):
+        self._base = dict(state) if state else {}  # type: Dict[StateKey, T]
+        self._overlay = {}  # type: Dict[StateKey, Any]
+        self._len = len(self._base)
+
+    @classmethod
+    def of(cls, state: StateMap[T]) -> "ImmutableStateMap[T]":
+        """Returns the given state map as an `ImmutableStateMap`, copying it
+        only if it isn't one already.
+        """
+        if isinstance(state, ImmutableStateMap):
+            return state
+        return cls(state)
+
+    @classmethod
+    def _from_parts(
+        cls, base: Dict[StateKey, T], overlay: Dict[StateKey, Any], length: int
+    ) -> "ImmutableStateMap[T]":
+        state_map = cls.__new__(cls)  # type: ImmutableStateMap[T]
+        state_map._base = base
+        state_map._overlay = overlay
+        state_map._len = length
+        return state_map
+
+    def __getitem__(self, key: StateKey) -> T:
+        value = self._overlay.get(key, _UNCHANGED)
+        if value is _UNCHANGED:
+            return self._base[key]
+        if value is _REMOVED:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: StateKey, default=None):
+        value = self._overlay.get(key, _UNCHANGED)
+        if value is _UNCHANGED:
+            return self._base.get(key, default)
+        if value is _REMOVED:
+            return default
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        value = self._overlay.get(key, _UNCHANGED)  # type: ignore[call-overload]
+        if value is _UNCHANGED:
+            return key in self._base
+        return value is not _REMOVED
+
+    def __iter__(self) -> Iterator[StateKey]:
+        if not self._overlay:
+            return iter(self._base)
+        return self._iter_with_overlay()
+
+    def _iter_with_overlay(self) -> Iterator[StateKey]:
+        overlay = self._overlay
+        for key in self._base:
+            if overlay.get(key) is not _REMOVED:
+                yield key
+        for key, value in overlay.items():
+            if value is not _REMOVED and key not in self._base:
+                yield key
+
+    def __len__(self) -> int:
+        return self._len
+
+    def keys(self):
+        if not self._overlay:
+            return self._base.keys()
+        return super().keys()
+
+    def items(self):
+        if not self._overlay:
+            return self._base.items()
+        return super().items()
+
+    def values(self):
+        if not self._overlay:
+            return self._base.values()
+        return super().values()
+
+    def __repr__(self) -> str:
+        return "ImmutableStateMap(%r)" % (dict(self.items()),)
+
+    def with_changes(
+        self, changes: StateMap[T], removed: Iterable[StateKey] = ()
+    ) -> "ImmutableStateMap[T]":
+        """Returns a copy of this map with the given keys removed, and then the
+        given entries added or replaced.
+
+        This is proportional to the number of entries that differ from the
+        shared base, rather than to the size of the map.
+        """
+        base = self._base
+        overlay = dict(self._overlay)
+        length = self._len
+
+        for key in removed:
+            current = overlay.get(key, _UNCHANGED)
+            if current is _UNCHANGED:
+                present = key in base
+            else:
+                present = current is not _REMOVED
+            if not present:
+                continue
+            length -= 1
+
+            if key in base:
+                overlay[key] = _REMOVED
+            else:
+                del overlay[key]
+
+        for key, value in changes.items():
+            current = overlay.get(key, _UNCHANGED)
+            if current is _UNCHANGED:
+                present = key in base
+            else:
+                present = current is not _REMOVED
+            if not present:
+                length += 1
+
+            if key in base and base[key] == value:
+                overlay.pop(key, None)
+            else:
+                overlay[key] = value
+
+        if len(overlay) > max(self._MIN_OVERLAY_SIZE, len(base) // self._OVERLAY_RATIO):
+            state_map = ImmutableStateMap._from_parts(base, overlay, length)
+            return ImmutableStateMap._from_parts(dict(state_map.items()), {}, length)
+
+        return ImmutableStateMap._from_parts(base, overlay, length)
+
+    def diff(self, other: StateMap[T]) -> Tuple[List[StateKey], Dict[StateKey, T]]:
+        """Works out how to get from this map to `other`.
+
+        If `other` was derived from the same map as this one (and neither has
+        been compacted since), only the entries which differ from the shared
+        base need to be compared.
+
+        Returns:
+            The keys which are in this map but not in `other`, and the entries
+            in `other` which are either not in this map or have a different
+            value.
+        """
+        if isinstance(other, ImmutableStateMap) and other._base is self._base:
+            keys = set(self._overlay)
+            keys.update(other._overlay)
+        else:
+            keys = set(self)
+            keys.update(other)
+
+        to_delete = []
+        to_insert = {}
+        for key in keys:
+            new_value = other.get(key, _REMOVED)
+            if new_value is _REMOVED:
+                if key in self:
+                    to_delete.append(key)
+            elif new_value != self.get(key, _REMOVED):
+                to_insert[key] = new_value
+
+        return to_delete, to_insert
+
+
 # Note that this seems to require inheriting *directly* from Interface in order
 # for mypy-zope to realize it is an interface.
 class ISynapseReactor(
-    IReactorTCP, IReactorPluggableNameResolver, IReactorTime, IReactorCore, Interface
+    IReactorTCP,
+    IReactorPluggableNameResolver,
+    IReactorTime,
+    IReactorCore,
+    IReactorThreads,
+    Interface,
 ):
     """The interfaces necessary for Synapse to function."""
 
@@ -284,14 +482,14 @@ class RoomAlias(DomainSpecificString):
 
 @attr.s(slots=True, frozen=True, repr=False)
 class RoomID(DomainSpecificString):
-    """Structure representing a room id. """
+    """Structure representing a room id."""
 
     SIGIL = "!"
 
 
 @attr.s(slots=True, frozen=True, repr=False)
 class EventID(DomainSpecificString):
-    """Structure representing an event id. """
+    """Structure representing an event id."""
 
     SIGIL = "$"
 
@@ -15,7 +15,8 @@
 import json
 import logging
 import re
-from typing import Pattern
+import secrets
+from typing import Any, Iterator, List, Mapping, Pattern
 
 import attr
 from frozendict import frozendict
@@ -60,6 +61,66 @@ json_encoder = json.JSONEncoder(
 json_decoder = json.JSONDecoder(parse_constant=_reject_invalid_json)
 
 
+class EncodedCanonicalJson(Mapping[str, Any]):
+    """A JSON object together with its canonical JSON encoding.
+
+    `splice_canonical_json` includes the encoding as-is rather than encoding the
+    object again, so an object which is sent in many requests (such as an event
+    sent to every server in a room) only needs to be encoded once.
+    """
+
+    __slots__ = ["_json_object", "encoded"]
+
+    def __init__(self, json_object: Mapping[str, Any], encoded: bytes):
+        self._json_object = json_object
+        self.encoded = encoded
+
+    def __getitem__(self, key: str) -> Any:
+        return self._json_object[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._json_object)
+
+    def __len__(self) -> int:
+        return len(self._json_object)
+
+
+def splice_canonical_json(json_object: Any) -> bytes:
+    """Encodes the given object as canonical JSON, as
+    `canonicaljson.encode_canonical_json` does, but includes the existing
+    encoding of any `EncodedCanonicalJson` in it.
+    """
+    encoded_parts = []  # type: List[bytes]
+
+    # The encoder can't write out raw JSON, so we have it write a placeholder
+    # string instead and then swap in the encodings. The placeholders have a
+    # random prefix so that they can't clash with strings in the object.
+    placeholder_prefix = "__encoded_canonical_json_%s_" % (secrets.token_hex(8),)
+
+    def _default(obj):
+        if isinstance(obj, EncodedCanonicalJson):
+            encoded_parts.append(obj.encoded)
+            return "%s%d" % (placeholder_prefix, len(encoded_parts) - 1)
+        return _handle_frozendict(obj)
+
+    encoder = json.JSONEncoder(
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        sort_keys=True,
+        default=_default,
+    )
+    encoded = encoder.encode(json_object).encode("utf-8")
+
+    if not encoded_parts:
+        return encoded
+
+    placeholder_regex = re.compile(
+        ('"%s(\\d+)"' % (placeholder_prefix,)).encode("ascii")
+    )
+    return placeholder_regex.sub(lambda m: encoded_parts[int(m.group(1))], encoded)
+
+
 def unwrapFirstError(failure):
     # defer.gatherResults and DeferredLists wrap failures.
     failure.trap(defer.FirstError)
@@ -1,4 +1,13 @@
-from . import logging, lrucache, lrucache_evict
+from . import (
+    logging,
+    lrucache,
+    lrucache_evict,
+    notifier_fanout,
+    push_badge_count,
+    push_conditions,
+    push_evaluation,
+    push_staging,
+)
 
 SUITES = [
     (logging, 1000),
@@ -6,4 +15,14 @@ SUITES = [
     (logging, None),
     (lrucache, None),
     (lrucache_evict, None),
+    (notifier_fanout, 10000),
+    (notifier_fanout, 100000),
+    (push_evaluation, 100),
+    (push_evaluation, 10000),
+    (push_evaluation, 50000),
+    (push_conditions, None),
+    (push_staging, 100),
+    (push_staging, 10000),
+    (push_staging, 50000),
+    (push_badge_count, None),
 ]
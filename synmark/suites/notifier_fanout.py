@@ -0,0 +1,75 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import Mock
+
+from pyperf import perf_counter
+
+from twisted.internet.defer import Deferred
+
+from synapse.logging.context import LoggingContext
+from synapse.notifier import Notifier, _NotifierUserStream
+from synapse.types import RoomStreamToken, StreamToken
+from synapse.util import Clock
+
+# The number of events sent into the room in one go, which should only wake
+# each listener once.
+EVENTS_PER_BURST = 10
+
+
+async def main(reactor, loops):
+    """
+    Benchmark waking up `loops` listeners in a single room after a burst of
+    events.
+    """
+    clock = Clock(reactor)
+
+    hs = Mock()
+    hs.get_clock.return_value = clock
+    hs.should_send_federation.return_value = False
+    notifier = Notifier(hs)
+
+    room_id = "!room:synmark"
+    done = Deferred()
+    woken = 0
+
+    def on_woken(_):
+        nonlocal woken
+        woken += 1
+        if woken == loops:
+            done.callback(None)
+
+    for i in range(loops):
+        user_stream = _NotifierUserStream(
+            user_id="@user%d:synmark" % (i,),
+            rooms=[room_id],
+            current_token=StreamToken.START,
+            time_now_ms=clock.time_msec(),
+        )
+        notifier._register_with_keys(user_stream)
+        user_stream.new_listener(StreamToken.START).deferred.addCallback(on_woken)
+
+    start = perf_counter()
+
+    with LoggingContext("notifier_fanout"):
+        for stream_id in range(1, EVENTS_PER_BURST + 1):
+            notifier.on_new_event(
+                "room_key", RoomStreamToken(None, stream_id), rooms=[room_id]
+            )
+
+    await done
+
+    end = perf_counter() - start
+
+    return end
@@ -0,0 +1,91 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synapse.logging.context import LoggingContext
+from synapse.push.push_tools import get_badge_count
+from synapse.storage.roommember import GetRoomsForUserWithStreamOrdering
+from synapse.types import PersistedEventPosition
+
+from tests.utils import setup_test_homeserver
+
+# The number of rooms the user is in.
+ROOMS = 500
+
+USER_ID = "@user:synmark"
+
+
+async def main(reactor, loops):
+    """
+    Benchmark working out the badge count `loops` times for a user in `ROOMS`
+    rooms, about a third of which have notifications.
+    """
+    cleanups = []
+    hs = setup_test_homeserver(cleanups.append, name="synmark", reactor=reactor)
+    store = hs.get_datastore()
+
+    with LoggingContext("push_badge_count"):
+        updater = store.db_pool.updates
+        while not await updater.has_completed_background_updates():
+            await updater.do_next_background_update(100)
+
+        room_ids = ["!room%d:synmark" % (i,) for i in range(ROOMS)]
+
+        # The user's rooms and receipts are read from caches when pushing, so
+        # we fill those in rather than creating the rooms.
+        store.get_invited_rooms_for_local_user.prefill((USER_ID,), [])
+        store.get_rooms_for_user_with_stream_ordering.prefill(
+            (USER_ID,),
+            frozenset(
+                GetRoomsForUserWithStreamOrdering(
+                    room_id, PersistedEventPosition("master", i)
+                )
+                for i, room_id in enumerate(room_ids)
+            ),
+        )
+        store.get_receipts_for_user.prefill(
+            (USER_ID, "m.read"), dict.fromkeys(room_ids, "$read")
+        )
+
+        await store.db_pool.simple_insert_many(
+            table="event_push_counts",
+            values=[
+                {
+                    "user_id": USER_ID,
+                    "room_id": room_id,
+                    "stream_ordering": 0,
+                    "notif_count": i % 3,
+                    "highlight_count": 0,
+                    "unread_count": i % 3,
+                }
+                for i, room_id in enumerate(room_ids)
+            ],
+            desc="synmark_push_badge_count",
+        )
+
+        start = perf_counter()
+
+        for _ in range(loops):
+            # Measure reading the counts from the database, rather than from
+            # the cache filled in by the previous loop.
+            store.get_unread_counts_for_room_for_user.invalidate_all()
+            await get_badge_count(store, USER_ID, group_by_room=True)
+
+        end = perf_counter() - start
+
+    for cleanup in cleanups:
+        cleanup()
+
+    return end
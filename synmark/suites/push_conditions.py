@@ -0,0 +1,65 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synapse.api.constants import EventTypes
+from synapse.events import make_event_from_dict
+from synapse.push.bulk_push_rule_evaluator import _condition_checker
+from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent
+from synapse.storage.databases.main.push_rule import _load_rules
+
+
+async def main(reactor, loops):
+    """
+    Benchmark checking the conditions of the default push rules against a
+    message for `loops` users, until the first rule matches for each.
+    """
+    event = make_event_from_dict(
+        {
+            "event_id": "$message",
+            "type": EventTypes.Message,
+            "sender": "@sender:synmark",
+            "room_id": "!room:synmark",
+            "content": {
+                "msgtype": "m.text",
+                "body": "Has anyone seen the agenda for tomorrow's meeting?",
+            },
+        }
+    )
+    evaluator = PushRuleEvaluatorForEvent(
+        event,
+        room_member_count=50,
+        sender_power_level=0,
+        power_levels={},
+    )
+
+    rules = [rule for rule in _load_rules([], {}) if rule.get("enabled", True)]
+    user_ids = ["@user%d:synmark" % (i,) for i in range(loops)]
+
+    start = perf_counter()
+
+    for user_id in user_ids:
+        # Each user gets their own cache of condition results, as they did
+        # before users with the same rules were evaluated together.
+        condition_cache = {}
+        for rule in rules:
+            if _condition_checker(
+                evaluator, rule["conditions"], user_id, "User", condition_cache
+            ):
+                break
+
+    end = perf_counter() - start
+
+    return end
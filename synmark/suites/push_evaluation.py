@@ -0,0 +1,196 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import Mock
+
+from pyperf import perf_counter
+
+from synapse.api.constants import EventTypes, Membership
+from synapse.events import make_event_from_dict
+from synapse.events.snapshot import EventContext
+from synapse.logging.context import LoggingContext
+from synapse.push.bulk_push_rule_evaluator import BulkPushRuleEvaluator
+from synapse.storage.databases.main.push_rule import _load_rules
+from synapse.storage.roommember import ProfileInfo
+from synapse.util import json_encoder
+
+ROOM_ID = "!room:synmark"
+SENDER = "@sender:synmark"
+
+
+def _make_member_event(user_id):
+    return make_event_from_dict(
+        {
+            "event_id": "$member-%s" % (user_id,),
+            "type": EventTypes.Member,
+            "state_key": user_id,
+            "sender": user_id,
+            "room_id": ROOM_ID,
+            "content": {"membership": Membership.JOIN},
+        }
+    )
+
+
+def _make_raw_rules(i):
+    """Make the push rules a user has set, as stored in the database.
+
+    Most users keep the default rules, but some have keywords, muted the room
+    or turned off notifications altogether.
+    """
+    raw_rules = []
+    if i % 10 == 0:
+        raw_rules.append(
+            {
+                "rule_id": "keyword%d" % (i,),
+                "priority_class": 2,
+                "priority": 0,
+                "conditions": json_encoder.encode(
+                    [
+                        {
+                            "kind": "event_match",
+                            "key": "content.body",
+                            "pattern": "keyword%d" % (i % 50,),
+                        }
+                    ]
+                ),
+                "actions": json_encoder.encode(["notify", {"set_tweak": "highlight"}]),
+            }
+        )
+    if i % 20 == 0:
+        raw_rules.append(
+            {
+                "rule_id": ROOM_ID,
+                "priority_class": 3,
+                "priority": 0,
+                "conditions": json_encoder.encode(
+                    [{"kind": "event_match", "key": "room_id", "pattern": ROOM_ID}]
+                ),
+                "actions": json_encoder.encode(["dont_notify"]),
+            }
+        )
+
+    enabled_map = {}
+    if i % 100 == 0:
+        enabled_map[".m.rule.master"] = True
+
+    return raw_rules, enabled_map
+
+
+class _Store:
+    """Just enough of the data store for evaluating push rules in a room with
+    the given members.
+    """
+
+    def __init__(self, user_ids, power_levels_event):
+        self.user_ids = user_ids
+        self.power_levels_event = power_levels_event
+
+        self.rules_by_user = {}
+        for i, user_id in enumerate(user_ids):
+            raw_rules, enabled_map = _make_raw_rules(i)
+            self.rules_by_user[user_id] = _load_rules(raw_rules, enabled_map)
+
+    def get_if_app_services_interested_in_user(self, user_id):
+        return False
+
+    async def get_membership_from_event_ids(self, event_ids):
+        return [
+            {
+                "event_id": event_id,
+                "user_id": event_id[len("$member-") :],
+                "membership": Membership.JOIN,
+            }
+            for event_id in event_ids
+        ]
+
+    async def bulk_get_push_rules(self, user_ids, on_invalidate=None):
+        return {user_id: self.rules_by_user[user_id] for user_id in user_ids}
+
+    async def get_joined_users_from_context(self, event, context):
+        return {
+            user_id: ProfileInfo(avatar_url=None, display_name="User %d" % (i,))
+            for i, user_id in enumerate(self.user_ids)
+        }
+
+    async def get_event(self, event_id):
+        return self.power_levels_event
+
+    async def ignored_by(self, user_id):
+        return set()
+
+    async def add_push_actions_to_staging(
+        self, event_id, user_id_actions, count_as_unread
+    ):
+        pass
+
+
+async def main(reactor, loops):
+    """
+    Benchmark evaluating the push rules of every member of a room with `loops`
+    members for a message.
+    """
+    user_ids = [SENDER] + ["@user%d:synmark" % (i,) for i in range(loops)]
+
+    power_levels_event = make_event_from_dict(
+        {
+            "event_id": "$power_levels",
+            "type": EventTypes.PowerLevels,
+            "state_key": "",
+            "sender": SENDER,
+            "room_id": ROOM_ID,
+            "content": {"users": {SENDER: 100}, "notifications": {"room": 50}},
+        }
+    )
+
+    state_ids = {(EventTypes.PowerLevels, ""): power_levels_event.event_id}
+    for user_id in user_ids:
+        state_ids[(EventTypes.Member, user_id)] = _make_member_event(user_id).event_id
+
+    hs = Mock()
+    hs.get_datastore.return_value = _Store(user_ids, power_levels_event)
+    hs.is_mine_id.side_effect = lambda user_id: user_id.endswith(":synmark")
+    evaluator = BulkPushRuleEvaluator(hs)
+
+    def make_message(i, body):
+        event = make_event_from_dict(
+            {
+                "event_id": "$message%d" % (i,),
+                "type": EventTypes.Message,
+                "sender": SENDER,
+                "room_id": ROOM_ID,
+                "content": {"msgtype": "m.text", "body": body},
+            }
+        )
+        context = EventContext.with_state(
+            state_group=1,
+            state_group_before_event=1,
+            current_state_ids=state_ids,
+            prev_state_ids=state_ids,
+        )
+        return event, context
+
+    with LoggingContext("push_evaluation"):
+        # Load the members' rules into the cache first, as it would be when
+        # the room is in use.
+        await evaluator.action_for_event_by_user(*make_message(0, "hello"))
+
+        event, context = make_message(1, "hello User 5, have you seen keyword20?")
+
+        start = perf_counter()
+
+        await evaluator.action_for_event_by_user(event, context)
+
+        end = perf_counter() - start
+
+    return end
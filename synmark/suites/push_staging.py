@@ -0,0 +1,57 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pyperf import perf_counter
+
+from synapse.logging.context import LoggingContext
+
+from tests.utils import setup_test_homeserver
+
+
+async def main(reactor, loops):
+    """
+    Benchmark staging the push actions for an event for `loops` users.
+    """
+    cleanups = []
+    hs = setup_test_homeserver(cleanups.append, name="synmark", reactor=reactor)
+    store = hs.get_datastore()
+
+    # Most members of a room are notified, a few are highlighted and the rest
+    # just have the event counted as unread.
+    actions_by_user = {}
+    for i in range(loops):
+        if i % 100 == 0:
+            actions = ["notify", {"set_tweak": "highlight"}]
+        elif i % 20 == 0:
+            actions = []
+        else:
+            actions = ["notify", {"set_tweak": "highlight", "value": False}]
+        actions_by_user["@user%d:synmark" % (i,)] = actions
+
+    with LoggingContext("push_staging"):
+        # Make sure the database connection is up before we start timing.
+        await store.add_push_actions_to_staging(
+            "$warmup", {"@user:synmark": ["notify"]}, True
+        )
+
+        start = perf_counter()
+
+        await store.add_push_actions_to_staging("$event", actions_by_user, True)
+
+        end = perf_counter() - start
+
+    for cleanup in cleanups:
+        cleanup()
+
+    return end
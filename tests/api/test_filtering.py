@@ -484,3 +484,65 @@ class FilteringTestCase(unittest.HomeserverTestCase):
         self.assertEquals(filter.get_filter_json(), user_filter_json)
 
         self.assertRegexpMatches(repr(filter), r"<FilterCollection \{.*\}>")
+
+    def test_get_filter_is_cached(self):
+        user_filter_json = {"room": {"state": {"types": ["m.*"]}}}
+
+        filter_id = self.get_success(
+            self.datastore.add_user_filter(
+                user_localpart=user_localpart, user_filter=user_filter_json
+            )
+        )
+
+        filter1 = self.get_success(
+            self.filtering.get_user_filter(
+                user_localpart=user_localpart, filter_id=filter_id
+            )
+        )
+        filter2 = self.get_success(
+            self.filtering.get_user_filter(
+                user_localpart=user_localpart, filter_id=str(filter_id)
+            )
+        )
+
+        self.assertIs(filter1, filter2)
+
+    def test_with_room_ids_does_not_modify_filter(self):
+        definition = {"rooms": ["!a:example.com"]}
+        room_filter = Filter(definition)
+
+        new_filter = room_filter.with_room_ids(["!b:example.com"])
+
+        self.assertEqual(new_filter.rooms, ["!a:example.com", "!b:example.com"])
+        self.assertEqual(room_filter.rooms, ["!a:example.com"])
+        self.assertEqual(definition, {"rooms": ["!a:example.com"]})
+
+        event = MockEvent(
+            sender="@foo:bar", type="m.room.message", room_id="!b:example.com"
+        )
+        self.assertTrue(new_filter.check(event))
+        self.assertFalse(room_filter.check(event))
+
+    def test_filter_batch(self):
+        definition = {
+            "types": ["m.room.*", "org.matrix.foo"],
+            "not_types": ["m.room.member"],
+        }
+        events = [
+            MockEvent(sender="@foo:bar", type=event_type, room_id="!foo:bar")
+            for event_type in (
+                "m.room.message",
+                "m.room.member",
+                "org.matrix.foo",
+                "org.matrix.foo.bar",
+                "m.roomy",
+            )
+        ]
+
+        results = Filter(definition).filter(events)
+        self.assertEqual(
+            [e.type for e in results], ["m.room.message", "org.matrix.foo"]
+        )
+
+        # An empty filter lets everything through.
+        self.assertEqual(Filter({}).filter(events), events)
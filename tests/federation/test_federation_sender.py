@@ -20,6 +20,8 @@ from signedjson.types import BaseKey, SigningKey
 from twisted.internet import defer
 
 from synapse.api.constants import RoomEncryptionAlgorithms
+from synapse.events import make_event_from_dict
+from synapse.federation.sender.transaction_manager import TransactionManager
 from synapse.rest import admin
 from synapse.rest.client.v1 import login
 from synapse.types import JsonDict, ReadReceipt
@@ -154,6 +156,45 @@ class FederationSenderReceiptsTestCases(HomeserverTestCase):
         )
 
 
+class TransactionManagerTestCase(HomeserverTestCase):
+    def make_homeserver(self, reactor, clock):
+        return self.setup_test_homeserver(
+            federation_transport_client=Mock(spec=["send_transaction"]),
+        )
+
+    def test_pdu_encoded_once(self):
+        """A PDU sent to several destinations is only encoded once"""
+        sent_pdus = []
+
+        async def record_transaction(txn, json_cb):
+            sent_pdus.extend(json_cb()["pdus"])
+            return {}
+
+        self.hs.get_federation_transport_client().send_transaction.side_effect = (
+            record_transaction
+        )
+
+        event = make_event_from_dict(
+            {
+                "event_id": "$event:test",
+                "room_id": "!room:test",
+                "type": "m.room.message",
+                "sender": "@user:test",
+                "content": {"body": "hi"},
+            }
+        )
+
+        transaction_manager = TransactionManager(self.hs)
+        for destination in ("host2", "host3"):
+            self.get_success(
+                transaction_manager.send_new_transaction(destination, [event], [])
+            )
+
+        self.assertEqual(len(sent_pdus), 2)
+        self.assertIs(sent_pdus[0], sent_pdus[1])
+        self.assertEqual(sent_pdus[0], event.get_pdu_json())
+
+
 class FederationSenderDevicesTestCases(HomeserverTestCase):
     servlets = [
         admin.register_servlets,
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging
+from unittest.mock import Mock
 
 from parameterized import parameterized
 
@@ -22,6 +23,7 @@ from synapse.rest import admin
 from synapse.rest.client.v1 import login, room
 
 from tests import unittest
+from tests.test_utils import make_awaitable
 
 
 class FederationServerTests(unittest.FederatingHomeserverTestCase):
@@ -152,6 +154,118 @@ class StateQueryTests(unittest.FederatingHomeserverTestCase):
         self.assertEqual(channel.json_body["errcode"], "M_FORBIDDEN")
 
 
+class StagedEventsTests(unittest.FederatingHomeserverTestCase):
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+    def _make_event(self, room_id, room_version, i):
+        return make_event_from_dict(
+            {
+                "room_id": room_id,
+                "type": "m.room.message",
+                "sender": "@user:other.example.com",
+                "content": {"body": str(i)},
+                "auth_events": [],
+                "prev_events": [],
+                "depth": i,
+                "origin_server_ts": i,
+            },
+            room_version,
+        )
+
+    def test_staged_events_processed_in_order(self):
+        """
+        Events in the staging area are processed in the order they were
+        received, and removed once they have been processed.
+        """
+        u1 = self.register_user("u1", "pass")
+        u1_token = self.login("u1", "pass")
+
+        room_1 = self.helper.create_room_as(u1, tok=u1_token)
+        room_version = self.get_success(self.store.get_room_version(room_1))
+
+        events = [self._make_event(room_1, room_version, i) for i in range(3)]
+
+        self.get_success(
+            self.store.insert_received_events_to_staging(
+                "other.example.com", events[:2], 1000
+            )
+        )
+        self.get_success(
+            self.store.insert_received_events_to_staging(
+                "other.example.com", events[2:], 2000
+            )
+        )
+
+        handler = self.hs.get_federation_handler()
+        handler.on_receive_pdu = Mock(
+            side_effect=lambda *args, **kwargs: make_awaitable(None)
+        )
+
+        self.hs.get_federation_server().process_staged_events(room_1)
+        self.pump()
+
+        self.assertEqual(
+            [call[0][1].event_id for call in handler.on_receive_pdu.call_args_list],
+            [event.event_id for event in events],
+        )
+        for call in handler.on_receive_pdu.call_args_list:
+            self.assertEqual(call[0][0], "other.example.com")
+
+        self.assertIsNone(
+            self.get_success(
+                self.store.get_next_staged_event_for_room(room_1, room_version)
+            )
+        )
+
+    def test_staged_events_from_other_instances_left_alone(self):
+        """
+        When processing isn't sharded, events received by other instances are
+        left for them to process.
+        """
+        u1 = self.register_user("u1", "pass")
+        u1_token = self.login("u1", "pass")
+
+        room_1 = self.helper.create_room_as(u1, tok=u1_token)
+        room_version = self.get_success(self.store.get_room_version(room_1))
+
+        event = self._make_event(room_1, room_version, 0)
+        self.get_success(
+            self.store.insert_received_events_to_staging(
+                "other.example.com", [event], 1000
+            )
+        )
+        self.get_success(
+            self.store.db_pool.simple_update_one(
+                table="federation_inbound_events_staging",
+                keyvalues={"event_id": event.event_id},
+                updatevalues={"instance_name": "federation_reader1"},
+            )
+        )
+
+        handler = self.hs.get_federation_handler()
+        handler.on_receive_pdu = Mock(
+            side_effect=lambda *args, **kwargs: make_awaitable(None)
+        )
+
+        # Go through the periodic check for staged events.
+        self.reactor.advance(60)
+
+        handler.on_receive_pdu.assert_not_called()
+        self.assertIsNotNone(
+            self.get_success(
+                self.store.get_next_staged_event_for_room(room_1, room_version)
+            )
+        )
+
+
 def _create_acl_event(content):
     return make_event_from_dict(
         {
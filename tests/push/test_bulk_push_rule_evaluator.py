@@ -0,0 +1,217 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import synapse.rest.admin
+from synapse.rest.client.v1 import login, push_rule, room
+
+from tests.unittest import HomeserverTestCase, override_config
+
+
+class BulkPushRuleEvaluatorTestCase(HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        room.register_servlets,
+        login.register_servlets,
+        push_rule.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.sender = self.register_user("sender", "pass")
+        self.sender_tok = self.login("sender", "pass")
+        self.room_id = self.helper.create_room_as(self.sender, tok=self.sender_tok)
+
+        self.tokens = {}
+        for localpart in ("bob", "carol", "dave", "eve", "frank"):
+            user_id = self.register_user(localpart, "pass")
+            self.tokens[user_id] = self.login(localpart, "pass")
+            self.helper.join(self.room_id, user_id, tok=self.tokens[user_id])
+
+    def _get_actions(self, event_id):
+        """Get the notify and highlight flags stored for each user for the
+        event.
+        """
+        rows = self.get_success(
+            self.store.db_pool.simple_select_list(
+                table="event_push_actions",
+                keyvalues={"event_id": event_id},
+                retcols=("user_id", "notif", "highlight"),
+            )
+        )
+        return {
+            row["user_id"]: (bool(row["notif"]), bool(row["highlight"])) for row in rows
+        }
+
+    def test_users_with_same_rules(self):
+        """Users with the same rules still get their own results for conditions
+        which depend on the user, and users with different rules get theirs.
+        """
+        # carol highlights on a keyword.
+        channel = self.make_request(
+            "PUT",
+            "/pushrules/global/content/keyword",
+            {"pattern": "keyword", "actions": ["notify", {"set_tweak": "highlight"}]},
+            access_token=self.tokens["@carol:test"],
+        )
+        self.assertEqual(channel.code, 200, channel.json_body)
+
+        # eve doesn't want to be notified about anything.
+        channel = self.make_request(
+            "PUT",
+            "/pushrules/global/override/.m.rule.master/enabled",
+            {"enabled": True},
+            access_token=self.tokens["@eve:test"],
+        )
+        self.assertEqual(channel.code, 200, channel.json_body)
+
+        event_id = self.helper.send(
+            self.room_id, "hello bob, keyword", tok=self.sender_tok
+        )["event_id"]
+
+        self.assertEqual(
+            self._get_actions(event_id),
+            {
+                # bob's display name is in the body.
+                "@bob:test": (True, True),
+                "@carol:test": (True, True),
+                "@dave:test": (True, False),
+                "@eve:test": (False, False),
+                "@frank:test": (True, False),
+            },
+        )
+
+    @override_config({"push_evaluator_instance": "master"})
+    def test_async_evaluation(self):
+        """Push actions are computed after the event has been persisted when a
+        push evaluator is configured.
+        """
+        event_id = self.helper.send(self.room_id, "hello bob", tok=self.sender_tok)[
+            "event_id"
+        ]
+        self.pump()
+
+        actions = self._get_actions(event_id)
+        self.assertEqual(actions["@bob:test"], (True, True))
+        self.assertEqual(actions["@carol:test"], (True, False))
+
+        # The push evaluator has caught up with the event.
+        event = self.get_success(self.store.get_event(event_id))
+        self.assertEqual(
+            self.get_success(self.store.get_push_evaluator_position()),
+            event.internal_metadata.stream_ordering,
+        )
+
+        # The unread counts have been updated too.
+        counts = self.get_success(
+            self.store.get_unread_counts_for_room_for_user(self.room_id, "@bob:test")
+        )
+        self.assertEqual(counts["highlight_count"], 1)
+
+    @override_config({"push_evaluator_instance": "master"})
+    def test_async_evaluation_retried(self):
+        """If the push actions for a batch of events can't be computed, the
+        batch is retried rather than skipped.
+        """
+        action_generator = self.hs.get_action_generator()
+        get_actions_for_event = action_generator.bulk_evaluator.get_actions_for_event
+        failures = [Exception("Failed to compute push actions")]
+
+        async def get_actions_or_fail(event, context):
+            if failures:
+                raise failures.pop()
+            return await get_actions_for_event(event, context)
+
+        action_generator.bulk_evaluator.get_actions_for_event = get_actions_or_fail
+
+        event_id = self.helper.send(self.room_id, "hello bob", tok=self.sender_tok)[
+            "event_id"
+        ]
+        self.pump()
+
+        self.assertEqual(self._get_actions(event_id), {})
+        event = self.get_success(self.store.get_event(event_id))
+        self.assertLess(
+            self.get_success(self.store.get_push_evaluator_position()),
+            event.internal_metadata.stream_ordering,
+        )
+
+        self.reactor.advance(action_generator.RETRY_INTERVAL_SECS)
+
+        actions = self._get_actions(event_id)
+        self.assertEqual(actions["@bob:test"], (True, True))
+        self.assertEqual(
+            self.get_success(self.store.get_push_evaluator_position()),
+            event.internal_metadata.stream_ordering,
+        )
+
+    def test_push_evaluator_position(self):
+        """The push evaluator's position isn't kept up to date while push
+        actions are computed before events are persisted, and starts from the
+        end of the events stream when it's first needed.
+        """
+        event_id = self.helper.send(self.room_id, "hello", tok=self.sender_tok)[
+            "event_id"
+        ]
+        rows = self.get_success(
+            self.store.db_pool.simple_select_list(
+                table="push_evaluator_stream_position",
+                keyvalues={},
+                retcols=("stream_id",),
+            )
+        )
+        self.assertEqual(rows, [])
+
+        event = self.get_success(self.store.get_event(event_id))
+        self.assertEqual(
+            self.get_success(self.store.get_push_evaluator_position()),
+            event.internal_metadata.stream_ordering,
+        )
+
+    def test_rules_shared_across_rooms(self):
+        """Users with the same push rules share one compiled copy of them in
+        every room, and a user's rules are updated when they change them.
+        """
+        room_id2 = self.helper.create_room_as(self.sender, tok=self.sender_tok)
+        for user_id, tok in self.tokens.items():
+            self.helper.join(room_id2, user_id, tok=tok)
+
+        self.helper.send(self.room_id, "hello", tok=self.sender_tok)
+        self.helper.send(room_id2, "hello", tok=self.sender_tok)
+
+        evaluator = self.hs.get_action_generator().bulk_evaluator
+        rules1 = evaluator._get_rules_for_room(self.room_id).rules_by_user
+        rules2 = evaluator._get_rules_for_room(room_id2).rules_by_user
+        self.assertEqual(len({id(rule_set) for rule_set in rules1.values()}), 1)
+        self.assertIs(rules1["@bob:test"], rules2["@carol:test"])
+
+        # carol changes their rules, which only affects them.
+        channel = self.make_request(
+            "PUT",
+            "/pushrules/global/content/keyword",
+            {"pattern": "keyword", "actions": ["notify", {"set_tweak": "highlight"}]},
+            access_token=self.tokens["@carol:test"],
+        )
+        self.assertEqual(channel.code, 200, channel.json_body)
+
+        event_id = self.helper.send(room_id2, "keyword", tok=self.sender_tok)[
+            "event_id"
+        ]
+        actions = self._get_actions(event_id)
+        self.assertEqual(actions["@carol:test"], (True, True))
+        self.assertEqual(actions["@bob:test"], (True, False))
+
+        rules2 = evaluator._get_rules_for_room(room_id2).rules_by_user
+        self.assertIsNot(rules2["@carol:test"], rules2["@bob:test"])
+        self.assertIs(rules2["@bob:test"], rules2["@dave:test"])
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+from unittest.mock import Mock
 
 import attr
 import pkg_resources
@@ -303,6 +304,48 @@ class EmailPusherTests(HomeserverTestCase):
         # We should get emailed about that message
         self._check_for_mail()
 
+    def test_context_shared_between_users(self):
+        """Users emailed about the same message share the context fetched for
+        it.
+        """
+        room = self.helper.create_room_as(self.user_id, tok=self.access_token)
+        for other in self.others:
+            self.helper.invite(
+                room=room, src=self.user_id, tok=self.access_token, targ=other.id
+            )
+            self.helper.join(room=room, user=other.id, tok=other.token)
+
+        # Give the second other user an email pusher too.
+        other = self.others[1]
+        store = self.hs.get_datastore()
+        user_tuple = self.get_success(store.get_user_by_access_token(other.token))
+        self.get_success(
+            store.user_add_threepid(other.id, "email", "b@example.com", 0, 0)
+        )
+        self.get_success(
+            self.hs.get_pusherpool().add_pusher(
+                user_id=other.id,
+                access_token=user_tuple.token_id,
+                kind="email",
+                app_id="m.email",
+                app_display_name="Email Notifications",
+                device_display_name="b@example.com",
+                pushkey="b@example.com",
+                lang=None,
+                data={},
+            )
+        )
+
+        get_events_around = Mock(side_effect=store.get_events_around)
+        store.get_events_around = get_events_around
+
+        self.helper.send(room, body="Hi!", tok=self.others[0].token)
+        self.pump(10)
+
+        # Both users were emailed, but the context was only fetched once.
+        self.assertEqual(len(self.email_attempts), 2)
+        self.assertEqual(get_events_around.call_count, 1)
+
     def _check_for_mail(self):
         """Check that the user receives an email notification"""
 
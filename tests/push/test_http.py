@@ -11,13 +11,16 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import copy
 from unittest.mock import Mock
 
+from twisted.internet import defer
 from twisted.internet.defer import Deferred
 
 import synapse.rest.admin
 from synapse.logging.context import make_deferred_yieldable
 from synapse.push import PusherConfigException
+from synapse.push.push_gateway import push_gateway_queued_devices
 from synapse.rest.client.v1 import login, room
 from synapse.rest.client.v2_alpha import receipts
 
@@ -46,7 +49,9 @@ class HTTPPusherTests(HomeserverTestCase):
 
         def post_json_get_json(url, body):
             d = Deferred()
-            self.push_attempts.append((d, url, body))
+            # Copy the body, as the caller is free to change it once the request
+            # has been made.
+            self.push_attempts.append((d, url, copy.deepcopy(body)))
             return make_deferred_yieldable(d)
 
         m.post_json_get_json = post_json_get_json
@@ -199,6 +204,284 @@ class HTTPPusherTests(HomeserverTestCase):
         self.assertEqual(len(pushers), 1)
         self.assertTrue(pushers[0].last_stream_ordering > last_stream_ordering)
 
+    @override_config({"push_evaluator_instance": "master"})
+    def test_sends_http_with_async_push_evaluation(self):
+        """
+        Pushes are still sent when push actions are computed after events have
+        been persisted.
+        """
+        # Register the user who gets notified
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        # Register the user who sends the message
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        # Register the pusher
+        user_tuple = self.get_success(
+            self.hs.get_datastore().get_user_by_access_token(access_token)
+        )
+        token_id = user_tuple.token_id
+
+        self.get_success(
+            self.hs.get_pusherpool().add_pusher(
+                user_id=user_id,
+                access_token=token_id,
+                kind="http",
+                app_id="m.http",
+                app_display_name="HTTP Push Notifications",
+                device_display_name="pushy push",
+                pushkey="a@example.com",
+                lang=None,
+                data={"url": "http://example.com/_matrix/push/v1/notify"},
+            )
+        )
+
+        # Create a room
+        room = self.helper.create_room_as(user_id, tok=access_token)
+
+        # The other user joins
+        self.helper.join(room=room, user=other_user_id, tok=other_access_token)
+
+        # The other user sends a message
+        self.helper.send(room, body="Hi!", tok=other_access_token)
+
+        # Advance time a bit, so the push actions are computed and the pusher
+        # registers that something has happened
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["content"]["body"], "Hi!"
+        )
+
+    def _send_message_to_pushers(self, localparts):
+        """Register users with HTTP pushers using the same push gateway, put
+        them in a room and send a message there.
+        """
+        room = None
+        for localpart in localparts:
+            user_id = self.register_user(localpart, "pass")
+            access_token = self.login(localpart, "pass")
+
+            user_tuple = self.get_success(
+                self.hs.get_datastore().get_user_by_access_token(access_token)
+            )
+            self.get_success(
+                self.hs.get_pusherpool().add_pusher(
+                    user_id=user_id,
+                    access_token=user_tuple.token_id,
+                    kind="http",
+                    app_id="m.http",
+                    app_display_name="HTTP Push Notifications",
+                    device_display_name="pushy push",
+                    pushkey=localpart,
+                    lang=None,
+                    data={
+                        "url": "http://example.com/_matrix/push/v1/notify",
+                        "format": "event_id_only",
+                    },
+                )
+            )
+
+            if room is None:
+                room = self.helper.create_room_as(user_id, tok=access_token)
+            else:
+                self.helper.join(room=room, user=user_id, tok=access_token)
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+        self.helper.join(room=room, user=other_user_id, tok=other_access_token)
+
+        self.helper.send(room, body="Hi!", tok=other_access_token)
+        self.pump()
+
+    @override_config(
+        {"push": {"batch_gateway_urls": ["http://example.com/_matrix/push/v1/notify"]}}
+    )
+    def test_coalesces_notifications(self):
+        """
+        Identical notifications for different devices on the same push gateway
+        are sent in a single request while waiting for earlier requests, if the
+        gateway supports it.
+        """
+        # Only allow one request to the gateway at a time.
+        self.hs.get_push_gateway_client()._limiter.max_count = 1
+
+        localparts = ("user1", "user2", "user3")
+        self._send_message_to_pushers(localparts)
+
+        # The first request is in flight, and the other notifications are
+        # waiting for it.
+        self.assertEqual(len(self.push_attempts), 1)
+        self.push_attempts[0][0].callback({})
+        self.pump()
+
+        # The users all have the same unread count, so the waiting notifications
+        # were sent together.
+        self.assertEqual(len(self.push_attempts), 2)
+        pushkeys = [
+            [d["pushkey"] for d in attempt[2]["notification"]["devices"]]
+            for attempt in self.push_attempts
+        ]
+        self.assertEqual(len(pushkeys[1]), 2)
+        self.assertCountEqual(pushkeys[0] + pushkeys[1], localparts)
+
+        # Each pusher only removes its own rejected pushkey.
+        rejected = pushkeys[1][0]
+        self.push_attempts[1][0].callback({"rejected": [rejected]})
+        self.pump()
+
+        pushers = self.get_success(
+            self.hs.get_datastore().get_pushers_by({"app_id": "m.http"})
+        )
+        self.assertCountEqual(
+            [p.pushkey for p in pushers], set(localparts) - {rejected}
+        )
+
+    def test_no_coalescing_by_default(self):
+        """
+        Notifications are sent to one device per request to push gateways
+        which haven't been configured as supporting several.
+        """
+        # Only allow one request to the gateway at a time.
+        self.hs.get_push_gateway_client()._limiter.max_count = 1
+
+        localparts = ("user1", "user2", "user3")
+        self._send_message_to_pushers(localparts)
+
+        for i in range(len(localparts)):
+            self.assertEqual(len(self.push_attempts), i + 1)
+            self.push_attempts[i][0].callback({})
+            self.pump()
+
+        pushkeys = [
+            [d["pushkey"] for d in attempt[2]["notification"]["devices"]]
+            for attempt in self.push_attempts
+        ]
+        self.assertCountEqual(pushkeys, [[localpart] for localpart in localparts])
+
+    def test_first_notification_includes_devices(self):
+        """
+        A notification sent to a push gateway with no other requests in flight
+        includes its devices.
+        """
+        client = self.hs.get_push_gateway_client()
+        url = "http://example.com/_matrix/push/v1/notify"
+        devices = [{"app_id": "m.http", "pushkey": "a@example.com"}]
+        queued = push_gateway_queued_devices.labels("example.com")
+        queued_before = queued._value.get()
+
+        d = defer.ensureDeferred(
+            client.send_notification(
+                url, {"notification": {"event_id": "$event", "devices": devices}}
+            )
+        )
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.assertEqual(self.push_attempts[0][2]["notification"]["devices"], devices)
+
+        self.push_attempts[0][0].callback({"rejected": ["a@example.com"]})
+        self.assertEqual(self.successResultOf(d), {"rejected": ["a@example.com"]})
+
+        # Nothing is left queued for the gateway.
+        self.assertEqual(queued._value.get(), queued_before)
+
+    @override_config(
+        {"push": {"batch_gateway_urls": ["http://example.com/_matrix/push/v1/notify"]}}
+    )
+    def test_bad_response_fails_every_waiter(self):
+        """
+        Every notification in a request fails if the push gateway's response
+        can't be handled, rather than being left waiting.
+        """
+        client = self.hs.get_push_gateway_client()
+        url = "http://example.com/_matrix/push/v1/notify"
+
+        ds = [
+            defer.ensureDeferred(
+                client.send_notification(
+                    url,
+                    {
+                        "notification": {
+                            "event_id": "$event",
+                            "devices": [{"app_id": "m.http", "pushkey": pushkey}],
+                        }
+                    },
+                )
+            )
+            for pushkey in ("a@example.com", "b@example.com")
+        ]
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.push_attempts[0][0].callback(["not", "an", "object"])
+
+        for d in ds:
+            self.failureResultOf(d, AttributeError)
+
+        # The notification can't be added to any more.
+        self.assertEqual(client._pending, {})
+
+    def test_uses_batched_push_actions(self):
+        """
+        Once a pusher has caught up, it is handed its push actions by the pusher
+        pool rather than fetching them itself.
+        """
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        user_tuple = self.get_success(
+            self.hs.get_datastore().get_user_by_access_token(access_token)
+        )
+        self.get_success(
+            self.hs.get_pusherpool().add_pusher(
+                user_id=user_id,
+                access_token=user_tuple.token_id,
+                kind="http",
+                app_id="m.http",
+                app_display_name="HTTP Push Notifications",
+                device_display_name="pushy push",
+                pushkey="a@example.com",
+                lang=None,
+                data={"url": "http://example.com/_matrix/push/v1/notify"},
+            )
+        )
+
+        room = self.helper.create_room_as(user_id, tok=access_token)
+        self.helper.join(room=room, user=other_user_id, tok=other_access_token)
+
+        # The pusher knows it has nothing to do when it starts.
+        store = self.hs.get_datastore()
+        fetch = Mock(wraps=store.get_unread_push_actions_for_user_in_range_for_http)
+        store.get_unread_push_actions_for_user_in_range_for_http = fetch
+
+        self.helper.send(room, body="Hi!", tok=other_access_token)
+        self.pump()
+
+        self.assertEqual(len(self.push_attempts), 1)
+        self.assertEqual(
+            self.push_attempts[0][2]["notification"]["content"]["body"], "Hi!"
+        )
+        fetch.assert_not_called()
+
+        # If the push fails, the pusher fetches its push actions again when it
+        # retries.
+        self.push_attempts[0][0].errback(Exception("Couldn't connect"))
+        self.pump()
+        self.assertEqual(len(self.push_attempts), 1)
+
+        self.reactor.advance(2)
+        self.assertEqual(len(self.push_attempts), 2)
+        self.assertEqual(
+            self.push_attempts[1][2]["notification"]["content"]["body"], "Hi!"
+        )
+        fetch.assert_called()
+
     def test_sends_high_priority_for_encrypted(self):
         """
         The HTTP pusher will send pushes at high priority if they correspond
@@ -17,13 +17,13 @@ from typing import Any, Dict
 from synapse.api.room_versions import RoomVersions
 from synapse.events import FrozenEvent
 from synapse.push import push_rule_evaluator
-from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent
+from synapse.push.push_rule_evaluator import PushRuleEvaluatorForEvent, WordMatcher
 
 from tests import unittest
 
 
 class PushRuleEvaluatorTestCase(unittest.TestCase):
-    def _get_evaluator(self, content):
+    def _get_evaluator(self, content, word_matcher=None):
         event = FrozenEvent(
             {
                 "event_id": "$event_id",
@@ -39,7 +39,11 @@ class PushRuleEvaluatorTestCase(unittest.TestCase):
         sender_power_level = 0
         power_levels = {}
         return PushRuleEvaluatorForEvent(
-            event, room_member_count, sender_power_level, power_levels
+            event,
+            room_member_count,
+            sender_power_level,
+            power_levels,
+            word_matcher=word_matcher,
         )
 
     def test_display_name(self):
@@ -68,19 +72,64 @@ class PushRuleEvaluatorTestCase(unittest.TestCase):
         # A display name with spaces should work fine.
         self.assertTrue(evaluator.matches(condition, "@user:test", "foo bar"))
 
+    def _get_evaluators(self, condition: Dict[str, Any], content: Dict[str, Any]):
+        """Get evaluators for the content both with and without a word matcher
+        for the pattern of the condition.
+        """
+        word_matcher = WordMatcher([condition.get("pattern", ""), "display_name"])
+        return [
+            self._get_evaluator(content),
+            self._get_evaluator(content, word_matcher=word_matcher),
+        ]
+
     def _assert_matches(
         self, condition: Dict[str, Any], content: Dict[str, Any], msg=None
     ) -> None:
-        evaluator = self._get_evaluator(content)
-        self.assertTrue(evaluator.matches(condition, "@user:test", "display_name"), msg)
+        for evaluator in self._get_evaluators(condition, content):
+            self.assertTrue(
+                evaluator.matches(condition, "@user:test", "display_name"), msg
+            )
 
     def _assert_not_matches(
         self, condition: Dict[str, Any], content: Dict[str, Any], msg=None
     ) -> None:
-        evaluator = self._get_evaluator(content)
-        self.assertFalse(
-            evaluator.matches(condition, "@user:test", "display_name"), msg
+        for evaluator in self._get_evaluators(condition, content):
+            self.assertFalse(
+                evaluator.matches(condition, "@user:test", "display_name"), msg
+            )
+
+    def test_word_matcher(self):
+        """The word matcher finds words in the same places as the regexes."""
+        word_matcher = WordMatcher(["foo", "Foo Bar", "@user:test", "f?o", "ünï"])
+
+        self.assertIn("FOO", word_matcher)
+        self.assertNotIn("f?o", word_matcher)
+        self.assertNotIn("ünï", word_matcher)
+
+        self.assertEqual(
+            word_matcher.find("Hi foo bar, @user:test!"),
+            {"foo", "foo bar", "@user:test"},
         )
+        self.assertEqual(word_matcher.find("foobar xfoo"), set())
+        self.assertEqual(word_matcher.find("foo-bar"), {"foo"})
+
+        # Non-ASCII text has to be searched with the regexes.
+        self.assertIsNone(word_matcher.find("foo ünï"))
+
+        # As do long words, which would make searching slow.
+        long_word = " ".join(["a"] * WordMatcher.MAX_WORD_LENGTH)
+        long_word_matcher = WordMatcher([long_word])
+        self.assertNotIn(long_word, long_word_matcher)
+        evaluator = self._get_evaluator({"body": "x " + long_word}, long_word_matcher)
+        condition = {"kind": "contains_display_name"}
+        self.assertTrue(evaluator.matches(condition, "@user:test", long_word))
+
+        evaluator = self._get_evaluator({"body": "Foo Bar"}, word_matcher)
+        condition = {"kind": "contains_display_name"}
+        self.assertTrue(evaluator.matches(condition, "@user:test", "foo bar"))
+        self.assertFalse(evaluator.matches(condition, "@user:test", "bar foo"))
+        # Display names which aren't in the matcher are still found.
+        self.assertTrue(evaluator.matches(condition, "@user:test", "bar"))
 
     def test_event_match_body(self):
         """Check that event_match conditions on content.body work as expected"""
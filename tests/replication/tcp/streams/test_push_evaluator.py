@@ -0,0 +1,45 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.replication.tcp.streams._base import PushEvaluatorStream
+
+from tests.replication._base import BaseStreamTestCase
+
+
+class PushEvaluatorStreamTestCase(BaseStreamTestCase):
+    def default_config(self):
+        config = super().default_config()
+        config["push_evaluator_instance"] = "master"
+        return config
+
+    def test_position(self):
+        """The push evaluator's position is replicated to workers."""
+        store = self.hs.get_datastore()
+        worker_store = self.worker_hs.get_datastore()
+
+        self.reconnect()
+
+        position = self.get_success(store.get_push_evaluator_position())
+        self.get_success(store.add_push_actions_for_persisted_events([], position + 5))
+        self.replicate()
+
+        stream_name, token, row = self.test_handler.received_rdata_rows.pop()
+        self.assertEqual(stream_name, "push_evaluator")
+        self.assertIsInstance(row, PushEvaluatorStream.PushEvaluatorStreamRow)
+        self.assertEqual(row.stream_id, position + 5)
+        self.assertEqual(token, position + 5)
+
+        self.assertEqual(
+            worker_store.get_current_push_evaluator_position(), position + 5
+        )
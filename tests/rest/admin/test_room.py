@@ -1258,6 +1258,53 @@ class RoomTestCase(unittest.HomeserverTestCase):
         # the create_room already does the right thing, so no need to verify that we got
         # the state events it created.
 
+    def test_compress_room_state(self):
+        """Test that a room can be queued for state compression"""
+        room_id = self.helper.create_room_as(self.admin_user, tok=self.admin_user_tok)
+
+        url = "/_synapse/admin/v1/rooms/%s/compress_state" % (room_id,)
+        channel = self.make_request(
+            "GET",
+            url.encode("ascii"),
+            access_token=self.admin_user_tok,
+        )
+        self.assertEqual(404, channel.code, msg=channel.json_body)
+
+        channel = self.make_request(
+            "POST",
+            url.encode("ascii"),
+            access_token=self.admin_user_tok,
+        )
+        self.assertEqual(200, channel.code, msg=channel.json_body)
+
+        channel = self.make_request(
+            "GET",
+            url.encode("ascii"),
+            access_token=self.admin_user_tok,
+        )
+        self.assertEqual(200, channel.code, msg=channel.json_body)
+        self.assertTrue(channel.json_body["pending"])
+
+        # let the background compressor run
+        self.reactor.advance(60)
+
+        channel = self.make_request(
+            "GET",
+            url.encode("ascii"),
+            access_token=self.admin_user_tok,
+        )
+        self.assertEqual(200, channel.code, msg=channel.json_body)
+        self.assertFalse(channel.json_body["pending"])
+        self.assertGreater(channel.json_body["last_compressed_group"], 0)
+
+        # unknown rooms can't be queued
+        channel = self.make_request(
+            "POST",
+            b"/_synapse/admin/v1/rooms/!unknown:test/compress_state",
+            access_token=self.admin_user_tok,
+        )
+        self.assertEqual(404, channel.code, msg=channel.json_body)
+
 
 class JoinAliasRoomTestCase(unittest.HomeserverTestCase):
 
@@ -1744,6 +1791,7 @@ PURGE_TABLES = [
     "event_push_actions",
     "event_search",
     "events",
+    "federation_inbound_events_staging",
     "group_rooms",
     "public_room_list_stream",
     "receipts_graph",
@@ -16,6 +16,7 @@ import json
 
 import synapse.rest.admin
 from synapse.api.constants import EventContentFields, EventTypes, RelationTypes
+from synapse.handlers.sync import SLIDING_WINDOW_CONNECTIONS_MAX_PER_DEVICE
 from synapse.rest.client.v1 import login, room
 from synapse.rest.client.v2_alpha import read_marker, sync
 
@@ -447,6 +448,31 @@ class UnreadMessagesTestCase(unittest.HomeserverTestCase):
         )
         self._check_unread_count(5)
 
+    @unittest.override_config({"push_evaluator_instance": "master"})
+    def test_unread_counts_with_async_push_evaluation(self):
+        """Clients aren't sent new events until the unread counts include them,
+        when push actions are computed after events are persisted.
+        """
+        self.helper.join(room=self.room_id, user=self.user2, tok=self.tok2)
+        self._check_unread_count(0)
+
+        channel = self.make_request(
+            "GET",
+            "/sync?timeout=10000&since=" + self.next_batch,
+            access_token=self.tok,
+            await_result=False,
+        )
+        self.helper.send(self.room_id, "hello", tok=self.tok2)
+
+        self.reactor.advance(1)
+        channel.await_result()
+        self.assertEqual(channel.code, 200, channel.json_body)
+
+        room_entry = channel.json_body["rooms"]["join"][self.room_id]
+        self.assertEqual(len(room_entry["timeline"]["events"]), 1)
+        self.assertEqual(room_entry["org.matrix.msc2654.unread_count"], 1)
+        self.assertEqual(room_entry["unread_notifications"]["notification_count"], 1)
+
     def _check_unread_count(self, expected_count: True):
         """Syncs and compares the unread count with the expected value."""
 
@@ -467,3 +493,209 @@ class UnreadMessagesTestCase(unittest.HomeserverTestCase):
 
         # Store the next batch for the next request.
         self.next_batch = channel.json_body["next_batch"]
+
+
+class SlidingWindowSyncTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def default_config(self):
+        config = super().default_config()
+        config["experimental_features"] = {"sliding_window_sync_enabled": True}
+        return config
+
+    def prepare(self, reactor, clock, hs):
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+
+        # Create some rooms, with the most recently active last.
+        self.room_ids = []
+        for i in range(3):
+            room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+            self.helper.send_state(
+                room_id, EventTypes.Name, {"name": "room %d" % (i,)}, tok=self.tok
+            )
+            self.helper.send(room_id, "message %d" % (i,), tok=self.tok)
+            self.room_ids.append(room_id)
+
+        self.body = {
+            "window": {
+                "range": [0, 1],
+                "timeline_limit": 1,
+                "required_state": [[EventTypes.Name, ""]],
+            }
+        }
+
+    def sliding_sync(self, since=None, expected_code=200):
+        url = "/_matrix/client/unstable/org.matrix.sliding_window_sync/sync"
+        if since:
+            url += "?since=" + since
+        channel = self.make_request("POST", url, self.body, access_token=self.tok)
+        self.assertEqual(channel.code, expected_code, channel.json_body)
+        return channel.json_body
+
+    def test_window(self):
+        """Only the rooms in the window are sent, most recent first, and rooms
+        are sent in full when they enter the window.
+        """
+        result = self.sliding_sync()
+
+        self.assertEqual(result["count"], 3)
+        self.assertEqual(result["window"], [self.room_ids[2], self.room_ids[1]])
+        self.assertEqual(
+            set(result["rooms"]["join"]), {self.room_ids[2], self.room_ids[1]}
+        )
+
+        room = result["rooms"]["join"][self.room_ids[2]]
+        self.assertEqual(len(room["timeline"]["events"]), 1)
+        self.assertEqual(
+            [ev["type"] for ev in room["state"]["events"]], [EventTypes.Name]
+        )
+
+        # Nothing has changed, so an incremental sync is empty.
+        result = self.sliding_sync(result["next_batch"])
+        self.assertEqual(result["window"], [self.room_ids[2], self.room_ids[1]])
+        self.assertEqual(result["rooms"]["join"], {})
+
+        # Activity in the oldest room moves it into the window. It gets sent in
+        # full, and the room which was already in the window isn't sent again.
+        self.helper.send(self.room_ids[0], "hello", tok=self.tok)
+        result = self.sliding_sync(result["next_batch"])
+
+        self.assertEqual(result["window"], [self.room_ids[0], self.room_ids[2]])
+        self.assertEqual(list(result["rooms"]["join"]), [self.room_ids[0]])
+
+        room = result["rooms"]["join"][self.room_ids[0]]
+        self.assertEqual(room["timeline"]["events"][0]["content"]["body"], "hello")
+        self.assertEqual(room["state"]["events"][0]["content"]["name"], "room 0")
+
+        # New activity in a room staying in the window is sent as an update.
+        self.helper.send(self.room_ids[0], "again", tok=self.tok)
+        result = self.sliding_sync(result["next_batch"])
+
+        self.assertEqual(list(result["rooms"]["join"]), [self.room_ids[0]])
+        room = result["rooms"]["join"][self.room_ids[0]]
+        self.assertEqual(room["timeline"]["events"][0]["content"]["body"], "again")
+        self.assertEqual(room["state"]["events"], [])
+
+    def test_old_positions_forgotten(self):
+        """Only the position a connection last synced from and the one it was
+        sent are remembered.
+        """
+        first = self.sliding_sync()["next_batch"]
+
+        self.helper.send(self.room_ids[0], "hello", tok=self.tok)
+        second = self.sliding_sync(first)["next_batch"]
+
+        self.helper.send(self.room_ids[0], "again", tok=self.tok)
+        self.sliding_sync(second)
+
+        # The client can retry its last sync, but can't go back any further.
+        self.sliding_sync(second)
+        result = self.sliding_sync(first, expected_code=400)
+        self.assertEqual(result["errcode"], "M_UNKNOWN_POS")
+
+    def test_connections_limited(self):
+        """Only a limited number of connections are remembered per device."""
+        since = self.sliding_sync()["next_batch"]
+
+        for i in range(SLIDING_WINDOW_CONNECTIONS_MAX_PER_DEVICE):
+            self.body["conn_id"] = "conn%d" % (i,)
+            self.sliding_sync()
+
+        del self.body["conn_id"]
+        result = self.sliding_sync(since, expected_code=400)
+        self.assertEqual(result["errcode"], "M_UNKNOWN_POS")
+
+    def test_unknown_since(self):
+        result = self.sliding_sync(since="s12345", expected_code=400)
+        self.assertEqual(result["errcode"], "M_UNKNOWN_POS")
+
+
+class GappySyncTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+        sync.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.user_id = self.register_user("kermit", "monkey")
+        self.tok = self.login("kermit", "monkey")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+    def _sync(self, filter_json, since=None):
+        url = "/sync?filter=" + json.dumps(filter_json)
+        if since:
+            url += "&since=" + since
+        channel = self.make_request("GET", url, access_token=self.tok)
+        self.assertEqual(channel.code, 200, channel.json_body)
+        return channel.json_body
+
+    def test_state_changed_in_gap(self):
+        """State which changed during the gap is returned, and nothing else."""
+        filter_json = {"room": {"timeline": {"limit": 2}}}
+        since = self._sync(filter_json)["next_batch"]
+
+        self.helper.send_state(
+            self.room_id, EventTypes.Name, {"name": "first"}, tok=self.tok
+        )
+        self.helper.send_state(
+            self.room_id, EventTypes.Topic, {"topic": "topic"}, tok=self.tok
+        )
+        self.helper.send_state(
+            self.room_id, EventTypes.Name, {"name": "second"}, tok=self.tok
+        )
+        for i in range(3):
+            self.helper.send(self.room_id, "message %d" % (i,), tok=self.tok)
+
+        room = self._sync(filter_json, since)["rooms"]["join"][self.room_id]
+        self.assertTrue(room["timeline"]["limited"])
+        state = {ev["type"]: ev["content"] for ev in room["state"]["events"]}
+        self.assertEqual(
+            state,
+            {EventTypes.Name: {"name": "second"}, EventTypes.Topic: {"topic": "topic"}},
+        )
+
+    def test_lazy_loaded_members_in_gap(self):
+        """When lazy-loading members, the members of the timeline senders are
+        returned along with the state which changed during the gap.
+        """
+        other_user_id = self.register_user("other", "pass")
+        other_tok = self.login("other", "pass")
+        self.helper.join(self.room_id, other_user_id, tok=other_tok)
+
+        filter_json = {
+            "room": {
+                "timeline": {"limit": 2},
+                "state": {
+                    "lazy_load_members": True,
+                    "include_redundant_members": True,
+                },
+            }
+        }
+        since = self._sync(filter_json)["next_batch"]
+
+        self.helper.send_state(
+            self.room_id, EventTypes.Name, {"name": "name"}, tok=self.tok
+        )
+        for i in range(3):
+            self.helper.send(self.room_id, "message %d" % (i,), tok=self.tok)
+        self.helper.send(self.room_id, "hello", tok=other_tok)
+
+        room = self._sync(filter_json, since)["rooms"]["join"][self.room_id]
+        self.assertTrue(room["timeline"]["limited"])
+        state = {(ev["type"], ev["state_key"]) for ev in room["state"]["events"]}
+        self.assertEqual(
+            state,
+            {
+                (EventTypes.Name, ""),
+                (EventTypes.Member, self.user_id),
+                (EventTypes.Member, other_user_id),
+            },
+        )
@@ -13,7 +13,9 @@
 # limitations under the License.
 
 import itertools
+import pickle
 from typing import List
+from unittest.mock import Mock
 
 import attr
 
@@ -23,6 +25,7 @@ from synapse.api.constants import EventTypes, JoinRules, Membership
 from synapse.api.room_versions import RoomVersions
 from synapse.event_auth import auth_types_for_event
 from synapse.events import make_event_from_dict
+from synapse.state.executor import StateResolutionExecutor, _resolve_in_subprocess
 from synapse.state.v2 import (
     _get_auth_chain_difference,
     lexicographical_topological_sort,
@@ -164,6 +167,9 @@ INITIAL_EDGES = ["START", "IMZ", "IMC", "IMB", "IJR", "IPOWER", "IMA", "CREATE"]
 
 
 class StateTestCase(unittest.TestCase):
+    # if set, passed to `resolve_events_with_store`
+    executor = None
+
     def test_ban_vs_pl(self):
         events = [
             FakeEvent(
@@ -488,6 +494,7 @@ class StateTestCase(unittest.TestCase):
                     [state_at_event[n] for n in prev_events],
                     event_map=event_map,
                     state_res_store=TestStateResolutionStore(event_map),
+                    executor=self.executor,
                 )
 
                 state_before = self.successResultOf(defer.ensureDeferred(state_d))
@@ -529,6 +536,65 @@ class StateTestCase(unittest.TestCase):
         self.assertEqual(expected_state, end_state)
 
 
+class InProcessStateResolutionExecutor(StateResolutionExecutor):
+    """A StateResolutionExecutor which runs the subprocess entry point in this
+    process.
+
+    The first time it is called for a resolution it only passes on the events in
+    the full conflicted set, so that the fetching of missing events is exercised.
+    """
+
+    def __init__(self):
+        hs = Mock(spec=["config", "get_clock", "get_reactor"])
+        hs.config.experimental.state_res_worker_processes = 1
+        hs.config.experimental.state_res_worker_min_conflicted_events = 0
+        hs.get_clock.return_value = FakeClock()
+        super().__init__(hs)
+
+        self.calls = 0
+
+    async def _run_in_pool(
+        self,
+        room_id,
+        room_version,
+        unconflicted_state,
+        full_conflicted_set,
+        events,
+        known_missing,
+    ):
+        self.calls += 1
+        if self.calls % 2:
+            events = [ev for ev in events if ev[0] in full_conflicted_set]
+
+        # make sure that everything survives being sent to another process.
+        args = pickle.loads(
+            pickle.dumps(
+                (
+                    room_id,
+                    room_version,
+                    unconflicted_state,
+                    full_conflicted_set,
+                    events,
+                    known_missing,
+                )
+            )
+        )
+        return _resolve_in_subprocess(*args)
+
+
+class StateResolutionExecutorTestCase(StateTestCase):
+    """Runs the state resolution tests through the StateResolutionExecutor."""
+
+    def setUp(self):
+        self.executor = InProcessStateResolutionExecutor()
+
+    def tearDown(self):
+        # check that we did actually use the executor, and that it never had to
+        # give up and resolve inline.
+        self.assertGreater(self.executor.calls, 0)
+        self.assertEqual(self.executor.calls % 2, 0)
+
+
 class LexicographicalTestCase(unittest.TestCase):
     def test_simple(self):
         graph = {"l": {"o"}, "m": {"n", "o"}, "n": {"o"}, "o": set(), "p": {"o"}}
@@ -15,6 +15,7 @@
 from typing import Iterable, Set
 
 from synapse.api.constants import AccountDataTypes
+from synapse.api.filtering import Filter
 
 from tests import unittest
 
@@ -119,3 +120,97 @@ class IgnoredUsersTestCase(unittest.HomeserverTestCase):
 
         # No one ignores the user now.
         self.assert_ignorers("@other:test", set())
+
+
+class AccountDataForUserTestCase(unittest.HomeserverTestCase):
+    def prepare(self, hs, reactor, clock):
+        self.store = self.hs.get_datastore()
+        self.user = "@user:test"
+
+    def test_changes_are_applied_to_cache(self):
+        """Changes to the account data and tags are applied to the cached copy,
+        rather than reloading it.
+        """
+        self.get_success(
+            self.store.add_account_data_for_user(self.user, "m.one", {"a": 1})
+        )
+        self.get_success(
+            self.store.add_tag_to_room(self.user, "!room:test", "m.favourite", {})
+        )
+        self.get_success(self.store.get_account_data_for_user(self.user))
+        self.get_success(self.store.get_tags_for_user(self.user))
+
+        self.get_success(
+            self.store.add_account_data_for_user(self.user, "m.one", {"a": 2})
+        )
+        self.get_success(
+            self.store.add_account_data_to_room(
+                self.user, "!room:test", "m.two", {"b": 1}
+            )
+        )
+        self.get_success(
+            self.store.remove_tag_from_room(self.user, "!room:test", "m.favourite")
+        )
+        self.get_success(
+            self.store.add_tag_to_room(self.user, "!other:test", "u.work", {})
+        )
+
+        account_data = self.get_success(self.store.get_account_data_for_user(self.user))
+        self.assertEqual(
+            account_data,
+            ({"m.one": {"a": 2}}, {"!room:test": {"m.two": {"b": 1}}}),
+        )
+        tags = self.get_success(self.store.get_tags_for_user(self.user))
+        self.assertEqual(tags, {"!other:test": {"u.work": {}}})
+
+        # Neither was loaded from scratch again.
+        self.assertEqual(
+            self.store._get_versioned_account_data_for_user.cache.cache.metrics.misses,
+            1,
+        )
+        self.assertEqual(
+            self.store._get_versioned_tags_for_user.cache.cache.metrics.misses, 1
+        )
+
+    def test_filtered_account_data(self):
+        """Only account data with the types matching the filters is returned,
+        whether or not the account data is cached.
+        """
+        for account_data_type in ("m.one", "m.two", "org.example.three"):
+            self.get_success(
+                self.store.add_account_data_for_user(self.user, account_data_type, {})
+            )
+            self.get_success(
+                self.store.add_account_data_to_room(
+                    self.user, "!room:test", account_data_type, {}
+                )
+            )
+
+        account_data_filter = Filter({"types": ["m.*"], "not_types": ["m.two"]})
+        room_account_data_filter = Filter({"types": ["org.example.three"]})
+        expected = ({"m.one": {}}, {"!room:test": {"org.example.three": {}}})
+
+        account_data = self.get_success(
+            self.store.get_filtered_account_data_for_user(
+                self.user, account_data_filter, room_account_data_filter
+            )
+        )
+        self.assertEqual(account_data, expected)
+
+        self.get_success(self.store.get_account_data_for_user(self.user))
+        account_data = self.get_success(
+            self.store.get_filtered_account_data_for_user(
+                self.user, account_data_filter, room_account_data_filter
+            )
+        )
+        self.assertEqual(account_data, expected)
+
+        account_data = self.get_success(
+            self.store.get_updated_account_data_for_user(
+                self.user,
+                0,
+                account_data_filter=account_data_filter,
+                room_account_data_filter=room_account_data_filter,
+            )
+        )
+        self.assertEqual(account_data, expected)
@@ -12,8 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 from unittest.mock import Mock
 
+import synapse.rest.admin
+from synapse.rest.client.v1 import login, room
+from synapse.rest.client.v2_alpha import read_marker
+
 from tests.unittest import HomeserverTestCase
 
 USER_ID = "@user:example.com"
@@ -209,3 +214,131 @@ class EventPushActionsStoreTestCase(HomeserverTestCase):
         add_event(0, 5)
         r = self.get_success(self.store.find_first_stream_ordering_after_ts(1))
         self.assertEqual(r, 0)
+
+
+class UnreadCountsForRoomsTestCase(HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets,
+        login.register_servlets,
+        read_marker.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.other_user_id = self.register_user("other", "pass")
+        self.other_tok = self.login("other", "pass")
+
+        self.room_ids = []
+        for _ in range(3):
+            room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+            self.helper.join(room_id, self.other_user_id, tok=self.other_tok)
+            self.room_ids.append(room_id)
+
+    def _get_notify_counts(self):
+        counts = self.get_success(
+            self.store.get_unread_counts_for_rooms_for_user(self.room_ids, self.user_id)
+        )
+        self.assertEqual(set(counts), set(self.room_ids))
+        return [counts[room_id]["notify_count"] for room_id in self.room_ids]
+
+    def test_counts_for_rooms(self):
+        """Counts are computed per room, from each room's read receipt."""
+        self.assertEqual(self._get_notify_counts(), [0, 0, 0])
+
+        for i, room_id in enumerate(self.room_ids):
+            for _ in range(i + 1):
+                res = self.helper.send(room_id, "hello", tok=self.other_tok)
+
+        # The counts are invalidated when new push actions are persisted.
+        self.assertEqual(self._get_notify_counts(), [1, 2, 3])
+
+        # ... and when the user sends a read receipt.
+        channel = self.make_request(
+            "POST",
+            "/rooms/%s/read_markers" % (self.room_ids[2],),
+            json.dumps({"m.read": res["event_id"]}).encode("utf8"),
+            access_token=self.tok,
+        )
+        self.assertEqual(channel.code, 200, channel.json_body)
+        self.assertEqual(self._get_notify_counts(), [1, 2, 0])
+
+        # The single room lookup shares the same cache.
+        counts = self.get_success(
+            self.store.get_unread_counts_for_room_for_user(
+                self.room_ids[1], self.user_id
+            )
+        )
+        self.assertEqual(
+            counts, {"notify_count": 2, "unread_count": 2, "highlight_count": 0}
+        )
+
+    def test_reconcile_push_counts(self):
+        """Drifted counts are repaired by the reconciliation job."""
+        for room_id in self.room_ids:
+            self.helper.send(room_id, "hello", tok=self.other_tok)
+        self.assertEqual(self._get_notify_counts(), [1, 1, 1])
+
+        # Mess up the stored counts.
+        self.get_success(
+            self.store.db_pool.simple_update(
+                table="event_push_counts",
+                keyvalues={"user_id": self.user_id},
+                updatevalues={"notif_count": 5},
+                desc="",
+            )
+        )
+        self.store.get_unread_counts_for_room_for_user.invalidate_all()
+        self.assertEqual(self._get_notify_counts(), [5, 5, 5])
+
+        self.store._reconcile_batch_size = 2
+        self.store._reconcile_batches_per_run = 1
+        self.get_success(self.store._reconcile_push_counts())
+
+        # The position is stored, so that the next run carries on from it even
+        # after a restart.
+        pos = self.get_success(
+            self.store.db_pool.simple_select_list(
+                table="event_push_counts_reconcile_position",
+                keyvalues=None,
+                retcols=("user_id", "room_id"),
+            )
+        )
+        self.assertEqual(len(pos), 1)
+        self.assertNotEqual(pos[0], {"user_id": "", "room_id": ""})
+
+        self.get_success(self.store._reconcile_push_counts())
+        self.assertEqual(self._get_notify_counts(), [1, 1, 1])
+
+        # Once the user leaves a room its counts are dropped.
+        self.helper.leave(self.room_ids[0], self.user_id, tok=self.tok)
+        self.get_success(self.store._reconcile_push_counts())
+        self.get_success(self.store._reconcile_push_counts())
+        rows = self.get_success(
+            self.store.db_pool.simple_select_onecol(
+                table="event_push_counts",
+                keyvalues={"user_id": self.user_id},
+                retcol="room_id",
+                desc="",
+            )
+        )
+        self.assertEqual(set(rows), set(self.room_ids[1:]))
+
+    def test_counts_dropped_on_leave(self):
+        """A user's counts in a room are dropped as soon as they leave it."""
+        self.helper.send(self.room_ids[0], "hello", tok=self.other_tok)
+        self.assertEqual(self._get_notify_counts(), [1, 0, 0])
+
+        self.helper.leave(self.room_ids[0], self.user_id, tok=self.tok)
+        rows = self.get_success(
+            self.store.db_pool.simple_select_onecol(
+                table="event_push_counts",
+                keyvalues={"user_id": self.user_id, "room_id": self.room_ids[0]},
+                retcol="notif_count",
+                desc="",
+            )
+        )
+        self.assertEqual(rows, [])
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-
 from synapse.api.constants import EventTypes, Membership
 from synapse.api.room_versions import RoomVersions
 from synapse.federation.federation_base import event_from_pdu_json
@@ -329,3 +328,62 @@ class ExtremPruneTestCase(HomeserverTestCase):
 
         # Check the new extremity is just the new remote event.
         self.assert_extremities([local_message_event_id, remote_event_2.event_id])
+
+
+class CurrentStateDeltaTestCase(HomeserverTestCase):
+    def prepare(self, reactor, clock, homeserver):
+        self.persistence = self.hs.get_storage().persistence
+        self.state_storage = self.hs.get_storage().state
+
+    def store_state_group(self, prev_group, delta_ids, current_state_ids):
+        return self.get_success(
+            self.state_storage.store_state_group(
+                "$event", "!room:test", prev_group, delta_ids, current_state_ids
+            )
+        )
+
+    def test_delta_from_state_group_chain(self):
+        """The delta between state groups should be worked out from the state
+        group deltas where one descends from the other.
+        """
+        state = {("m.room.create", ""): "$create", ("test.state", ""): "$a"}
+        group_0 = self.store_state_group(None, None, state)
+
+        delta_1 = {("test.state", "1"): "$1"}
+        state = {**state, **delta_1}
+        group_1 = self.store_state_group(group_0, delta_1, state)
+
+        delta_2 = {("test.state", "2"): "$2", ("test.state", ""): "$b"}
+        state = {**state, **delta_2}
+        group_2 = self.store_state_group(group_1, delta_2, state)
+
+        # a sibling of group_2
+        delta_3 = {("test.state", "3"): "$3"}
+        group_3 = self.store_state_group(group_1, delta_3, {**state, **delta_3})
+
+        delta_ids = self.get_success(
+            self.persistence._get_state_delta_from_chain(group_0, group_2, {})
+        )
+        self.assertEqual(
+            delta_ids,
+            {
+                ("test.state", "1"): "$1",
+                ("test.state", "2"): "$2",
+                ("test.state", ""): "$b",
+            },
+        )
+
+        # deltas which are already in memory are used in preference to the
+        # database
+        delta_ids = self.get_success(
+            self.persistence._get_state_delta_from_chain(
+                group_1, group_2, {(group_1, group_2): {("test.state", "2"): "$2"}}
+            )
+        )
+        self.assertEqual(delta_ids, {("test.state", "2"): "$2"})
+
+        # group_3 doesn't descend from group_2
+        delta_ids = self.get_success(
+            self.persistence._get_state_delta_from_chain(group_2, group_3, {})
+        )
+        self.assertIsNone(delta_ids)
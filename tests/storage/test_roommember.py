@@ -16,6 +16,7 @@
 from synapse.api.constants import Membership
 from synapse.rest.admin import register_servlets_for_client_rest_resource
 from synapse.rest.client.v1 import login, room
+from synapse.storage.databases.main.roommember import _build_member_summaries
 from synapse.types import UserID, create_requester
 
 from tests import unittest
@@ -161,6 +162,43 @@ class RoomMemberStoreTestCase(unittest.HomeserverTestCase):
         )
         self.assertEqual(users.keys(), {self.u_alice, self.u_bob})
 
+    def test_room_summary(self):
+        """The stored room summary is kept in line with the room's members."""
+        room_id = self.helper.create_room_as(self.u_alice, tok=self.t_alice)
+
+        def _compute_summary_txn(txn):
+            return _build_member_summaries(
+                self.store._get_room_membership_counts_txn(txn, room_id),
+                self.store._get_room_heroes_txn(txn, room_id),
+            )
+
+        def assert_summary_correct():
+            summary = self.get_success(self.store.get_room_summary(room_id))
+            expected = self.get_success(
+                self.store.db_pool.runInteraction("", _compute_summary_txn)
+            )
+            self.assertEqual(summary, expected)
+            return summary
+
+        users = ["@user%d:elsewhere" % (i,) for i in range(8)]
+        for user_id in users:
+            self.inject_room_member(room_id, user_id, Membership.JOIN)
+            assert_summary_correct()
+
+        self.inject_room_member(room_id, self.u_bob, Membership.INVITE)
+        summary = assert_summary_correct()
+        self.assertEqual(summary[Membership.JOIN].count, 9)
+        self.assertEqual(summary[Membership.INVITE].count, 1)
+
+        # Members leaving, including the heroes, are replaced by other members.
+        for user_id, _ in list(summary[Membership.JOIN].members):
+            self.inject_room_member(room_id, user_id, Membership.LEAVE)
+            assert_summary_correct()
+
+        self.inject_room_member(room_id, users[0], Membership.BAN)
+        summary = assert_summary_correct()
+        self.assertEqual(summary[Membership.BAN].count, 1)
+
 
 class CurrentStateMembershipUpdateTestCase(unittest.HomeserverTestCase):
     def prepare(self, reactor, clock, homeserver):
@@ -13,13 +13,18 @@
 # limitations under the License.
 
 import logging
+from unittest.mock import patch
 
 from synapse.api.constants import EventTypes, Membership
 from synapse.api.room_versions import RoomVersions
+from synapse.storage.databases.state.store import (
+    _CompressorLevel,
+    _get_compressed_prev_group,
+)
 from synapse.storage.state import StateFilter
 from synapse.types import RoomID, UserID
 
-from tests.unittest import HomeserverTestCase
+from tests.unittest import HomeserverTestCase, TestCase
 
 logger = logging.getLogger(__name__)
 
@@ -102,6 +107,128 @@ class StateStoreTestCase(HomeserverTestCase):
 
         self.assertEqual({ev.event_id for ev in state_list}, {e1.event_id, e2.event_id})
 
+    @patch("synapse.storage.databases.state.store.STATE_COMPRESSOR_LEVELS", (3, 2))
+    def test_compress_state_groups(self):
+        """Compressing the state groups of a room should bound the length of the
+        delta chains without changing the state of any group.
+        """
+        self.inject_state_event(self.room, self.u_alice, EventTypes.Create, "", {})
+        for i in range(10):
+            self.inject_state_event(
+                self.room, self.u_alice, EventTypes.Name, "", {"name": "room %d" % i}
+            )
+            self.inject_state_event(
+                self.room,
+                self.u_alice,
+                EventTypes.Member,
+                "@user%d:test" % (i,),
+                {"membership": Membership.JOIN},
+            )
+
+        state_groups = self.get_success(
+            self.state_datastore.db_pool.simple_select_onecol(
+                table="state_groups",
+                keyvalues={"room_id": self.room.to_string()},
+                retcol="id",
+            )
+        )
+        self.assertGreater(len(state_groups), 10)
+
+        # read the state directly from the database, rather than via the caches.
+        state_before = self.get_success(
+            self.state_datastore._get_state_groups_from_groups(
+                state_groups, StateFilter.all()
+            )
+        )
+
+        self.get_success(
+            self.state_datastore.queue_room_for_state_compression(self.room.to_string())
+        )
+        while not self.get_success(
+            self.state_datastore.compress_state_groups_for_room(
+                self.room.to_string(), batch_size=4
+            )
+        ):
+            pass
+
+        state_after = self.get_success(
+            self.state_datastore._get_state_groups_from_groups(
+                state_groups, StateFilter.all()
+            )
+        )
+        self.assertEqual(state_before, state_after)
+
+        # the longest chain allowed by the levels is 3 + 2 deltas
+        for state_group in state_groups:
+            hops = self.get_success(
+                self.state_datastore.db_pool.runInteraction(
+                    "count_hops",
+                    self.state_datastore._count_state_group_hops_txn,
+                    state_group,
+                )
+            )
+            self.assertLessEqual(hops, 5)
+
+        progress = self.get_success(
+            self.state_datastore.get_state_compression_progress(self.room.to_string())
+        )
+        self.assertFalse(progress["pending"])
+        self.assertEqual(progress["last_compressed_group"], max(state_groups))
+
+    def test_get_state_keys_changed_between_groups(self):
+        """The keys which changed between two groups on the same delta chain
+        are read from the deltas between them.
+        """
+        self.inject_state_event(self.room, self.u_alice, EventTypes.Create, "", {})
+        e_name = self.inject_state_event(
+            self.room, self.u_alice, EventTypes.Name, "", {"name": "test room"}
+        )
+        e_topic = self.inject_state_event(
+            self.room, self.u_alice, EventTypes.Topic, "", {"topic": "topic"}
+        )
+        e_member = self.inject_state_event(
+            self.room,
+            self.u_bob,
+            EventTypes.Member,
+            self.u_bob.to_string(),
+            {"membership": Membership.JOIN},
+        )
+
+        event_to_groups = self.get_success(
+            self.store._get_state_group_for_events(
+                [e_name.event_id, e_topic.event_id, e_member.event_id]
+            )
+        )
+
+        changed = self.get_success(
+            self.storage.state.get_state_keys_changed_between_groups(
+                event_to_groups[e_name.event_id],
+                [event_to_groups[e_topic.event_id], event_to_groups[e_member.event_id]],
+            )
+        )
+        self.assertEqual(
+            changed,
+            {(EventTypes.Topic, ""), (EventTypes.Member, self.u_bob.to_string())},
+        )
+
+        # the comparison goes both ways
+        changed = self.get_success(
+            self.storage.state.get_state_keys_changed_between_groups(
+                event_to_groups[e_member.event_id], [event_to_groups[e_name.event_id]]
+            )
+        )
+        self.assertEqual(
+            changed,
+            {(EventTypes.Topic, ""), (EventTypes.Member, self.u_bob.to_string())},
+        )
+
+        changed = self.get_success(
+            self.storage.state.get_state_keys_changed_between_groups(
+                event_to_groups[e_topic.event_id], [event_to_groups[e_topic.event_id]]
+            )
+        )
+        self.assertEqual(changed, set())
+
     def test_get_state_for_event(self):
 
         # this defaults to a linear DAG as each new injection defaults to whatever
@@ -471,3 +598,13 @@ class StateStoreTestCase(HomeserverTestCase):
 
         self.assertEqual(is_all, True)
         self.assertDictEqual({(e5.type, e5.state_key): e5.event_id}, state_dict)
+
+
+class CompressedPrevGroupTestCase(TestCase):
+    def test_only_first_group_stored_in_full(self):
+        """Only the first group, and those which come after every level is full,
+        are stored in full.
+        """
+        levels = [_CompressorLevel(3), _CompressorLevel(2)]
+        prev_groups = [_get_compressed_prev_group(levels, sg) for sg in range(1, 9)]
+        self.assertEqual(prev_groups, [None, 1, 2, 1, 4, 5, None, 7])
@@ -0,0 +1,128 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import synapse.rest.admin
+from synapse.api.filtering import Filter
+from synapse.rest.client.v1 import login, room
+
+from tests.unittest import HomeserverTestCase
+
+
+class RoomEventsStreamForRoomsTestCase(HomeserverTestCase):
+    servlets = [
+        synapse.rest.admin.register_servlets_for_client_rest_resource,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+
+        self.room_ids = [
+            self.helper.create_room_as(self.user_id, tok=self.tok) for _ in range(3)
+        ]
+        self.from_key = self.store.get_room_max_token()
+
+        # Interleave the events in the different rooms.
+        self.event_ids = {room_id: [] for room_id in self.room_ids}
+        for i in range(4):
+            for room_id in self.room_ids:
+                for event_type in ("m.room.message", "com.example.other"):
+                    event_id = self.helper.send_event(
+                        room_id,
+                        event_type,
+                        content={"body": str(i), "msgtype": "m.text"},
+                        tok=self.tok,
+                    )["event_id"]
+                    self.event_ids[room_id].append((event_type, event_id))
+
+        self.to_key = self.store.get_room_max_token()
+
+    def _get(self, limit, event_filter=None):
+        return self.get_success(
+            self.store.get_room_events_stream_for_rooms(
+                self.room_ids,
+                self.from_key,
+                self.to_key,
+                limit=limit,
+                event_filter=event_filter,
+            )
+        )
+
+    def test_limit_per_room(self):
+        """Each room gets its own most recent events, in ascending order."""
+        results = self._get(limit=3)
+
+        self.assertEqual(set(results), set(self.room_ids))
+        for room_id in self.room_ids:
+            events, start_key = results[room_id]
+            expected = [event_id for _, event_id in self.event_ids[room_id][-3:]]
+            self.assertEqual([e.event_id for e in events], expected)
+            self.assertEqual(start_key.stream, events[0].internal_metadata.after.stream)
+            self.assertEqual(
+                events[0].internal_metadata.before.stream, start_key.stream - 1
+            )
+
+    def test_filter(self):
+        """The filter's type clauses are applied before the limit."""
+        for filter_json in (
+            {"types": ["m.room.message"]},
+            {"types": ["m.room.*"]},
+            {"not_types": ["com.example.*"]},
+        ):
+            results = self._get(limit=3, event_filter=Filter(filter_json))
+
+            for room_id in self.room_ids:
+                events, _ = results[room_id]
+                expected = [
+                    event_id
+                    for event_type, event_id in self.event_ids[room_id]
+                    if event_type == "m.room.message"
+                ][-3:]
+                self.assertEqual([e.event_id for e in events], expected, filter_json)
+
+    def test_paginate_filter_wildcards(self):
+        """Paginating a room applies the filter's type wildcards too."""
+        room_id = self.room_ids[0]
+        for filter_json, expected_type in (
+            ({"types": ["m.room.*"]}, "m.room.message"),
+            ({"not_types": ["m.room.*"]}, "com.example.other"),
+        ):
+            events, _ = self.get_success(
+                self.store.paginate_room_events(
+                    room_id,
+                    self.to_key,
+                    self.from_key,
+                    limit=10,
+                    event_filter=Filter(filter_json),
+                )
+            )
+            expected = [
+                event_id
+                for event_type, event_id in reversed(self.event_ids[room_id])
+                if event_type == expected_type
+            ]
+            self.assertEqual([e.event_id for e in events], expected, filter_json)
+
+    def test_no_new_events(self):
+        """Rooms which haven't changed are omitted."""
+        results = self.get_success(
+            self.store.get_room_events_stream_for_rooms(
+                self.room_ids, self.to_key, self.to_key, limit=3
+            )
+        )
+        self.assertEqual(results, {})
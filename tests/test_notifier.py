@@ -0,0 +1,82 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.notifier import _NotifierUserStream
+from synapse.types import RoomStreamToken, StreamToken
+
+from tests import unittest
+
+
+class NotifierWakeupTestCase(unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.notifier = hs.get_notifier()
+        self.room_id = "!room:test"
+
+    def _add_listeners(self, count):
+        """Register `count` user streams in the room, each with a listener.
+
+        Returns:
+            A list which the tokens each listener is woken with are appended to.
+        """
+        woken = []
+        for i in range(count):
+            user_stream = _NotifierUserStream(
+                user_id="@user%d:test" % (i,),
+                rooms=[self.room_id],
+                current_token=StreamToken.START,
+                time_now_ms=self.clock.time_msec(),
+            )
+            self.notifier._register_with_keys(user_stream)
+            listener = user_stream.new_listener(StreamToken.START)
+            listener.deferred.addCallback(woken.append)
+        return woken
+
+    def test_wakeups_are_batched(self):
+        """Listeners are woken in batches over several reactor ticks."""
+        self.notifier.MAX_WAKEUPS_PER_TICK = 3
+        woken = self._add_listeners(7)
+
+        self.notifier.on_new_event(
+            "room_key", RoomStreamToken(None, 2), rooms=[self.room_id]
+        )
+        self.assertEqual(len(woken), 0)
+
+        # Each run wakes up a batch, and schedules another run. (We call it
+        # directly, as the fake reactor would run all the ticks at once.)
+        self.notifier._wake_pending_streams()
+        self.assertEqual(len(woken), 3)
+        self.notifier._wake_pending_streams()
+        self.assertEqual(len(woken), 6)
+        self.reactor.advance(0)
+        self.assertEqual(len(woken), 7)
+
+        # The stream tokens are moved on straight away, though.
+        user_stream = self.notifier.user_to_user_stream["@user0:test"]
+        self.assertEqual(user_stream.current_token.room_key.stream, 2)
+
+    def test_wakeups_are_coalesced(self):
+        """A listener is only woken once for several events in the same tick,
+        with the latest token.
+        """
+        woken = self._add_listeners(2)
+
+        for stream_id in (2, 3, 4):
+            self.notifier.on_new_event(
+                "room_key", RoomStreamToken(None, stream_id), rooms=[self.room_id]
+            )
+
+        self.reactor.advance(0)
+        self.assertEqual(len(woken), 2)
+        for token in woken:
+            self.assertEqual(token.room_key.stream, 4)
@@ -19,7 +19,12 @@ from twisted.web.resource import Resource
 
 from synapse.api.errors import Codes, RedirectException, SynapseError
 from synapse.config.server import parse_listener_def
-from synapse.http.server import DirectServeHtmlResource, JsonResource, OptionsResource
+from synapse.http.server import (
+    DirectServeHtmlResource,
+    JsonResource,
+    OptionsResource,
+    StreamedJsonObject,
+)
 from synapse.http.site import SynapseSite
 from synapse.logging.context import make_deferred_yieldable
 from synapse.util import Clock
@@ -178,6 +183,51 @@ class JsonResourceTests(unittest.TestCase):
         self.assertEqual(channel.result["code"], b"200")
         self.assertNotIn("body", channel.result)
 
+    def test_streamed_json_object(self):
+        """
+        A StreamedJsonObject returned by a callback is encoded as the response
+        is written out.
+        """
+        generated = []
+
+        def _members():
+            for i in range(3):
+                generated.append(i)
+                # Big enough that the producer has to write several chunks.
+                yield "room%d" % (i,), {"events": ["x" * 1000], "index": i}
+
+        rooms = StreamedJsonObject(_members())
+
+        def _callback(request, **kwargs):
+            return 200, StreamedJsonObject(
+                [("next_batch", "s1"), ("rooms", StreamedJsonObject([("join", rooms)]))]
+            )
+
+        res = JsonResource(self.homeserver)
+        res.register_paths(
+            "GET",
+            [re.compile("^/_matrix/foo$")],
+            _callback,
+            "test_servlet",
+        )
+
+        channel = make_request(self.reactor, FakeSite(res), b"GET", b"/_matrix/foo")
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(generated, [0, 1, 2])
+        self.assertEqual(
+            channel.json_body,
+            {
+                "next_batch": "s1",
+                "rooms": {
+                    "join": {
+                        "room%d" % (i,): {"events": ["x" * 1000], "index": i}
+                        for i in range(3)
+                    }
+                },
+            },
+        )
+
 
 class OptionsResourceTests(unittest.TestCase):
     def setUp(self):
@@ -76,6 +76,7 @@ class StateGroupStore:
         self._group_to_state = {}
 
         self._event_id_to_event = {}
+        self._resolutions = {}
 
         self._next_group = 1
 
@@ -108,6 +109,18 @@ class StateGroupStore:
     async def get_state_group_delta(self, name):
         return (None, None)
 
+    async def _get_state_for_groups(self, groups):
+        return {group: dict(self._group_to_state[group]) for group in groups}
+
+    async def get_state_group_for_resolution(self, room_version, state_groups):
+        return self._resolutions.get((room_version, frozenset(state_groups)))
+
+    async def store_state_group_resolution(
+        self, room_id, room_version, state_groups, resolved_state_group
+    ):
+        key = (room_version, frozenset(state_groups))
+        self._resolutions.setdefault(key, resolved_state_group)
+
     def register_events(self, events):
         for e in events:
             self._event_id_to_event[e.event_id] = e
@@ -163,6 +176,7 @@ class StateTestCase(unittest.TestCase):
             spec_set=[
                 "config",
                 "get_datastore",
+                "get_datastores",
                 "get_storage",
                 "get_auth",
                 "get_state_handler",
@@ -173,6 +187,7 @@ class StateTestCase(unittest.TestCase):
         )
         hs.config = default_config("tesths", True)
         hs.get_datastore.return_value = self.store
+        hs.get_datastores.return_value = storage
         hs.get_state_handler.return_value = None
         hs.get_clock.return_value = MockClock()
         hs.get_auth.return_value = Auth(hs)
@@ -566,6 +581,60 @@ class StateTestCase(unittest.TestCase):
 
         self.assertIsNotNone(context.state_group)
 
+    @defer.inlineCallbacks
+    def test_resolution_is_persisted(self):
+        """A second state handler (e.g. after a restart, or on another worker)
+        should reuse the result of an earlier resolution of the same state
+        groups rather than resolving again.
+        """
+        prev_event_id1 = "event_id1"
+        prev_event_id2 = "event_id2"
+        event = create_event(
+            type="test_message",
+            name="event3",
+            prev_events=[(prev_event_id1, {}), (prev_event_id2, {})],
+        )
+
+        creation = create_event(type=EventTypes.Create, state_key="")
+
+        old_state_1 = [
+            creation,
+            create_event(type="test1", state_key="1"),
+            create_event(type="test2", state_key=""),
+        ]
+
+        old_state_2 = [
+            creation,
+            create_event(type="test1", state_key="1"),
+            create_event(type="test3", state_key=""),
+        ]
+
+        self.store.register_events(old_state_1)
+        self.store.register_events(old_state_2)
+
+        context = yield self._get_context(
+            event, prev_event_id1, old_state_1, prev_event_id2, old_state_2
+        )
+
+        # build a new handler, which won't share the in-memory cache, and make
+        # sure it doesn't try to do the resolution again.
+        self.state = StateHandler(self.state.hs)
+        resolution_handler = self.state._state_resolution_handler
+        resolution_handler.resolve_events_with_store = Mock(
+            side_effect=AssertionError("unexpected state resolution")
+        )
+
+        context2 = yield defer.ensureDeferred(self.state.compute_event_context(event))
+
+        self.assertEqual(context.state_group, context2.state_group)
+
+        current_state_ids = yield defer.ensureDeferred(context.get_current_state_ids())
+        current_state_ids2 = yield defer.ensureDeferred(
+            context2.get_current_state_ids()
+        )
+        self.assertEqual(current_state_ids, current_state_ids2)
+        self.assertEqual(len(current_state_ids2), 4)
+
     @defer.inlineCallbacks
     def test_resolve_state_conflict(self):
         prev_event_id1 = "event_id1"
@@ -13,7 +13,13 @@
 # limitations under the License.
 
 from synapse.api.errors import SynapseError
-from synapse.types import GroupID, RoomAlias, UserID, map_username_to_mxid_localpart
+from synapse.types import (
+    GroupID,
+    ImmutableStateMap,
+    RoomAlias,
+    UserID,
+    map_username_to_mxid_localpart,
+)
 
 from tests import unittest
 
@@ -106,3 +112,48 @@ class MapUsernameTestCase(unittest.TestCase):
         self.assertEqual(
             map_username_to_mxid_localpart("têst".encode("utf-8")), "t=c3=aast"
         )
+
+
+class ImmutableStateMapTestCase(unittest.TestCase):
+    def test_with_changes(self):
+        base = ImmutableStateMap({("m.room.create", ""): "$create", ("a", ""): "$a"})
+        changed = base.with_changes({("b", ""): "$b"}, [("a", "")])
+
+        self.assertEqual(changed, {("m.room.create", ""): "$create", ("b", ""): "$b"})
+        self.assertEqual(len(changed), 2)
+        self.assertNotIn(("a", ""), changed)
+        self.assertIsNone(changed.get(("a", "")))
+        with self.assertRaises(KeyError):
+            changed[("a", "")]
+
+        # the original is unaffected
+        self.assertEqual(base, {("m.room.create", ""): "$create", ("a", ""): "$a"})
+
+        # putting an entry back the way it was doesn't count as a change
+        restored = changed.with_changes({("a", ""): "$a"}, [("b", "")])
+        self.assertEqual(restored, base)
+        self.assertEqual(restored.diff(base), ([], {}))
+
+    def test_compaction(self):
+        base = ImmutableStateMap({("m.room.member", str(i)): str(i) for i in range(10)})
+
+        state_map = base
+        for i in range(100):
+            state_map = state_map.with_changes({("m.room.member", str(i)): "$new"})
+
+        self.assertEqual(len(state_map), 100)
+        self.assertEqual(
+            dict(state_map.items()),
+            {("m.room.member", str(i)): "$new" for i in range(100)},
+        )
+
+    def test_diff(self):
+        base = ImmutableStateMap({("a", ""): "$a", ("b", ""): "$b", ("c", ""): "$c"})
+        old = base.with_changes({("a", ""): "$a2"})
+        new = base.with_changes({("d", ""): "$d"}, [("b", "")])
+
+        expected = ([("b", "")], {("a", ""): "$a", ("d", ""): "$d"})
+        self.assertEqual(old.diff(new), expected)
+
+        # diffing against a map with a different base gives the same answer
+        self.assertEqual(old.diff(dict(new.items())), expected)
@@ -0,0 +1,69 @@
+# Copyright 2021 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from canonicaljson import encode_canonical_json
+from frozendict import frozendict
+
+from synapse.util import EncodedCanonicalJson, splice_canonical_json
+
+from tests.unittest import TestCase
+
+
+def _encoded(json_object):
+    return EncodedCanonicalJson(json_object, encode_canonical_json(json_object))
+
+
+class SpliceCanonicalJsonTestCase(TestCase):
+    def test_plain_json(self):
+        """Objects without any encoded parts are encoded as canonical JSON"""
+        json_object = {
+            "b": ["☃", 1, None],
+            "a": frozendict({"z": True, "y": "é"}),
+        }
+        self.assertEqual(
+            splice_canonical_json(json_object), encode_canonical_json(json_object)
+        )
+
+    def test_encoded_parts(self):
+        """Encoded parts are included as if the object had been encoded"""
+        pdu = {"type": "m.room.message", "content": {"body": "☃"}}
+        edu = {"edu_type": "m.typing", "content": {}}
+
+        self.assertEqual(
+            splice_canonical_json(
+                {"pdus": [_encoded(pdu), pdu, _encoded(pdu)], "edus": [edu]}
+            ),
+            encode_canonical_json({"pdus": [pdu, pdu, pdu], "edus": [edu]}),
+        )
+
+    def test_encoded_at_top_level(self):
+        pdu = {"type": "m.room.message", "content": {}}
+        self.assertEqual(
+            splice_canonical_json({"content": _encoded(pdu), "origin": "test"}),
+            encode_canonical_json({"content": pdu, "origin": "test"}),
+        )
+
+    def test_placeholder_like_strings(self):
+        """Strings which look like the placeholders are left alone"""
+        pdu = {"content": {"body": '"__encoded_canonical_json_0"'}}
+        self.assertEqual(
+            splice_canonical_json({"pdus": [_encoded(pdu)], "body": "__0"}),
+            encode_canonical_json({"pdus": [pdu], "body": "__0"}),
+        )
+
+    def test_acts_as_mapping(self):
+        pdu = {"type": "m.room.message", "content": {}}
+        encoded = _encoded(pdu)
+        self.assertEqual(encoded, pdu)
+        self.assertEqual(encoded["type"], "m.room.message")
+        self.assertIn("content", encoded)